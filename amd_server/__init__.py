@@ -0,0 +1,10 @@
+"""Shared building blocks for the Twilio AMD testing servers"""
+
+from .webhook import (
+    ADVANCED_FIELDS,
+    MANUAL_FIELDS,
+    FieldTable,
+    WebhookEvent,
+    decode_form,
+    decode_request,
+)
@@ -0,0 +1,367 @@
+# Command line entry point: python -m amd_server <command>
+import argparse
+import json
+import os
+
+from . import serve
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m amd_server', description='Twilio AMD testing server tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('serve', help='Run a webhook server')
+    p.add_argument('--app', choices=sorted(serve.VARIANTS), default='advanced',
+                   help='server variant (default: advanced)')
+    p.add_argument('--host', default='0.0.0.0')
+    p.add_argument('--port', type=int, default=int(os.getenv('PORT', '5000')))
+    p.add_argument('--dev', action='store_true',
+                   help='Flask development server with reloader and debugger')
+    p.add_argument('--workers', type=int, default=(os.cpu_count() or 1) * 2 + 1,
+                   help='worker processes (production mode)')
+    p.add_argument('--threads', type=int, default=8, help='request threads per worker')
+    p.add_argument('--keepalive', type=int, default=5, help='keep-alive timeout in seconds')
+    p.add_argument('--graceful-timeout', type=int, default=30,
+                   help='seconds to drain in-flight requests after SIGTERM')
+    p.add_argument('--access-log', default=None, help="access log file ('-' for stdout)")
+
+    p = commands.add_parser('fake-twilio', help='Run a local stand-in for the Twilio Calls API')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8081)
+    p.add_argument('--scenario', default='mix',
+                   help="simulator scenario: mix, greeting, simple, human or beep (default: mix)")
+    p.add_argument('--time-scale', type=float, default=1.0,
+                   help='multiplier on simulated waits (0.1 = ten times faster, 0 = no waiting)')
+    p.add_argument('--ring-ms', type=int, default=3000, help='time from dialing to answer')
+    p.add_argument('--jitter', type=float, default=0.1, help='random variation of segment lengths')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--workers', type=int, default=8, help='callback delivery threads')
+    p.add_argument('--callbacks-per-second', type=float, default=None,
+                   help='cap on callbacks and TwiML fetches sent per second')
+    p.add_argument('--rest-rate', type=float, default=None,
+                   help='answer REST GETs beyond this many per second with 429')
+    p.add_argument('--busy', type=float, default=0, help='share of calls that end busy')
+    p.add_argument('--no-answer', type=float, default=0, help='share of calls that ring out unanswered')
+    p.add_argument('--smoke', type=int, metavar='CALLS', default=None,
+                   help='place CALLS calls against --webhook, print stats and exit')
+    p.add_argument('--webhook', default='http://127.0.0.1:5000', help='webhook server base URL')
+    p.add_argument('--app', choices=sorted(serve.VARIANTS), default='advanced',
+                   help='webhook server variant (which TwiML URL to fetch)')
+
+    p = commands.add_parser('dial', help='Dial a CSV/JSONL list of destinations under CPS and concurrency limits')
+    p.add_argument('--input', required=True, help="destinations: CSV with a 'to' column, or JSONL")
+    p.add_argument('--configs', required=True, help='AMD_CONFIGURATIONS-style JSON file (e.g. from screen --output)')
+    p.add_argument('--use', default=None, help='comma-separated configuration keys to assign (default: all)')
+    p.add_argument('--strategy', choices=('round-robin', 'weighted', 'ab'), default='round-robin')
+    p.add_argument('--weight', action='append', default=[], metavar='KEY=WEIGHT',
+                   help='share of destinations for a configuration (weighted strategy); repeatable')
+    p.add_argument('--split', type=float, default=0.5, help='share of destinations for the B configuration (ab)')
+    p.add_argument('--seed', type=int, default=0, help='seed of the weighted and A/B assignment')
+    p.add_argument('--from', dest='caller_ids', default=os.getenv('TWILIO_PHONE_NUMBER'),
+                   help='comma-separated caller IDs (default: TWILIO_PHONE_NUMBER)')
+    p.add_argument('--cps', type=float, default=1.0, help="account calls-per-second limit")
+    p.add_argument('--caller-cps', type=float, default=None, help='calls-per-second limit per caller ID')
+    p.add_argument('--concurrency', type=int, default=10, help='calls up at the same time')
+    p.add_argument('--max-attempts', type=int, default=3, help='attempts per destination for busy/no-answer')
+    p.add_argument('--retry-delay', type=float, default=300, help='seconds before the first redial (doubles after)')
+    p.add_argument('--checkpoint', default=None, help='JSONL journal; rerun with the same file to resume')
+    p.add_argument('--webhook', default='http://127.0.0.1:5000',
+                   help='webhook server base URL for configurations without callback URLs')
+    p.add_argument('--app', choices=sorted(serve.VARIANTS), default='advanced',
+                   help='webhook server variant the callback URLs point at')
+    p.add_argument('--base-url', default=None, help='REST API base URL (e.g. a fake-twilio server)')
+    p.add_argument('--fake', action='store_true',
+                   help='dial an in-process fake Twilio that calls an in-process webhook app')
+    p.add_argument('--time-scale', type=float, default=0.01, help='fake Twilio clock multiplier (--fake)')
+    p.add_argument('--busy', type=float, default=0.1, help='share of fake calls that end busy (--fake)')
+    p.add_argument('--no-answer', type=float, default=0.05, help='share of fake calls unanswered (--fake)')
+    p.add_argument('--quiet', action='store_true', help='print only the summary')
+
+    p = commands.add_parser('history', help='Fetch call results from the REST API into the result store')
+    p.add_argument('--store', default=os.getenv('AMD_STORE_PATH'), required=not os.getenv('AMD_STORE_PATH'),
+                   help='result store database (default: AMD_STORE_PATH)')
+    p.add_argument('--since', default=None, help='list calls started on or after (YYYY-MM-DD or ISO time)')
+    p.add_argument('--until', default=None, help='list calls started on or before')
+    p.add_argument('--status', default=None, help='only calls with this status (date range mode)')
+    p.add_argument('--sids', default=None, help="file with one Call SID per line ('-' for stdin)")
+    p.add_argument('--workers', type=int, default=8, help='concurrent fetches (SID mode)')
+    p.add_argument('--refetch', action='store_true', help='fetch calls already in the store again')
+    p.add_argument('--base-url', default=None, help='REST API base URL (e.g. a fake-twilio server)')
+    p.add_argument('--quiet', action='store_true', help='print only the final counts')
+
+    p = commands.add_parser('analytics', help='Accuracy, unknown rate and latency per config from stored results')
+    source = p.add_mutually_exclusive_group()
+    source.add_argument('--store', default=os.getenv('AMD_STORE_PATH'),
+                        help='result store database (default: AMD_STORE_PATH)')
+    source.add_argument('--input', default=None, help='previously exported .npz or .parquet file')
+    p.add_argument('--export', default=None, help='write the loaded results to .npz or .parquet')
+    p.add_argument('--expected', action='append', default=[], metavar='OUTCOME|KEY=OUTCOME',
+                   help="expected outcome for every call ('machine'), or per destination number or "
+                        "simulator scenario ('+5511987654321=machine'); repeatable")
+    p.add_argument('--hours', type=float, default=None, help='only results from the last N hours')
+    p.add_argument('--by', default='config', help='comma-separated grouping columns (default: config)')
+    for column in ('config', 'mode', 'country', 'state', 'destination'):
+        p.add_argument(f'--{column}', action='append', default=None, help=f'only these {column} values')
+    p.add_argument('--confusion', action='store_true', help='also print confusion matrices')
+    p.add_argument('--boot', type=int, default=2000, help='bootstrap resamples for the 95%% CIs')
+
+    p = commands.add_parser('screen', help='Screen a grid of AMD parameters offline against speech/silence timelines')
+    p.add_argument('--wav', action='append', default=[], metavar='PATH=OUTCOME',
+                   help="add a recording (16-bit PCM WAV) with the outcome AMD should report; repeatable")
+    p.add_argument('--no-scenarios', action='store_true', help='leave out the Studio simulator scenarios')
+    p.add_argument('--mode', action='append', default=None, choices=('Enable', 'DetectMessageEnd'),
+                   help='detection modes to screen (default: both)')
+    p.add_argument('--step', action='append', default=[], metavar='PARAM=STEP',
+                   help="grid spacing override, e.g. machine_detection_speech_threshold=100")
+    p.add_argument('--copies', type=int, default=20, help='jittered variants of each timeline')
+    p.add_argument('--jitter', type=float, default=0.1, help='random variation of segment lengths')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--latency-weight', type=float, default=0.01,
+                   help='score = accuracy - weight x median decision seconds (default 0.01)')
+    p.add_argument('--top', type=int, default=10, help='parameter sets to list')
+    p.add_argument('--output', default=None, help='write the top sets as AMD_CONFIGURATIONS-style JSON')
+
+    p = commands.add_parser('replay', help='Replay captured requests (AMD_CAPTURE_DIR) against a server')
+    p.add_argument('capture', nargs='+', help='capture files, or directories holding them')
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument('--target', help='base URL of the server to replay against')
+    target.add_argument('--app', choices=sorted(serve.VARIANTS), help='replay against a fresh in-process app')
+    p.add_argument('--speed', type=float, default=1.0,
+                   help='1 = original timing, N = N times faster, 0 = as fast as possible')
+    p.add_argument('--concurrency', type=int, default=8, help='requests in flight at most')
+    p.add_argument('--limit', type=int, default=None, help='replay only the first N requests')
+    p.add_argument('--path', action='append', default=None, help='replay only paths starting with this; repeatable')
+    p.add_argument('--examples', type=int, default=5, help='differences and errors to show')
+    p.add_argument('--output', default=None, help='write the report as JSON')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        if args.dev:
+            serve.run_dev(args.app, args.host, args.port)
+        else:
+            serve.run_production(args.app, args.host, args.port, args.workers,
+                                 threads=args.threads, keepalive=args.keepalive,
+                                 graceful_timeout=args.graceful_timeout,
+                                 access_log=args.access_log)
+    elif args.command == 'fake-twilio':
+        from .fake_twilio import FakeTwilio, rest_server, smoke_run
+
+        platform = FakeTwilio(scenario=args.scenario, time_scale=args.time_scale,
+                              ring_ms=args.ring_ms, jitter=args.jitter, seed=args.seed,
+                              workers=args.workers,
+                              callbacks_per_second=args.callbacks_per_second,
+                              unanswered={'busy': args.busy, 'no-answer': args.no_answer})
+        try:
+            if args.smoke is not None:
+                print(json.dumps(smoke_run(platform, args.webhook, args.smoke, args.app), indent=2))
+                return
+            server = rest_server(platform, args.host, args.port, args.rest_rate)
+            print(f"Fake Twilio API on http://{args.host}:{server.server_port}/2010-04-01/Accounts/<sid>/Calls.json", flush=True)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+        finally:
+            platform.close()
+    elif args.command == 'dial':
+        run_dial(args)
+    elif args.command == 'history':
+        run_history(args)
+    elif args.command == 'analytics':
+        run_analytics(args)
+    elif args.command == 'screen':
+        run_screen(args)
+    elif args.command == 'replay':
+        run_replay(args)
+
+
+def run_dial(args):
+    from .dialer import (Checkpoint, Dialer, RetryPolicy, assigner, print_dial_result, read_destinations,
+                         with_callbacks)
+
+    with open(args.configs) as f:
+        configurations = with_callbacks(json.load(f), args.webhook, args.app)
+    keys = [key.strip() for key in args.use.split(',')] if args.use else list(configurations)
+    unknown = [key for key in keys if key not in configurations]
+    if unknown:
+        raise SystemExit(f"dial: unknown configurations {', '.join(unknown)}")
+    weights = {}
+    for item in args.weight:
+        key, _, weight = item.partition('=')
+        weights[key] = float(weight)
+    caller_ids = [number.strip() for number in (args.caller_ids or '').split(',') if number.strip()]
+    if not caller_ids:
+        raise SystemExit('dial: give --from (or set TWILIO_PHONE_NUMBER)')
+
+    checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else None
+    platform = bus = None
+    if args.fake:
+        from .app import create_app
+        from .fake_twilio import FakeTwilio, FlaskTransport
+
+        os.environ.setdefault('AMD_LOG_CONSOLE', '0')
+        app = create_app(args.app)
+        bus = app.extensions['amd_server'].bus
+        # Calls of an earlier run died with its fake; new SIDs must not collide with theirs
+        seed = args.seed + (checkpoint.dials if checkpoint else 0)
+        client = platform = FakeTwilio(FlaskTransport(app), time_scale=args.time_scale, seed=seed,
+                                       unanswered={'busy': args.busy, 'no-answer': args.no_answer})
+    elif args.base_url:
+        from .fake_twilio import rest_client
+
+        client = rest_client(args.base_url)
+    else:
+        from twilio.rest import Client
+
+        client = Client(os.getenv('ACCOUNT_SID'), os.getenv('AUTH_TOKEN'))
+
+    retry = RetryPolicy(max_attempts=args.max_attempts, delay=args.retry_delay)
+    # Redial delays and REST checks follow the fake clock
+    scale = args.time_scale if args.fake else 1
+    retry.delay *= scale
+    dialer = Dialer(client, configurations, caller_ids, assign=assigner(args.strategy, keys, weights or None,
+                                                                          args.split, args.seed),
+                    bus=bus, max_concurrent=args.concurrency, calls_per_second=args.cps,
+                    caller_id_cps=args.caller_cps, retry=retry, checkpoint=checkpoint,
+                    check_interval=60 * scale)
+    try:
+        summary = dialer.run(read_destinations(args.input), on_result=None if args.quiet else print_dial_result)
+    finally:
+        dialer.close()
+        if platform is not None:
+            platform.close()
+    summary.print_table(configurations)
+
+
+def run_history(args):
+    import sys
+
+    from .history import DEFAULT_BASE_URL, HistoryFetcher, RestSession, print_history
+    from .store import ResultStore
+
+    if not args.since and not args.sids:
+        raise SystemExit('history: give --since (date range) or --sids (SID list)')
+    session = RestSession(os.getenv('ACCOUNT_SID'), os.getenv('AUTH_TOKEN'),
+                          base_url=args.base_url or DEFAULT_BASE_URL, pool_size=args.workers)
+    fetcher = HistoryFetcher(session, ResultStore(args.store), workers=args.workers)
+    try:
+        if args.sids:
+            lines = sys.stdin if args.sids == '-' else open(args.sids)
+            sids = (line.strip() for line in lines if line.strip())
+            results = fetcher.fetch(sids, skip_stored=not args.refetch)
+        else:
+            results = fetcher.fetch_range(args.since, args.until, args.status, skip_stored=not args.refetch)
+        if args.quiet:
+            for _ in results:
+                pass
+        else:
+            print_history(results)
+    finally:
+        fetcher.close()
+    print(json.dumps(fetcher.stats()), flush=True)
+
+
+def run_analytics(args):
+    import time
+
+    from .analytics import OUTCOMES, ResultColumns, confusion_matrices, print_summary, summarize
+    from .store import ResultStore
+
+    # A bare outcome is the default for every call; KEY=OUTCOME entries override it
+    default, expected = None, {}
+    for item in args.expected:
+        key, sep, outcome = item.rpartition('=')
+        if outcome not in OUTCOMES:
+            raise SystemExit(f"analytics: --expected {item!r}: outcome must be one of {', '.join(OUTCOMES)}")
+        if sep:
+            expected[key] = outcome
+        else:
+            default = outcome
+    since = time.time() - args.hours * 3600 if args.hours else None
+    if args.input:
+        results = ResultColumns.load(args.input)
+        if since is not None:
+            results = results.where(since=since)
+    elif args.store:
+        store = ResultStore(args.store)
+        results = ResultColumns.from_store(store, expected, since=since, default=default)
+        store.close()
+    else:
+        raise SystemExit('analytics: give --store (or set AMD_STORE_PATH) or --input')
+    if args.export:
+        results.save(args.export)
+        print(f"{len(results)} results written to {args.export}")
+
+    results = results.where(config=args.config, mode=args.mode, country=args.country,
+                            state=args.state, destination=args.destination)
+    by = tuple(name.strip() for name in args.by.split(',') if name.strip())
+    print(f"{len(results)} calls\n")
+    print_summary(summarize(results, by, n_boot=args.boot), by)
+    if args.confusion:
+        for label, (expected_labels, answered, counts) in confusion_matrices(results, by).items():
+            print(f"\n{' / '.join(v or '-' for v in label) or 'all'}: expected (rows) vs AnsweredBy (columns)")
+            print(' ' * 10 + ''.join(f"{name:>22}" for name in answered))
+            for name, row in zip(expected_labels, counts):
+                print(f"{name:<10}" + ''.join(f"{value:>22}" for value in row))
+
+
+def run_screen(args):
+    import time
+
+    from .screening import MODES, SCREEN_STEPS, parameter_grid, screen, timeline_from_wav
+    from .simulator import EXPECTED_OUTCOMES, load_scenarios
+
+    timelines, expected = {}, {}
+    if not args.no_scenarios:
+        timelines.update(load_scenarios())
+        expected.update(EXPECTED_OUTCOMES)
+    for item in args.wav:
+        path, sep, outcome = item.rpartition('=')
+        if not sep or outcome not in ('machine', 'human', 'fax', 'unknown'):
+            raise SystemExit(f"screen: --wav needs PATH=OUTCOME (machine/human/fax/unknown), got {item!r}")
+        name = os.path.basename(path)
+        timelines[name] = timeline_from_wav(path)
+        expected[name] = outcome
+    if not timelines:
+        raise SystemExit('screen: no timelines (give --wav or drop --no-scenarios)')
+    steps = dict(SCREEN_STEPS)
+    for item in args.step:
+        name, _, value = item.partition('=')
+        steps[name] = int(value)
+
+    params = parameter_grid(steps=steps, modes=tuple(args.mode or MODES))
+    started = time.perf_counter()
+    result, labels = screen(timelines, expected, params, copies=args.copies, jitter=args.jitter,
+                            seed=args.seed, latency_weight=args.latency_weight)
+    print(f"Screened in {time.perf_counter() - started:.2f}s\n")
+    result.print_report(args.top, labels)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({f"screened_{i}": result.configuration(i) for i in result.ranked(args.top)}, f, indent=2)
+        print(f"\nTop {args.top} written to {args.output}")
+
+
+def run_replay(args):
+    from .replay import FlaskTarget, HttpTarget, print_report, replay
+
+    if args.app:
+        from .app import create_app
+
+        os.environ.setdefault('AMD_LOG_CONSOLE', '0')
+        target = FlaskTarget(create_app(args.app))
+    else:
+        target = HttpTarget(args.target)
+    report = replay(args.capture, target, speed=args.speed, concurrency=args.concurrency, limit=args.limit,
+                    path_prefix=args.path, max_examples=args.examples)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
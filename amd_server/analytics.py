@@ -0,0 +1,474 @@
+# Columnar AMD result analytics (NumPy)
+#
+# The result store holds one row per callback; comparing configurations
+# over months of history one Python dict at a time is too slow. Results
+# are loaded once into dictionary-encoded NumPy columns (one AMD result per
+# call), which can be saved as .npz or Parquet and reloaded in
+# milliseconds. Confusion matrices, unknown rates, latency percentiles and
+# bootstrap confidence intervals are then computed with whole-array
+# operations for any slice by config, detection mode and destination.
+import time
+
+import numpy as np
+
+from .history import CALL_RESOURCE
+from .simulator import EXPECTED_OUTCOMES
+from .webhook import normalize_outcome
+
+# Normalized outcomes (webhook.normalize_outcome); expected codes index this too
+OUTCOMES = ('machine', 'human', 'fax', 'unknown')
+UNLABELLED = -1
+
+# Dictionary-encoded text columns (int32 codes into a category list)
+TEXT_COLUMNS = ('config', 'mode', 'country', 'state', 'destination', 'answered_by')
+# Other columns: received_at (float64 epoch s), detection_ms (float32, NaN when
+# missing), outcome / expected (int8 codes into OUTCOMES, -1 = not known)
+# and call_sid (fixed-width bytes)
+NUMERIC_COLUMNS = ('received_at', 'detection_ms', 'outcome', 'expected', 'call_sid')
+
+# One AMD result per call: the first callback carrying AnsweredBy, else the
+# first REST fetch row (history.CALL_RESOURCE) when no callback arrived.
+# Async AMD callbacks carry no To / geo fields, so those come from any row
+# of the call (its status callbacks).
+RESULTS_QUERY = f"""
+SELECT a.call_sid, a.received_at, COALESCE(a.config_key, g.config_key), a.answered_by, a.detection_ms,
+       g.mode, g.country, g.state, g.destination, g.scenario
+FROM callbacks a
+JOIN (SELECT call_sid,
+             COALESCE(MIN(CASE WHEN answered_by IS NOT NULL AND webhook_type != '{CALL_RESOURCE}' THEN id END),
+                      MIN(CASE WHEN answered_by IS NOT NULL THEN id END)) AS result_id,
+             MAX(config_key) AS config_key,
+             MAX(json_extract(params, '$.AmdMode')) AS mode,
+             MAX(COALESCE(json_extract(params, '$.ToCountry'), json_extract(params, '$.CalledCountry'))) AS country,
+             MAX(COALESCE(json_extract(params, '$.ToState'), json_extract(params, '$.CalledState'))) AS state,
+             MAX(COALESCE(json_extract(params, '$.To'), json_extract(params, '$.to'))) AS destination,
+             MAX(json_extract(params, '$.scenario')) AS scenario
+      FROM callbacks
+      WHERE received_at >= ? AND received_at < ?
+      GROUP BY call_sid) g ON a.id = g.result_id
+ORDER BY a.received_at
+"""
+
+
+def _mode_for(answered_by):
+    if not answered_by:
+        return ''
+    if answered_by == 'machine_start':
+        return 'Enable'
+    if answered_by.startswith('machine_end'):
+        return 'DetectMessageEnd'
+    return ''
+
+
+def _index(values, value):
+    """Position of value in the category list, appending it if new"""
+    if value not in values:
+        values.append(value)
+    return values.index(value)
+
+
+def _outcome_index(value):
+    return OUTCOMES.index(value) if value in OUTCOMES else UNLABELLED
+
+
+class _Encoder:
+    """Builds int codes for a text column, assigning new codes as values appear"""
+
+    __slots__ = ('index', 'codes')
+
+    def __init__(self):
+        self.index = {}
+        self.codes = []
+
+    def add(self, value):
+        value = value or ''
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.index)
+        self.codes.append(code)
+
+    def categories(self):
+        return list(self.index)
+
+
+class ResultColumns:
+    """AMD results as NumPy columns, one row per call
+
+    columns maps every name in TEXT_COLUMNS and NUMERIC_COLUMNS to an
+    array of the same length; categories maps each text column to the list
+    its codes index ('' marks a missing value).
+    """
+
+    def __init__(self, columns, categories):
+        self.columns = columns
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.columns['received_at'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    # -- building --------------------------------------------------------
+
+    @classmethod
+    def from_rows(cls, rows, expected=None, default=None):
+        """Encode (call_sid, received_at, config, answered_by, detection_ms, mode,
+        country, state, destination, scenario) tuples; see RESULTS_QUERY
+
+        expected sets the outcome each call should have had: one outcome
+        ('machine', the same as `default`), or {destination number or
+        scenario: outcome}. Calls from the fake platform carry their
+        scenario, which is used when the mapping does not name the call;
+        `default` labels the calls that are still unlabelled.
+        """
+        names = ('config', 'answered_by', 'mode', 'country', 'state', 'destination', 'scenario')
+        encoders = {name: _Encoder() for name in names}
+        adders = [encoders[name].add for name in names]
+        sids, received, detection = [], [], []
+        for call_sid, received_at, config, answered_by, ms, mode, country, state, to, scenario in rows:
+            sids.append(call_sid or '')
+            received.append(received_at)
+            detection.append(ms if ms is not None else np.nan)
+            for add, value in zip(adders, (config, answered_by, mode, country, state, to, scenario)):
+                add(value)
+        codes = {name: np.asarray(encoders[name].codes, dtype=np.int32) for name in names}
+        categories = {name: encoders[name].categories() for name in names}
+
+        # Per-category lookups replace per-row work for the derived columns
+        answered = categories['answered_by']
+        outcome = np.asarray([OUTCOMES.index(normalize_outcome(v)) for v in answered], dtype=np.int8)[codes['answered_by']]
+
+        # Untagged calls get the mode implied by their result (as WebhookEvent.detection_mode)
+        modes = list(categories['mode'])
+        implied = np.asarray([_index(modes, _mode_for(v)) for v in answered], dtype=np.int32)
+        mode = codes['mode']
+        if '' in modes:
+            mode = np.where(mode == modes.index(''), implied[codes['answered_by']], mode)
+
+        # Lowest precedence first: `default` for calls nothing else labels,
+        # the simulator scenario, then `expected` by scenario and by
+        # destination number
+        if isinstance(expected, str):
+            default, by_key = expected, {}
+        else:
+            by_key = dict(expected or {})
+
+        def lookup(name, table):
+            lut = [_outcome_index(table.get(value)) for value in categories[name]]
+            return np.asarray(lut or [UNLABELLED], dtype=np.int8)[codes[name]]
+
+        want = lookup('scenario', EXPECTED_OUTCOMES)
+        if default:
+            want[want == UNLABELLED] = _outcome_index(default)
+        for name in ('scenario', 'destination'):
+            if by_key:
+                mapped = lookup(name, by_key)
+                want = np.where(mapped != UNLABELLED, mapped, want)
+
+        columns = {name: codes[name] for name in ('config', 'country', 'state', 'destination', 'answered_by')}
+        columns.update(
+            mode=mode,
+            received_at=np.asarray(received, dtype=np.float64),
+            detection_ms=np.asarray(detection, dtype=np.float32),
+            outcome=outcome,
+            expected=want,
+            call_sid=np.asarray(sids, dtype='S34'),
+        )
+        categories['mode'] = modes
+        return cls(columns, {name: categories[name] for name in TEXT_COLUMNS})
+
+    @classmethod
+    def from_store(cls, store, expected=None, since=None, until=None, chunk=50000, default=None):
+        """Load one AMD result per call from a ResultStore received in [since, until)"""
+        rows = store.iter_rows(RESULTS_QUERY, (since or 0, until or time.time() + 86400), chunk)
+        return cls.from_rows(rows, expected, default)
+
+    # -- files -----------------------------------------------------------
+
+    def save_npz(self, path):
+        """Write every column plus the category lists to a compressed .npz"""
+        arrays = dict(self.columns)
+        for name, values in self.categories.items():
+            arrays[f'{name}__categories'] = np.asarray(values, dtype=str)
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load_npz(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            columns = {name: data[name] for name in TEXT_COLUMNS + NUMERIC_COLUMNS}
+            categories = {name: data[f'{name}__categories'].tolist() for name in TEXT_COLUMNS}
+        return cls(columns, categories)
+
+    def to_arrow(self):
+        """pyarrow Table with text columns as dictionary arrays"""
+        pa = _pyarrow()
+        arrays = {name: pa.DictionaryArray.from_arrays(self.columns[name], pa.array(self.categories[name], pa.string()))
+                  for name in TEXT_COLUMNS}
+        labels = pa.array(OUTCOMES, pa.string())
+        arrays['outcome'] = pa.DictionaryArray.from_arrays(self.columns['outcome'], labels)
+        expected = self.columns['expected']
+        arrays['expected'] = pa.DictionaryArray.from_arrays(
+            pa.array(expected, mask=expected == UNLABELLED), labels)
+        arrays['received_at'] = pa.array(self.columns['received_at'])
+        detection = self.columns['detection_ms']
+        arrays['detection_ms'] = pa.array(detection, mask=np.isnan(detection))
+        arrays['call_sid'] = pa.array(self.columns['call_sid'].astype(str), pa.string())
+        return pa.table(arrays)
+
+    def save_parquet(self, path):
+        table = self.to_arrow()
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, path)
+
+    @classmethod
+    def load_parquet(cls, path):
+        _pyarrow()
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        columns, categories = {}, {}
+        for name in TEXT_COLUMNS:
+            chunk = table.column(name).combine_chunks()
+            columns[name] = chunk.indices.to_numpy(zero_copy_only=False).astype(np.int32)
+            categories[name] = chunk.dictionary.to_pylist()
+        for name in ('outcome', 'expected'):
+            chunk = table.column(name).combine_chunks()
+            codes = chunk.indices.fill_null(UNLABELLED).to_numpy(zero_copy_only=False)
+            # Map through the stored dictionary in case it was written in another order
+            lookup = np.asarray([OUTCOMES.index(v) for v in chunk.dictionary.to_pylist()] + [UNLABELLED], dtype=np.int8)
+            columns[name] = lookup[codes]
+        columns['received_at'] = table.column('received_at').to_numpy()
+        columns['detection_ms'] = table.column('detection_ms').to_numpy(zero_copy_only=False).astype(np.float32)
+        columns['call_sid'] = np.asarray(table.column('call_sid').to_pylist(), dtype='S34')
+        return cls(columns, categories)
+
+    def save(self, path):
+        """Save as Parquet for *.parquet, else as .npz"""
+        if str(path).endswith('.parquet'):
+            self.save_parquet(path)
+        else:
+            self.save_npz(path)
+
+    @classmethod
+    def load(cls, path):
+        if str(path).endswith('.parquet'):
+            return cls.load_parquet(path)
+        return cls.load_npz(path)
+
+    # -- slicing ---------------------------------------------------------
+
+    def take(self, index):
+        """Rows selected by a boolean mask or index array, sharing the category lists"""
+        return ResultColumns({name: values[index] for name, values in self.columns.items()}, self.categories)
+
+    def mask(self, since=None, until=None, **filters):
+        """Boolean mask for rows matching every filter
+
+        filters are text columns (config, mode, country, state, destination,
+        answered_by) mapped to one value or a list of values.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        for name, wanted in filters.items():
+            if wanted is None:
+                continue
+            if name not in self.categories:
+                raise ValueError(f"Unknown column: {name!r} (use one of {', '.join(TEXT_COLUMNS)})")
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+            codes = [i for i, value in enumerate(self.categories[name]) if value in wanted]
+            keep &= np.isin(self.columns[name], codes)
+        if since is not None:
+            keep &= self.columns['received_at'] >= since
+        if until is not None:
+            keep &= self.columns['received_at'] < until
+        return keep
+
+    def where(self, since=None, until=None, **filters):
+        return self.take(self.mask(since, until, **filters))
+
+    def groups(self, by):
+        """(group code per row, list of group label tuples) for one or more text columns"""
+        by = (by,) if isinstance(by, str) else tuple(by)
+        if not by:
+            return np.zeros(len(self), dtype=np.int64), [()]
+        sizes = [max(len(self.categories[name]), 1) for name in by]
+        combined = np.ravel_multi_index([self.columns[name] for name in by], sizes)
+        keys, codes = np.unique(combined, return_inverse=True)
+        labels = [tuple(self.categories[name][i] for name, i in zip(by, index))
+                  for index in zip(*np.unravel_index(keys, sizes))]
+        return codes.reshape(-1), labels
+
+
+# -- analytics ---------------------------------------------------------------
+
+
+def confusion_matrices(results, by='config'):
+    """{group: (expected labels, AnsweredBy labels, counts[expected, answered_by])}
+
+    Only rows with a known expected outcome are counted.
+    """
+    codes, labels = results.groups(by)
+    labelled = results['expected'] != UNLABELLED
+    answered = results.categories['answered_by']
+    cells = len(OUTCOMES) * len(answered)
+    flat = (codes[labelled] * cells + results['expected'][labelled].astype(np.int64) * len(answered)
+            + results['answered_by'][labelled])
+    counts = np.bincount(flat, minlength=len(labels) * cells).reshape(len(labels), len(OUTCOMES), len(answered))
+    matrices = {}
+    for g, label in enumerate(labels):
+        rows = [i for i in range(len(OUTCOMES)) if counts[g, i].any()]
+        cols = [j for j in range(len(answered)) if counts[g, :, j].any()]
+        matrices[label] = ([OUTCOMES[i] for i in rows], [answered[j] for j in cols],
+                           counts[g][np.ix_(rows, cols)])
+    return matrices
+
+
+def _group_counts(codes, groups, flags):
+    return np.bincount(codes, weights=flags, minlength=groups), np.bincount(codes, minlength=groups)
+
+
+def _sorted_by_group(codes, groups, values):
+    """Values sorted within each group and the slice bounds of every group"""
+    keep = np.isfinite(values)
+    codes, values = codes[keep], values[keep]
+    order = np.lexsort((values, codes))
+    bounds = np.searchsorted(codes[order], np.arange(groups + 1))
+    return values[order], bounds
+
+
+def latency_percentiles(results, by='config', q=(50, 90, 95, 99)):
+    """{group: {'n': detections, 'p50': ms, ...}} of MachineDetectionDuration"""
+    codes, labels = results.groups(by)
+    values, bounds = _sorted_by_group(codes, len(labels), results['detection_ms'].astype(np.float64))
+    table = {}
+    for g, label in enumerate(labels):
+        chunk = values[bounds[g]:bounds[g + 1]]
+        entry = {'n': int(len(chunk))}
+        points = np.percentile(chunk, q) if len(chunk) else [np.nan] * len(q)
+        entry.update({f'p{p:g}': float(v) for p, v in zip(q, points)})
+        table[label] = entry
+    return table
+
+
+def proportion_ci(successes, trials, n_boot=2000, alpha=0.05, rng=None):
+    """Bootstrap (percentile) CIs for many proportions at once; arrays of (low, high)
+
+    Resampling n Bernoulli outcomes and taking their mean is the same as
+    drawing Binomial(n, p) / n, so every group is resampled in one call.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    successes = np.asarray(successes, dtype=np.float64)
+    trials = np.asarray(trials, dtype=np.int64)
+    p = np.divide(successes, trials, out=np.zeros_like(successes), where=trials > 0)
+    draws = rng.binomial(trials[:, None], p[:, None], size=(len(trials), n_boot))
+    rates = draws / np.maximum(trials, 1)[:, None]
+    low, high = np.percentile(rates, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=1)
+    low[trials == 0] = high[trials == 0] = np.nan
+    return low, high
+
+
+def quantile_ci(sorted_values, q=0.5, n_boot=2000, alpha=0.05, rng=None):
+    """Bootstrap CI of the q-quantile of already sorted values, in O(n_boot)
+
+    The k-th smallest of n values resampled from the data is the data value
+    at rank floor(n * U), where U is the k-th smallest of n uniforms and so
+    follows Beta(k, n - k + 1); drawing U directly replaces the resampling.
+    The quantile is taken as the k = ceil(q * n)-th order statistic.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    n = len(sorted_values)
+    if not n:
+        return np.nan, np.nan
+    k = min(max(int(np.ceil(q * n)), 1), n)
+    ranks = np.minimum((rng.beta(k, n - k + 1, n_boot) * n).astype(np.int64), n - 1)
+    low, high = np.percentile(sorted_values[ranks], [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return float(low), float(high)
+
+
+def bootstrap_ci(values, statistic=np.mean, n_boot=2000, alpha=0.05, rng=None, max_cells=20_000_000):
+    """Percentile bootstrap CI of any statistic(values) (statistic must accept axis=1)
+
+    Resamples are drawn as index matrices, max_cells elements at a time;
+    use proportion_ci / quantile_ci for rates and percentiles, which do not
+    need to materialize the resamples.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return np.nan, np.nan
+    per_batch = max(1, min(n_boot, max_cells // len(values)))
+    estimates = []
+    for start in range(0, n_boot, per_batch):
+        size = min(per_batch, n_boot - start)
+        estimates.append(statistic(values[rng.integers(0, len(values), (size, len(values)))], axis=1))
+    low, high = np.percentile(np.concatenate(estimates), [100 * alpha / 2, 100 * (1 - alpha / 2)])
+    return float(low), float(high)
+
+
+def summarize(results, by='config', n_boot=2000, alpha=0.05, q=(50, 90, 99), seed=0):
+    """Per-group rows: calls, accuracy and unknown rate with bootstrap CIs, latency percentiles
+
+    accuracy counts calls with a known expected outcome; latency_p50_ci is
+    the bootstrap CI of the median detection time.
+    """
+    rng = np.random.default_rng(seed)
+    codes, labels = results.groups(by)
+    groups = len(labels)
+    outcome, expected = results['outcome'], results['expected']
+    labelled = expected != UNLABELLED
+    correct, scored = _group_counts(codes[labelled], groups, (outcome[labelled] == expected[labelled]).astype(np.float64))
+    unknown, calls = _group_counts(codes, groups, (outcome == OUTCOMES.index('unknown')).astype(np.float64))
+    acc_low, acc_high = proportion_ci(correct, scored, n_boot, alpha, rng)
+    unk_low, unk_high = proportion_ci(unknown, calls, n_boot, alpha, rng)
+    values, bounds = _sorted_by_group(codes, groups, results['detection_ms'].astype(np.float64))
+
+    names = (by,) if isinstance(by, str) else tuple(by)
+    rows = []
+    for g, label in enumerate(labels):
+        chunk = values[bounds[g]:bounds[g + 1]]
+        row = dict(zip(names, label))
+        row.update(
+            calls=int(calls[g]),
+            scored=int(scored[g]),
+            accuracy=float(correct[g] / scored[g]) if scored[g] else None,
+            accuracy_ci=(float(acc_low[g]), float(acc_high[g])) if scored[g] else None,
+            unknown_rate=float(unknown[g] / calls[g]),
+            unknown_rate_ci=(float(unk_low[g]), float(unk_high[g])),
+            detections=int(len(chunk)),
+        )
+        if len(chunk):
+            row.update({f'latency_p{p:g}_ms': float(v) for p, v in zip(q, np.percentile(chunk, q))})
+            row['latency_p50_ci'] = quantile_ci(chunk, 0.5, n_boot, alpha, rng)
+        rows.append(row)
+    return rows
+
+
+def print_summary(rows, by='config'):
+    """Print summarize() rows as a table"""
+    names = (by,) if isinstance(by, str) else tuple(by)
+    label_width = max([len(' / '.join(names))] + [len(' / '.join(str(r[n]) for n in names)) for r in rows])
+
+    def interval(value, ci):
+        if value is None:
+            return f"{'-':>19}"
+        return f"{value:>6.1%} [{ci[0]:>5.1%},{ci[1]:>5.1%}]"
+
+    print(f"{' / '.join(names):<{label_width}} {'Calls':>7} {'Accuracy (95% CI)':>19} "
+          f"{'Unknown (95% CI)':>19} {'p50 ms':>7} {'p90 ms':>7} {'p99 ms':>7}")
+    print("-" * (label_width + 74))
+    for r in rows:
+        label = ' / '.join(str(r[n]) or '-' for n in names)
+        latency = ' '.join(f"{r.get(f'latency_p{p}_ms', float('nan')):>7.0f}" for p in (50, 90, 99))
+        print(f"{label:<{label_width}} {r['calls']:>7} {interval(r['accuracy'], r['accuracy_ci'])} "
+              f"{interval(r['unknown_rate'], r['unknown_rate_ci'])} {latency}")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet/Arrow export needs pyarrow: pip install pyarrow "
+                          "(or save as .npz, which needs only NumPy)") from None
+    return pyarrow
@@ -0,0 +1,422 @@
+# Application factory for the two webhook servers
+#
+# The advanced and manual servers share every component (event bus, TwiML
+# cache, metrics, dedup cache, call tracker, result store and log sink) and
+# most of their routes; they differ in the TwiML endpoint (/silent or
+# /handle_amd), the console view and the informational pages. create_app()
+# builds a fresh Flask app with its own components, so the server.py
+# scripts, `python -m amd_server serve`, gunicorn workers, benchmarks and
+# tests all get the same app without importing a script by file path.
+#
+# Start-up cost matters because every gunicorn worker and every new
+# container pays it: nothing here imports twilio, and the SQLite store
+# module is only imported when AMD_STORE_PATH enables it (the request
+# capture module likewise when AMD_CAPTURE_DIR does, and sqlite3 for the
+# shared dedup table when AMD_DEDUP_SHARED does).
+import abc
+import os
+import time
+
+from flask import Flask, request
+
+from .calls import tracker_from_env
+from .console import ADVANCED_CONSOLE, MANUAL_CONSOLE
+from .dedup import callback_key, dedup_from_env
+from .events import bus_from_env, flask_sse_response
+from .geo import flask_geo_response, geo_from_env
+from .logsink import console_formatter, sink_from_env
+from .metrics import Metrics, flask_metrics_response
+from .spool import MAX_ENTRY_BYTES, find_call_sid, spool_from_env
+from .timing import SamplingProfiler, flask_profile_response, timing_from_env
+from .twiml import flask_response, twiml_from_env
+from .webhook import ADVANCED_FIELDS, MANUAL_FIELDS, decode_form, decode_request
+
+# Twilio requests webhooks and TwiML with whichever method the number or call is configured for
+TWILIO_METHODS = ['GET', 'POST']
+
+ENDPOINT_ITEMS = """
+        <li><strong>/status</strong> - Server status (JSON)</li>
+        <li><strong>/events</strong> - Live callback stream (Server-Sent Events, optional ?call_sid=)</li>
+        <li><strong>/metrics</strong> - Prometheus metrics: AMD detection time histograms and outcome counts per config</li>
+        <li><strong>/calls/&lt;call_sid&gt;</strong> - Merged status/AMD timeline of an active call (JSON)</li>
+        <li><strong>/geo</strong> - AMD outcomes and detection times per country, state and config (JSON)</li>"""
+
+
+def _capture_from_env():
+    if not os.getenv('AMD_CAPTURE_DIR'):
+        return None
+    from .capture import capture_from_env
+
+    return capture_from_env()
+
+
+def _store_from_env():
+    if not os.getenv('AMD_STORE_PATH'):
+        return None
+    from .store import store_from_env
+
+    return store_from_env()
+
+
+class WebhookServer(abc.ABC):
+    """Components shared by both variants; bound methods are the Flask views
+
+    Variants set the class attributes below, provide the view named after
+    twiml_endpoint and implement process_twiml() and home().
+    """
+
+    name = None
+    fields = None
+    console = None
+    twiml_endpoint = None
+
+    def __init__(self):
+        # Monitoring code waits on these instead of polling the REST API (see amd_server.events)
+        self.bus = bus_from_env()
+        # TwiML documents are rendered once at startup (see amd_server.twiml)
+        self.twiml = twiml_from_env()
+        # Detection-time histograms and outcome counts per config and mode (see amd_server.metrics)
+        self.metrics = Metrics()
+        # Twilio retries slow callbacks; repeats get the first response back unprocessed (see amd_server.dedup)
+        self.dedup = dedup_from_env()
+        if self.dedup is not None:
+            self.metrics.add_collector(self.dedup.prometheus_samples)
+        # Per-stage request timings: Server-Timing header and stage histograms (see amd_server.timing)
+        self.timing = timing_from_env(self.metrics)
+        # GET /admin/profile is only served when AMD_ADMIN_TOKEN is set
+        self.admin_token = os.getenv('AMD_ADMIN_TOKEN') or None
+        self.profiler = SamplingProfiler()
+        # Outcome and detection-time rollups per (country, state, config) (see amd_server.geo)
+        self.geo = geo_from_env()
+        self.metrics.add_collector(self.geo.prometheus_samples)
+        # Status and AMD callbacks merged into one record per call, finalized after hangup (see amd_server.calls)
+        self.calls = tracker_from_env(self.bus)
+        # Every decoded callback is also recorded when AMD_STORE_PATH is set (see amd_server.store)
+        self.store = _store_from_env()
+        # With AMD_CAPTURE_DIR set, requests and responses are recorded for replay (see amd_server.capture)
+        self.capture = _capture_from_env()
+        # Structured log records are written by a background thread (see amd_server.logsink)
+        self.log = sink_from_env(self.timing.timed('log_writer', 'console', console_formatter(self.console)))
+        # With AMD_SPOOL_DIR set, callbacks are acknowledged once durably spooled and
+        # processed by a worker pool; created last, as replay starts at once (see amd_server.spool)
+        self.spool = spool_from_env(self.timing.timed('spool_worker', 'process', self.process_spooled))
+        if self.spool is not None:
+            self.metrics.add_collector(self.spool.prometheus_samples)
+
+    def close(self):
+        """Drain and stop the background workers (otherwise done at interpreter exit)"""
+        # The spool goes first: its workers still record into everything else
+        if self.spool is not None:
+            self.spool.close()
+        if self.capture is not None:
+            self.capture.close()
+        self.calls.close()
+        self.geo.close()
+        if self.dedup is not None:
+            self.dedup.close()
+        if self.store is not None:
+            self.store.close()
+        self.log.close()
+
+    def routes(self):
+        """(rule, view, methods) served by this variant"""
+        routes = [
+            ('/webhook', self.handle_webhook, TWILIO_METHODS),
+            (self.twiml_endpoint, getattr(self, self.twiml_endpoint.strip('/')), TWILIO_METHODS),
+            ('/status', self.status, ['GET']),
+            ('/metrics', self.metrics_endpoint, ['GET']),
+            ('/calls/<call_sid>', self.call_record, ['GET']),
+            ('/geo', self.geo_rollups, ['GET']),
+            ('/events', self.events, ['GET']),
+            ('/', self.home, ['GET']),
+        ]
+        if self.admin_token:
+            routes.append(('/admin/profile', self.admin_profile, ['GET']))
+        return routes
+
+    def decode(self):
+        """Decode the current request, timing form parsing and decoding separately"""
+        # werkzeug parses lazily, on first access; decode_request reads args for both methods
+        if request.method == 'POST':
+            request.form
+        request.args
+        self.timing.lap('parse')
+        event = decode_request(request, self.fields)
+        self.timing.lap('decode')
+        return event
+
+    def respond(self, cached):
+        response = flask_response(cached, request)
+        self.timing.lap('twiml')
+        return response
+
+    def record(self, event, received_at=None):
+        """Hand a decoded callback to the store, event bus, metrics, geo rollups and call tracker"""
+        if self.store is not None:
+            self.store.add(event, received_at)
+        self.bus.publish_event(event, received_at)
+        self.metrics.observe(event, received_at)
+        self.geo.observe(event, received_at)
+        self.calls.observe(event, received_at)
+        self.timing.lap('record')
+
+    def duplicate(self, path, event, cached):
+        """The first response to an earlier delivery of this callback, or None"""
+        if self.dedup is None:
+            return None
+        return self.dedup.check(callback_key(path, event.params), cached)
+
+    def handle_webhook(self):
+        """Handle Twilio status and AMD callbacks; the reply is an empty TwiML document"""
+        if self.spool is not None:
+            return self.spool_request() or self.respond(self.twiml.empty)
+        event = self.decode()
+        duplicate = self.duplicate(request.path, event, self.twiml.empty)
+        self.timing.lap('dedup')
+        if duplicate is not None:
+            return self.respond(duplicate)
+        self.process_webhook(event)
+        return self.respond(self.twiml.empty)
+
+    def process_webhook(self, event, received_at=None):
+        """Log and record a /webhook callback (in the request, or on a spool worker)"""
+        self.log.emit('webhook', ts=received_at or time.time(), method=event.method,
+                      webhook_type=event.webhook_type, params=event.params)
+        self.timing.lap('log')
+        self.record(event, received_at)
+
+    @abc.abstractmethod
+    def process_twiml(self, event, received_at=None):
+        """Record and log a TwiML endpoint request (in the request, or on a spool worker)"""
+
+    def spool_request(self):
+        """Append the raw callback to the spool; an error response if it was not accepted, else None"""
+        if (request.content_length or 0) > MAX_ENTRY_BYTES:
+            return {"error": "callback too large"}, 413
+        body = request.get_data() if request.method == 'POST' else b''
+        query = request.query_string
+        call_sid = find_call_sid(body) or find_call_sid(query)
+        if call_sid is None:
+            return {"error": "CallSid missing"}, 400
+        accepted = self.spool.append(call_sid, request.method, request.path, query, body)
+        self.timing.lap('spool')
+        if not accepted:
+            return {"error": "callback spool full, retry later"}, 503, {'Retry-After': '1'}
+        return None
+
+    def process_spooled(self, entry):
+        """Spool worker: decode and process a callback acknowledged earlier"""
+        event = decode_form(entry.method, entry.form(), self.fields, entry.tags())
+        if entry.path == self.twiml_endpoint:
+            self.process_twiml(event, entry.received_at)
+        elif self.duplicate(entry.path, event, self.twiml.empty) is None:
+            self.process_webhook(event, entry.received_at)
+
+    def admin_profile(self):
+        """Sample all threads for ?seconds=N and return collapsed stacks (token required)"""
+        return flask_profile_response(self.profiler, request, self.admin_token)
+
+    def status_info(self):
+        return {}
+
+    def status(self):
+        """Simple status endpoint"""
+        info = {
+            "status": "running",
+            "server": self.name,
+            "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        info.update(self.status_info())
+        info.update({
+            "endpoints": ["/webhook", self.twiml_endpoint, "/status", "/events", "/metrics", "/calls/<call_sid>",
+                          "/geo"],
+            "accepts": "GET and POST requests",
+            "log": self.log.stats(),
+            "store": self.store.stats() if self.store is not None else None,
+            "events": self.bus.stats(),
+            "metrics": self.metrics.summary(),
+            "dedup": self.dedup.stats() if self.dedup is not None else None,
+            "calls": self.calls.stats(),
+            "geo": self.geo.stats(),
+            "spool": self.spool.stats() if self.spool is not None else None,
+            "timing": self.metrics.stage_summary(),
+            "capture": self.capture.stats() if self.capture is not None else None,
+        })
+        return info
+
+    def metrics_endpoint(self):
+        """Prometheus metrics: AMD detection histograms and outcome counts"""
+        return flask_metrics_response(self.metrics)
+
+    def call_record(self, call_sid):
+        """Merged lifecycle record of a call still being tracked"""
+        record = self.calls.get(call_sid)
+        if record is None:
+            return {"error": "call not tracked (unknown or already finalized)", "call_sid": call_sid}, 404
+        return record
+
+    def geo_rollups(self):
+        """Outcome counts and detection-time quantiles per region and config (?country=&state=&config=)"""
+        return flask_geo_response(self.geo, request)
+
+    def events(self):
+        """Server-Sent Events stream of webhook callbacks (optionally ?call_sid=CA...)"""
+        return flask_sse_response(self.bus, request)
+
+    @abc.abstractmethod
+    def home(self):
+        """Home page with server info"""
+
+
+class AdvancedServer(WebhookServer):
+    """Advanced Version: the caller stays silent while AMD classifies a Studio flow"""
+
+    name = "Twilio AMD Testing Server"
+    fields = ADVANCED_FIELDS
+    console = ADVANCED_CONSOLE
+    twiml_endpoint = '/silent'
+
+    def silent(self):
+        """Keep caller silent to allow AMD detection of callee's Studio flow"""
+        # Nothing here waits on the spool: the request is only logged, without decoding it
+        self.log.emit('silent', method=request.method, length=60)
+        self.timing.lap('log')
+        return self.respond(self.twiml.pause(60))
+
+    def process_twiml(self, event, received_at=None):
+        """Log a /silent request that reached a spool worker"""
+        self.log.emit('silent', ts=received_at or time.time(), method=event.method, length=60)
+        self.timing.lap('log')
+
+    def status_info(self):
+        return {
+            "purpose": "AMD testing with caller staying silent",
+            "test_setup": {
+                "caller": "Twilio number with AMD enabled (stays silent)",
+                "callee": "Twilio number with Studio flow (simulates scenarios)",
+                "amd_purpose": "Detect if Studio flow simulates human or machine"
+            },
+        }
+
+    def home(self):
+        """Home page with server info"""
+        return """
+    <h1>Twilio AMD Testing Server</h1>
+    <p><strong>Purpose:</strong> AMD testing where caller stays silent and callee Studio flow simulates scenarios</p>
+
+    <h2>Test Setup</h2>
+    <ul>
+        <li><strong>Caller:</strong> Twilio number with AMD enabled (stays silent)</li>
+        <li><strong>Callee:</strong> Twilio number with Studio flow (simulates human/machine scenarios)</li>
+        <li><strong>AMD Purpose:</strong> Detect if Studio flow simulates human or machine</li>
+    </ul>
+
+    <h2>Endpoints</h2>
+    <ul>
+        <li><strong>/webhook</strong> - AMD callback endpoint (GET/POST) - logs AMD results</li>
+        <li><strong>/silent</strong> - TwiML endpoint (GET/POST) - keeps caller silent for 60s</li>""" + ENDPOINT_ITEMS + """
+    </ul>
+
+    <h2>How It Works</h2>
+    <ol>
+        <li>Caller (Twilio number) calls callee (Twilio number) with AMD enabled</li>
+        <li>Caller gets TwiML from /silent endpoint - stays quiet for 60 seconds</li>
+        <li>Callee Studio flow simulates different answering scenarios (human/machine)</li>
+        <li>AMD analyzes callee's response and sends results to /webhook</li>
+        <li>Server logs AMD results for analysis and fine-tuning</li>
+    </ol>
+
+    <p><strong>No messages are played by the caller</strong> - this is pure AMD detection testing!</p>
+    <p>Check the console for webhook logs and AMD results.</p>
+    """
+
+
+class ManualServer(WebhookServer):
+    """Manual Setup: /handle_amd answers each AMD result with a spoken message"""
+
+    name = "Twilio AMD Demo Server"
+    fields = MANUAL_FIELDS
+    console = MANUAL_CONSOLE
+    twiml_endpoint = '/handle_amd'
+
+    # Shown in the console view when present
+    amd_fields = ('MachineDetectionDuration', 'MachineDetectionSilenceTimeout',
+                  'MachineDetectionSpeechThreshold', 'MachineDetectionSpeechEndThreshold')
+
+    def handle_amd(self):
+        """Handle AMD results with TwiML response"""
+        if self.spool is not None:
+            # Keep the raw body for the spool: parsing the form consumes the input stream
+            request.get_data(cache=True)
+        event = self.decode()
+
+        # AMD result from either AnsweredBy or AnsweringMachineDetection
+        answered_by = event.answered_by or 'unknown'
+
+        # Pre-rendered response for the normalized result (machine/human/fax/unknown)
+        cached = self.twiml.amd(answered_by)
+        duplicate = self.duplicate(request.path, event, cached)
+        self.timing.lap('dedup')
+        if duplicate is not None:
+            return self.respond(duplicate)
+
+        # The TwiML depends on the result, so it is decoded here; the rest can wait for the spool
+        if self.spool is None:
+            self.process_twiml(event)
+        else:
+            error = self.spool_request()
+            if error is not None:
+                if error[1] != 503:
+                    return error
+                # Refused by backpressure: process in the request rather than fail the call
+                self.process_twiml(event)
+        return self.respond(cached)
+
+    def process_twiml(self, event, received_at=None):
+        """Record and log a /handle_amd callback (in the request, or on a spool worker)"""
+        answered_by = event.answered_by or 'unknown'
+        cached = self.twiml.amd(answered_by)
+        self.record(event, received_at)
+
+        amd_details = {field: event.get(field) for field in self.amd_fields if event.get(field)}
+        self.log.emit('handle_amd', ts=received_at or time.time(), method=event.method,
+                      webhook_type=event.webhook_type,
+                      call_sid=event.get('CallSid', 'N/A'), call_status=event.get('CallStatus', 'N/A'),
+                      answered_by=answered_by, amd_details=amd_details,
+                      action=cached.action, message=cached.message)
+        self.timing.lap('log')
+
+    def home(self):
+        """Home page with server info"""
+        return """
+    <h1>Twilio AMD Demo Server</h1>
+    <p>Server is running and ready to receive webhooks!</p>
+    <ul>
+        <li><strong>/webhook</strong> - Main webhook endpoint for AMD callbacks (GET/POST)</li>
+        <li><strong>/handle_amd</strong> - TwiML handler for AMD results (GET/POST)</li>""" + ENDPOINT_ITEMS + """
+    </ul>
+    <p>Check the console for webhook logs.</p>
+    <p><em>Note: This server accepts both GET and POST requests to handle different webhook configurations.</em></p>
+    """
+
+
+SERVERS = {'advanced': AdvancedServer, 'manual': ManualServer}
+
+
+def create_app(variant='advanced'):
+    """New Flask app for a server variant ('advanced' or 'manual') with its own components
+
+    The WebhookServer instance is available as app.extensions['amd_server'].
+    """
+    try:
+        server = SERVERS[variant]()
+    except KeyError:
+        raise ValueError(f"unknown server variant {variant!r} (expected one of {sorted(SERVERS)})") from None
+    app = Flask(f'amd_server.{variant}')
+    server.timing.install(app)
+    for rule, view, methods in server.routes():
+        app.add_url_rule(rule, view.__name__, view, methods=methods)
+    if server.capture is not None:
+        app.wsgi_app = server.capture.wrap(app.wsgi_app)
+    app.extensions['amd_server'] = server
+    return app
@@ -0,0 +1,200 @@
+# Concurrent batch runner for AMD_CONFIGURATIONS
+#
+# Launches N trials per configuration on a bounded thread pool, paces
+# calls.create with a calls-per-second token bucket and tags every callback
+# URL with AmdConfig/AmdTrial so results map back to their trial. Each trial
+# waits for its async AMD callback on the event bus (with a single REST
+# fetch as fallback, or REST polling when there is no bus) and results are
+# reported as soon as they complete.
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .ratelimit import TokenBucket
+from .webhook import CONFIG_PARAM, COUNTRY_PARAM, MODE_PARAM, STATE_PARAM, TRIAL_PARAM, tag_url
+
+STATUS_EVENTS = ['initiated', 'ringing', 'answered', 'completed']
+
+
+def build_call_params(config_key, config, from_number, to_number, trial=None, region=None):
+    """calls.create keyword arguments for one configuration, with tagged callback URLs
+
+    Callbacks carry AmdConfig, AmdMode and (for batch runs) AmdTrial tags,
+    and AmdCountry / AmdState when the destination's (country, state)
+    `region` is known.
+    Status callbacks go to the async AMD callback URL unless the
+    configuration sets its own (synchronous AMD configurations only have
+    that one).
+    """
+    params = dict(config['params'])
+    tags = {CONFIG_PARAM: config_key}
+    if params.get('machine_detection'):
+        tags[MODE_PARAM] = params['machine_detection']
+    if trial is not None:
+        tags[TRIAL_PARAM] = trial
+    if region is not None and region[0]:
+        tags[COUNTRY_PARAM] = region[0]
+        if region[1]:
+            tags[STATE_PARAM] = region[1]
+    if params.get('async_amd_status_callback'):
+        params['async_amd_status_callback'] = tag_url(params['async_amd_status_callback'], **tags)
+        params.setdefault('status_callback', params['async_amd_status_callback'])
+    elif params.get('status_callback'):
+        params['status_callback'] = tag_url(params['status_callback'], **tags)
+    params.setdefault('status_callback_method', 'POST')
+    params.setdefault('status_callback_event', STATUS_EVENTS)
+    return {'to': to_number, 'from_': from_number, **params}
+
+
+class TrialResult:
+    """Outcome of one call placed for one configuration"""
+
+    __slots__ = ('config_key', 'trial', 'call_sid', 'answered_by', 'detection_ms',
+                 'source', 'error', 'started_at', 'finished_at')
+
+    def __init__(self, config_key, trial):
+        self.config_key = config_key
+        self.trial = trial
+        self.call_sid = None
+        self.answered_by = None
+        self.detection_ms = None
+        self.source = None
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class BatchSummary:
+    """Running per-configuration tallies, updated as trials complete"""
+
+    def __init__(self, config_keys):
+        self._lock = threading.Lock()
+        self.results = []
+        self.by_config = {key: {'outcomes': {}, 'durations': [], 'errors': 0} for key in config_keys}
+
+    def add(self, result):
+        with self._lock:
+            self.results.append(result)
+            entry = self.by_config[result.config_key]
+            if result.error:
+                entry['errors'] += 1
+                return
+            outcome = result.answered_by or 'no_result'
+            entry['outcomes'][outcome] = entry['outcomes'].get(outcome, 0) + 1
+            if result.detection_ms is not None:
+                entry['durations'].append(result.detection_ms)
+
+    def rows(self):
+        """[(config_key, trials, outcome counts, median detection ms, errors)]"""
+        with self._lock:
+            rows = []
+            for key, entry in self.by_config.items():
+                trials = sum(entry['outcomes'].values()) + entry['errors']
+                median = statistics.median(entry['durations']) if entry['durations'] else None
+                rows.append((key, trials, dict(entry['outcomes']), median, entry['errors']))
+            return rows
+
+    def print_table(self, configurations=None):
+        print(f"\n{'Configuration':<32} {'Trials':>6} {'Median ms':>9} {'Errors':>6}  Outcomes")
+        print("-" * 90)
+        for key, trials, outcomes, median, errors in self.rows():
+            name = configurations[key]['name'][:32] if configurations else key
+            median_text = f"{median:.0f}" if median is not None else "-"
+            outcome_text = ", ".join(f"{k}={v}" for k, v in sorted(outcomes.items())) or "-"
+            print(f"{name:<32} {trials:>6} {median_text:>9} {errors:>6}  {outcome_text}")
+
+
+class BatchRunner:
+    """Runs trials for several AMD configurations with bounded concurrency and a CPS cap"""
+
+    def __init__(self, client, configurations, from_number, to_number, bus=None,
+                 concurrency=4, calls_per_second=1.0, wait_timeout=90, poll_interval=5):
+        self.client = client
+        self.configurations = configurations
+        self.from_number = from_number
+        self.to_number = to_number
+        self.bus = bus
+        self.concurrency = concurrency
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.limiter = TokenBucket(calls_per_second)
+
+    def run(self, config_keys=None, trials=1, on_result=None, first_trial=1):
+        """Run `trials` calls per configuration; on_result(result, summary) fires per completion
+
+        Trials are numbered from `first_trial`, so follow-up runs for the same
+        configuration keep distinct AmdTrial tags.
+        """
+        config_keys = list(config_keys or self.configurations)
+        summary = BatchSummary(config_keys)
+        jobs = [(key, n) for n in range(first_trial, first_trial + trials) for key in config_keys]
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='amd-batch') as pool:
+            futures = [pool.submit(self.run_trial, key, n) for key, n in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                summary.add(result)
+                if on_result:
+                    on_result(result, summary)
+        return summary
+
+    def run_trial(self, config_key, trial):
+        """Place one call and wait for its AMD result"""
+        result = TrialResult(config_key, trial)
+        params = build_call_params(config_key, self.configurations[config_key],
+                                   self.from_number, self.to_number, trial)
+        self.limiter.acquire()
+        try:
+            call = self.client.calls.create(**params)
+            result.call_sid = call.sid
+            if self.bus is not None:
+                message = self.bus.wait_for_amd(call.sid, self.wait_timeout)
+                if message is not None:
+                    result.answered_by = message['answered_by']
+                    result.detection_ms = _to_int(message.get('detection_ms'))
+                    result.source = 'webhook'
+                else:
+                    # No callback arrived: one REST fetch as a fallback
+                    self._fetch_result(result)
+            else:
+                deadline = time.monotonic() + self.wait_timeout
+                while not self._fetch_result(result) and time.monotonic() < deadline:
+                    time.sleep(self.poll_interval)
+        except Exception as e:
+            result.error = str(e)
+        result.finished_at = time.time()
+        return result
+
+    def _fetch_result(self, result):
+        fetched = self.client.calls(result.call_sid).fetch()
+        result.answered_by = getattr(fetched, 'answered_by', None)
+        result.detection_ms = _to_int(getattr(fetched, 'machine_detection_duration', None))
+        result.source = 'rest'
+        return result.answered_by is not None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def print_result_row(result, summary):
+    """on_result callback that prints each trial as it completes"""
+    if result.error:
+        outcome = f"ERROR: {result.error}"
+    else:
+        outcome = result.answered_by or 'no result'
+        if result.detection_ms is not None:
+            outcome += f" ({result.detection_ms}ms)"
+    done = len(summary.results)
+    print(f"[{done:>3}] {result.config_key:<20} trial {result.trial:<3} "
+          f"{result.call_sid or '-':<36} {outcome}  [{result.elapsed:.1f}s]")
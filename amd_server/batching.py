@@ -0,0 +1,122 @@
+# Bounded queue drained in batches by a background thread
+#
+# Shared by the log sink and the result store: the request path only does a
+# queue put, and the worker thread hands whole batches to a callback so the
+# expensive part (stdout writes, SQLite commits) is amortized.
+import atexit
+import queue
+import sys
+import threading
+
+DROP = 'drop'
+BLOCK = 'block'
+
+_STOP = object()
+
+
+class _Barrier:
+    """Queue marker that is released once every item before it was handled"""
+
+    __slots__ = ('done',)
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class BatchWorker:
+    """Runs handler(batch) on a background thread for items submitted from any thread
+
+    policy is DROP (discard new items when the queue is full and count
+    them) or BLOCK (wait for room, up to block_timeout seconds if given).
+    """
+
+    def __init__(self, handler, name, maxsize=10000, policy=DROP, block_timeout=None,
+                 batch_size=256, flush_interval=0.2, on_close=None):
+        if policy not in (DROP, BLOCK):
+            raise ValueError(f"Unknown queue policy: {policy!r} (use 'drop' or 'block')")
+        self.handler = handler
+        self.name = name
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_close = on_close
+        self.dropped = 0
+        self.errors = 0
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, item):
+        """Queue one item; returns False (and counts it) if it had to be dropped"""
+        try:
+            if self.policy == DROP:
+                self._queue.put_nowait(item)
+            else:
+                self._queue.put(item, timeout=self.block_timeout)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "policy": self.policy,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+    def flush(self, timeout=5):
+        """Block until every item submitted before this call has been handled"""
+        if not self._thread.is_alive():
+            return False
+        barrier = _Barrier()
+        self._queue.put(barrier)
+        return barrier.done.wait(timeout)
+
+    def close(self, timeout=5):
+        """Process pending items and stop the worker thread"""
+        atexit.unregister(self.close)
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            barriers = []
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                if isinstance(item, _Barrier):
+                    barriers.append(item)
+                else:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self.handler(batch)
+                except Exception as e:
+                    self.errors += 1
+                    sys.stderr.write(f"{self.name} error: {e}\n")
+            for barrier in barriers:
+                barrier.done.set()
+        if self.on_close:
+            self.on_close()
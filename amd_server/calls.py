@@ -0,0 +1,275 @@
+# Per-call lifecycle records
+#
+# Status callbacks (initiated / ringing / answered / completed) and the
+# async AMD result for a call arrive as unrelated requests. CallTracker
+# merges them into one CallRecord per CallSid with the arrival time of
+# each transition. A record is finalized a grace period after the call
+# ends (a late AMD result still lands in it), or once it has been idle for
+# `idle_ttl` if its final callback never comes, and is then handed to the
+# configured writers on a background thread and dropped from memory. Expiry
+# is checked every `sweep_interval` seconds by a timer thread, so records
+# are finalized on time even when no callbacks arrive.
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .batching import DROP, BatchWorker
+from .events import TERMINAL_STATUSES
+from .webhook import AMD_RESULT, normalize_outcome
+
+# CallStatus -> CallRecord timestamp attribute
+TRANSITIONS = {
+    'queued': 'initiated_at',
+    'initiated': 'initiated_at',
+    'ringing': 'ringing_at',
+    'in-progress': 'answered_at',
+    'answered': 'answered_at',
+}
+
+COMPLETED = 'completed'
+INCOMPLETE = 'incomplete'   # idle past idle_ttl without a final status
+EVICTED = 'evicted'         # pushed out by max_calls
+
+
+def _seconds(start, end):
+    if start is None or end is None:
+        return None
+    return round(end - start, 3)
+
+
+class CallRecord:
+    """Merged lifecycle of one call; times are callback arrival times (epoch seconds)"""
+
+    __slots__ = ('call_sid', 'config_key', 'detection_mode', 'to_country', 'to_state',
+                 'first_seen', 'last_seen', 'initiated_at', 'ringing_at', 'answered_at',
+                 'amd_at', 'ended_at', 'call_status', 'answered_by', 'detection_ms',
+                 'duration_s', 'callbacks', 'finalize_at', 'state')
+
+    def __init__(self, call_sid, now):
+        self.call_sid = call_sid
+        self.first_seen = self.last_seen = now
+        self.config_key = self.detection_mode = self.to_country = self.to_state = None
+        self.initiated_at = self.ringing_at = self.answered_at = self.amd_at = self.ended_at = None
+        self.call_status = self.answered_by = self.detection_ms = self.duration_s = None
+        self.callbacks = 0
+        self.finalize_at = None
+        self.state = None
+
+    def update(self, event, now):
+        params = event.params
+        self.last_seen = now
+        self.callbacks += 1
+        self.config_key = self.config_key or event.config_key
+        self.detection_mode = self.detection_mode or event.detection_mode
+        self.to_country = self.to_country or params.get('ToCountry') or params.get('CalledCountry')
+        self.to_state = self.to_state or params.get('ToState') or params.get('CalledState')
+        if event.webhook_type == AMD_RESULT:
+            self.amd_at = now
+            self.answered_by = event.answered_by
+            self.detection_ms = _int(params.get('MachineDetectionDuration')) or self.detection_ms
+        status = params.get('CallStatus')
+        if status:
+            self.call_status = status
+            attr = TRANSITIONS.get(status)
+            if attr is not None and getattr(self, attr) is None:
+                setattr(self, attr, now)
+            elif status in TERMINAL_STATUSES and self.ended_at is None:
+                self.ended_at = now
+                self.duration_s = _int(params.get('CallDuration'))
+
+    @property
+    def time_to_answer(self):
+        return _seconds(self.initiated_at, self.answered_at)
+
+    @property
+    def time_to_amd(self):
+        """Answer to AMD result arrival (detection time plus callback delivery)"""
+        return _seconds(self.answered_at, self.amd_at)
+
+    @property
+    def outcome(self):
+        return normalize_outcome(self.answered_by) if self.answered_by else None
+
+    def as_dict(self):
+        record = {name: getattr(self, name) for name in self.__slots__ if name != 'finalize_at'}
+        record['time_to_answer_s'] = self.time_to_answer
+        record['time_to_amd_s'] = self.time_to_amd
+        record['outcome'] = self.outcome
+        return record
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class BusWriter:
+    """Publishes finalized records on an EventBus as CALL_FINALIZED messages"""
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def write(self, records):
+        for record in records:
+            self.bus.publish({
+                'type': 'CALL_FINALIZED',
+                'call_sid': record['call_sid'],
+                'call_status': record['call_status'],
+                'answered_by': None,   # not an AMD result message (see EventBus.publish)
+                'config_key': record['config_key'],
+                'received_at': record['last_seen'],
+                'record': record,
+            })
+
+    def close(self):
+        pass
+
+
+class CallTracker:
+    """In-memory CallSid -> CallRecord table with bounded size and finalize-on-expiry
+
+    writers are objects with write(list of record dicts) and close(), the
+    same interface as the log sink writers (e.g. logsink.JsonlFileWriter).
+    """
+
+    def __init__(self, writers=(), grace=30, idle_ttl=3600, max_calls=100000,
+                 sweep_interval=1.0, clock=time.time, sweeper=True):
+        self.writers = list(writers)
+        self.grace = grace
+        self.idle_ttl = idle_ttl
+        self.max_calls = max_calls
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._ending = deque()        # (finalize_at, sid) for ended calls, in order
+        self._idle = OrderedDict()    # sid -> check_at for calls not ended yet, in creation order
+        self._next_sweep = 0.0
+        self.finalized = {COMPLETED: 0, INCOMPLETE: 0, EVICTED: 0}
+        self._worker = BatchWorker(self._write, name='amd-calls', maxsize=10000, policy=DROP,
+                                   on_close=self._close_writers)
+        self._stop = threading.Event()
+        self._sweeper = None
+        if sweeper:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='amd-calls-sweep', daemon=True)
+            self._sweeper.start()
+        atexit.register(self.close)
+
+    def observe(self, event, received_at=None):
+        """Merge one decoded WebhookEvent into its call's record"""
+        call_sid = event.call_sid
+        if not call_sid:
+            return
+        now = received_at if received_at is not None else self._clock()
+        with self._lock:
+            record = self._calls.get(call_sid)
+            if record is None:
+                record = self._calls[call_sid] = CallRecord(call_sid, now)
+                self._idle[call_sid] = now + self.idle_ttl
+                if len(self._calls) > self.max_calls:
+                    self._finalize(next(iter(self._calls)), EVICTED)
+            record.update(event, now)
+            if record.ended_at is not None and record.finalize_at is None:
+                record.finalize_at = now + self.grace
+                self._ending.append((record.finalize_at, call_sid))
+                # Ended calls are finalized from _ending; the idle check no longer applies
+                self._idle.pop(call_sid, None)
+            due = now >= self._next_sweep
+        if due:
+            self.sweep(now)
+
+    def get(self, call_sid):
+        """Current record of a call that has not been finalized yet, as a dict"""
+        with self._lock:
+            record = self._calls.get(call_sid)
+            return record.as_dict() if record is not None else None
+
+    def sweep(self, now=None):
+        """Finalize ended calls past their grace period and calls idle past idle_ttl"""
+        now = self._clock() if now is None else now
+        with self._lock:
+            self._next_sweep = now + self.sweep_interval
+            while self._ending and self._ending[0][0] <= now:
+                _, call_sid = self._ending.popleft()
+                if call_sid in self._calls:
+                    self._finalize(call_sid, COMPLETED)
+            idle = self._idle
+            while idle:
+                call_sid, check_at = next(iter(idle.items()))
+                if check_at > now:
+                    break
+                record = self._calls[call_sid]
+                if record.last_seen + self.idle_ttl <= now:
+                    self._finalize(call_sid, INCOMPLETE)
+                else:
+                    idle.move_to_end(call_sid)
+                    idle[call_sid] = record.last_seen + self.idle_ttl
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            self.sweep()
+
+    def _finalize(self, call_sid, state):
+        # Called with self._lock held
+        record = self._calls.pop(call_sid)
+        self._idle.pop(call_sid, None)
+        record.state = state
+        self.finalized[state] += 1
+        self._worker.submit(record.as_dict())
+
+    def stats(self):
+        with self._lock:
+            stats = {'active': len(self._calls), 'capacity': self.max_calls,
+                     'ending': len(self._ending), 'finalized': dict(self.finalized)}
+        stats['sink'] = self._worker.stats()
+        return stats
+
+    def close(self, timeout=5):
+        """Finalize every open record, hand them to the writers and stop"""
+        atexit.unregister(self.close)
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+        with self._lock:
+            for call_sid in list(self._calls):
+                record = self._calls[call_sid]
+                self._finalize(call_sid, COMPLETED if record.ended_at is not None else INCOMPLETE)
+        self._worker.close(timeout)
+
+    def _write(self, batch):
+        for writer in self.writers:
+            writer.write(batch)
+
+    def _close_writers(self):
+        for writer in self.writers:
+            writer.close()
+
+
+def tracker_from_env(bus=None):
+    """CallTracker from AMD_CALLS_* environment variables
+
+    AMD_CALLS_FILE      JSONL file receiving finalized call records (disabled when unset)
+    AMD_CALLS_GRACE     seconds to keep a record after the call ends (default 30)
+    AMD_CALLS_IDLE_TTL  seconds before a call with no final status is dropped (default 3600)
+    AMD_CALLS_MAX       maximum calls tracked at once (default 100000)
+
+    Finalized records are also published on `bus` when one is given.
+    """
+    from .logsink import JsonlFileWriter
+
+    writers = []
+    if bus is not None:
+        writers.append(BusWriter(bus))
+    path = os.getenv('AMD_CALLS_FILE')
+    if path:
+        writers.append(JsonlFileWriter(path))
+    return CallTracker(
+        writers,
+        grace=float(os.getenv('AMD_CALLS_GRACE', '30')),
+        idle_ttl=float(os.getenv('AMD_CALLS_IDLE_TTL', '3600')),
+        max_calls=int(os.getenv('AMD_CALLS_MAX', '100000')),
+    )
@@ -0,0 +1,244 @@
+# Opt-in capture of the requests a server receives, for replay
+#
+# With AMD_CAPTURE_DIR set, a WSGI middleware records every request as it
+# arrived: arrival time, method, path, query string, headers and the raw
+# body, together with the response status, body and how long the server
+# took. amd_server.replay sends a capture back to any server at its
+# original pace, faster, or as fast as possible, and compares the answers.
+#
+# Recording happens off the request path: the middleware keeps the bytes
+# it already has and hands one tuple to a background writer (the same
+# BatchWorker as the log sink), which appends length- and CRC-framed
+# records (as in amd_server.spool) to one file per process. Records are
+# written as responses complete, so concurrent requests can be slightly out
+# of arrival order in a file; reading puts them back in order through a
+# bounded window. A torn final record from a crash is skipped on read. Capture stops once a file
+# reaches `max_bytes`, so a forgotten capture cannot fill the disk.
+#
+# The event stream and admin endpoints are not captured; Authorization and
+# Cookie headers are dropped.
+import glob
+import heapq
+import json
+import os
+import threading
+import time
+import zlib
+from io import BytesIO
+
+from .batching import DROP, BatchWorker
+from .spool import HEADER
+
+CAPTURE_SUFFIX = '.amdcap'
+# Paths (prefixes) never captured: long-lived streams and token-guarded endpoints
+SKIPPED_PATHS = ('/events', '/admin/')
+DROPPED_HEADERS = ('Authorization', 'Cookie')
+# Responses longer than this are recorded truncated (they are compared, not served)
+MAX_RESPONSE_BYTES = 64 * 1024
+# Records re-ordered by arrival time while reading a file: more than a process has requests in flight
+REORDER_WINDOW = 1024
+
+
+def _headers(environ):
+    headers = []
+    for key, value in environ.items():
+        if key.startswith('HTTP_'):
+            name = key[5:].replace('_', '-').title()
+        elif key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = key.replace('_', '-').title()
+        else:
+            continue
+        if value and name not in DROPPED_HEADERS:
+            headers.append((name, value))
+    return headers
+
+
+def encode_record(record):
+    """Framed capture record: JSON metadata, a newline, then the raw request body"""
+    meta, body = record
+    payload = json.dumps(meta, separators=(',', ':')).encode() + b'\n' + body
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class _Response:
+    """Response iterable that keeps a copy of the body and records the request once it is sent"""
+
+    def __init__(self, iterable, capture, meta, body, started):
+        self._iterable = iterable
+        self._capture = capture
+        self._meta = meta
+        self._body = body
+        self._started = started
+        self._chunks = []
+        self._size = 0
+        self._recorded = False
+
+    def __iter__(self):
+        for chunk in self._iterable:
+            if self._size < MAX_RESPONSE_BYTES:
+                self._chunks.append(chunk)
+                self._size += len(chunk)
+            yield chunk
+        self._record()
+
+    def _record(self):
+        if self._recorded:
+            return
+        self._recorded = True
+        self._meta['d'] = round(time.perf_counter() - self._started, 6)
+        self._meta['r'] = b''.join(self._chunks)[:MAX_RESPONSE_BYTES].decode('utf-8', 'replace')
+        self._capture.submit(self._meta, self._body)
+
+    def close(self):
+        # Servers call close() even when the client went away mid-response
+        try:
+            if hasattr(self._iterable, 'close'):
+                self._iterable.close()
+        finally:
+            self._record()
+
+
+class Capture:
+    """Records requests to `directory`/<pid>-<start><CAPTURE_SUFFIX> from a WSGI middleware"""
+
+    def __init__(self, directory, max_bytes=1 << 30, skip=SKIPPED_PATHS):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{os.getpid()}-{int(time.time())}{CAPTURE_SUFFIX}')
+        self.max_bytes = max_bytes
+        self.skip = tuple(skip)
+        self.captured = 0
+        self.bytes = 0
+        self.full = False
+        self._file = open(self.path, 'ab')
+        self._lock = threading.Lock()
+        self._worker = BatchWorker(self._write, name='amd-capture', maxsize=10000, policy=DROP,
+                                   on_close=self._file.close)
+
+    def wrap(self, wsgi_app):
+        """WSGI middleware around wsgi_app (install with app.wsgi_app = capture.wrap(app.wsgi_app))"""
+
+        def middleware(environ, start_response):
+            path = environ.get('PATH_INFO', '')
+            if self.full or path.startswith(self.skip):
+                return wsgi_app(environ, start_response)
+            received_at = time.time()
+            started = time.perf_counter()
+            stream = environ['wsgi.input']
+            length = environ.get('CONTENT_LENGTH')
+            if length:
+                body = stream.read(int(length))
+            elif environ.get('HTTP_TRANSFER_ENCODING', '').lower() == 'chunked':
+                body = stream.read()
+            else:
+                body = b''
+            # The app reads the same bytes the capture keeps
+            environ['wsgi.input'] = BytesIO(body)
+            meta = {'t': received_at, 'm': environ.get('REQUEST_METHOD', 'GET'), 'p': path,
+                    'q': environ.get('QUERY_STRING', ''), 'h': _headers(environ)}
+
+            def capture_start_response(status, headers, exc_info=None):
+                meta['s'] = int(status.split(' ', 1)[0])
+                return start_response(status, headers, exc_info)
+
+            return _Response(wsgi_app(environ, capture_start_response), self, meta, body, started)
+
+        return middleware
+
+    def submit(self, meta, body):
+        self._worker.submit((meta, body))
+
+    def _write(self, batch):
+        data = b''.join(encode_record(record) for record in batch)
+        with self._lock:
+            if self.full:
+                return
+            self._file.write(data)
+            self._file.flush()
+            self.captured += len(batch)
+            self.bytes += len(data)
+            if self.bytes >= self.max_bytes:
+                self.full = True
+
+    def stats(self):
+        stats = {'file': self.path, 'captured': self.captured, 'bytes': self.bytes, 'full': self.full}
+        stats['writer'] = self._worker.stats()
+        return stats
+
+    def close(self, timeout=5):
+        self._worker.close(timeout)
+
+
+class CapturedRequest:
+    """One recorded request and the response the capturing server gave"""
+
+    __slots__ = ('received_at', 'method', 'path', 'query', 'headers', 'body', 'status', 'response',
+                 'duration')
+
+    def __init__(self, meta, body):
+        self.received_at = meta['t']
+        self.method = meta['m']
+        self.path = meta['p']
+        self.query = meta['q']
+        self.headers = meta['h']
+        self.body = body
+        self.status = meta.get('s')
+        self.response = meta.get('r')
+        self.duration = meta.get('d')
+
+    @property
+    def url(self):
+        return f'{self.path}?{self.query}' if self.query else self.path
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, crc = HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                # Torn by a crash mid-write: the rest of the file is unreadable
+                return
+            meta, _, body = payload.partition(b'\n')
+            yield CapturedRequest(json.loads(meta), body)
+
+
+def _in_arrival_order(records, window=REORDER_WINDOW):
+    heap = []
+    for n, record in enumerate(records):
+        heapq.heappush(heap, (record.received_at, n, record))
+        if len(heap) > window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+def capture_files(paths):
+    """Capture files named by `paths` (files, or directories holding them)"""
+    files = []
+    for path in [paths] if isinstance(paths, str) else paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*' + CAPTURE_SUFFIX))))
+        else:
+            files.append(path)
+    return files
+
+
+def read_capture(paths):
+    """Lazily yield the CapturedRequests of several capture files in arrival order"""
+    return heapq.merge(*(_in_arrival_order(_read_file(path)) for path in capture_files(paths)),
+                       key=lambda r: r.received_at)
+
+
+def capture_from_env():
+    """Capture into AMD_CAPTURE_DIR, or None when the variable is unset
+
+    AMD_CAPTURE_DIR     directory receiving one capture file per process (capture is off when unset)
+    AMD_CAPTURE_MAX_MB  size at which a process stops capturing (default 1024)
+    """
+    directory = os.getenv('AMD_CAPTURE_DIR')
+    if not directory:
+        return None
+    return Capture(directory, max_bytes=int(float(os.getenv('AMD_CAPTURE_MAX_MB', '1024')) * (1 << 20)))
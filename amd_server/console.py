@@ -0,0 +1,165 @@
+# Console views of the servers' log records
+#
+# The log sink hands each record (a plain dict, see amd_server.logsink) to
+# one of these formatters on its background thread, so the banners cost the
+# request path nothing. The advanced server shows AMD result interpretation
+# and its test scenario; the manual server shows the /handle_amd decision.
+from .logsink import format_timestamp
+from .webhook import ADVANCED_FIELDS, MANUAL_FIELDS, MACHINE_RESULTS, WebhookEvent
+
+
+def format_advanced_webhook(record):
+    """Categorized console view of an advanced-server /webhook record"""
+    event = WebhookEvent(record['method'], record['webhook_type'], record['params'], ADVANCED_FIELDS)
+    params = event.params
+    lines = [
+        "\n" + "="*70,
+        f"--- AMD WEBHOOK RECEIVED ({event.webhook_type}) [{event.method}] ---",
+        f"Timestamp: {format_timestamp(record['ts'])}",
+        "="*70,
+    ]
+
+    # Display key information prominently
+    key_info = []
+    if 'CallSid' in params:
+        key_info.append(f"Call SID: {params['CallSid']}")
+    if 'CallStatus' in params:
+        key_info.append(f"Status: {params['CallStatus']}")
+    if 'AnsweredBy' in params:
+        key_info.append(f"AMD Result: {params['AnsweredBy']}")
+
+        # Show AMD result interpretation
+        amd_result = params['AnsweredBy'].lower()
+        if amd_result == 'human':
+            key_info.append("   ✅ Human detected - real person answered")
+        elif amd_result in MACHINE_RESULTS:
+            key_info.append("   🤖 Machine detected - answering machine/voicemail")
+        elif amd_result == 'fax':
+            key_info.append("   📠 Fax machine detected")
+        elif amd_result == 'unknown':
+            key_info.append("   ❓ Unknown - could not determine human vs machine")
+        else:
+            key_info.append(f"   ❓ Unrecognized AMD result: {amd_result}")
+
+    if 'MachineDetectionDuration' in params:
+        duration = params['MachineDetectionDuration']
+        try:
+            key_info.append(f"AMD Duration: {duration}ms ({float(duration)/1000:.2f}s)")
+        except ValueError:
+            key_info.append(f"AMD Duration: {duration}ms")
+
+    if 'SequenceNumber' in params:
+        key_info.append(f"Sequence: {params['SequenceNumber']}")
+    if 'CallbackSource' in params:
+        key_info.append(f"Source: {params['CallbackSource']}")
+
+    lines.extend(f">> {info}" for info in key_info)
+
+    lines.append("\n" + "-"*50)
+    lines.append("DETAILED WEBHOOK DATA:")
+    lines.append("-"*50)
+
+    # Display categorized data (only categories with data)
+    for category, data in event.categorized():
+        lines.append(f"\n[{category}]:")
+        for key, value in data:
+            # Don't show empty values
+            if value and value.strip():
+                lines.append(f"   {key}: {value}")
+
+    # Show test scenario context
+    lines.append("\n[TEST SCENARIO CONTEXT]:")
+    lines.append("   Caller: Twilio number with AMD enabled (stays silent)")
+    lines.append("   Callee: Twilio number with Studio flow (simulates scenarios)")
+    lines.append("   AMD Purpose: Detect if Studio flow simulates human or machine")
+    lines.append("   No Messages: Caller doesn't play messages - Studio handles everything")
+
+    lines.append("="*70 + "\n")
+    return "\n".join(lines) + "\n"
+
+
+def format_silent(record):
+    """Console view of a /silent record"""
+    return "\n".join([
+        "\n" + "="*50,
+        "--- SILENT ENDPOINT CALLED ---",
+        f"Timestamp: {format_timestamp(record['ts'])}",
+        "="*50,
+        ">> Action: Keeping caller silent for AMD detection",
+        f">> Duration: {record['length']} seconds (allows AMD to analyze callee)",
+        ">> Callee: Studio flow will simulate human/machine scenarios",
+        ">> Caller: Stays silent - no messages played",
+        "="*50 + "\n",
+    ]) + "\n"
+
+
+def format_manual_webhook(record):
+    """Categorized console view of a manual-server /webhook record"""
+    event = WebhookEvent(record['method'], record['webhook_type'], record['params'], MANUAL_FIELDS)
+    params = event.params
+    lines = [
+        "\n" + "="*60,
+        f"--- WEBHOOK RECEIVED ({event.webhook_type}) [{event.method}] ---",
+        f"Timestamp: {format_timestamp(record['ts'])}",
+        "="*60,
+    ]
+
+    # Display key information prominently
+    key_info = []
+    if 'CallSid' in params:
+        key_info.append(f"Call SID: {params['CallSid']}")
+    if 'CallStatus' in params:
+        key_info.append(f"Status: {params['CallStatus']}")
+    if 'AnsweredBy' in params:
+        key_info.append(f"AMD Result: {params['AnsweredBy']}")
+    if 'AnsweringMachineDetection' in params:
+        key_info.append(f"AMD Detection: {params['AnsweringMachineDetection']}")
+    if 'SequenceNumber' in params:
+        key_info.append(f"Sequence: {params['SequenceNumber']}")
+    if 'CallbackSource' in params:
+        key_info.append(f"Source: {params['CallbackSource']}")
+
+    lines.extend(f">> {info}" for info in key_info)
+
+    lines.append("\n" + "-"*40)
+    lines.append("PARSED WEBHOOK DATA:")
+    lines.append("-"*40)
+
+    # Display categorized data (only categories with data)
+    for category, data in event.categorized():
+        lines.append(f"\n[{category}]:")
+        for key, value in data:
+            # Don't show empty values
+            if value and value.strip():
+                lines.append(f"   {key}: {value}")
+
+    lines.append("="*60 + "\n")
+    return "\n".join(lines) + "\n"
+
+
+def format_handle_amd(record):
+    """Console view of a /handle_amd record"""
+    lines = [
+        "\n" + "="*60,
+        f"--- AMD TwiML HANDLER ({record['webhook_type']}) [{record['method']}] ---",
+        f"Timestamp: {format_timestamp(record['ts'])}",
+        "="*60,
+        f">> Call SID: {record['call_sid']}",
+        f">> Call Status: {record['call_status']}",
+        f">> AMD Result: {record['answered_by']}",
+    ]
+
+    if record['amd_details']:
+        lines.append("\n[AMD Details]:")
+        for field, value in record['amd_details'].items():
+            lines.append(f"   {field}: {value}")
+
+    lines.append("-"*60)
+    lines.append(f">> Action: {record['action']}")
+    lines.append(f">> Message: {record['message']}")
+    lines.append("="*60 + "\n")
+    return "\n".join(lines) + "\n"
+
+
+ADVANCED_CONSOLE = {'webhook': format_advanced_webhook, 'silent': format_silent}
+MANUAL_CONSOLE = {'webhook': format_manual_webhook, 'handle_amd': format_handle_amd}
@@ -0,0 +1,199 @@
+# Duplicate callback suppression
+#
+# Twilio retries a callback when the webhook is slow to answer, which is
+# exactly when the server is busiest. Each callback gets a key from its
+# endpoint, CallSid, SequenceNumber and CallbackSource (or AnsweredBy for
+# AMD results); the first arrival is processed and its response remembered,
+# and repeats within the TTL get that response back without being logged,
+# stored or published again. Entries are capped in number and expire, so
+# memory stays flat however long the server runs.
+#
+# The cache lives in one process. Under gunicorn a retry can reach another
+# worker than the first delivery did, so with AMD_DEDUP_SHARED set, keys
+# missing from the local cache are also claimed in an SQLite table every
+# worker on the host shares: one upsert per first-seen callback, in WAL
+# mode without fsync. sqlite3 is only imported when the table is used.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_SIZE = 50000
+DEFAULT_TTL = 3600
+# Expired keys are deleted from the shared table every this many claims
+PURGE_EVERY = 1000
+
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dedup_keys (
+    key         TEXT PRIMARY KEY,
+    expires_at  REAL NOT NULL         -- unix epoch seconds
+) WITHOUT ROWID
+"""
+
+# Inserts a new key, or takes over an expired one; no row changes when the key is live
+CLAIM = """
+INSERT INTO dedup_keys (key, expires_at) VALUES (?, ?)
+ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at WHERE dedup_keys.expires_at <= ?
+"""
+
+
+def callback_key(path, values):
+    """Dedup key for a callback's form/query values, or None if it cannot be keyed"""
+    call_sid = values.get('CallSid')
+    if not call_sid:
+        return None
+    # Status callbacks are numbered per call; without a number fall back to the status
+    sequence = values.get('SequenceNumber') or values.get('CallStatus') or ''
+    source = values.get('CallbackSource') or values.get('AnsweredBy') or ''
+    return f"{path}|{call_sid}|{sequence}|{source}"
+
+
+class SharedKeys:
+    """Callback keys claimed in an SQLite table shared by the processes of a host"""
+
+    def __init__(self, path, timeout=5.0, clock=time.time):
+        import sqlite3
+
+        self.path = path
+        self._clock = clock
+        self._error = sqlite3.Error
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SHARED_SCHEMA)
+        self._lock = threading.Lock()
+        self.claims = 0
+        self.errors = 0
+
+    def claim(self, key, ttl):
+        """True if no process has claimed key within ttl, or if the table cannot be reached
+
+        Failing open means an unavailable table degrades to per-process
+        dedup rather than dropping callbacks.
+        """
+        now = self._clock()
+        with self._lock:
+            try:
+                claimed = self._conn.execute(CLAIM, (key, now + ttl, now)).rowcount > 0
+                self.claims += 1
+                if self.claims % PURGE_EVERY == 0:
+                    self._conn.execute("DELETE FROM dedup_keys WHERE expires_at <= ?", (now,))
+                return claimed
+            except self._error:
+                self.errors += 1
+                return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class DedupCache:
+    """Bounded LRU of callback keys with a TTL, mapping each key to its response
+
+    shared: optional SharedKeys consulted for keys this process has not seen.
+    """
+
+    def __init__(self, max_entries=DEFAULT_SIZE, ttl=DEFAULT_TTL, clock=time.monotonic, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def check(self, key, response):
+        """Return the remembered response if key was seen, else remember `response` and return None
+
+        Check and insert are one step, so concurrent retries of the same
+        callback are processed once.
+        """
+        if key is None:
+            return None
+        now = self._clock()
+        entries = self._entries
+        with self._lock:
+            entry = entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del entries[key]
+                self.expired += 1
+            self.misses += 1
+            entries[key] = (now + self.ttl, response)
+            # Oldest entries sit at the front; drop expired ones and any over capacity
+            while entries:
+                oldest_key, (expires_at, _) = next(iter(entries.items()))
+                if expires_at <= now:
+                    self.expired += 1
+                elif len(entries) > self.max_entries:
+                    self.evicted += 1
+                else:
+                    break
+                del entries[oldest_key]
+        # First time here; another worker may still have processed it
+        if self.shared is not None and not self.shared.claim(key, self.ttl):
+            with self._lock:
+                self.misses -= 1
+                self.hits += 1
+                self.shared_hits += 1
+            return response
+        return None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'capacity': self.max_entries,
+                'ttl_s': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evicted': self.evicted,
+                'expired': self.expired,
+                'shared': None if self.shared is None else {
+                    'path': self.shared.path,
+                    'hits': self.shared_hits,
+                    'claims': self.shared.claims,
+                    'errors': self.shared.errors,
+                },
+            }
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.close()
+
+    def prometheus_samples(self):
+        """(name, type, help, value) samples for Metrics.add_collector"""
+        stats = self.stats()
+        return [
+            ('amd_dedup_hits_total', 'counter', 'Duplicate callbacks answered from the dedup cache', stats['hits']),
+            ('amd_dedup_misses_total', 'counter', 'Callbacks seen for the first time', stats['misses']),
+            ('amd_dedup_entries', 'gauge', 'Callback keys currently remembered', stats['entries']),
+        ] + ([] if self.shared is None else [
+            ('amd_dedup_shared_hits_total', 'counter', 'Duplicates first processed by another worker',
+             self.shared_hits),
+        ])
+
+
+def dedup_from_env():
+    """DedupCache from AMD_DEDUP_SIZE / AMD_DEDUP_TTL, or None when AMD_DEDUP_SIZE=0
+
+    AMD_DEDUP_SIZE    callback keys remembered (default 50000, 0 disables)
+    AMD_DEDUP_TTL     seconds a key is remembered (default 3600)
+    AMD_DEDUP_SHARED  SQLite file shared by the workers of a host (per-process dedup when unset)
+    """
+    size = int(os.getenv('AMD_DEDUP_SIZE', str(DEFAULT_SIZE)))
+    if size <= 0:
+        return None
+    shared = os.getenv('AMD_DEDUP_SHARED')
+    return DedupCache(size, float(os.getenv('AMD_DEDUP_TTL', str(DEFAULT_TTL))),
+                      shared=SharedKeys(shared) if shared else None)
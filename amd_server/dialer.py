@@ -0,0 +1,634 @@
+# High-volume outbound dialer
+#
+# Destinations are read lazily from a CSV or JSONL file (a `to` column or
+# key, plus optional `from`, `config`, `country` and `state`), so a million-row list costs no
+# more memory than a ten-row one. Each destination is assigned an AMD
+# configuration by a strategy: round-robin over the row position, or a
+# weighted / A/B split on a hash of the number. Either depends only on the
+# input and the seed, so a resumed run makes the same assignment again.
+#
+# Calls are paced by token buckets, one for the account's calls-per-second
+# limit and one per caller ID, and each call goes out from whichever caller
+# ID is ready first. At most `max_concurrent` calls are up at once. Busy
+# and no-answer results are redialed after a backoff without holding a
+# slot while they wait. Every placed call and every result is appended to
+# a JSONL checkpoint, so a restart skips finished rows, keeps pending
+# retries on schedule and waits for calls that were in flight instead of
+# dialing them again.
+import bisect
+import csv
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .batch import _to_int, build_call_params
+from .events import TERMINAL_STATUSES
+from .ratelimit import TokenBucket
+
+STRATEGIES = ('round-robin', 'weighted', 'ab')
+RETRY_STATUSES = ('busy', 'no-answer')
+STOP_CHECK_INTERVAL = 0.5   # seconds between checks for a stopping run while a call is up
+
+
+def read_destinations(path):
+    """Yield one dict per destination ({'to': ..., 'from': ..., 'config': ..., ...}) from a CSV or JSONL file
+
+    .jsonl/.ndjson files hold one JSON object (or bare number string) per
+    line; anything else is read as CSV. A CSV whose first row is a phone
+    number has no header, and its first column is the number. Blank lines
+    are skipped.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson'):
+            for line in f:
+                line = line.strip()
+                if line:
+                    row = json.loads(line)
+                    yield {'to': row} if isinstance(row, str) else row
+            return
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        if header[0].strip().lstrip('+').isdigit():
+            rows, header = itertools.chain([header], reader), ['to']
+        else:
+            header = [name.strip().lower() for name in header]
+            rows = reader
+            if 'to' not in header:
+                header[0] = 'to'
+        for values in rows:
+            if any(value.strip() for value in values):
+                yield {name: value.strip() for name, value in zip(header, values)}
+
+
+def _unit(seed, key):
+    """Deterministic point in [0, 1) for a destination"""
+    return zlib.crc32(f"{seed}:{key}".encode()) / 2 ** 32
+
+
+def assigner(strategy, config_keys, weights=None, split=0.5, seed=0):
+    """assign(index, destination) -> config key
+
+    round-robin  config_keys in turn, by row position
+    weighted     {key: weight} shares, by a hash of the destination number
+    ab           the first two config_keys, `split` of the numbers to the second
+
+    Hashing the number keeps a destination that appears twice on the same
+    configuration, as an A/B test needs.
+    """
+    keys = list(config_keys)
+    if strategy == 'round-robin':
+        return lambda index, destination: keys[index % len(keys)]
+    if strategy == 'ab':
+        if len(keys) != 2:
+            raise ValueError("an A/B split needs exactly two configurations")
+        weights = {keys[0]: 1 - split, keys[1]: split}
+    elif strategy != 'weighted':
+        raise ValueError(f"unknown strategy {strategy!r}; choose from {', '.join(STRATEGIES)}")
+    weights = weights or {key: 1 for key in keys}
+    names = list(weights)
+    cumulative = list(itertools.accumulate(weights.values()))
+    if not cumulative or cumulative[-1] <= 0:
+        raise ValueError("weights must add up to more than zero")
+    total = cumulative[-1]
+    return lambda index, destination: names[bisect.bisect_right(cumulative, _unit(seed, destination['to']) * total)]
+
+
+class RetryPolicy:
+    """Which final statuses are redialed, how many times, and after how long"""
+
+    __slots__ = ('statuses', 'max_attempts', 'delay', 'backoff')
+
+    def __init__(self, statuses=RETRY_STATUSES, max_attempts=3, delay=300, backoff=2.0):
+        self.statuses = frozenset(statuses)
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.backoff = backoff
+
+    def retry_after(self, status, attempt):
+        """Seconds until the next attempt, or None when the destination is finished"""
+        if status not in self.statuses or attempt >= self.max_attempts:
+            return None
+        return self.delay * self.backoff ** (attempt - 1)
+
+
+class DialResult:
+    """Outcome of one attempt to reach one destination"""
+
+    __slots__ = ('index', 'to', 'from_', 'config_key', 'attempt', 'region', 'call_sid', 'status',
+                 'answered_by', 'detection_ms', 'error', 'retry_at', 'resumed', 'started_at', 'finished_at')
+
+    def __init__(self, job, from_number):
+        self.index = job.index
+        self.to = job.to
+        self.from_ = from_number
+        self.config_key = job.config_key
+        self.attempt = job.attempt
+        self.region = job.region
+        self.call_sid = None
+        self.status = None
+        self.answered_by = None
+        self.detection_ms = None
+        self.error = None
+        self.retry_at = None
+        self.resumed = False
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def final(self):
+        return self.retry_at is None
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _Job:
+    __slots__ = ('index', 'to', 'from_', 'config_key', 'attempt', 'region')
+
+    def __init__(self, index, to, from_, config_key, attempt=1, region=None):
+        self.index = index
+        self.to = to
+        self.from_ = from_
+        self.config_key = config_key
+        self.attempt = attempt
+        self.region = region   # (country, state) tagged on the callbacks, or None
+
+    @classmethod
+    def from_record(cls, index, record, attempt):
+        region = record.get('region')   # absent from checkpoints written before regions were kept
+        return cls(index, record['to'], record['from'], record['config'], attempt, tuple(region) if region else None)
+
+
+class Checkpoint:
+    """Append-only JSONL journal of placed calls and results, replayed when opened
+
+    Records are {"event": "dial", ...} once a call is accepted and
+    {"event": "result", ...} when it ends. The last record of each row says
+    where it stands: finished, waiting for a retry, or in flight.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.done = set()
+        self.retries = {}     # index -> last non-final result record
+        self.in_flight = {}   # index -> dial record without a result
+        self.dials = 0        # calls placed by all runs so far
+        self._recover()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def _recover(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                # A record torn by a crash mid-write; the line is dropped
+                f.truncate(end)
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            index = record['index']
+            self.retries.pop(index, None)
+            self.in_flight.pop(index, None)
+            if record['event'] == 'dial':
+                self.in_flight[index] = record
+                self.dials += 1
+            elif record['retry_at'] is None:
+                self.done.add(index)
+            else:
+                self.retries[index] = record
+
+    def known(self, index):
+        return index in self.done or index in self.retries or index in self.in_flight
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def dialed(self, result):
+        self.dials += 1
+        self.write({'event': 'dial', 'index': result.index, 'attempt': result.attempt, 'to': result.to,
+                    'from': result.from_, 'config': result.config_key, 'region': result.region,
+                    'call_sid': result.call_sid, 'at': result.started_at})
+
+    def finished(self, result):
+        self.write({'event': 'result', 'index': result.index, 'attempt': result.attempt, 'to': result.to,
+                    'from': result.from_, 'config': result.config_key, 'region': result.region,
+                    'call_sid': result.call_sid,
+                    'status': result.status, 'answered_by': result.answered_by,
+                    'detection_ms': result.detection_ms, 'error': result.error, 'retry_at': result.retry_at})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class _Watched:
+    __slots__ = ('status', 'answered_by', 'detection_ms', 'ended', 'amd')
+
+    def __init__(self):
+        self.status = None
+        self.answered_by = None
+        self.detection_ms = None
+        self.ended = threading.Event()
+        self.amd = threading.Event()
+
+
+class CallWatcher:
+    """Final status and AMD result per call, from one wildcard subscription to the event bus
+
+    Calls are tracked from their first callback, so a call that ends before
+    anyone waits for it is still seen. The table is bounded like the bus's
+    AMD result cache.
+    """
+
+    def __init__(self, bus, max_calls=100000, queue_size=65536):
+        self.max_calls = max_calls
+        self._calls = OrderedDict()
+        self._lock = threading.Lock()
+        self._subscription = bus.subscribe(maxsize=queue_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='amd-dialer-watch', daemon=True)
+        self._thread.start()
+
+    def _get(self, call_sid):
+        with self._lock:
+            watched = self._calls.get(call_sid)
+            if watched is None:
+                watched = self._calls[call_sid] = _Watched()
+                if len(self._calls) > self.max_calls:
+                    self._calls.popitem(last=False)
+            return watched
+
+    def _run(self):
+        while not self._closed:
+            message = self._subscription.get(timeout=0.5)
+            if message is None or not message.get('call_sid'):
+                continue
+            watched = self._get(message['call_sid'])
+            if message.get('answered_by'):
+                watched.answered_by = message['answered_by']
+                watched.detection_ms = _to_int(message.get('detection_ms'))
+                watched.amd.set()
+            status = message.get('call_status')
+            if status:
+                watched.status = status
+                if status in TERMINAL_STATUSES:
+                    watched.ended.set()
+
+    def wait(self, call_sid, timeout):
+        """The call's _Watched state once it has ended, or None on timeout"""
+        watched = self._get(call_sid)
+        return watched if watched.ended.wait(timeout) else None
+
+    def wait_for_amd(self, call_sid, timeout):
+        watched = self._get(call_sid)
+        return watched if watched.amd.wait(timeout) else None
+
+    def forget(self, call_sid):
+        with self._lock:
+            self._calls.pop(call_sid, None)
+
+    def close(self):
+        self._closed = True
+        self._thread.join()
+        self._subscription.close()
+
+
+class DialSummary:
+    """Running per-configuration tallies of attempts, final statuses and AMD outcomes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.finished = 0
+        self.skipped = 0
+        self.resumed = 0
+        self.by_config = {}
+
+    def add(self, result):
+        with self._lock:
+            self.attempts += 1
+            entry = self.by_config.setdefault(result.config_key, {
+                'attempts': 0, 'retries': 0, 'destinations': 0, 'statuses': {}, 'outcomes': {}})
+            entry['attempts'] += 1
+            if not result.final:
+                entry['retries'] += 1
+                return
+            self.finished += 1
+            entry['destinations'] += 1
+            status = result.status or 'unknown'
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+            if result.answered_by:
+                entry['outcomes'][result.answered_by] = entry['outcomes'].get(result.answered_by, 0) + 1
+
+    def print_table(self, configurations=None):
+        print(f"\n{'Configuration':<32} {'Dests':>6} {'Calls':>6} {'Retry':>6}  Final statuses / AMD outcomes")
+        print("-" * 100)
+        with self._lock:
+            for key, entry in sorted(self.by_config.items()):
+                name = configurations[key]['name'][:32] if configurations and key in configurations else key
+                statuses = ", ".join(f"{k}={v}" for k, v in sorted(entry['statuses'].items())) or "-"
+                outcomes = ", ".join(f"{k}={v}" for k, v in sorted(entry['outcomes'].items())) or "-"
+                print(f"{name:<32} {entry['destinations']:>6} {entry['attempts']:>6} {entry['retries']:>6}  "
+                      f"{statuses} / {outcomes}")
+            print(f"\n{self.finished} destinations finished in {self.attempts} calls"
+                  f" ({self.skipped} already done, {self.resumed} in-flight calls resumed)")
+
+
+class Dialer:
+    """Dials a stream of destinations under CPS, per-caller-ID and concurrency limits
+
+    client needs calls.create(**kwargs) and calls(sid).fetch(), so twilio's
+    Client and FakeTwilio both work. With an event bus fed by the webhook
+    server, call ends are seen from the callbacks; without one each call is
+    polled over REST every `poll_interval` seconds. With a bus the REST API
+    is still checked every `check_interval` seconds per call, in case a
+    callback was lost.
+    """
+
+    def __init__(self, client, configurations, caller_ids, assign=None, bus=None,
+                 max_concurrent=10, calls_per_second=1.0, caller_id_cps=None, burst=1,
+                 retry=None, checkpoint=None, call_timeout=600, amd_wait=10,
+                 poll_interval=5, check_interval=60):
+        if isinstance(caller_ids, str):
+            caller_ids = [caller_ids]
+        if not caller_ids:
+            raise ValueError("at least one caller ID is needed")
+        self.client = client
+        self.configurations = configurations
+        self.caller_ids = list(caller_ids)
+        self.assign = assign or assigner('round-robin', configurations)
+        self.max_concurrent = max_concurrent
+        self.retry = retry or RetryPolicy()
+        self.checkpoint = checkpoint
+        self.call_timeout = call_timeout
+        self.amd_wait = amd_wait
+        self.poll_interval = poll_interval
+        self.check_interval = check_interval
+        self.limiter = TokenBucket(calls_per_second, burst) if calls_per_second else None
+        self._caller_id_cps = caller_id_cps
+        self._burst = burst
+        self._caller_buckets = {}
+        self.watcher = CallWatcher(bus) if bus is not None else None
+
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._active = 0
+        self._retries = []   # heap of (due, seq, job)
+        self._seq = itertools.count()
+
+    # -- pacing ------------------------------------------------------------
+
+    def _bucket(self, caller_id):
+        bucket = self._caller_buckets.get(caller_id)
+        if bucket is None and self._caller_id_cps:
+            bucket = self._caller_buckets[caller_id] = TokenBucket(self._caller_id_cps, self._burst)
+        return bucket
+
+    def _pace(self, job):
+        """Wait for the CPS limits and return the caller ID to dial from"""
+        if job.from_:
+            caller_id = job.from_
+        elif self._caller_id_cps:
+            caller_id = min(self.caller_ids, key=lambda number: self._bucket(number).delay())
+        else:
+            caller_id = self.caller_ids[job.index % len(self.caller_ids)]
+        bucket = self._bucket(caller_id)
+        if bucket is not None:
+            bucket.acquire()
+        if self.limiter is not None:
+            self.limiter.acquire()
+        return caller_id
+
+    # -- scheduling --------------------------------------------------------
+
+    def _fresh(self, destinations, summary):
+        """Jobs for rows the checkpoint does not already know about"""
+        for index, destination in enumerate(destinations):
+            if self.checkpoint is not None and self.checkpoint.known(index):
+                if index in self.checkpoint.done:
+                    summary.skipped += 1
+                continue
+            config_key = destination.get('config') or self.assign(index, destination)
+            if config_key not in self.configurations:
+                raise KeyError(f"row {index}: unknown configuration {config_key!r}")
+            country = destination.get('country')
+            region = (country, destination.get('state') or None) if country else None
+            yield _Job(index, destination['to'], destination.get('from') or None, config_key, region=region)
+
+    def _push_retry(self, due, job):
+        with self._cond:
+            heapq.heappush(self._retries, (due, next(self._seq), job))
+            self._cond.notify_all()
+
+    def _start(self, pool, func, *args):
+        with self._cond:
+            self._active += 1
+        pool.submit(func, *args)
+
+    def _done(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def run(self, destinations, on_result=None):
+        """Dial every destination (an iterable of dicts, see read_destinations)
+
+        on_result(result, summary) fires for every attempt, including the
+        ones that will be retried. Returns the DialSummary.
+        """
+        summary = DialSummary()
+        self._stopping.clear()
+        with ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix='amd-dialer') as pool:
+            try:
+                self._schedule(pool, destinations, summary, on_result)
+            except BaseException:
+                # Ctrl-C or a bad row: stop waiting on live calls, which stay
+                # in flight in the checkpoint and are resumed by the next run
+                self._stopping.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+        return summary
+
+    def _schedule(self, pool, destinations, summary, on_result):
+        if self.checkpoint is not None:
+            # Calls that were up when the last run stopped hold their slots until they end
+            for index, record in self.checkpoint.in_flight.items():
+                job = _Job.from_record(index, record, record['attempt'])
+                summary.resumed += 1
+                with self._cond:
+                    while self._active >= self.max_concurrent:
+                        self._cond.wait()
+                self._start(pool, self._resume, job, record, summary, on_result)
+            for index, record in self.checkpoint.retries.items():
+                job = _Job.from_record(index, record, record['attempt'] + 1)
+                self._push_retry(record['retry_at'], job)
+
+        fresh = self._fresh(destinations, summary)
+        exhausted = False
+        while True:
+            job = None
+            with self._cond:
+                while self._active >= self.max_concurrent:
+                    self._cond.wait()
+                if self._retries and self._retries[0][0] <= time.time():
+                    job = heapq.heappop(self._retries)[2]
+            if job is None and not exhausted:
+                job = next(fresh, None)
+                exhausted = job is None
+            if job is None:
+                with self._cond:
+                    if not self._retries and not self._active:
+                        break
+                    # Woken early by a finished call or a new retry
+                    timeout = self._retries[0][0] - time.time() if self._retries else None
+                    self._cond.wait(timeout)
+                continue
+            caller_id = self._pace(job)
+            self._start(pool, self._dial, job, caller_id, summary, on_result)
+
+    # -- calls -------------------------------------------------------------
+
+    def _dial(self, job, caller_id, summary, on_result):
+        result = DialResult(job, caller_id)
+        try:
+            params = build_call_params(job.config_key, self.configurations[job.config_key], caller_id, job.to,
+                                       region=job.region)
+            try:
+                call = self.client.calls.create(**params)
+            except Exception as e:
+                result.status, result.error = 'failed', str(e)
+            else:
+                result.call_sid = call.sid
+                if self.checkpoint is not None:
+                    self.checkpoint.dialed(result)
+                if not self._wait(result):
+                    return
+            self._finish(job, result, summary, on_result)
+        finally:
+            self._done()
+
+    def _resume(self, job, record, summary, on_result):
+        result = DialResult(job, record['from'])
+        result.call_sid = record['call_sid']
+        result.started_at = record['at']
+        result.resumed = True
+        try:
+            if self._wait(result):
+                self._finish(job, result, summary, on_result)
+        finally:
+            self._done()
+
+    def _wait(self, result):
+        """Fill in the call's final status and AMD result; False if the run is stopping"""
+        deadline = time.monotonic() + self.call_timeout
+        try:
+            while time.monotonic() < deadline:
+                check_at = time.monotonic() + (self.check_interval if self.watcher is not None
+                                               else self.poll_interval)
+                while time.monotonic() < min(check_at, deadline):
+                    if self._stopping.is_set():
+                        return False
+                    # Short slices so a stopping run is noticed quickly
+                    slice_ = min(STOP_CHECK_INTERVAL, check_at - time.monotonic())
+                    if self.watcher is None:
+                        self._stopping.wait(max(slice_, 0))
+                        continue
+                    watched = self.watcher.wait(result.call_sid, max(slice_, 0))
+                    if watched is not None:
+                        result.status = watched.status
+                        if watched.answered_by is None and watched.status == 'completed' and self.amd_wait:
+                            # The AMD callback can trail the end of a short call
+                            self.watcher.wait_for_amd(result.call_sid, self.amd_wait)
+                        result.answered_by = watched.answered_by
+                        result.detection_ms = watched.detection_ms
+                        return True
+                if self._fetch(result):
+                    return True
+            result.error = f"no final status within {self.call_timeout}s"
+        except Exception as e:
+            result.error = str(e)
+        finally:
+            if self.watcher is not None:
+                self.watcher.forget(result.call_sid)
+        return True
+
+    def _fetch(self, result):
+        """One REST check; True once the call has a final status"""
+        fetched = self.client.calls(result.call_sid).fetch()
+        result.status = getattr(fetched, 'status', None)
+        result.answered_by = getattr(fetched, 'answered_by', None)
+        result.detection_ms = _to_int(getattr(fetched, 'machine_detection_duration', None))
+        return result.status in TERMINAL_STATUSES
+
+    def _finish(self, job, result, summary, on_result):
+        retry_after = self.retry.retry_after(result.status, job.attempt)
+        if retry_after is not None:
+            result.retry_at = time.time() + retry_after
+        result.finished_at = time.time()
+        if self.checkpoint is not None:
+            self.checkpoint.finished(result)
+        if retry_after is not None:
+            retry = _Job(job.index, job.to, job.from_, job.config_key, job.attempt + 1, job.region)
+            self._push_retry(result.retry_at, retry)
+        summary.add(result)
+        if on_result:
+            on_result(result, summary)
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+
+
+def with_callbacks(configurations, webhook_base, variant='advanced'):
+    """Copy of configurations with the webhook URLs filled in where a configuration has none
+
+    Configurations written by `python -m amd_server screen --output` carry
+    only AMD parameters; the callback and TwiML URLs depend on where the
+    webhook server runs.
+    """
+    base = webhook_base.rstrip('/')
+    if variant == 'manual':
+        # Synchronous AMD: the result arrives with the /handle_amd TwiML request
+        defaults = {'url': f"{base}/handle_amd", 'status_callback': f"{base}/webhook"}
+    else:
+        defaults = {'url': f"{base}/silent", 'async_amd': True,
+                    'async_amd_status_callback': f"{base}/webhook", 'async_amd_status_callback_method': 'POST'}
+    return {key: dict(config, params={**defaults, **config['params']}) for key, config in configurations.items()}
+
+
+def print_dial_result(result, summary):
+    """on_result callback that prints each attempt as it finishes"""
+    if result.error:
+        outcome = f"ERROR: {result.error}"
+    else:
+        outcome = result.status or 'unknown'
+        if result.answered_by:
+            outcome += f" {result.answered_by}"
+            if result.detection_ms is not None:
+                outcome += f" ({result.detection_ms}ms)"
+    if not result.final:
+        outcome += f", retry in {result.retry_at - time.time():.0f}s"
+    print(f"[{summary.attempts:>5}] row {result.index:<6} #{result.attempt} {result.to:<16} "
+          f"{result.config_key:<20} {result.call_sid or '-':<36} {outcome}", flush=True)
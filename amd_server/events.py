@@ -0,0 +1,223 @@
+# In-process event bus fed by the webhook handlers
+#
+# Monitoring code subscribes to a call (or to everything) and is woken as
+# soon as a callback lands, instead of polling the REST API. The latest AMD
+# result per call is kept in a bounded table so a waiter that starts after
+# the callback arrived still gets it immediately.
+#
+# Every open /events stream holds a server thread for as long as the client
+# stays connected, so the number of streams per process is capped and
+# requests over the cap are answered with 503.
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+TERMINAL_STATUSES = frozenset(['completed', 'failed', 'canceled', 'busy', 'no-answer'])
+
+
+def event_message(event, received_at=None):
+    """Bus message for a decoded WebhookEvent"""
+    params = event.params
+    return {
+        'type': event.webhook_type,
+        'call_sid': params.get('CallSid'),
+        'call_status': params.get('CallStatus'),
+        'answered_by': event.answered_by,
+        'detection_ms': params.get('MachineDetectionDuration'),
+        'config_key': event.config_key,
+        'received_at': received_at if received_at is not None else time.time(),
+        'params': params,
+    }
+
+
+class Subscription:
+    """Queue of bus messages for one subscriber; overflow is dropped and counted"""
+
+    __slots__ = ('call_sid', 'dropped', '_queue', '_bus')
+
+    def __init__(self, bus, call_sid, maxsize):
+        self._bus = bus
+        self._queue = queue.Queue(maxsize)
+        self.call_sid = call_sid
+        self.dropped = 0
+
+    def _offer(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout=None):
+        """Next message, or None if nothing arrived within timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventBus:
+    """Fan-out of webhook messages to per-call and wildcard subscribers"""
+
+    def __init__(self, max_results=10000, subscriber_queue=256, max_streams=None):
+        self.max_results = max_results
+        self.subscriber_queue = subscriber_queue
+        # Open SSE streams allowed at once (None for no limit)
+        self.max_streams = max_streams
+        self.streams = 0
+        self.streams_refused = 0
+        self.published = 0
+        self._lock = threading.Lock()
+        self._by_call = {}
+        self._wildcard = []
+        self._amd_results = OrderedDict()
+
+    def subscribe(self, call_sid=None, maxsize=None):
+        """Subscribe to one call's messages, or to all messages when call_sid is None"""
+        subscription = Subscription(self, call_sid, maxsize or self.subscriber_queue)
+        with self._lock:
+            if call_sid is None:
+                self._wildcard.append(subscription)
+            else:
+                self._by_call.setdefault(call_sid, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription.call_sid is None:
+                if subscription in self._wildcard:
+                    self._wildcard.remove(subscription)
+            else:
+                subscribers = self._by_call.get(subscription.call_sid, [])
+                if subscription in subscribers:
+                    subscribers.remove(subscription)
+                if not subscribers:
+                    self._by_call.pop(subscription.call_sid, None)
+
+    def open_stream(self):
+        """Reserve a slot for an SSE stream; False when max_streams are already open"""
+        with self._lock:
+            if self.max_streams is not None and self.streams >= self.max_streams:
+                self.streams_refused += 1
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self.streams -= 1
+
+    def publish(self, message):
+        """Deliver a message (see event_message) to its call's subscribers and wildcards"""
+        call_sid = message.get('call_sid')
+        with self._lock:
+            self.published += 1
+            if message.get('answered_by') and call_sid:
+                self._amd_results[call_sid] = message
+                self._amd_results.move_to_end(call_sid)
+                if len(self._amd_results) > self.max_results:
+                    self._amd_results.popitem(last=False)
+            targets = list(self._wildcard)
+            targets.extend(self._by_call.get(call_sid, ()))
+        for subscription in targets:
+            subscription._offer(message)
+
+    def publish_event(self, event, received_at=None):
+        self.publish(event_message(event, received_at))
+
+    def amd_result(self, call_sid):
+        """Latest AMD result message already received for a call, if any"""
+        with self._lock:
+            return self._amd_results.get(call_sid)
+
+    def wait_for_amd(self, call_sid, timeout=60):
+        """Block until the AMD result for call_sid arrives; returns the message or None"""
+        with self.subscribe(call_sid) as subscription:
+            # Checked after subscribing so a result published in between is not missed
+            message = self.amd_result(call_sid)
+            deadline = time.monotonic() + timeout
+            while message is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                candidate = subscription.get(timeout=remaining)
+                if candidate is not None and candidate.get('answered_by'):
+                    message = candidate
+            return message
+
+    def stats(self):
+        with self._lock:
+            return {
+                'published': self.published,
+                'subscribers': len(self._wildcard) + sum(len(s) for s in self._by_call.values()),
+                'amd_results': len(self._amd_results),
+                'streams': self.streams,
+                'streams_refused': self.streams_refused,
+            }
+
+
+def sse_stream(bus, call_sid=None, heartbeat=15):
+    """Server-Sent Events for bus messages; a per-call stream ends when the call ends"""
+    subscription = bus.subscribe(call_sid)
+    try:
+        yield 'retry: 3000\n\n'
+        if call_sid is not None:
+            cached = bus.amd_result(call_sid)
+            if cached is not None:
+                yield _sse(cached)
+        while True:
+            message = subscription.get(timeout=heartbeat)
+            if message is None:
+                yield ': keep-alive\n\n'
+                continue
+            yield _sse(message)
+            if call_sid is not None and message.get('call_status') in TERMINAL_STATUSES:
+                break
+    finally:
+        subscription.close()
+
+
+def _sse(message):
+    return f"event: {message['type']}\ndata: {json.dumps(message, separators=(',', ':'))}\n\n"
+
+
+def flask_sse_response(bus, request):
+    """Flask streaming response for GET /events[?call_sid=CA...]
+
+    Answers 503 with Retry-After when the bus already has max_streams open.
+    """
+    from flask import Response, stream_with_context
+
+    if not bus.open_stream():
+        return Response('too many open event streams\n', status=503, mimetype='text/plain',
+                        headers={'Retry-After': '5'})
+    call_sid = request.args.get('call_sid') or None
+    response = Response(
+        stream_with_context(sse_stream(bus, call_sid)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+    # Released when the server closes the response, even if the stream never started
+    response.call_on_close(bus.close_stream)
+    return response
+
+
+def bus_from_env():
+    """EventBus with the /events stream cap from AMD_EVENTS_MAX_STREAMS
+
+    AMD_EVENTS_MAX_STREAMS  open /events streams per process (default 4, 0 for no limit); each
+                            stream holds a server thread (gunicorn --threads) while it is open
+    """
+    max_streams = int(os.getenv('AMD_EVENTS_MAX_STREAMS', '4'))
+    return EventBus(max_streams=max_streams or None)
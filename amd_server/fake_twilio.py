@@ -0,0 +1,747 @@
+# Local stand-in for Twilio's voice platform
+#
+# Accepts calls.create-shaped requests (in process through FakeTwilio.calls,
+# or over HTTP through the REST server below), answers each call with a
+# scenario timeline from the Studio simulator, fetches the call's TwiML
+# from the webhook server and posts the status and AMD callbacks Twilio
+# would send, on a clock that can be compressed for load testing. A share of
+# calls can end busy or unanswered instead, for exercising redial logic.
+# Scenario choice and AMD outcomes are seeded, so a run is reproducible.
+import calendar
+import heapq
+import http.client
+import itertools
+import json
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from .ratelimit import TokenBucket
+from .simulator import (DEFAULT_MEDIA_MS, EXPECTED_OUTCOMES, SCENARIOS, amd_decision,
+                        load_scenarios, resolve_scenario, speech_ms, timeline_ms)
+from .webhook import normalize_outcome
+
+ACCOUNT_SID = 'AC' + '0' * 32
+API_VERSION = '2010-04-01'
+
+# Number prefix -> (country, state, city, zip) used for the geo callback fields
+NUMBER_GEO = (
+    ('+1212', ('US', 'NY', 'NEW YORK', '10001')),
+    ('+1415', ('US', 'CA', 'SAN FRANCISCO', '94105')),
+    ('+1501', ('US', 'AR', 'LITTLE ROCK', '72201')),
+    ('+1512', ('US', 'TX', 'AUSTIN', '78701')),
+    ('+1', ('US', '', '', '')),
+    ('+5511', ('BR', 'SP', 'SAO PAULO', '')),
+    ('+5521', ('BR', 'RJ', 'RIO DE JANEIRO', '')),
+    ('+55', ('BR', '', '', '')),
+    ('+44', ('GB', '', 'LONDON', '')),
+)
+
+STATUS_EVENTS = ('initiated', 'ringing', 'answered', 'completed')
+
+# Final statuses of calls that are never answered, with their SIP response codes
+UNANSWERED = {'busy': '486', 'no-answer': '487'}
+ENDED_STATUSES = frozenset(['completed', 'canceled', 'busy', 'no-answer'])
+
+
+def number_geo(number):
+    for prefix, geo in NUMBER_GEO:
+        if number.startswith(prefix):
+            return geo
+    return ('', '', '', '')
+
+
+def geo_params(from_number, to_number):
+    """FromCountry/ToCity/CallerZip/... fields for a call"""
+    params = {}
+    for number, sides in ((from_number, ('From', 'Caller')), (to_number, ('To', 'Called'))):
+        country, state, city, zip_code = number_geo(number)
+        for side in sides:
+            params[f'{side}Country'] = country
+            params[f'{side}State'] = state
+            params[f'{side}City'] = city
+            params[f'{side}Zip'] = zip_code
+    return params
+
+
+def to_param_name(name):
+    """calls.create keyword -> Twilio form field (from_ -> From, async_amd -> AsyncAmd)"""
+    return ''.join(part.capitalize() for part in name.rstrip('_').split('_'))
+
+
+def _form_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return [_form_value(v) for v in value]
+    return str(value)
+
+
+def twiml_duration_ms(body):
+    """How long a fetched TwiML document keeps the call up; Twilio hangs up when it ends"""
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError:
+        return 0
+    total = 0
+    for verb in root:
+        if verb.tag == 'Say':
+            total += speech_ms(verb.text or '') * int(verb.get('loop', 1) or 1)
+        elif verb.tag == 'Pause':
+            total += int(verb.get('length', 1)) * 1000
+        elif verb.tag == 'Play':
+            total += DEFAULT_MEDIA_MS
+        elif verb.tag == 'Hangup':
+            break
+    return total
+
+
+class FakeCall:
+    """Snapshot of a call resource (the attributes of twilio's CallInstance that we use)"""
+
+    __slots__ = ('sid', 'account_sid', 'to', 'from_', 'status', 'direction', 'answered_by',
+                 'machine_detection_duration', 'duration', 'date_created', 'start_time',
+                 'end_time', 'scenario')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def to_json(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['from'] = data.pop('from_')
+        data['api_version'] = API_VERSION
+        data['uri'] = f"/{API_VERSION}/Accounts/{self.account_sid}/Calls/{self.sid}.json"
+        return data
+
+
+class _Call:
+    """Mutable state of one simulated call"""
+
+    def __init__(self, sid, params, scenario, timeline, created):
+        self.sid = sid
+        self.params = params
+        self.scenario = scenario
+        self.timeline = timeline
+        self.created = created
+        self.status = 'queued'
+        self.answered_by = None
+        self.detection_ms = None
+        self.unanswered = None    # 'busy' or 'no-answer' for calls that are never answered
+        self.answered_at = None   # simulated ms since creation
+        self.ended_at = None
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.outbox = []
+        self.draining = False
+
+    def param(self, name, default=None):
+        value = self.params.get(name, default)
+        return value[-1] if isinstance(value, list) else value
+
+    def snapshot(self, account_sid):
+        return FakeCall(
+            sid=self.sid, account_sid=account_sid, to=self.param('To'), from_=self.param('From'),
+            status=self.status, direction='outbound-api', answered_by=self.answered_by,
+            machine_detection_duration=self.detection_ms,
+            duration=None if self.ended_at is None else str(round((self.ended_at - (self.answered_at or self.ended_at)) / 1000)),
+            date_created=formatdate(self.created, usegmt=True),
+            start_time=None if self.answered_at is None else formatdate(self.created + self.answered_at / 1000, usegmt=True),
+            end_time=None if self.ended_at is None else formatdate(self.created + self.ended_at / 1000, usegmt=True),
+            scenario=self.scenario,
+        )
+
+
+class HttpTransport:
+    """Sends callbacks over HTTP with one keep-alive connection per thread and host"""
+
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self, scheme, netloc):
+        conns = self._local.__dict__.setdefault('conns', {})
+        conn = conns.get((scheme, netloc))
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conn = conns[(scheme, netloc)] = cls(netloc, timeout=self.timeout)
+        return conn
+
+    def request(self, method, url, params):
+        parts = urlsplit(url)
+        query = urlencode(params, doseq=True)
+        path = parts.path or '/'
+        if method == 'GET':
+            path += '?' + '&'.join(filter(None, (parts.query, query)))
+            body, headers = None, {}
+        else:
+            if parts.query:
+                path += '?' + parts.query
+            body, headers = query.encode(), {'Content-Type': 'application/x-www-form-urlencoded'}
+        conn = self._connection(parts.scheme, parts.netloc)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            if response.will_close:
+                conn.close()
+            return response.status, data
+        except Exception:
+            conn.close()
+            raise
+
+
+class FlaskTransport:
+    """Delivers callbacks straight to a Flask app's test client (no sockets)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, url, params):
+        client = self._local.__dict__.get('client')
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if method == 'GET':
+            query = '&'.join(filter(None, (parts.query, urlencode(params, doseq=True))))
+            response = client.get(path, query_string=query)
+        else:
+            response = client.post(path, query_string=parts.query, data=params)
+        return response.status_code, response.get_data()
+
+
+class _CallList:
+    """client.calls look-alike: calls.create(**kwargs) and calls(sid).fetch()"""
+
+    def __init__(self, platform):
+        self._platform = platform
+
+    def create(self, **kwargs):
+        params = {to_param_name(k): _form_value(v) for k, v in kwargs.items() if v is not None}
+        return self._platform.create_call(params)
+
+    def __call__(self, sid):
+        return _CallContext(self._platform, sid)
+
+
+class _CallContext:
+    def __init__(self, platform, sid):
+        self._platform = platform
+        self.sid = sid
+
+    def fetch(self):
+        call = self._platform.fetch_call(self.sid)
+        if call is None:
+            raise KeyError(f"no call {self.sid}")
+        return call
+
+
+class FakeTwilio:
+    """Simulated voice platform that places calls against the webhook servers
+
+    scenario: a scenario name (see simulator.SCENARIOS), 'mix' for an even
+    split, or {name: weight}. `numbers` maps To numbers to fixed scenarios
+    (or to 'busy' / 'no-answer'). unanswered={'busy': 0.1, 'no-answer': 0.05}
+    ends that share of the other calls without an answer.
+    time_scale multiplies every wait (1.0 real time, 0.1 ten times faster,
+    0 as fast as possible); reported durations stay in simulated time.
+    jitter varies each timeline segment by up to +/- that fraction.
+    """
+
+    def __init__(self, transport=None, scenario='mix', numbers=None, time_scale=1.0,
+                 ring_ms=3000, jitter=0.1, seed=0, workers=8, callbacks_per_second=None,
+                 account_sid=ACCOUNT_SID, scenarios=None, unanswered=None):
+        self.transport = transport or HttpTransport()
+        self.scenarios = scenarios or load_scenarios()
+        if scenario == 'mix':
+            weights = {name: 1 for name in self.scenarios}
+        elif isinstance(scenario, dict):
+            weights = {resolve_scenario(name): w for name, w in scenario.items()}
+        else:
+            weights = {resolve_scenario(scenario): 1}
+        self._names = list(weights)
+        self._weights = list(weights.values())
+        self.numbers = {number: name if name in UNANSWERED else resolve_scenario(name)
+                        for number, name in (numbers or {}).items()}
+        self.unanswered = {status: rate for status, rate in (unanswered or {}).items() if rate}
+        for status in self.unanswered:
+            if status not in UNANSWERED:
+                raise ValueError(f"unanswered statuses are {', '.join(UNANSWERED)}, not {status!r}")
+        self.time_scale = time_scale
+        self.ring_ms = ring_ms
+        self.jitter = jitter
+        self.seed = seed
+        self.account_sid = account_sid
+        self.calls = _CallList(self)
+        self.limiter = TokenBucket(callbacks_per_second) if callbacks_per_second else None
+
+        self._calls = {}
+        self._counter = itertools.count()
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._stats = {'calls': 0, 'events': 0, 'callbacks': 0, 'callback_errors': 0,
+                       'twiml_fetches': 0, 'lag_ms_total': 0.0, 'lag_ms_max': 0.0, 'outcomes': {}}
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fake-twilio')
+        self._dispatcher = threading.Thread(target=self._dispatch, name='fake-twilio-clock', daemon=True)
+        self._dispatcher.start()
+
+    # -- calls -----------------------------------------------------------
+
+    def create_call(self, params):
+        """Accept a Calls.json request (Twilio field names) and start the call"""
+        for required in ('To', 'From'):
+            if not params.get(required):
+                raise ValueError(f"Required parameter {required} is missing")
+        if not params.get('Url') and not params.get('Twiml'):
+            raise ValueError("Either Url or Twiml is required")
+        n = next(self._counter)
+        rng = random.Random(f"{self.seed}:{n}")
+        to_number = params['To'][-1] if isinstance(params['To'], list) else params['To']
+        fixed = self.numbers.get(to_number)
+        scenario = fixed if fixed in self.scenarios else rng.choices(self._names, self._weights)[0]
+        timeline = [(kind, max(1, round(ms * rng.uniform(1 - self.jitter, 1 + self.jitter))))
+                    for kind, ms in self.scenarios[scenario]]
+        call = _Call(f"CA{self.seed & 0xffffffff:08x}{n:024x}", params, scenario, timeline, time.time())
+        if fixed in UNANSWERED:
+            call.unanswered = fixed
+        elif self.unanswered:
+            # A separate stream, so enabling this leaves the scenarios and timings of a seed unchanged
+            draw = random.Random(f"{self.seed}:{n}:answer").random()
+            for status, rate in self.unanswered.items():
+                if draw < rate:
+                    call.unanswered = status
+                    break
+                draw -= rate
+        with self._stats_lock:
+            self._calls[call.sid] = call
+            self._stats['calls'] += 1
+        self._schedule(call, 0, self._initiated)
+        return call.snapshot(self.account_sid)
+
+    def fetch_call(self, sid):
+        call = self._calls.get(sid)
+        return None if call is None else call.snapshot(self.account_sid)
+
+    def list_calls(self, start_after=None, start_before=None, status=None):
+        """Snapshots of every call, newest first, optionally filtered by creation time and status"""
+        with self._stats_lock:
+            calls = list(self._calls.values())
+        calls.sort(key=lambda call: call.created, reverse=True)
+        return [call.snapshot(self.account_sid) for call in calls
+                if (start_after is None or call.created >= start_after)
+                and (start_before is None or call.created <= start_before)
+                and (status is None or call.status == status)]
+
+    def expected_outcome(self, sid):
+        """Outcome the call's scenario should be detected as ('machine' or 'human')"""
+        call = self._calls.get(sid)
+        return None if call is None else EXPECTED_OUTCOMES[call.scenario]
+
+    # -- scheduling ------------------------------------------------------
+
+    def _schedule(self, call, at_ms, action, *args):
+        """Run action(call, *args) at simulated time at_ms after the call was created"""
+        self._schedule_all(call, [(at_ms, action, args)])
+
+    def _schedule_all(self, call, events):
+        """Schedule several (at_ms, action, args) events of a call at once
+
+        They are queued under one lock: on a compressed clock they are all
+        due at once, and queueing them one by one would let the dispatcher
+        start a later event before an earlier one is queued.
+        """
+        with self._cond:
+            for at_ms, action, args in events:
+                due = call.created + at_ms * self.time_scale / 1000
+                self._pending += 1
+                # Simulated time breaks ties, so a compressed clock keeps event order
+                heapq.heappush(self._heap, (due, at_ms, next(self._seq), call, action, args))
+            self._cond.notify()
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._heap or self._heap[0][0] > time.time()):
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                due, _, _, call, action, args = heapq.heappop(self._heap)
+            with call.lock:
+                call.outbox.append((due, action, args))
+                start = not call.draining
+                call.draining = True
+            if start:
+                self._pool.submit(self._drain, call)
+
+    def _drain(self, call):
+        # A call's events run in order on one worker at a time
+        while True:
+            with call.lock:
+                if not call.outbox:
+                    call.draining = False
+                    return
+                due, action, args = call.outbox.pop(0)
+            lag_ms = max(0.0, (time.time() - due) * 1000)
+            try:
+                action(call, *args)
+            except Exception:
+                with self._stats_lock:
+                    self._stats['callback_errors'] += 1
+            with self._stats_lock:
+                self._stats['events'] += 1
+                self._stats['lag_ms_total'] += lag_ms
+                self._stats['lag_ms_max'] = max(self._stats['lag_ms_max'], lag_ms)
+            with self._cond:
+                self._pending -= 1
+                self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Block until every scheduled event has run; False if timeout expires first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._dispatcher.join()
+        self._pool.shutdown(wait=True)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats, outcomes=dict(self._stats['outcomes']))
+            lag_total = stats.pop('lag_ms_total')
+            active = sum(1 for call in self._calls.values() if call.status not in ENDED_STATUSES)
+        with self._cond:
+            stats['pending_events'] = self._pending
+        stats['active_calls'] = active
+        stats['lag_ms_max'] = round(stats['lag_ms_max'], 3)
+        stats['lag_ms_mean'] = round(lag_total / stats['events'], 3) if stats['events'] else 0.0
+        return stats
+
+    # -- call lifecycle --------------------------------------------------
+
+    def _base_params(self, call):
+        params = {
+            'AccountSid': self.account_sid,
+            'ApiVersion': API_VERSION,
+            'CallSid': call.sid,
+            'From': call.param('From'),
+            'To': call.param('To'),
+            'Caller': call.param('From'),
+            'Called': call.param('To'),
+            'Direction': 'outbound-api',
+        }
+        params.update(geo_params(params['From'], params['To']))
+        return params
+
+    def _send(self, url, method, params):
+        if self.limiter:
+            self.limiter.acquire()
+        try:
+            status, body = self.transport.request(method or 'POST', url, params)
+        except Exception:
+            status, body = None, b''
+        with self._stats_lock:
+            self._stats['callbacks'] += 1
+            if status is None or status >= 400:
+                self._stats['callback_errors'] += 1
+        return status, body
+
+    def _status_callback(self, call, event, status, at_ms, **extra):
+        call.status = status
+        url = call.param('StatusCallback')
+        events = call.params.get('StatusCallbackEvent') or ['completed']
+        if isinstance(events, str):
+            events = events.split()
+        if not url or event not in events:
+            return
+        params = self._base_params(call)
+        params.update({
+            'CallStatus': status,
+            'CallbackSource': 'call-progress-events',
+            'SequenceNumber': str(next(call.sequence)),
+            'Timestamp': formatdate(call.created + at_ms / 1000, usegmt=True),
+        })
+        params.update(extra)
+        self._send(url, call.param('StatusCallbackMethod', 'POST'), params)
+
+    def _amd_settings(self, call):
+        def number(name, default):
+            value = call.param(name)
+            return int(value) if value not in (None, '') else default
+        return {
+            'machine_detection': call.param('MachineDetection'),
+            'timeout': number('MachineDetectionTimeout', 30),
+            'speech_threshold': number('MachineDetectionSpeechThreshold', 2400),
+            'speech_end_threshold': number('MachineDetectionSpeechEndThreshold', 1200),
+            'silence_timeout': number('MachineDetectionSilenceTimeout', 5000),
+        }
+
+    def _is_async_amd(self, call):
+        # Twilio needs AsyncAmd=true; a bare AsyncAmdStatusCallback is accepted here too
+        flag = call.param('AsyncAmd')
+        if flag is not None:
+            return flag.lower() == 'true'
+        return bool(call.param('AsyncAmdStatusCallback'))
+
+    def _initiated(self, call):
+        self._status_callback(call, 'initiated', 'initiated', 0)
+        ringing_ms = self.ring_ms // 3
+        if call.unanswered == 'busy':
+            self._schedule(call, ringing_ms, self._unanswered, ringing_ms)
+            return
+        self._schedule(call, ringing_ms, self._ringing, ringing_ms)
+
+    def _ringing(self, call, at_ms):
+        self._status_callback(call, 'ringing', 'ringing', at_ms)
+        if call.unanswered == 'no-answer':
+            # Rings for the call's Timeout (Twilio's default is 60 seconds)
+            ended_ms = at_ms + int(call.param('Timeout') or 60) * 1000
+            self._schedule(call, ended_ms, self._unanswered, ended_ms)
+            return
+        self._schedule(call, self.ring_ms, self._answered)
+
+    def _unanswered(self, call, at_ms):
+        call.ended_at = at_ms
+        self._status_callback(call, 'completed', call.unanswered, at_ms, CallDuration='0',
+                              SipResponseCode=UNANSWERED[call.unanswered])
+
+    def _answered(self, call):
+        call.answered_at = self.ring_ms
+        self._status_callback(call, 'answered', 'in-progress', self.ring_ms)
+        hangup_ms = self.ring_ms + timeline_ms(call.timeline)
+        events = [(hangup_ms, self._hangup, (hangup_ms,))]
+        if not call.param('MachineDetection'):
+            events.append((self.ring_ms, self._fetch_twiml, ()))
+        else:
+            answered_by, detection_ms = amd_decision(call.timeline, **self._amd_settings(call))
+            decided_ms = self.ring_ms + detection_ms
+            if self._is_async_amd(call):
+                events.append((self.ring_ms, self._fetch_twiml, ()))
+                events.append((decided_ms, self._amd_result, (answered_by, detection_ms)))
+            else:
+                # Synchronous AMD holds the TwiML request until detection finishes
+                events.append((decided_ms, self._sync_amd, (answered_by, detection_ms)))
+        self._schedule_all(call, events)
+
+    def _record_outcome(self, call, answered_by, detection_ms):
+        call.answered_by = answered_by
+        call.detection_ms = str(detection_ms)
+        with self._stats_lock:
+            outcomes = self._stats['outcomes']
+            outcomes[answered_by] = outcomes.get(answered_by, 0) + 1
+
+    def _sync_amd(self, call, answered_by, detection_ms):
+        if call.ended_at is not None:
+            return
+        self._record_outcome(call, answered_by, detection_ms)
+        self._fetch_twiml(call, AnsweredBy=answered_by, MachineDetectionDuration=str(detection_ms))
+
+    def _amd_result(self, call, answered_by, detection_ms):
+        if call.ended_at is not None:
+            # The call ended before detection finished
+            answered_by, detection_ms = 'unknown', call.ended_at - call.answered_at
+        self._record_outcome(call, answered_by, detection_ms)
+        params = {
+            'AccountSid': self.account_sid,
+            'CallSid': call.sid,
+            'AnsweredBy': answered_by,
+            'MachineDetectionDuration': str(detection_ms),
+        }
+        self._send(call.param('AsyncAmdStatusCallback'), call.param('AsyncAmdStatusCallbackMethod', 'POST'), params)
+
+    def _fetch_twiml(self, call, **extra):
+        if call.ended_at is not None:
+            return
+        fetched_ms = call.answered_at + int(extra.get('MachineDetectionDuration', 0))
+        if call.param('Twiml'):
+            body = call.param('Twiml').encode()
+        else:
+            params = self._base_params(call)
+            params['CallStatus'] = 'in-progress'
+            params.update(extra)
+            _, body = self._send(call.param('Url'), call.param('Method', 'POST'), params)
+            with self._stats_lock:
+                self._stats['twiml_fetches'] += 1
+        end_ms = fetched_ms + twiml_duration_ms(body or b'<Response/>')
+        # Whichever side hangs up first ends the call
+        self._schedule(call, end_ms, self._hangup, end_ms)
+
+    def _hangup(self, call, at_ms):
+        if call.ended_at is not None:
+            return
+        call.ended_at = at_ms
+        duration = round((at_ms - call.answered_at) / 1000)
+        self._status_callback(call, 'completed', 'completed', at_ms,
+                              CallDuration=str(duration), Duration=str(max(1, -(-duration // 60))),
+                              SipResponseCode='200')
+
+
+# -- REST endpoint ---------------------------------------------------------
+
+def _parse_time(value):
+    """Epoch seconds for a StartTime filter (YYYY-MM-DD or ISO 8601 UTC), or None"""
+    if not value:
+        return None
+    value = value.rstrip('Z')
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    return None
+
+
+class _RestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    platform = None
+    limiter = None
+    throttled = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        parts = [p for p in urlsplit(self.path).path.split('/') if p]
+        # /2010-04-01/Accounts/{AccountSid}/Calls.json or .../Calls/{CallSid}.json
+        if len(parts) >= 4 and parts[0] == API_VERSION and parts[1] == 'Accounts':
+            if parts[3] == 'Calls.json' and len(parts) == 4:
+                return 'calls', None
+            if parts[3] == 'Calls' and len(parts) == 5 and parts[4].endswith('.json'):
+                return 'call', parts[4][:-5]
+        if parts == ['stats']:
+            return 'stats', None
+        return None, None
+
+    def do_POST(self):
+        route, _ = self._route()
+        length = int(self.headers.get('Content-Length') or 0)
+        form = parse_qs(self.rfile.read(length).decode(), keep_blank_values=True)
+        if route != 'calls':
+            return self._reply(404, {'code': 20404, 'message': 'The requested resource was not found', 'status': 404})
+        params = {k: (v if k == 'StatusCallbackEvent' else v[-1]) for k, v in form.items()}
+        try:
+            call = self.platform.create_call(params)
+        except ValueError as e:
+            return self._reply(400, {'code': 21201, 'message': str(e), 'status': 400})
+        self._reply(201, call.to_json())
+
+    def _throttled(self):
+        if self.limiter is None or self.limiter.try_acquire():
+            return False
+        type(self).throttled += 1
+        body = json.dumps({'code': 20429, 'message': 'Too Many Requests', 'status': 429}).encode()
+        self.send_response(429)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def _list(self):
+        # Paged like Twilio: newest first, PageSize (max 1000) and an opaque PageToken
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        page_size = min(max(int(query.get('PageSize', 50)), 1), 1000)
+        page = int(query.get('Page', 0))
+        offset = int(query.get('PageToken', 'PA0')[2:] or 0)
+        calls = self.platform.list_calls(_parse_time(query.get('StartTime>=')),
+                                         _parse_time(query.get('StartTime<=')), query.get('Status'))
+        chunk = calls[offset:offset + page_size]
+        uri = parts.path
+        more = dict(query, Page=page + 1, PageToken=f"PA{offset + page_size}")
+        self._reply(200, {
+            'calls': [call.to_json() for call in chunk],
+            'page': page,
+            'page_size': page_size,
+            'start': offset,
+            'end': offset + len(chunk) - 1,
+            'uri': f"{uri}?{parts.query}" if parts.query else uri,
+            'first_page_uri': f"{uri}?{urlencode({'PageSize': page_size, 'Page': 0})}",
+            'previous_page_uri': None,
+            'next_page_uri': f"{uri}?{urlencode(more)}" if offset + page_size < len(calls) else None,
+        })
+
+    def do_GET(self):
+        route, sid = self._route()
+        if route == 'stats':
+            return self._reply(200, dict(self.platform.stats(), rest_throttled=self.throttled))
+        if self._throttled():
+            return
+        if route == 'calls':
+            return self._list()
+        call = self.platform.fetch_call(sid) if route == 'call' else None
+        if call is None:
+            return self._reply(404, {'code': 20404, 'message': 'The requested resource was not found', 'status': 404})
+        self._reply(200, call.to_json())
+
+
+def rest_server(platform, host='127.0.0.1', port=0, requests_per_second=None, burst=1):
+    """ThreadingHTTPServer exposing the Calls API of `platform`; call serve_forever() on it
+
+    With requests_per_second, GETs beyond that rate are answered 429 with
+    Retry-After, as Twilio does when an account exceeds its API concurrency.
+    """
+    limiter = TokenBucket(requests_per_second, burst) if requests_per_second else None
+    handler = type('RestHandler', (_RestHandler,), {'platform': platform, 'limiter': limiter})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def rest_client(base_url, account_sid=ACCOUNT_SID, auth_token='fake'):
+    """twilio.rest.Client whose API requests go to a fake REST server"""
+    from twilio.rest import Client
+
+    client = Client(account_sid, auth_token)
+    client.api.base_url = base_url.rstrip('/')
+    return client
+
+
+def smoke_run(platform, webhook_base, calls=10, variant='advanced', machine_detection='Enable',
+              from_number='+15017122661', to_number='+5511987654321'):
+    """Place `calls` calls against a running webhook server and wait for them to finish"""
+    base = webhook_base.rstrip('/')
+    params = {'to': to_number, 'from_': from_number, 'machine_detection': machine_detection,
+              'status_callback': f"{base}/webhook", 'status_callback_event': list(STATUS_EVENTS)}
+    if variant == 'manual':
+        params['url'] = f"{base}/handle_amd"
+    else:
+        params.update(url=f"{base}/silent", async_amd=True,
+                      async_amd_status_callback=f"{base}/webhook")
+    sids = [platform.calls.create(**params).sid for _ in range(calls)]
+    platform.wait()
+    hits = sum(1 for sid in sids
+               if normalize_outcome(platform.fetch_call(sid).answered_by) == platform.expected_outcome(sid))
+    return {'calls': calls, 'correct': hits, **platform.stats()}
+
+
+SCENARIO_CHOICES = ('mix',) + tuple(SCENARIOS)
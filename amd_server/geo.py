@@ -0,0 +1,342 @@
+# Incremental AMD outcome rollups by destination region
+#
+# AMD behaves differently across carrier regions (greeting styles, ring
+# times, network tones), so outcomes are rolled up per (country, state,
+# config) as callbacks arrive: AnsweredBy counts, final call statuses and a
+# fixed-bucket MachineDetectionDuration histogram that quantiles are read
+# from, the same sketch the /metrics histograms use. Each callback costs a
+# couple of dict lookups and a bisect over the buckets, whatever the volume.
+#
+# Status callbacks carry the To/Called geo fields, but the async AMD
+# callback does not. Calls placed with a known region (the dialer's
+# `country` and `state` columns) carry it in AmdCountry / AmdState tags on
+# every callback URL. For other calls the region is remembered, in a
+# bounded per-process table, from the call's first callback that has one;
+# with several worker processes an AMD callback that lands on a worker
+# which saw none of the call's status callbacks counts as unknown.
+#
+# With AMD_GEO_DIR set, each process writes its rollups to a JSON snapshot
+# every `snapshot_interval` seconds and on exit, into its own lane (as in
+# amd_server.spool), and picks its lane's snapshot up again on start-up.
+# /geo merges the other lanes' snapshots into the live view, so one worker
+# answers for the whole deployment, at most one interval behind.
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .events import TERMINAL_STATUSES
+from .metrics import DURATION_BUCKETS, OTHER, UNTAGGED, bucket_quantile
+from .spool import _claim_lane
+from .webhook import AMD_RESULT, COUNTRY_PARAM, STATE_PARAM, normalize_outcome
+
+UNKNOWN = 'unknown'
+SNAPSHOT_FILE = 'geo.json'
+SNAPSHOT_VERSION = 1
+
+
+def _region(value):
+    return value.strip().upper() if value and value.strip() else None
+
+
+class _Rollup:
+    """Counts and detection-time histogram of one (country, state, config)"""
+
+    __slots__ = ('answered_by', 'statuses', 'detection', 'updated')
+
+    def __init__(self):
+        self.answered_by = {}
+        self.statuses = {}
+        self.detection = [0] * (len(DURATION_BUCKETS) + 2)   # buckets, +Inf, sum
+        self.updated = None
+
+    def merge(self, data):
+        for name, count in data['answered_by'].items():
+            self.answered_by[name] = self.answered_by.get(name, 0) + count
+        for name, count in data['statuses'].items():
+            self.statuses[name] = self.statuses.get(name, 0) + count
+        for i, value in enumerate(data['detection']):
+            self.detection[i] += value
+        self.updated = max(self.updated or 0, data['updated'] or 0) or None
+
+    def as_data(self, key):
+        return {'country': key[0], 'state': key[1], 'config': key[2],
+                'answered_by': dict(self.answered_by), 'statuses': dict(self.statuses),
+                'detection': list(self.detection), 'updated': self.updated}
+
+
+def summarize(data):
+    """JSON-friendly view of one rollup: counts, machine share and detection-time quantiles"""
+    outcomes = {}
+    for answered_by, count in data['answered_by'].items():
+        outcome = normalize_outcome(answered_by)
+        outcomes[outcome] = outcomes.get(outcome, 0) + count
+    results = sum(outcomes.values())
+    detection = data['detection']
+    count = sum(detection[:-1])
+    return {
+        'country': data['country'], 'state': data['state'], 'config': data['config'],
+        'results': results,
+        'outcomes': outcomes,
+        'answered_by': data['answered_by'],
+        'machine_rate': round(outcomes.get('machine', 0) / results, 4) if results else None,
+        'statuses': data['statuses'],
+        'detection_count': count,
+        'detection_mean_s': round(detection[-1] / count, 3) if count else None,
+        'detection_p50_s': bucket_quantile(DURATION_BUCKETS, detection, 0.50),
+        'detection_p90_s': bucket_quantile(DURATION_BUCKETS, detection, 0.90),
+        'updated': data['updated'],
+    }
+
+
+class GeoRollups:
+    """(country, state, config) -> outcome counts and detection histogram, updated per callback
+
+    At most max_keys rollups are kept; callbacks for regions beyond that
+    are counted under ('other', 'other', config label). max_calls bounds
+    the CallSid -> region table used for callbacks without geo fields.
+    """
+
+    def __init__(self, directory=None, snapshot_interval=60, max_keys=10000, max_calls=100000,
+                 max_configs=100):
+        self.max_keys = max_keys
+        self.max_calls = max_calls
+        self.max_configs = max_configs
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._rollups = {}
+        self._regions = OrderedDict()   # CallSid -> (country, state)
+        self._configs = set()
+        self._changes = 0
+        self._saved_changes = 0
+        self.snapshots = 0
+        self.snapshot_errors = 0
+        self.directory = directory
+        self.lane = self._lane_lock = None
+        self._stop = threading.Event()
+        self._thread = None
+        if directory:
+            self.lane, self._lane_lock = _claim_lane(directory)
+            self._rollups = self._load(os.path.join(self.lane, SNAPSHOT_FILE))
+            self._configs.update(key[2] for key in self._rollups if key[2] not in (UNTAGGED, OTHER))
+            self._thread = threading.Thread(target=self._run, name='amd-geo-snapshot', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    # -- updates -----------------------------------------------------------
+
+    def _config_label(self, config_key):
+        # Called with self._lock held
+        if not config_key:
+            return UNTAGGED
+        if config_key in self._configs:
+            return config_key
+        if len(self._configs) < self.max_configs:
+            self._configs.add(config_key)
+            return config_key
+        return OTHER
+
+    def _call_region(self, call_sid, params):
+        # Called with self._lock held
+        country = _region(params.get('ToCountry') or params.get('CalledCountry'))
+        if country is None:
+            # Tagged at dial time, so the same in every worker process
+            country = _region(params.get(COUNTRY_PARAM))
+            if country is not None:
+                return country, _region(params.get(STATE_PARAM)) or UNKNOWN
+            region = self._regions.get(call_sid)
+            return region if region is not None else (UNKNOWN, UNKNOWN)
+        region = (country, _region(params.get('ToState') or params.get('CalledState')) or UNKNOWN)
+        if call_sid and call_sid not in self._regions:
+            self._regions[call_sid] = region
+            if len(self._regions) > self.max_calls:
+                self._regions.popitem(last=False)
+        return region
+
+    def observe(self, event, received_at=None):
+        """Fold one decoded WebhookEvent into its region's rollup"""
+        params = event.params
+        is_result = event.webhook_type == AMD_RESULT and event.answered_by
+        status = params.get('CallStatus')
+        final = status if status in TERMINAL_STATUSES else None
+        with self._lock:
+            region = self._call_region(event.call_sid, params)
+            if not is_result and final is None:
+                return
+            key = region + (self._config_label(event.config_key),)
+            rollup = self._rollups.get(key)
+            if rollup is None:
+                if len(self._rollups) >= self.max_keys:
+                    key = (OTHER, OTHER, key[2])
+                    rollup = self._rollups.get(key)
+                if rollup is None:
+                    rollup = self._rollups[key] = _Rollup()
+            if is_result:
+                answered_by = event.answered_by
+                rollup.answered_by[answered_by] = rollup.answered_by.get(answered_by, 0) + 1
+                duration = params.get('MachineDetectionDuration')
+                if duration:
+                    try:
+                        seconds = int(duration) / 1000
+                    except ValueError:
+                        pass
+                    else:
+                        rollup.detection[bisect.bisect_left(DURATION_BUCKETS, seconds)] += 1
+                        rollup.detection[-1] += seconds
+            if final is not None:
+                rollup.statuses[final] = rollup.statuses.get(final, 0) + 1
+            rollup.updated = received_at if received_at is not None else time.time()
+            self._changes += 1
+
+    # -- queries -----------------------------------------------------------
+
+    def _live(self):
+        with self._lock:
+            return [rollup.as_data(key) for key, rollup in self._rollups.items()]
+
+    def rollups(self, country=None, state=None, config=None, min_results=0, merged=True):
+        """Summaries sorted by (country, state, config), optionally filtered
+
+        merged=True adds the latest snapshots of the other lanes (other
+        worker processes, or earlier ones whose lane is no longer in use).
+        """
+        combined = {}
+        sources = [self._live()]
+        if merged:
+            sources.extend(self._other_lanes())
+        for source in sources:
+            for data in source:
+                key = (data['country'], data['state'], data['config'])
+                rollup = combined.get(key)
+                if rollup is None:
+                    rollup = combined[key] = _Rollup()
+                rollup.merge(data)
+        country, state = _region(country), _region(state)
+        summaries = []
+        for key in sorted(combined):
+            if (country and key[0] != country) or (state and key[1] != state) or (config and key[2] != config):
+                continue
+            summary = summarize(combined[key].as_data(key))
+            if summary['results'] >= min_results:
+                summaries.append(summary)
+        return summaries
+
+    def stats(self):
+        with self._lock:
+            stats = {'rollups': len(self._rollups), 'calls_tracked': len(self._regions),
+                     'capacity': self.max_keys, 'changes': self._changes}
+        stats.update({'lane': self.lane, 'snapshots': self.snapshots, 'snapshot_errors': self.snapshot_errors})
+        return stats
+
+    def prometheus_samples(self):
+        """(name, type, help, value) samples for Metrics.add_collector"""
+        stats = self.stats()
+        return [
+            ('amd_geo_rollups', 'gauge', 'Distinct (country, state, config) rollups kept', stats['rollups']),
+            ('amd_geo_snapshots_total', 'counter', 'Geo rollup snapshots written', stats['snapshots']),
+            ('amd_geo_snapshot_errors_total', 'counter', 'Geo rollup snapshots that failed', stats['snapshot_errors']),
+        ]
+
+    # -- snapshots ---------------------------------------------------------
+
+    def _load(self, path):
+        """{key: _Rollup} from a snapshot file; empty if it is missing or unusable"""
+        rollups = {}
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return rollups
+        except (OSError, ValueError):
+            # A damaged snapshot is left for inspection and replaced by the next write
+            self.snapshot_errors += 1
+            return rollups
+        if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('buckets') != list(DURATION_BUCKETS):
+            return rollups
+        for data in snapshot['rollups']:
+            key = (data['country'], data['state'], data['config'])
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollup = rollups[key] = _Rollup()
+            rollup.merge(data)
+        return rollups
+
+    def _other_lanes(self):
+        if not self.directory:
+            return []
+        lanes = []
+        for name in sorted(os.listdir(self.directory)):
+            lane = os.path.join(self.directory, name)
+            if lane == self.lane or not name.startswith('lane-'):
+                continue
+            rollups = self._load(os.path.join(lane, SNAPSHOT_FILE))
+            lanes.append([rollup.as_data(key) for key, rollup in rollups.items()])
+        return lanes
+
+    def snapshot(self):
+        """Write this process's rollups to its lane if anything changed since the last write"""
+        if self.lane is None:
+            return False
+        with self._lock:
+            changes = self._changes
+            if changes == self._saved_changes:
+                return False
+            rollups = [rollup.as_data(key) for key, rollup in self._rollups.items()]
+        path = os.path.join(self.lane, SNAPSHOT_FILE)
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'version': SNAPSHOT_VERSION, 'written_at': time.time(), 'pid': os.getpid(),
+                           'buckets': list(DURATION_BUCKETS), 'rollups': rollups}, f, separators=(',', ':'))
+            # Readers in other processes see the old or the new snapshot, never a partial one
+            os.replace(path + '.tmp', path)
+        except OSError:
+            self.snapshot_errors += 1
+            return False
+        self._saved_changes = changes
+        self.snapshots += 1
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.snapshot_interval):
+            self.snapshot()
+
+    def close(self):
+        """Write a final snapshot and release the lane"""
+        atexit.unregister(self.close)
+        if self._thread is None or self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.snapshot()
+        if self._lane_lock is not None:
+            self._lane_lock.close()
+
+
+def geo_from_env():
+    """GeoRollups from AMD_GEO_* environment variables
+
+    AMD_GEO_DIR        directory for periodic rollup snapshots (kept in memory only when unset)
+    AMD_GEO_INTERVAL   seconds between snapshots (default 60)
+    AMD_GEO_MAX_KEYS   (country, state, config) rollups kept (default 10000)
+    """
+    return GeoRollups(
+        directory=os.getenv('AMD_GEO_DIR') or None,
+        snapshot_interval=float(os.getenv('AMD_GEO_INTERVAL', '60')),
+        max_keys=int(os.getenv('AMD_GEO_MAX_KEYS', '10000')),
+    )
+
+
+def flask_geo_response(rollups, request):
+    """GET /geo?country=US&state=CA&config=KEY&min_results=N handler body"""
+    try:
+        min_results = int(request.args.get('min_results', '0'))
+    except ValueError:
+        return {"error": "min_results must be an integer"}, 400
+    return {
+        'generated_at': time.time(),
+        'rollups': rollups.rollups(request.args.get('country'), request.args.get('state'),
+                                   request.args.get('config'), min_results),
+    }
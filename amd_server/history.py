@@ -0,0 +1,305 @@
+# Bulk retrieval of historical call results from the Calls REST API
+#
+# client.calls(sid).fetch() in a loop pays one HTTPS round trip per call,
+# back to back, so reconciling a day of test calls takes minutes. The
+# fetcher here shares one pooled keep-alive session between a bounded set
+# of worker threads, pages through the Calls list for date ranges, retries
+# 429 (and 503) responses with exponential backoff that honours
+# Retry-After, and streams every call into the ResultStore as it arrives.
+import json
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import date, datetime, timezone
+from email.utils import mktime_tz, parsedate_tz
+
+API_VERSION = '2010-04-01'
+DEFAULT_BASE_URL = 'https://api.twilio.com'
+RETRY_STATUSES = frozenset([429, 503])
+
+# webhook_type of store rows that came from the REST API rather than a callback
+CALL_RESOURCE = 'CALL_RESOURCE'
+
+
+class RestError(Exception):
+    """Non-retryable (or retries exhausted) error response from the REST API"""
+
+    def __init__(self, status, message, url):
+        super().__init__(f"HTTP {status} from {url}: {message}")
+        self.status = status
+        self.url = url
+
+
+class RestSession:
+    """Pooled, authenticated GET session with retry and backoff on throttling
+
+    One requests.Session is shared by all threads; its connection pool
+    holds up to pool_size keep-alive connections and makes extra threads
+    wait for one instead of opening more.
+    """
+
+    def __init__(self, account_sid, auth_token, base_url=DEFAULT_BASE_URL, pool_size=8, timeout=30,
+                 max_retries=6, backoff=0.5, max_backoff=30.0, sleep=time.sleep):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.account_sid = account_sid
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._sleep = sleep
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+
+    @classmethod
+    def from_client(cls, client, **options):
+        """Session using a twilio.rest.Client's credentials and API base URL"""
+        options.setdefault('base_url', client.api.base_url)
+        return cls(client.username, client.password, **options)
+
+    def calls_path(self, call_sid=None):
+        base = f"/{API_VERSION}/Accounts/{self.account_sid}/Calls"
+        return f"{base}/{call_sid}.json" if call_sid else f"{base}.json"
+
+    def get_json(self, path, params=None):
+        """GET base_url + path (or an absolute URL) and decode the JSON body"""
+        url = path if path.startswith('http') else self.base_url + path
+        attempt = 0
+        while True:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            with self._lock:
+                self.requests += 1
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                with self._lock:
+                    self.retries += 1
+                self._sleep(self._delay(attempt, response.headers.get('Retry-After')))
+                attempt += 1
+                continue
+            if response.status_code >= 400:
+                try:
+                    message = response.json().get('message')
+                except ValueError:
+                    message = response.text[:200]
+                raise RestError(response.status_code, message, url)
+            return response.json()
+
+    def _delay(self, attempt, retry_after):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+        # Jitter so throttled workers do not all come back at the same instant
+        return delay * random.uniform(1.0, 1.25)
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'retries': self.retries}
+
+    def close(self):
+        self.session.close()
+
+
+def _epoch(value):
+    parsed = parsedate_tz(value) if value else None
+    return mktime_tz(parsed) if parsed is not None else None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _time_filter(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def call_summary(call):
+    """The AMD-relevant fields of a call resource (REST JSON)"""
+    return {
+        'call_sid': call.get('sid'),
+        'status': call.get('status'),
+        'answered_by': call.get('answered_by'),
+        'machine_detection_duration': _to_int(call.get('machine_detection_duration')),
+        'duration': _to_int(call.get('duration')),
+        'start_time': call.get('start_time'),
+        'end_time': call.get('end_time'),
+    }
+
+
+def call_row(call, config_key=None):
+    """ResultStore insert row (see store.event_row) for a call resource
+
+    received_at is the call's end (or start, or creation) time so fetched
+    rows sort alongside the callbacks the server received for the call.
+    """
+    received_at = (_epoch(call.get('end_time')) or _epoch(call.get('start_time'))
+                   or _epoch(call.get('date_created')) or time.time())
+    return (
+        received_at,
+        call.get('sid'),
+        config_key,
+        CALL_RESOURCE,
+        call.get('status'),
+        call.get('answered_by'),
+        _to_int(call.get('machine_detection_duration')),
+        None,
+        json.dumps(call, separators=(',', ':')),
+    )
+
+
+class HistoryFetcher:
+    """Fetches call results by SID list or date range and streams them into a ResultStore"""
+
+    def __init__(self, session, store=None, workers=8, page_size=1000):
+        self.session = session
+        self.store = store
+        self.workers = workers
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self.fetched = 0
+        self.skipped = 0
+        self.errors = 0
+        self.store_dropped = 0
+
+    @classmethod
+    def from_client(cls, client, store=None, workers=8, **session_options):
+        """Fetcher sharing a twilio.rest.Client's credentials, with a pool sized to `workers`"""
+        session_options.setdefault('pool_size', workers)
+        return cls(RestSession.from_client(client, **session_options), store, workers)
+
+    def _stored_sids(self):
+        if self.store is None:
+            return set()
+        self.store.flush()
+        rows = self.store.query("SELECT DISTINCT call_sid FROM callbacks WHERE webhook_type = ?",
+                                (CALL_RESOURCE,))
+        return {row['call_sid'] for row in rows}
+
+    def _record(self, call, config_key=None):
+        # A row the store's queue dropped is fetched again by the next run
+        dropped = self.store is not None and not self.store.add_rows([call_row(call, config_key)])
+        with self._lock:
+            self.fetched += 1
+            self.store_dropped += dropped
+        return call_summary(call)
+
+    def fetch(self, call_sids, config_keys=None, skip_stored=True):
+        """Yield a summary per SID as its fetch completes (completion order, not input order)
+
+        config_keys optionally maps SIDs to the AMD configuration that placed
+        them, which the call resource does not carry. SIDs already fetched
+        into the store are skipped unless skip_stored is False. Failed
+        fetches yield {'call_sid': ..., 'error': ...}.
+        """
+        config_keys = config_keys or {}
+        stored = self._stored_sids() if skip_stored else set()
+
+        def fetch_one(call_sid):
+            try:
+                call = self.session.get_json(self.session.calls_path(call_sid))
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                return {'call_sid': call_sid, 'error': str(e)}
+            return self._record(call, config_keys.get(call_sid))
+
+        # At most 2 x workers fetches are queued at once, so a long SID list
+        # (or a generator) is consumed as results are taken
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='amd-history') as pool:
+            pending = set()
+            for call_sid in call_sids:
+                if call_sid in stored:
+                    with self._lock:
+                        self.skipped += 1
+                    continue
+                pending.add(pool.submit(fetch_one, call_sid))
+                if len(pending) >= self.workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
+
+    def list_calls(self, start=None, end=None, status=None):
+        """Yield call resources (REST JSON) page by page, newest first
+
+        start / end bound the call start time; they may be dates, datetimes
+        (UTC if naive) or strings already in Twilio's filter format.
+        """
+        params = {'PageSize': self.page_size}
+        if start is not None:
+            params['StartTime>='] = _time_filter(start)
+        if end is not None:
+            params['StartTime<='] = _time_filter(end)
+        if status:
+            params['Status'] = status
+        path = self.session.calls_path()
+        while path:
+            page = self.session.get_json(path, params)
+            yield from page.get('calls', ())
+            path, params = page.get('next_page_uri'), None
+
+    def fetch_range(self, start, end=None, status=None, config_keys=None, skip_stored=True):
+        """Yield a summary per call listed in the date range, storing each as its page arrives
+
+        The list resource already carries answered_by and durations, so no
+        per-call fetch is needed.
+        """
+        config_keys = config_keys or {}
+        stored = self._stored_sids() if skip_stored else set()
+        for call in self.list_calls(start, end, status):
+            if call.get('sid') in stored:
+                with self._lock:
+                    self.skipped += 1
+                continue
+            yield self._record(call, config_keys.get(call.get('sid')))
+
+    def stats(self):
+        with self._lock:
+            stats = {'fetched': self.fetched, 'skipped': self.skipped, 'errors': self.errors,
+                     'store_dropped': self.store_dropped}
+        stats.update(self.session.stats())
+        return stats
+
+    def close(self):
+        if self.store is not None:
+            self.store.flush()
+        self.session.close()
+
+
+def print_history(results):
+    """Print summaries as a table and return AnsweredBy counts"""
+    counts = {}
+    print(f"{'Call SID':<36} {'Status':<12} {'AnsweredBy':<20} {'AMD ms':>7} {'Secs':>5}")
+    print("-" * 84)
+    for result in results:
+        if result.get('error'):
+            print(f"{result['call_sid']:<36} ERROR {result['error']}")
+            continue
+        answered_by = result['answered_by'] or '-'
+        counts[answered_by] = counts.get(answered_by, 0) + 1
+        detection = result['machine_detection_duration']
+        duration = result['duration']
+        print(f"{result['call_sid']:<36} {result['status'] or '-':<12} {answered_by:<20} "
+              f"{detection if detection is not None else '-':>7} {duration if duration is not None else '-':>5}")
+    return counts
@@ -0,0 +1,148 @@
+# Non-blocking structured log sink for the webhook handlers
+#
+# Handlers push one record (a plain dict) per event; a background thread
+# drains the bounded queue in batches and hands each batch to the configured
+# writers (human-readable console view and/or a rotating JSONL file).
+import json
+import os
+import sys
+import time
+
+from .batching import DROP, BatchWorker
+
+
+def format_timestamp(ts):
+    """Local wall-clock time of a record, as the console banners show it"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+
+
+def console_formatter(formatters):
+    """Combine per-kind formatter functions into one; unknown kinds are skipped"""
+    def format_record(record):
+        formatter = formatters.get(record['kind'])
+        return formatter(record) if formatter else ''
+    return format_record
+
+
+class ConsoleWriter:
+    """Writes records to a text stream using a formatter function"""
+
+    def __init__(self, formatter, stream=None):
+        self.formatter = formatter
+        self.stream = stream or sys.stdout
+
+    def write(self, records):
+        text = ''.join(self.formatter(record) for record in records)
+        if text:
+            self.stream.write(text)
+            self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class JsonlFileWriter:
+    """Appends records as JSON lines, rotating the file when it grows past max_bytes"""
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        # Binary, so the rotation size counts bytes on disk
+        self._file = open(path, 'ab')
+        self._size = self._file.tell()
+
+    def write(self, records):
+        data = ''.join(
+            json.dumps(record, separators=(',', ':'), default=str) + '\n'
+            for record in records
+        ).encode('utf-8')
+        if self.max_bytes and self._size + len(data) > self.max_bytes and self._size:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'ab')
+        self._size = 0
+
+    def close(self):
+        self._file.close()
+
+
+class LogSink:
+    """Bounded queue of log records drained by a background writer thread
+
+    policy is DROP (discard new records when the queue is full and count
+    them) or BLOCK (wait for room, up to block_timeout seconds if given).
+    """
+
+    def __init__(self, writers, maxsize=10000, policy=DROP, block_timeout=None,
+                 batch_size=256, flush_interval=0.2):
+        self.writers = list(writers)
+        self.write_errors = 0
+        self._worker = BatchWorker(
+            self._write, 'amd-log-writer', maxsize=maxsize, policy=policy,
+            block_timeout=block_timeout, batch_size=batch_size,
+            flush_interval=flush_interval, on_close=self._close_writers,
+        )
+
+    def emit(self, kind, **fields):
+        """Queue one structured record; never raises if the queue is full"""
+        fields['kind'] = kind
+        fields.setdefault('ts', time.time())
+        return self._worker.submit(fields)
+
+    def stats(self):
+        stats = self._worker.stats()
+        stats['write_errors'] = self.write_errors
+        return stats
+
+    def close(self, timeout=5):
+        """Flush pending records and stop the writer thread"""
+        self._worker.close(timeout)
+
+    def _write(self, batch):
+        for writer in self.writers:
+            try:
+                writer.write(batch)
+            except Exception as e:
+                self.write_errors += 1
+                sys.stderr.write(f"amd_server log writer error: {e}\n")
+
+    def _close_writers(self):
+        for writer in self.writers:
+            writer.close()
+
+
+def sink_from_env(console_formatter):
+    """Build a LogSink from AMD_LOG_* environment variables
+
+    AMD_LOG_CONSOLE     1 (default) to print the categorized console view, 0 to disable
+    AMD_LOG_FILE        path of a rotating JSONL log (disabled when unset)
+    AMD_LOG_FILE_MAX_MB rotate the JSONL file at this size (default 50)
+    AMD_LOG_QUEUE_SIZE  maximum queued records (default 10000)
+    AMD_LOG_POLICY      'drop' (default) or 'block' when the queue is full
+    """
+    writers = []
+    if os.getenv('AMD_LOG_CONSOLE', '1') != '0':
+        writers.append(ConsoleWriter(console_formatter))
+    log_file = os.getenv('AMD_LOG_FILE')
+    if log_file:
+        max_bytes = int(float(os.getenv('AMD_LOG_FILE_MAX_MB', '50')) * 1024 * 1024)
+        writers.append(JsonlFileWriter(log_file, max_bytes=max_bytes))
+    return LogSink(
+        writers,
+        maxsize=int(os.getenv('AMD_LOG_QUEUE_SIZE', '10000')),
+        policy=os.getenv('AMD_LOG_POLICY', DROP),
+    )
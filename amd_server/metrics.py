@@ -0,0 +1,308 @@
+# Streaming AMD metrics with a Prometheus text endpoint
+#
+# Every callback updates fixed-bucket histograms and counters labelled by
+# AMD configuration (the AmdConfig tag) and detection mode, so memory stays
+# constant however many calls come in. Each request thread writes to its
+# own shard without taking a lock; a scrape sums the shards. The only lock
+# is taken when a thread creates its shard or a new label set first appears.
+# Servers that start a thread per request (the threaded development server)
+# would leave a shard behind per request, so the shards of threads that have
+# exited are folded into one base shard whenever a new shard is created and
+# on every scrape.
+import bisect
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+# MachineDetectionDuration buckets (seconds); Twilio's timeout tops out at 59s
+DURATION_BUCKETS = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0)
+# Callback arrival lag buckets (seconds); Twilio's Timestamp has 1s resolution
+LAG_BUCKETS = (0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Request stage buckets (seconds), from decode steps of tens of microseconds to stalls
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+UNTAGGED = 'untagged'
+OTHER = 'other'
+UNKNOWN_MODE = 'unknown'
+
+HISTOGRAMS = {
+    'amd_detection_duration_seconds': ('MachineDetectionDuration reported with AMD results', DURATION_BUCKETS),
+    'amd_callback_lag_seconds': ('Arrival time minus the callback Timestamp', LAG_BUCKETS),
+    'amd_request_stage_seconds': ('Time spent in each stage of a request (see amd_server.timing)', STAGE_BUCKETS),
+}
+# Histograms labelled by config and mode (summarized per config in /status)
+CONFIG_HISTOGRAMS = ('amd_detection_duration_seconds', 'amd_callback_lag_seconds')
+COUNTERS = {
+    'amd_answered_by_total': 'AMD results by AnsweredBy value',
+    'amd_callbacks_total': 'Callbacks received by webhook type',
+}
+
+
+class _Shard:
+    """One thread's metric values: {(name, labels): int} and {(name, labels): [bucket counts, sum]}"""
+
+    __slots__ = ('counters', 'histograms', 'stages')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.stages = {}   # endpoint -> {stage: stage histogram in self.histograms}
+
+    def merge(self, other):
+        """Add the values of `other` to this shard"""
+        counters = self.counters
+        for key, value in list(other.counters.items()):
+            counters[key] = counters.get(key, 0) + value
+        histograms = self.histograms
+        for key, values in list(other.histograms.items()):
+            total = histograms.get(key)
+            if total is None:
+                histograms[key] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    total[i] += value
+
+
+class Metrics:
+    """Per-config / per-mode AMD aggregates, updated lock-free from request threads
+
+    At most max_configs distinct AmdConfig values get their own labels;
+    later ones are counted under 'other' so label cardinality stays bounded.
+    """
+
+    def __init__(self, max_configs=100):
+        self.max_configs = max_configs
+        self.started = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []       # (owning thread, shard)
+        self._base = _Shard()   # values of threads that have exited
+        self._configs = set()
+        self._collectors = []
+
+    def add_collector(self, collect):
+        """Include collect() -> [(name, type, help, value)] samples in every scrape"""
+        self._collectors.append(collect)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._fold_exited()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_exited(self):
+        # Called with the lock held; a thread that has exited no longer writes to its shard
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._base.merge(shard)
+        self._shards = live
+
+    def shard_count(self):
+        """Shards currently held (one per live writer thread, plus the base)"""
+        with self._lock:
+            return len(self._shards) + 1
+
+    def _config_label(self, config_key):
+        if not config_key:
+            return UNTAGGED
+        if config_key in self._configs:
+            return config_key
+        with self._lock:
+            if len(self._configs) < self.max_configs:
+                self._configs.add(config_key)
+                return config_key
+        return OTHER
+
+    def _count(self, shard, name, labels):
+        key = (name, labels)
+        shard.counters[key] = shard.counters.get(key, 0) + 1
+
+    def _observe(self, shard, name, labels, value):
+        key = (name, labels)
+        values = shard.histograms.get(key)
+        if values is None:
+            buckets = HISTOGRAMS[name][1]
+            values = shard.histograms[key] = [0] * (len(buckets) + 2)  # buckets, +Inf, sum
+        values[bisect.bisect_left(HISTOGRAMS[name][1], value)] += 1
+        values[-1] += value
+
+    def observe(self, event, received_at=None):
+        """Record one decoded WebhookEvent"""
+        shard = self._shard()
+        params = event.params
+        config = self._config_label(event.config_key)
+        mode = event.detection_mode or UNKNOWN_MODE
+        self._count(shard, 'amd_callbacks_total', (('type', event.webhook_type),))
+
+        answered_by = event.answered_by
+        if answered_by:
+            labels = (('config', config), ('mode', mode))
+            self._count(shard, 'amd_answered_by_total', labels + (('answered_by', answered_by),))
+            duration = params.get('MachineDetectionDuration')
+            if duration:
+                try:
+                    self._observe(shard, 'amd_detection_duration_seconds', labels, int(duration) / 1000)
+                except ValueError:
+                    pass
+
+        stamp = params.get('Timestamp')
+        if stamp:
+            parsed = parsedate_tz(stamp)
+            if parsed is not None:
+                now = received_at if received_at is not None else time.time()
+                lag = max(0.0, now - mktime_tz(parsed))
+                self._observe(shard, 'amd_callback_lag_seconds', (('config', config), ('mode', mode)), lag)
+
+    def observe_stages(self, endpoint, stages):
+        """Record one request's [(stage, seconds)] under the endpoint's name"""
+        # _observe() inlined: this runs for every request with timing on
+        shard = self._shard()
+        by_stage = shard.stages.get(endpoint)
+        if by_stage is None:
+            by_stage = shard.stages[endpoint] = {}
+        for stage, seconds in stages:
+            values = by_stage.get(stage)
+            if values is None:
+                key = ('amd_request_stage_seconds', (('endpoint', endpoint), ('stage', stage)))
+                values = by_stage[stage] = shard.histograms.setdefault(key, [0] * (len(STAGE_BUCKETS) + 2))
+            values[bisect.bisect_left(STAGE_BUCKETS, seconds)] += 1
+            values[-1] += seconds
+
+    def snapshot(self):
+        """Summed ({key: count}, {key: [bucket counts, sum]}) across all shards"""
+        total = _Shard()
+        # Held throughout, so a shard is never counted both on its own and in the base
+        with self._lock:
+            self._fold_exited()
+            total.merge(self._base)
+            for _, shard in self._shards:
+                total.merge(shard)
+        return total.counters, total.histograms
+
+    def render_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        counters, histograms = self.snapshot()
+        lines = []
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), values[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(values[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        for collect in self._collectors:
+            for name, kind, help_text, value in collect():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """JSON-friendly per config/mode summary for /status"""
+        counters, histograms = self.snapshot()
+        groups = {}
+
+        def group(labels):
+            labels = dict(labels)
+            key = f"{labels['config']}/{labels['mode']}"
+            return groups.setdefault(key, {'config': labels['config'], 'mode': labels['mode'],
+                                           'results': 0, 'answered_by': {}})
+
+        for (name, labels), value in counters.items():
+            if name == 'amd_answered_by_total':
+                entry = group(labels[:2])
+                entry['results'] += value
+                entry['answered_by'][labels[2][1]] = value
+        for (name, labels), values in histograms.items():
+            if name not in CONFIG_HISTOGRAMS:
+                continue
+            entry = group(labels)
+            count = sum(values[:-1])
+            prefix = 'detection' if name == 'amd_detection_duration_seconds' else 'lag'
+            buckets = HISTOGRAMS[name][1]
+            entry[f'{prefix}_count'] = count
+            entry[f'{prefix}_mean_s'] = round(values[-1] / count, 3) if count else None
+            entry[f'{prefix}_p50_s'] = bucket_quantile(buckets, values, 0.50)
+            entry[f'{prefix}_p90_s'] = bucket_quantile(buckets, values, 0.90)
+        callbacks = {dict(labels)['type']: value for (name, labels), value in counters.items()
+                     if name == 'amd_callbacks_total'}
+        return {
+            'uptime_s': round(time.time() - self.started, 1),
+            'callbacks': callbacks,
+            'configs': [groups[key] for key in sorted(groups)],
+        }
+
+    def stage_summary(self):
+        """{endpoint: {stage: count, mean and quantiles in ms}} for /status"""
+        _, histograms = self.snapshot()
+        buckets_ms = [bound * 1000 for bound in STAGE_BUCKETS]
+        endpoints = {}
+        for (name, labels), values in sorted(histograms.items()):
+            if name != 'amd_request_stage_seconds':
+                continue
+            labels = dict(labels)
+            count = sum(values[:-1])
+            endpoints.setdefault(labels['endpoint'], {})[labels['stage']] = {
+                'count': count,
+                'mean_ms': round(values[-1] * 1000 / count, 3) if count else None,
+                'p50_ms': bucket_quantile(buckets_ms, values, 0.50),
+                'p90_ms': bucket_quantile(buckets_ms, values, 0.90),
+                'p99_ms': bucket_quantile(buckets_ms, values, 0.99),
+            }
+        return endpoints
+
+
+def bucket_quantile(buckets, values, q):
+    """Quantile estimate from bucket counts, interpolating linearly inside the bucket"""
+    counts = values[:-1]
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    lower = 0.0
+    for bound, count in zip(buckets, counts):
+        if count and seen + count >= rank:
+            return round(lower + (bound - lower) * (rank - seen) / count, 3)
+        seen += count
+        lower = bound
+    return buckets[-1]
+
+
+def _number(value):
+    return value if isinstance(value, str) else repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def flask_metrics_response(metrics):
+    """Flask response for GET /metrics"""
+    from flask import Response
+
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
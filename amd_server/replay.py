@@ -0,0 +1,297 @@
+# Replay of captured requests against a server instance
+#
+# A capture (see amd_server.capture) is read lazily in arrival order and
+# sent to a target: a base URL over keep-alive HTTP connections, or a Flask
+# app in-process. speed=1 keeps the original gaps between requests, speed=N
+# divides them by N, and speed=0 sends as fast as `concurrency` workers
+# can. The calling thread releases each request at its due time into a
+# small queue feeding the workers, so a slow target shows up as dispatch
+# lag (how late requests were sent) rather than as a silently stretched
+# timeline.
+#
+# Each response is compared with the one the capturing server gave. Status
+# codes are always compared; bodies are compared except for endpoints whose
+# answers change from call to call (status pages, metrics, call records).
+# The report has the latency distribution per path next to the captured
+# one, the dispatch lag and the differences with a few examples.
+import difflib
+import http.client
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .capture import MAX_RESPONSE_BYTES, read_capture
+
+# Paths (prefixes when ending in '/') whose bodies hold timestamps, counters or live state
+VOLATILE_PATHS = ('/status', '/metrics', '/geo', '/calls/')
+# Captured headers that describe the original connection rather than the request
+HOP_HEADERS = ('Host', 'Content-Length', 'Connection', 'Keep-Alive', 'Transfer-Encoding')
+
+
+class HttpTarget:
+    """Sends captured requests to base_url with one keep-alive connection per thread"""
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or 'http'
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def send(self, request):
+        """(status, body bytes) of the target's answer"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.netloc, timeout=self.timeout)
+        headers = {name: value for name, value in request.headers if name not in HOP_HEADERS}
+        try:
+            conn.request(request.method, self.prefix + request.url, body=request.body or None, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            if response.will_close:
+                conn.close()
+                self._local.conn = None
+            return response.status, data
+        except Exception:
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+class FlaskTarget:
+    """Sends captured requests to a Flask app's test client (no sockets)"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, request):
+        client = self._local.__dict__.get('client')
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        headers = [(name, value) for name, value in request.headers if name not in HOP_HEADERS]
+        response = client.open(request.path, method=request.method, query_string=request.query,
+                               data=request.body, headers=headers)
+        return response.status_code, response.get_data()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _distribution(values):
+    """Count and mean/p50/p90/p99/max in milliseconds"""
+    values = sorted(values)
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'count': len(values),
+        'mean_ms': ms(sum(values) / len(values)) if values else None,
+        'p50_ms': ms(percentile(values, 50)),
+        'p90_ms': ms(percentile(values, 90)),
+        'p99_ms': ms(percentile(values, 99)),
+        'max_ms': ms(values[-1]) if values else None,
+    }
+
+
+class _PathStats:
+    __slots__ = ('latencies', 'captured', 'errors', 'status_diffs', 'body_diffs')
+
+    def __init__(self):
+        self.latencies = []
+        self.captured = []
+        self.errors = 0
+        self.status_diffs = 0
+        self.body_diffs = 0
+
+
+class Replayer:
+    """Replays a capture against a target (HttpTarget, FlaskTarget or anything with send(request))
+
+    speed: 1 for the original timing, N for N times faster, 0 for as fast as possible.
+    """
+
+    def __init__(self, target, speed=1.0, concurrency=8, volatile=VOLATILE_PATHS, max_examples=5):
+        if speed < 0:
+            raise ValueError("speed must be >= 0 (0 sends as fast as possible)")
+        self.target = target
+        self.speed = speed
+        self.concurrency = concurrency
+        self.volatile = tuple(volatile)
+        self.max_examples = max_examples
+
+    def _compare_body(self, path):
+        # Entries ending in '/' are prefixes, the others exact paths
+        return not any(path == entry or (entry.endswith('/') and path.startswith(entry))
+                       for entry in self.volatile)
+
+    def run(self, requests, limit=None):
+        """Replay an iterable of CapturedRequests (e.g. read_capture(paths)); returns the report dict"""
+        backlog = queue.Queue(self.concurrency * 2)
+        lock = threading.Lock()
+        paths = {}
+        lags = []
+        examples = []
+
+        def worker():
+            local_lags = []
+            while True:
+                item = backlog.get()
+                if item is None:
+                    break
+                due, request = item
+                sent = time.perf_counter()
+                if due is not None:
+                    local_lags.append(max(0.0, sent - due))
+                error = None
+                try:
+                    status, body = self.target.send(request)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                latency = time.perf_counter() - sent
+                with lock:
+                    stats = paths.get(request.path)
+                    if stats is None:
+                        stats = paths[request.path] = _PathStats()
+                    if request.duration is not None:
+                        stats.captured.append(request.duration)
+                    if error is not None:
+                        stats.errors += 1
+                        if len(examples) < self.max_examples:
+                            examples.append({'method': request.method, 'url': request.url, 'error': error})
+                        continue
+                    stats.latencies.append(latency)
+                    self._diff(request, status, body, stats, examples)
+            with lock:
+                lags.extend(local_lags)
+
+        threads = [threading.Thread(target=worker, name=f'amd-replay-{n}', daemon=True)
+                   for n in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        first = None
+        sent = 0
+        try:
+            for request in requests:
+                if limit is not None and sent >= limit:
+                    break
+                due = None
+                if self.speed:
+                    if first is None:
+                        first = request.received_at
+                    due = start + (request.received_at - first) / self.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                backlog.put((due, request))
+                sent += 1
+        finally:
+            for _ in threads:
+                backlog.put(None)
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - start
+        return self._report(paths, lags, examples, sent, elapsed)
+
+    def _diff(self, request, status, body, stats, examples):
+        # Called with the replay lock held
+        if request.status is not None and status != request.status:
+            stats.status_diffs += 1
+            if len(examples) < self.max_examples:
+                examples.append({'method': request.method, 'url': request.url,
+                                 'status': {'captured': request.status, 'replayed': status}})
+            return
+        if request.response is None or not self._compare_body(request.path):
+            return
+        replayed = body[:MAX_RESPONSE_BYTES].decode('utf-8', 'replace')
+        if replayed != request.response:
+            stats.body_diffs += 1
+            if len(examples) < self.max_examples:
+                diff = difflib.unified_diff(request.response.splitlines(), replayed.splitlines(),
+                                            'captured', 'replayed', lineterm='', n=1)
+                examples.append({'method': request.method, 'url': request.url, 'diff': '\n'.join(list(diff)[:40])})
+
+    def _report(self, paths, lags, examples, sent, elapsed):
+        every, every_captured = [], []
+        by_path = {}
+        totals = {'errors': 0, 'status_diffs': 0, 'body_diffs': 0}
+        for path in sorted(paths):
+            stats = paths[path]
+            every.extend(stats.latencies)
+            every_captured.extend(stats.captured)
+            by_path[path] = {'latency': _distribution(stats.latencies), 'captured': _distribution(stats.captured),
+                             'errors': stats.errors, 'status_diffs': stats.status_diffs,
+                             'body_diffs': stats.body_diffs}
+            for key in totals:
+                totals[key] += by_path[path][key]
+        report = {
+            'requests': sent,
+            'speed': self.speed,
+            'concurrency': self.concurrency,
+            'elapsed_s': round(elapsed, 3),
+            'rps': round(sent / elapsed, 1) if elapsed else None,
+            'latency': _distribution(every),
+            'captured': _distribution(every_captured),
+            'dispatch_lag': _distribution(lags),
+            'paths': by_path,
+            'examples': examples,
+        }
+        report.update(totals)
+        return report
+
+
+def print_report(report):
+    """Latency per path next to the captured figures, dispatch lag and differences"""
+    speed = 'as fast as possible' if not report['speed'] else f"{report['speed']:g}x"
+    print(f"Replayed {report['requests']} requests in {report['elapsed_s']}s ({report['rps']} req/s, "
+          f"{speed}, {report['concurrency']} in flight)\n")
+    print(f"{'Path':<24} {'Count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+          f"   {'captured p50/p99':>17}  Errors  Diffs")
+    print("-" * 112)
+    rows = list(report['paths'].items()) + [('all', {'latency': report['latency'], 'captured': report['captured'],
+                                                     'errors': report['errors'],
+                                                     'status_diffs': report['status_diffs'],
+                                                     'body_diffs': report['body_diffs']})]
+    for path, entry in rows:
+        latency, captured = entry['latency'], entry['captured']
+
+        def fmt(value):
+            return f"{value:>9.3f}" if value is not None else f"{'-':>9}"
+
+        captured_text = (f"{captured['p50_ms']:.3f}/{captured['p99_ms']:.3f}" if captured['count'] else '-')
+        print(f"{path:<24} {latency['count']:>7} {fmt(latency['p50_ms'])} {fmt(latency['p90_ms'])} "
+              f"{fmt(latency['p99_ms'])} {fmt(latency['max_ms'])}   {captured_text:>17}  {entry['errors']:>6}  "
+              f"{entry['status_diffs'] + entry['body_diffs']:>5}")
+    lag = report['dispatch_lag']
+    if lag['count']:
+        print(f"\nDispatch lag behind the capture's timeline: p50 {lag['p50_ms']} ms, p99 {lag['p99_ms']} ms, "
+              f"max {lag['max_ms']} ms")
+    if report['examples']:
+        print(f"\nDifferences and errors ({len(report['examples'])} shown):")
+        for example in report['examples']:
+            print(f"  {example['method']} {example['url'][:90]}")
+            if 'error' in example:
+                print(f"    error: {example['error']}")
+            elif 'status' in example:
+                print(f"    status {example['status']['captured']} -> {example['status']['replayed']}")
+            else:
+                for line in example['diff'].splitlines():
+                    print(f"    {line}")
+
+
+def replay(paths, target, speed=1.0, concurrency=8, limit=None, path_prefix=None, **kwargs):
+    """Replay the capture files (or directories) `paths` against target; returns the report"""
+    requests = read_capture(paths)
+    if path_prefix:
+        prefixes = (path_prefix,) if isinstance(path_prefix, str) else tuple(path_prefix)
+        requests = (request for request in requests if request.path.startswith(prefixes))
+    return Replayer(target, speed, concurrency, **kwargs).run(requests, limit)
@@ -0,0 +1,333 @@
+# Offline AMD parameter screening (NumPy)
+#
+# Every live test call shows how one parameter set behaves on one greeting.
+# Here the AMD rules of simulator.amd_decision are applied to many
+# speech/silence timelines and a whole grid of parameter sets at once: the
+# timelines are padded to a common length and walked segment by segment,
+# with the detector state of every (timeline, parameter set) pair held in
+# 2-D arrays and updated by masks. Screening tens of thousands of
+# combinations takes seconds, and only the shortlist needs live calls
+# (ParameterSearch(include=...) or AMD_CONFIGURATIONS).
+import wave
+
+import numpy as np
+
+from .search import PARAM_BOUNDS
+from .simulator import BEEP, EXPECTED_OUTCOMES, SILENCE, SPEECH, load_scenarios
+
+MODES = ('Enable', 'DetectMessageEnd')
+
+# Grid spacing used instead of each parameter's live-search step, so the
+# default grid stays around 65k parameter sets
+SCREEN_STEPS = {
+    'machine_detection_timeout': 10,
+    'machine_detection_speech_threshold': 200,
+    'machine_detection_speech_end_threshold': 200,
+    'machine_detection_silence_timeout': 1000,
+}
+
+# AnsweredBy codes of evaluate()
+ANSWERED_BY = ('machine_start', 'machine_end_beep', 'machine_end_silence', 'machine_end_other', 'human', 'unknown')
+MACHINE_START, END_BEEP, END_SILENCE, END_OTHER, HUMAN, UNKNOWN = range(len(ANSWERED_BY))
+# Normalized outcome of each code (see webhook.normalize_outcome)
+CODE_OUTCOMES = np.array(['machine'] * 4 + ['human', 'unknown'])
+
+_KIND_CODES = {SPEECH: 0, SILENCE: 1, BEEP: 2}
+
+
+def parameter_grid(bounds=PARAM_BOUNDS, steps=SCREEN_STEPS, modes=MODES):
+    """Every combination of the bounded parameters (and detection modes) as flat arrays
+
+    Returns {parameter name: array}, including 'machine_detection'.
+    """
+    names = list(bounds)
+    axes = [np.arange(low, high + 1, (steps or {}).get(name, step)) for name, (low, high, step) in bounds.items()]
+    axes.append(np.arange(len(modes)))
+    mesh = np.meshgrid(*axes, indexing='ij')
+    grid = {name: values.ravel() for name, values in zip(names, mesh)}
+    grid['machine_detection'] = np.asarray(modes)[mesh[-1].ravel()]
+    return grid
+
+
+def pack_timelines(timelines):
+    """(kinds int8 [T, S], durations float64 [T, S]) padded with zero-length silence
+
+    A zero-length silence never changes the detector's state, so padding
+    lets timelines of different lengths be walked together.
+    """
+    width = max((len(timeline) for timeline in timelines), default=0)
+    kinds = np.full((len(timelines), width), _KIND_CODES[SILENCE], dtype=np.int8)
+    durations = np.zeros((len(timelines), width), dtype=np.float64)
+    for i, timeline in enumerate(timelines):
+        for j, (kind, duration) in enumerate(timeline):
+            kinds[i, j] = _KIND_CODES[kind]
+            durations[i, j] = duration
+    return kinds, durations
+
+
+def jitter_timelines(packed, copies=20, jitter=0.1, seed=0):
+    """`copies` variants of every packed timeline, each segment scaled by up to +/- jitter
+
+    Variants of timeline i are rows i * copies ... (i + 1) * copies - 1.
+    """
+    kinds, durations = packed
+    rng = np.random.default_rng(seed)
+    kinds = np.repeat(kinds, copies, axis=0)
+    durations = np.repeat(durations, copies, axis=0)
+    scaled = np.maximum(1, np.round(durations * rng.uniform(1 - jitter, 1 + jitter, durations.shape)))
+    return kinds, np.where(durations > 0, scaled, 0.0)
+
+
+def timeline_from_wav(path, frame_ms=20, threshold_db=-40.0, min_speech_ms=200, min_silence_ms=300):
+    """Speech/silence timeline of a 16-bit PCM WAV recording by frame energy
+
+    Frames louder than threshold_db (dBFS) are speech. Speech runs shorter
+    than min_speech_ms and silences shorter than min_silence_ms are merged
+    into their surroundings. Beeps are not told apart from speech.
+    """
+    with wave.open(path, 'rb') as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit PCM WAV files are supported")
+        rate, channels = f.getframerate(), f.getnchannels()
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2').astype(np.float64)
+    samples = samples.reshape(-1, channels).mean(axis=1) / 32768.0
+    size = max(1, int(rate * frame_ms / 1000))
+    frames = samples[:len(samples) // size * size].reshape(-1, size)
+    level = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+    loud = level > threshold_db
+
+    # Run-length encode, then absorb runs below the minimum length
+    edges = np.flatnonzero(np.diff(loud.astype(np.int8))) + 1
+    starts = np.concatenate([[0], edges])
+    lengths = np.diff(np.concatenate([starts, [len(loud)]])) * frame_ms
+    timeline = []
+    for start, length in zip(starts, lengths):
+        kind = SPEECH if loud[start] else SILENCE
+        if timeline and (length < (min_speech_ms if kind == SPEECH else min_silence_ms) or timeline[-1][0] == kind):
+            timeline[-1] = (timeline[-1][0], timeline[-1][1] + int(length))
+        else:
+            timeline.append((kind, int(length)))
+    return timeline
+
+
+def evaluate(packed, params, chunk=20000):
+    """(AnsweredBy codes int8 [T, P], MachineDetectionDuration ms int32 [T, P])
+
+    packed is pack_timelines() output; params holds equal-length arrays for
+    every PARAM_BOUNDS name plus 'machine_detection'. Matches
+    simulator.amd_decision for every pair; parameter sets are processed
+    `chunk` at a time to bound memory.
+    """
+    kinds, durations = packed
+    total = len(params['machine_detection'])
+    codes = np.empty((len(kinds), total), dtype=np.int8)
+    ms = np.empty((len(kinds), total), dtype=np.int32)
+    for start in range(0, total, chunk):
+        part = {name: np.asarray(values[start:start + chunk]) for name, values in params.items()}
+        codes[:, start:start + chunk], ms[:, start:start + chunk] = _evaluate_chunk(kinds, durations, part)
+    return codes, ms
+
+
+def _evaluate_chunk(kinds, durations, params):
+    shape = (len(kinds), len(params['machine_detection']))
+    timeout_ms = params['machine_detection_timeout'][None, :] * 1000.0
+    speech_threshold = params['machine_detection_speech_threshold'][None, :].astype(np.float64)
+    speech_end = params['machine_detection_speech_end_threshold'][None, :].astype(np.float64)
+    silence_timeout = params['machine_detection_silence_timeout'][None, :].astype(np.float64)
+    message_end = (params['machine_detection'] == 'DetectMessageEnd')[None, :]
+
+    code = np.full(shape, UNKNOWN, dtype=np.int8)
+    at = np.zeros(shape)
+    decided = np.zeros(shape, dtype=bool)
+    stopped = np.zeros(shape, dtype=bool)
+    stop_at = np.zeros(shape)
+    stop_heard = np.zeros(shape, dtype=bool)
+    speech_run = np.zeros(shape)    # speech in the current utterance (short pauses included)
+    silence_run = np.zeros(shape)   # silence since the last speech
+    machine_at = np.full(shape, np.nan)
+    now = np.zeros((len(kinds), 1))
+    heard = np.zeros((len(kinds), 1), dtype=bool)
+
+    def decide(mask, answered_by, when):
+        code[mask] = answered_by
+        at[mask] = np.broadcast_to(when, shape)[mask]
+        decided[mask] = True
+
+    for i in range(kinds.shape[1]):
+        kind = kinds[:, i:i + 1]
+        d = durations[:, i:i + 1]
+        end = now + d
+        active = ~(decided | stopped)
+        if not active.any():
+            break
+        no_machine = np.isnan(machine_at)
+
+        speech = active & (kind == 0)
+        if speech.any():
+            speech_run = np.where(speech, speech_run + silence_run, speech_run)
+            silence_run = np.where(speech, 0.0, silence_run)
+            trigger = speech & no_machine & (speech_run + d >= speech_threshold)
+            machine_at = np.where(trigger, now + (speech_threshold - speech_run), machine_at)
+            decide(trigger & ~message_end, MACHINE_START, machine_at)
+            speech_run = np.where(speech, speech_run + d, speech_run)
+
+        beep = active & (kind == 2)
+        if beep.any():
+            # A beep after a greeting ends the message; straight after pickup it is a machine
+            after = beep & (~no_machine | heard)
+            decide(after, END_BEEP, end)
+            decide(beep & ~after & ~message_end, MACHINE_START, end)
+            decide(beep & ~after & message_end, END_BEEP, end)
+
+        silence = active & (kind == 1)
+        if silence.any():
+            decide(silence & ~heard & (end >= silence_timeout), UNKNOWN, silence_timeout)
+            talking = silence & heard
+            trigger = talking & (silence_run + d >= speech_end)
+            when = now + (speech_end - silence_run)
+            decide(trigger & ~no_machine, END_SILENCE, when)
+            decide(trigger & no_machine, HUMAN, when)
+            silence_run = np.where(talking & ~trigger, silence_run + d, silence_run)
+
+        heard = heard | (kind == 0)
+        now = end
+        # amd_decision stops listening once the timeout has passed
+        newly = ~(decided | stopped) & (now >= timeout_ms)
+        if newly.any():
+            stop_at[newly] = np.broadcast_to(now, shape)[newly]
+            stop_heard[newly] = np.broadcast_to(heard, shape)[newly]
+            stopped |= newly
+
+    # Still undecided when the timeline ended (or the timeout passed)
+    rest = ~decided
+    final_at = np.where(stopped, stop_at, now)
+    final_heard = np.where(stopped, stop_heard, heard)
+    code[rest & ~np.isnan(machine_at)] = END_OTHER
+    code[rest & np.isnan(machine_at) & final_heard] = HUMAN
+    code[rest & np.isnan(machine_at) & ~final_heard] = UNKNOWN
+    at[rest] = final_at[rest]
+
+    late = at > timeout_ms
+    code[late] = UNKNOWN
+    at = np.where(late, timeout_ms, at)
+    return code, at.astype(np.int32)
+
+
+class ScreenResult:
+    """Per parameter set accuracy, unknown rate and median decision time over all timelines"""
+
+    def __init__(self, params, codes, ms, expected, latency_weight=0.01):
+        self.params = params
+        self.codes = codes
+        self.ms = ms
+        self.expected = np.asarray(expected)
+        outcomes = CODE_OUTCOMES[codes]
+        self.correct = outcomes == self.expected[:, None]
+        self.accuracy = self.correct.mean(axis=0)
+        self.unknown_rate = (codes == UNKNOWN).mean(axis=0)
+        # As Candidate.latency_ms: median time to decision, unknowns at the full timeout
+        self.latency_ms = np.median(ms, axis=0)
+        self.latency_weight = latency_weight
+        self.score = self.accuracy - latency_weight * self.latency_ms / 1000
+        self._distinct = None
+
+    def __len__(self):
+        return len(self.accuracy)
+
+    def distinct(self):
+        """One index per distinct behaviour (same decision and time on every timeline)
+
+        Parameters that never come into play on the timelines (a silence
+        timeout longer than any initial silence, say) produce many sets that
+        behave identically; the first in grid order stands for each group.
+        """
+        if self._distinct is None:
+            rows = np.ascontiguousarray(np.vstack([self.codes.astype(np.int32), self.ms]).T)
+            keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+            self._distinct = np.sort(np.unique(keys, return_index=True)[1])
+        return self._distinct
+
+    def ranked(self, n=10, distinct=True):
+        """Indices of the n best scores (ties go to the faster set), one per behaviour by default"""
+        candidates = self.distinct() if distinct else np.arange(len(self))
+        order = np.lexsort((self.latency_ms[candidates], -self.score[candidates]))
+        return candidates[order[:n]]
+
+    def pareto_front(self):
+        """Indices not beaten on both accuracy and median latency, fastest first"""
+        order = np.lexsort((-self.accuracy, self.latency_ms))
+        accuracy = self.accuracy[order]
+        best_before = np.concatenate([[-np.inf], np.maximum.accumulate(accuracy)[:-1]])
+        return order[accuracy > best_before]
+
+    def point(self, i):
+        """Parameter set i as calls.create keyword arguments"""
+        point = {name: values[i].item() for name, values in self.params.items() if name != 'machine_detection'}
+        point['machine_detection'] = str(self.params['machine_detection'][i])
+        return point
+
+    def configuration(self, i, base_params=None):
+        """AMD_CONFIGURATIONS-style entry for parameter set i"""
+        point = self.point(i)
+        text = ", ".join(f"{k.replace('machine_detection_', '')}={v}" for k, v in point.items()
+                         if k != 'machine_detection')
+        return {'name': f"Screened {point['machine_detection']} #{i}",
+                'description': f"{text} (offline accuracy {self.accuracy[i]:.0%})",
+                'params': {**(base_params or {}), **point}}
+
+    def shortlist(self, n=5):
+        """Search points (without the mode) for ParameterSearch(include=...)"""
+        points = []
+        for i in self.ranked(n):
+            point = self.point(i)
+            point.pop('machine_detection')
+            points.append(point)
+        return points
+
+    def print_report(self, n=10, labels=None):
+        """Top n parameter sets, with per-timeline-group accuracy when labels are given"""
+        groups = sorted(set(labels)) if labels is not None else []
+        labels = np.asarray(labels) if labels is not None else None
+        print(f"{len(self)} parameter sets ({len(self.distinct())} distinct behaviours) x "
+              f"{len(self.expected)} timelines")
+        header = f"{'#':>6} {'Mode':<16} {'Tmo':>3} {'Speech':>6} {'End':>5} {'Silence':>7} " \
+                 f"{'Acc':>5} {'Unk':>5} {'p50 ms':>7} {'Score':>6}"
+        print(header + ''.join(f" {g[:10]:>10}" for g in groups))
+        print("-" * (len(header) + 11 * len(groups)))
+        front = set(self.pareto_front().tolist())
+        for i in self.ranked(n):
+            p = self.point(i)
+            line = (f"{i:>6} {p['machine_detection']:<16} {p['machine_detection_timeout']:>3} "
+                    f"{p['machine_detection_speech_threshold']:>6} {p['machine_detection_speech_end_threshold']:>5} "
+                    f"{p['machine_detection_silence_timeout']:>7} {self.accuracy[i]:>5.0%} "
+                    f"{self.unknown_rate[i]:>5.0%} {self.latency_ms[i]:>7.0f} {self.score[i]:>6.3f}")
+            for g in groups:
+                line += f" {self.correct[labels == g, i].mean():>10.0%}"
+            print(line + ('  *' if i in front else ''))
+        print("* on the accuracy / latency Pareto front")
+
+
+def screen(timelines=None, expected=None, params=None, copies=20, jitter=0.1, seed=0,
+           latency_weight=0.01, chunk=20000):
+    """Evaluate a parameter grid over timelines; returns (ScreenResult, timeline labels)
+
+    timelines maps a name to a timeline (default: the Studio simulator
+    scenarios) and expected maps the same names to the outcome AMD should
+    report (default: simulator.EXPECTED_OUTCOMES). Each timeline is
+    evaluated in `copies` jittered variants.
+    """
+    timelines = timelines or load_scenarios()
+    expected = expected or EXPECTED_OUTCOMES
+    missing = [name for name in timelines if name not in expected]
+    if missing:
+        raise ValueError(f"No expected outcome for timeline(s): {', '.join(missing)}")
+    names = list(timelines)
+    packed = pack_timelines([timelines[name] for name in names])
+    if copies > 1:
+        packed = jitter_timelines(packed, copies, jitter, seed)
+    else:
+        copies = 1
+    labels = np.repeat(names, copies)
+    params = params if params is not None else parameter_grid()
+    codes, ms = evaluate(packed, params, chunk)
+    return ScreenResult(params, codes, ms, [expected[name] for name in labels], latency_weight), labels
@@ -0,0 +1,252 @@
+# Adaptive AMD parameter search (successive halving)
+#
+# Candidates are sampled inside the documented AMD parameter bounds and
+# called against a scenario with a known answer (e.g. the simulator's
+# voicemail greeting -> 'machine'). Each rung gives every surviving
+# candidate eta times more trials than the last and keeps the best 1/eta,
+# so most of the call budget goes to promising regions. All state is a JSON
+# file rewritten after every trial, so an interrupted search resumes where
+# it stopped.
+import json
+import math
+import os
+import random
+import statistics
+
+from .batch import BatchRunner
+from .webhook import normalize_outcome
+
+# Parameter -> (low, high, step), from the README's AMD Parameter Reference
+PARAM_BOUNDS = {
+    'machine_detection_timeout': (3, 59, 1),
+    'machine_detection_speech_threshold': (1000, 6000, 100),
+    'machine_detection_speech_end_threshold': (500, 5000, 100),
+    'machine_detection_silence_timeout': (2000, 10000, 100),
+}
+
+STATE_VERSION = 1
+
+
+def sample_params(rng, bounds=PARAM_BOUNDS):
+    """One random point inside bounds, snapped to each parameter's step"""
+    params = {}
+    for name, (low, high, step) in bounds.items():
+        params[name] = low + step * rng.randint(0, (high - low) // step)
+    return params
+
+
+class Candidate:
+    """One parameter set and the outcomes observed for it so far"""
+
+    __slots__ = ('key', 'params', 'outcomes', 'errors', 'eliminated_at')
+
+    def __init__(self, key, params, outcomes=None, errors=0, eliminated_at=None):
+        self.key = key
+        self.params = params
+        self.outcomes = outcomes if outcomes is not None else []  # [answered_by, detection_ms]
+        self.errors = errors
+        self.eliminated_at = eliminated_at
+
+    @property
+    def trials(self):
+        return len(self.outcomes)
+
+    def accuracy(self, expected):
+        if not self.outcomes:
+            return 0.0
+        hits = sum(1 for answered_by, _ in self.outcomes if normalize_outcome(answered_by) == expected)
+        return hits / len(self.outcomes)
+
+    def latency_ms(self):
+        """Median time-to-decision; calls without a decision count as the full timeout"""
+        if not self.outcomes:
+            return None
+        timeout_ms = self.params['machine_detection_timeout'] * 1000
+        return statistics.median(ms if ms is not None else timeout_ms for _, ms in self.outcomes)
+
+    def score(self, expected, latency_weight):
+        """Accuracy minus latency_weight per second of median detection time"""
+        latency = self.latency_ms()
+        return self.accuracy(expected) - latency_weight * (latency or 0) / 1000
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ParameterSearch:
+    """Resumable successive-halving search over AMD detection parameters
+
+    `expected` is the outcome the test scenario should produce ('machine',
+    'human' or 'fax'). If `state_path` already exists the stored search is
+    resumed and the sampling arguments are ignored.
+    """
+
+    def __init__(self, state_path, expected='machine', candidates=16, eta=2, min_trials=2,
+                 max_rungs=None, latency_weight=0.01, bounds=PARAM_BOUNDS, base_params=None,
+                 include=(), seed=None):
+        self.state_path = state_path
+        if os.path.exists(state_path):
+            self._load()
+            return
+        if expected not in ('machine', 'human', 'fax'):
+            raise ValueError(f"expected must be machine, human or fax, not {expected!r}")
+        rng = random.Random(seed)
+        points = [dict(params) for params in include]
+        while len(points) < candidates:
+            points.append(sample_params(rng, bounds))
+        width = len(str(len(points)))
+        self.candidates = [Candidate(f"search_{i:0{width}d}", params)
+                           for i, params in enumerate(points, 1)]
+        self.expected = expected
+        self.eta = eta
+        self.min_trials = min_trials
+        self.max_rungs = max_rungs or max(1, math.ceil(math.log(len(points), eta)) + 1)
+        self.latency_weight = latency_weight
+        self.base_params = dict(base_params or {'machine_detection': 'Enable'})
+        self.rung = 0
+        self.save()
+
+    # -- state -----------------------------------------------------------
+
+    def _load(self):
+        with open(self.state_path) as f:
+            state = json.load(f)
+        if state.get('version') != STATE_VERSION:
+            raise ValueError(f"{self.state_path}: unsupported search state version {state.get('version')}")
+        self.expected = state['expected']
+        self.eta = state['eta']
+        self.min_trials = state['min_trials']
+        self.max_rungs = state['max_rungs']
+        self.latency_weight = state['latency_weight']
+        self.base_params = state['base_params']
+        self.rung = state['rung']
+        self.candidates = [Candidate(**c) for c in state['candidates']]
+
+    def save(self):
+        """Write state atomically so a crash never leaves a truncated file"""
+        state = {
+            'version': STATE_VERSION,
+            'expected': self.expected,
+            'eta': self.eta,
+            'min_trials': self.min_trials,
+            'max_rungs': self.max_rungs,
+            'latency_weight': self.latency_weight,
+            'base_params': self.base_params,
+            'rung': self.rung,
+            'candidates': [c.to_dict() for c in self.candidates],
+        }
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp, self.state_path)
+
+    # -- search ----------------------------------------------------------
+
+    @property
+    def survivors(self):
+        return [c for c in self.candidates if c.eliminated_at is None]
+
+    @property
+    def done(self):
+        return self.rung >= self.max_rungs or len(self.survivors) <= 1
+
+    def rung_trials(self, rung=None):
+        """Total trials each survivor should have by the end of a rung"""
+        return self.min_trials * self.eta ** (self.rung if rung is None else rung)
+
+    def configuration(self, candidate):
+        """AMD_CONFIGURATIONS-style entry for a candidate"""
+        params = {**self.base_params, **candidate.params}
+        text = ", ".join(f"{k.replace('machine_detection_', '')}={v}" for k, v in candidate.params.items())
+        return {'name': f"Search {candidate.key}", 'description': text, 'params': params}
+
+    def ranked(self, candidates=None):
+        candidates = self.survivors if candidates is None else candidates
+        return sorted(candidates, key=lambda c: c.score(self.expected, self.latency_weight), reverse=True)
+
+    def step(self, evaluate):
+        """Bring every survivor up to this rung's trial count, then keep the best 1/eta
+
+        evaluate(configurations, trials, first_trial, on_result) must place
+        `trials` calls for each configuration and call on_result(result)
+        with a TrialResult for every call (see batch_evaluator).
+        """
+        target = self.rung_trials()
+        by_candidate = {c.key: c for c in self.candidates}
+
+        def record(result):
+            candidate = by_candidate[result.config_key]
+            if result.error:
+                candidate.errors += 1
+            else:
+                candidate.outcomes.append([result.answered_by, result.detection_ms])
+            self.save()
+
+        # Candidates resumed mid-rung may need fewer trials than the rest
+        groups = {}
+        for candidate in self.survivors:
+            needed = target - candidate.trials
+            if needed > 0:
+                first = candidate.trials + candidate.errors + 1
+                groups.setdefault((needed, first), []).append(candidate)
+        for (needed, first), group in groups.items():
+            configurations = {c.key: self.configuration(c) for c in group}
+            evaluate(configurations, needed, first, record)
+
+        ranked = self.ranked()
+        keep = max(1, math.ceil(len(ranked) / self.eta))
+        for candidate in ranked[keep:]:
+            candidate.eliminated_at = self.rung
+        self.rung += 1
+        self.save()
+        return ranked[:keep]
+
+    def run(self, evaluate, on_rung=None):
+        """Run rungs until one candidate is left or max_rungs is reached"""
+        while not self.done:
+            survivors = self.step(evaluate)
+            if on_rung:
+                on_rung(self, survivors)
+        return self.ranked()
+
+    def pareto_front(self, min_trials=None):
+        """Candidates not beaten on both accuracy and latency, fastest first"""
+        min_trials = self.min_trials if min_trials is None else min_trials
+        points = [(c.accuracy(self.expected), c.latency_ms(), c)
+                  for c in self.candidates if c.trials >= min_trials]
+        front = []
+        for accuracy, latency, candidate in points:
+            dominated = any(
+                a >= accuracy and l <= latency and (a > accuracy or l < latency)
+                for a, l, _ in points
+            )
+            if not dominated:
+                front.append((latency, -accuracy, candidate))
+        return [candidate for _, _, candidate in sorted(front, key=lambda p: p[:2])]
+
+    def print_report(self):
+        print(f"\nSearch for '{self.expected}': rung {self.rung}/{self.max_rungs}, "
+              f"{len(self.survivors)} of {len(self.candidates)} candidates left")
+        print(f"{'Candidate':<12} {'Trials':>6} {'Accuracy':>8} {'Median ms':>9} {'Score':>7}  Parameters")
+        print("-" * 100)
+        front = set(c.key for c in self.pareto_front())
+        for candidate in self.ranked(self.candidates):
+            latency = candidate.latency_ms()
+            marker = '*' if candidate.key in front else ' '
+            latency_text = f"{latency:.0f}" if latency is not None else "-"
+            print(f"{candidate.key:<11}{marker} {candidate.trials:>6} "
+                  f"{candidate.accuracy(self.expected):>8.0%} {latency_text:>9} "
+                  f"{candidate.score(self.expected, self.latency_weight):>7.3f}  "
+                  f"{self.configuration(candidate)['description']}")
+        print("* = on the accuracy / latency Pareto front")
+
+
+def batch_evaluator(client, from_number, to_number, bus=None, **runner_options):
+    """ParameterSearch evaluate() that places calls with a BatchRunner"""
+
+    def evaluate(configurations, trials, first_trial, on_result):
+        runner = BatchRunner(client, configurations, from_number, to_number, bus=bus, **runner_options)
+        runner.run(trials=trials, first_trial=first_trial,
+                   on_result=lambda result, summary: on_result(result))
+
+    return evaluate
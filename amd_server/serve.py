@@ -0,0 +1,59 @@
+# Serving the webhook servers in development or production mode
+#
+# Development mode is the Flask server the scripts have always used (reloader
+# and debugger on). Production mode runs the same app under gunicorn with
+# several worker processes, each serving requests on a thread pool with HTTP
+# keep-alive; SIGTERM stops accepting connections and lets in-flight requests
+# drain for up to --graceful-timeout seconds.
+
+# Server variants built by amd_server.app.create_app (kept here so the CLI
+# can list them without importing Flask)
+VARIANTS = ('advanced', 'manual')
+
+
+def load_app(variant):
+    """A new Flask app for a server variant (see amd_server.app.create_app)"""
+    from .app import create_app
+
+    return create_app(variant)
+
+
+def run_dev(variant, host, port):
+    """Flask development server with reloader and debugger (single process)"""
+    app = load_app(variant)
+    app.run(host=host, port=port, debug=True)
+
+
+def run_production(variant, host, port, workers, threads=8, keepalive=5,
+                   graceful_timeout=30, timeout=30, access_log=None):
+    """Multi-process gunicorn server with threaded workers"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit(
+            "Production mode needs gunicorn (Linux/macOS): pip install gunicorn\n"
+            "Use --dev to run the Flask development server instead."
+        )
+
+    class AmdApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'{host}:{port}',
+                'workers': workers,
+                'worker_class': 'gthread',
+                'threads': threads,
+                'keepalive': keepalive,
+                'graceful_timeout': graceful_timeout,
+                'timeout': timeout,
+                'accesslog': access_log,
+                'proc_name': f'amd_server-{variant}',
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Loaded in each worker after fork (no preload), so every worker
+            # starts its own log/store background threads
+            return load_app(variant)
+
+    AmdApplication().run()
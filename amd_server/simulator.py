@@ -0,0 +1,210 @@
+# Scenario timelines from the Studio answering-machine simulator
+#
+# The Studio flow in "Answering Machine Simulator/studio-flow-example.json"
+# picks one of several branches (recorded greeting, spoken greeting, human)
+# for each incoming call. Here each branch is turned into a timeline of
+# speech / silence / beep segments by walking the flow the way it runs
+# when the caller stays silent, and amd_decision() applies Twilio's
+# documented AMD parameters to a timeline. fake_twilio uses both to
+# answer simulated calls.
+import json
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUDIO_FLOW = os.path.join(ROOT, 'Answering Machine Simulator', 'studio-flow-example.json')
+
+SPEECH = 'speech'
+SILENCE = 'silence'
+BEEP = 'beep'
+
+# Flow states that start a scenario, with the short names used on the command line
+SCENARIOS = {
+    'greeting': 'ContestadoraGravacao',
+    'simple': 'ContestadoraSimples',
+    'human': 'SimulHuman',
+    'beep': 'Copy_of_AM_Beep',
+}
+
+# Scenario -> outcome AMD should report (normalized, see webhook.normalize_outcome)
+EXPECTED_OUTCOMES = {
+    'ContestadoraGravacao': 'machine',
+    'ContestadoraSimples': 'machine',
+    'SimulHuman': 'human',
+    'Copy_of_AM_Beep': 'machine',
+}
+
+# Audio files referenced by the flow have no length in the JSON
+DEFAULT_MEDIA_MS = 6000
+BEEP_MS = 400
+WORD_MS = 350
+MIN_SPEECH_MS = 600
+
+# Event a state emits when the caller stays silent
+SILENT_CALLER_EVENTS = {
+    'say-play': 'audioComplete',
+    'set-variables': 'next',
+    'gather-input-on-call': 'timeout',
+    'record-voicemail': 'noAudio',
+    'connect-call-to': 'callCompleted',
+}
+
+
+def speech_ms(text):
+    """Rough spoken length of a <Say> text"""
+    return max(MIN_SPEECH_MS, len(text.split()) * WORD_MS)
+
+
+def load_flow(path=STUDIO_FLOW):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _append(timeline, kind, duration_ms):
+    if duration_ms <= 0:
+        return
+    if timeline and timeline[-1][0] == kind:
+        timeline[-1] = (kind, timeline[-1][1] + duration_ms)
+    else:
+        timeline.append((kind, duration_ms))
+
+
+def state_segments(state, media_ms=None):
+    """[(kind, duration_ms)] heard by the caller while a flow state runs"""
+    props = state.get('properties', {})
+    kind = state['type']
+    segments = []
+    if kind == 'say-play':
+        loops = int(props.get('loop', 1))
+        if props.get('say'):
+            segments = [(SPEECH, speech_ms(props['say']))] * loops
+        elif props.get('play'):
+            url = props['play']
+            if 'beep' in url.lower():
+                segments = [(BEEP, BEEP_MS)] * loops
+            else:
+                segments = [(SPEECH, (media_ms or {}).get(url, DEFAULT_MEDIA_MS))] * loops
+    elif kind == 'gather-input-on-call':
+        if props.get('say'):
+            segments.append((SPEECH, speech_ms(props['say'])))
+        segments.append((SILENCE, int(props.get('timeout', 5)) * 1000))
+    elif kind == 'record-voicemail':
+        if str(props.get('play_beep', 'true')).lower() == 'true':
+            segments.append((BEEP, BEEP_MS))
+        segments.append((SILENCE, int(props.get('timeout', 5)) * 1000))
+    elif kind == 'connect-call-to':
+        segments.append((SILENCE, int(props.get('timeout', 30)) * 1000))
+    return segments
+
+
+def scenario_timeline(flow, start, media_ms=None, max_states=50):
+    """Timeline of the flow from state `start` until it ends (the callee hangs up)"""
+    states = {state['name']: state for state in flow['states']}
+    if start not in states:
+        raise KeyError(f"flow has no state named {start!r}")
+    timeline = []
+    name = start
+    for _ in range(max_states):
+        state = states[name]
+        for kind, duration in state_segments(state, media_ms):
+            _append(timeline, kind, duration)
+        event = SILENT_CALLER_EVENTS.get(state['type'])
+        name = next((t.get('next') for t in state.get('transitions', ()) if t['event'] == event), None)
+        if not name:
+            break
+    return timeline
+
+
+def load_scenarios(path=STUDIO_FLOW, media_ms=None, answer_pause_ms=500):
+    """{state name: timeline} for every scenario in SCENARIOS
+
+    Each timeline starts with answer_pause_ms of silence, the gap between
+    pickup and the first audio.
+    """
+    flow = load_flow(path)
+    scenarios = {}
+    for start in SCENARIOS.values():
+        timeline = [(SILENCE, answer_pause_ms)] if answer_pause_ms else []
+        for kind, duration in scenario_timeline(flow, start, media_ms):
+            _append(timeline, kind, duration)
+        scenarios[start] = timeline
+    return scenarios
+
+
+def resolve_scenario(name):
+    """Flow state name for a scenario given by short name or state name"""
+    if name in SCENARIOS:
+        return SCENARIOS[name]
+    if name in SCENARIOS.values():
+        return name
+    raise KeyError(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+
+
+def timeline_ms(timeline):
+    return sum(duration for _, duration in timeline)
+
+
+def amd_decision(timeline, machine_detection='Enable', timeout=30, speech_threshold=2400,
+                 speech_end_threshold=1200, silence_timeout=5000):
+    """(AnsweredBy, MachineDetectionDuration ms) for a timeline under the given AMD settings
+
+    Follows Twilio's documented rules: initial silence longer than
+    silence_timeout is 'unknown'; speech that runs past speech_threshold is a
+    machine, while speech followed by speech_end_threshold of silence is a
+    human. With DetectMessageEnd a machine is only reported when its greeting
+    ends, on a beep (machine_end_beep), silence (machine_end_silence) or
+    hang-up (machine_end_other). No decision within `timeout` seconds is
+    'unknown'.
+    """
+    timeout_ms = timeout * 1000
+    now = 0
+    heard_speech = False
+    speech_run = 0      # speech in the current utterance (short pauses included)
+    silence_run = 0     # silence since the last speech
+    machine_at = None
+
+    for kind, duration in timeline:
+        end = now + duration
+        if kind == SPEECH:
+            heard_speech = True
+            speech_run += silence_run
+            silence_run = 0
+            if machine_at is None and speech_run + duration >= speech_threshold:
+                machine_at = now + (speech_threshold - speech_run)
+                if machine_detection != 'DetectMessageEnd':
+                    return _decided('machine_start', machine_at, timeout_ms)
+            speech_run += duration
+        elif kind == BEEP:
+            if machine_at is not None or heard_speech:
+                # A beep after a greeting ends the message
+                return _decided('machine_end_beep', end, timeout_ms)
+            # A beep straight after pickup is also an answering machine
+            machine_at = now
+            if machine_detection != 'DetectMessageEnd':
+                return _decided('machine_start', end, timeout_ms)
+            return _decided('machine_end_beep', end, timeout_ms)
+        else:
+            if not heard_speech:
+                if now + duration >= silence_timeout:
+                    return _decided('unknown', silence_timeout, timeout_ms)
+            else:
+                if silence_run + duration >= speech_end_threshold:
+                    at = now + (speech_end_threshold - silence_run)
+                    if machine_at is not None:
+                        return _decided('machine_end_silence', at, timeout_ms)
+                    return _decided('human', at, timeout_ms)
+                silence_run += duration
+        now = end
+        if now >= timeout_ms:
+            break
+
+    if machine_at is not None:
+        return _decided('machine_end_other', now, timeout_ms)
+    if heard_speech:
+        return _decided('human', now, timeout_ms)
+    return _decided('unknown', now, timeout_ms)
+
+
+def _decided(answered_by, at_ms, timeout_ms):
+    if at_ms > timeout_ms:
+        return 'unknown', timeout_ms
+    return answered_by, int(at_ms)
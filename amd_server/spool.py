@@ -0,0 +1,427 @@
+# Acknowledge-fast durable spool for webhook callbacks
+#
+# With AMD_SPOOL_DIR set, /webhook only checks that the request carries a
+# CallSid, appends the raw form/query bytes to an append-only segment file
+# and answers Twilio. A dispatcher thread reads the segments back and hands
+# each entry to a pool of worker threads that decode, dedup, log, store and
+# count it. Entries are partitioned by CallSid, so the callbacks of one
+# call are still processed in arrival order.
+#
+# The contiguous prefix of finished entries is checkpointed every
+# `checkpoint_interval` seconds; on start-up everything after the
+# checkpoint is replayed (at-least-once: entries finished in the last
+# interval before a crash are processed again), a torn final record is
+# truncated, and fully consumed segments are deleted. Appends are written
+# to the OS on every callback, which survives a process crash; fsync=True
+# also survives power loss at the cost of one fsync per callback.
+#
+# Backpressure: once `max_depth` entries are waiting, appends are refused
+# (the endpoint answers 503 with Retry-After) until the depth falls back to
+# `resume_depth`, so a stalled consumer cannot fill the disk or turn into
+# slow responses and Twilio timeouts.
+#
+# Each process spools into its own lane directory, claimed with an
+# exclusive lock; a gunicorn worker that replaces a crashed one claims the
+# free lane and replays it.
+import atexit
+import json
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from urllib.parse import parse_qsl
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, lane-0 without locking
+    fcntl = None
+
+HEADER = struct.Struct('<II')   # payload length, CRC-32 of the payload
+SEGMENT_SUFFIX = '.seg'
+MAX_ENTRY_BYTES = 64 * 1024
+READ_CHUNK = 1 << 20
+
+_CALL_SID = re.compile(rb'(?:^|&)CallSid=([^&]+)')
+_STOP = object()
+
+
+def find_call_sid(data):
+    """CallSid of a raw urlencoded form or query string, or None"""
+    match = _CALL_SID.search(data)
+    return match.group(1) if match else None
+
+
+def _parse(data):
+    # First value wins for repeated keys, as with werkzeug's MultiDict
+    params = {}
+    for key, value in parse_qsl(data.decode('utf-8', 'replace'), keep_blank_values=True):
+        params.setdefault(key, value)
+    return params
+
+
+class SpoolEntry:
+    """One spooled callback as received: raw query string and body bytes"""
+
+    __slots__ = ('received_at', 'call_sid', 'method', 'path', 'query', 'body')
+
+    def __init__(self, received_at, call_sid, method, path, query, body):
+        self.received_at = received_at
+        self.call_sid = call_sid
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+
+    def encode(self):
+        return b'\t'.join([repr(self.received_at).encode(), self.call_sid, self.method.encode(),
+                           self.path.encode(), self.query, self.body])
+
+    @classmethod
+    def decode(cls, payload):
+        received_at, call_sid, method, path, query, body = payload.split(b'\t', 5)
+        return cls(float(received_at), call_sid, method.decode(), path.decode(), query, body)
+
+    def form(self):
+        """Callback parameters: the form body of a POST, the query string of a GET"""
+        return _parse(self.body if self.method == 'POST' else self.query)
+
+    def tags(self):
+        """Query-string parameters of a POST callback URL (e.g. AmdConfig), else None"""
+        return _parse(self.query) if self.method == 'POST' and self.query else None
+
+
+def _segment_name(number):
+    return f'{number:012d}{SEGMENT_SUFFIX}'
+
+
+def _claim_lane(directory):
+    """(lane path, open lock file) of the first lane no other process holds"""
+    os.makedirs(directory, exist_ok=True)
+    number = 0
+    while True:
+        lane = os.path.join(directory, f'lane-{number}')
+        os.makedirs(lane, exist_ok=True)
+        if fcntl is None:
+            return lane, None
+        lock = open(os.path.join(lane, 'lock'), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lane, lock
+        except OSError:
+            lock.close()
+            number += 1
+
+
+class Spool:
+    """Durable callback queue: append from request threads, handler(entry) on a worker pool"""
+
+    def __init__(self, directory, handler, workers=4, max_depth=100000, resume_depth=None,
+                 segment_bytes=64 * 1024 * 1024, fsync=False, checkpoint_interval=0.5,
+                 worker_queue=1024):
+        self.directory = directory
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self.resume_depth = int(max_depth * 0.8) if resume_depth is None else resume_depth
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.checkpoint_interval = checkpoint_interval
+        self.lane, self._lane_lock = _claim_lane(directory)
+
+        self._lock = threading.Lock()
+        self._appended = threading.Condition(self._lock)
+        self._checkpoint_lock = threading.Lock()
+        self.appended = 0
+        self.processed = 0
+        self.refused = 0
+        self.errors = 0
+        self.truncated = 0
+        self._refusing = False
+        self._closing = False
+        self._inflight = deque()   # [end position, received_at, done] in spool order
+        self._checkpoint_at = 0.0
+
+        self._committed = self._load_checkpoint()
+        self.replayed = self._recover()
+        self._depth = self.replayed
+        self._segment = self._segments()[-1]
+        self._fd = os.open(self._path(self._segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._write_offset = os.fstat(self._fd).st_size
+
+        self._queues = [queue.Queue(worker_queue) for _ in range(workers)]
+        self._threads = [threading.Thread(target=self._work, args=(q,), name=f'amd-spool-{n}', daemon=True)
+                         for n, q in enumerate(self._queues)]
+        self._threads.append(threading.Thread(target=self._dispatch, name='amd-spool-dispatch', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        atexit.register(self.close)
+
+    # --- Files ------------------------------------------------------------------
+
+    def _path(self, segment):
+        return os.path.join(self.lane, _segment_name(segment))
+
+    def _segments(self):
+        numbers = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.lane)
+                         if name.endswith(SEGMENT_SUFFIX))
+        return numbers or [max(self._committed[0], 1)]
+
+    def _load_checkpoint(self):
+        try:
+            with open(os.path.join(self.lane, 'checkpoint')) as f:
+                saved = json.load(f)
+            return saved['segment'], saved['offset']
+        except (OSError, ValueError, KeyError):
+            return 1, 0
+
+    def _recover(self):
+        """Validate everything after the checkpoint, truncating at a torn record; returns the entry count"""
+        pending = 0
+        segments = [n for n in self._segments() if n >= self._committed[0]]
+        if segments and segments[0] > self._committed[0]:
+            self._committed = (segments[0], 0)
+        for segment in segments:
+            path = self._path(segment)
+            if not os.path.exists(path):
+                continue
+            offset = self._committed[1] if segment == self._committed[0] else 0
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                while True:
+                    header = f.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        valid = not header
+                        break
+                    length, crc = HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        valid = False
+                        break
+                    offset += HEADER.size + length
+                    pending += 1
+            if not valid:
+                self.truncated += 1
+                sys.stderr.write(f"amd_server spool: truncating torn record in {path} at byte {offset}\n")
+                os.truncate(path, offset)
+        return pending
+
+    def _save_checkpoint(self, force=False):
+        with self._checkpoint_lock:
+            with self._lock:
+                committed = self._committed
+                now = time.monotonic()
+                if not force and now < self._checkpoint_at:
+                    return
+                self._checkpoint_at = now + self.checkpoint_interval
+            path = os.path.join(self.lane, 'checkpoint')
+            with open(path + '.tmp', 'w') as f:
+                json.dump({'segment': committed[0], 'offset': committed[1]}, f)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+            for segment in self._segments():
+                if segment < committed[0]:
+                    os.remove(self._path(segment))
+
+    # --- Request path -------------------------------------------------------------
+
+    def append(self, call_sid, method, path, query, body, received_at=None):
+        """Durably queue one raw callback; returns False when refused by backpressure"""
+        payload = SpoolEntry(received_at if received_at is not None else time.time(),
+                             call_sid, method, path, query, body).encode()
+        record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._refusing and self._depth <= self.resume_depth:
+                self._refusing = False
+            elif not self._refusing and self._depth >= self.max_depth:
+                self._refusing = True
+            if self._refusing or self._closing:
+                self.refused += 1
+                return False
+            if self._write_offset >= self.segment_bytes:
+                os.close(self._fd)
+                self._segment += 1
+                self._fd = os.open(self._path(self._segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self._write_offset = 0
+            os.write(self._fd, record)
+            if self.fsync:
+                os.fsync(self._fd)
+            self._write_offset += len(record)
+            self._depth += 1
+            self.appended += 1
+            self._appended.notify()
+        return True
+
+    # --- Consumers ------------------------------------------------------------------
+
+    def _dispatch(self):
+        segment, offset = self._committed
+        fd = None
+        while True:
+            with self._lock:
+                while (segment, offset) == (self._segment, self._write_offset) and not self._closing:
+                    self._appended.wait(0.5)
+                if (segment, offset) == (self._segment, self._write_offset):
+                    break   # closing and caught up
+                limit = self._write_offset if segment == self._segment else None
+            if fd is None:
+                fd = os.open(self._path(segment), os.O_RDONLY)
+            size = READ_CHUNK if limit is None else min(READ_CHUNK, limit - offset)
+            data = os.pread(fd, size, offset)
+            if not data:
+                # End of a sealed segment; the writer has moved on to the next one
+                os.close(fd)
+                fd = None
+                segment, offset = segment + 1, 0
+                continue
+            view = memoryview(data)
+            position = 0
+            while position + HEADER.size <= len(data):
+                length, crc = HEADER.unpack_from(data, position)
+                end = position + HEADER.size + length
+                if end > len(data):
+                    if position == 0:
+                        # Record larger than the read chunk: read exactly what it needs
+                        data = os.pread(fd, HEADER.size + length, offset)
+                        view = memoryview(data)
+                        continue
+                    break
+                payload = bytes(view[position + HEADER.size:end])
+                position = end
+                entry = SpoolEntry.decode(payload) if zlib.crc32(payload) == crc else None
+                marker = [(segment, offset + position), entry.received_at if entry else time.time(), False]
+                with self._lock:
+                    self._inflight.append(marker)
+                    if entry is None:
+                        self.errors += 1
+                if entry is None:
+                    self._finish(marker)
+                else:
+                    self._queues[zlib.crc32(entry.call_sid) % self.workers].put((entry, marker))
+            offset += position
+        if fd is not None:
+            os.close(fd)
+        for q in self._queues:
+            q.put(_STOP)
+
+    def _work(self, q):
+        while True:
+            item = q.get()
+            if item is _STOP:
+                return
+            entry, marker = item
+            try:
+                self.handler(entry)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                sys.stderr.write(f"amd_server spool handler error: {e}\n")
+            self._finish(marker)
+
+    def _finish(self, marker):
+        with self._lock:
+            marker[2] = True
+            while self._inflight and self._inflight[0][2]:
+                self._committed = self._inflight.popleft()[0]
+                self._depth -= 1
+                self.processed += 1
+            due = time.monotonic() >= self._checkpoint_at
+        if due:
+            self._save_checkpoint()
+
+    # --- Monitoring and shutdown -------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            oldest = self._inflight[0][1] if self._inflight else None
+            stats = {
+                'lane': self.lane,
+                'state': 'refusing' if self._refusing and self._depth > self.resume_depth else 'accepting',
+                'depth': self._depth,
+                'lag_s': round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                'max_depth': self.max_depth,
+                'resume_depth': self.resume_depth,
+                'workers': self.workers,
+                'appended': self.appended,
+                'processed': self.processed,
+                'replayed': self.replayed,
+                'refused': self.refused,
+                'errors': self.errors,
+                'truncated': self.truncated,
+                'segment': self._segment,
+            }
+        segments = self._segments()
+        stats['segments'] = len(segments)
+        stats['bytes'] = sum(os.path.getsize(self._path(n)) for n in segments if os.path.exists(self._path(n)))
+        return stats
+
+    def prometheus_samples(self):
+        """(name, type, help, value) samples for Metrics.add_collector"""
+        stats = self.stats()
+        return [
+            ('amd_spool_depth', 'gauge', 'Spooled callbacks not processed yet', stats['depth']),
+            ('amd_spool_lag_seconds', 'gauge', 'Age of the oldest callback being processed', stats['lag_s']),
+            ('amd_spool_refusing', 'gauge', '1 while appends are refused by backpressure',
+             1 if stats['state'] == 'refusing' else 0),
+            ('amd_spool_appended_total', 'counter', 'Callbacks appended to the spool', stats['appended']),
+            ('amd_spool_processed_total', 'counter', 'Spooled callbacks processed', stats['processed']),
+            ('amd_spool_refused_total', 'counter', 'Callbacks refused because the spool was full', stats['refused']),
+            ('amd_spool_replayed_total', 'counter', 'Callbacks replayed after a restart', stats['replayed']),
+            ('amd_spool_bytes', 'gauge', 'Size of the spool segment files', stats['bytes']),
+        ]
+
+    def drain(self, timeout=5):
+        """Wait until every appended callback has been processed; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self._depth == 0:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def close(self, timeout=5):
+        """Stop accepting, process what is spooled (up to timeout) and checkpoint"""
+        atexit.unregister(self.close)
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._appended.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._save_checkpoint(force=True)
+        os.close(self._fd)
+        if self._lane_lock is not None:
+            self._lane_lock.close()
+
+
+def spool_from_env(handler):
+    """Spool from AMD_SPOOL_* environment variables, or None when AMD_SPOOL_DIR is unset
+
+    AMD_SPOOL_DIR           directory of the spool lanes (disabled when unset)
+    AMD_SPOOL_WORKERS       processing threads (default 4)
+    AMD_SPOOL_MAX_DEPTH     waiting callbacks at which appends are refused (default 100000)
+    AMD_SPOOL_RESUME_DEPTH  depth at which appends are accepted again (default 80% of max)
+    AMD_SPOOL_SEGMENT_MB    segment file size before rolling over (default 64)
+    AMD_SPOOL_FSYNC         1 to fsync every append (survives power loss; default 0)
+    """
+    directory = os.getenv('AMD_SPOOL_DIR')
+    if not directory:
+        return None
+    resume = os.getenv('AMD_SPOOL_RESUME_DEPTH')
+    return Spool(
+        directory, handler,
+        workers=int(os.getenv('AMD_SPOOL_WORKERS', '4')),
+        max_depth=int(os.getenv('AMD_SPOOL_MAX_DEPTH', '100000')),
+        resume_depth=int(resume) if resume else None,
+        segment_bytes=int(float(os.getenv('AMD_SPOOL_SEGMENT_MB', '64')) * 1024 * 1024),
+        fsync=os.getenv('AMD_SPOOL_FSYNC', '0') == '1',
+    )
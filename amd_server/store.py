@@ -0,0 +1,197 @@
+# Persistent AMD result store (SQLite, WAL mode)
+#
+# Every decoded callback is queued from the request thread and inserted by a
+# background thread in group commits (one transaction per batch), so the
+# request path never waits on fsync. Reads use their own per-thread
+# connections, which WAL allows to run concurrently with the writer.
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .batching import DROP, BatchWorker
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS callbacks (
+    id            INTEGER PRIMARY KEY,
+    received_at   REAL NOT NULL,      -- unix epoch seconds
+    call_sid      TEXT,
+    config_key    TEXT,
+    webhook_type  TEXT,
+    call_status   TEXT,
+    answered_by   TEXT,
+    detection_ms  INTEGER,
+    sequence      INTEGER,
+    params        TEXT NOT NULL       -- full callback as JSON
+);
+CREATE INDEX IF NOT EXISTS idx_callbacks_call_sid ON callbacks (call_sid);
+CREATE INDEX IF NOT EXISTS idx_callbacks_config_time ON callbacks (config_key, received_at, answered_by);
+CREATE INDEX IF NOT EXISTS idx_callbacks_answered_time ON callbacks (answered_by, received_at);
+CREATE INDEX IF NOT EXISTS idx_callbacks_time ON callbacks (received_at, config_key, answered_by);
+"""
+
+INSERT = """
+INSERT INTO callbacks (received_at, call_sid, config_key, webhook_type, call_status,
+                       answered_by, detection_ms, sequence, params)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def event_row(event, received_at=None):
+    """Flatten a WebhookEvent into an insert row"""
+    params = event.params
+    return (
+        received_at if received_at is not None else time.time(),
+        params.get('CallSid'),
+        event.config_key,
+        event.webhook_type,
+        params.get('CallStatus'),
+        event.answered_by,
+        _to_int(params.get('MachineDetectionDuration')),
+        _to_int(params.get('SequenceNumber')),
+        json.dumps(params, separators=(',', ':')),
+    )
+
+
+class ResultStore:
+    """Indexed history of every decoded callback with batched background inserts"""
+
+    def __init__(self, path, maxsize=50000, policy=DROP, batch_size=500, flush_interval=0.25):
+        self.path = path
+        self.inserted = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._writer_conn = None
+        self._worker = BatchWorker(
+            self._insert_batch, 'amd-result-store', maxsize=maxsize, policy=policy,
+            batch_size=batch_size, flush_interval=flush_interval, on_close=self._close_writer,
+        )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode; only an
+        # OS crash or power loss can roll back the last commits.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- Writes ---------------------------------------------------------------
+
+    def add(self, event, received_at=None):
+        """Queue a decoded callback for insertion; returns False if it was dropped"""
+        return self._worker.submit(event_row(event, received_at))
+
+    def add_rows(self, rows):
+        """Queue pre-built insert rows (see event_row); returns how many were accepted
+
+        Rows the queue had to drop are counted in stats()['dropped'].
+        """
+        accepted = 0
+        for row in rows:
+            accepted += self._worker.submit(row)
+        return accepted
+
+    def _insert_batch(self, rows):
+        if self._writer_conn is None:
+            self._writer_conn = self._connect()
+        with self._writer_conn:
+            self._writer_conn.executemany(INSERT, rows)
+        self.inserted += len(rows)
+
+    def _close_writer(self):
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+            self._writer_conn = None
+
+    def flush(self, timeout=5):
+        """Wait until everything queued so far has been committed"""
+        return self._worker.flush(timeout)
+
+    def close(self, timeout=5):
+        self._worker.close(timeout)
+
+    def stats(self):
+        stats = self._worker.stats()
+        stats['inserted'] = self.inserted
+        stats['path'] = self.path
+        return stats
+
+    # --- Reads ----------------------------------------------------------------
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def query(self, sql, args=()):
+        """Run a read-only query and return a list of dicts"""
+        return [dict(row) for row in self._reader().execute(sql, args)]
+
+    def iter_rows(self, sql, args=(), chunk=10000):
+        """Run a read-only query and yield its rows (sqlite3.Row, indexable and unpackable)
+
+        Rows are fetched `chunk` at a time, so large results are not held in
+        memory at once. Iterate from a single thread.
+        """
+        cursor = self._reader().execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(chunk)
+            if not rows:
+                return
+            yield from rows
+
+    def results_for_call(self, call_sid):
+        """All callbacks received for one call, oldest first"""
+        return self.query(
+            "SELECT * FROM callbacks WHERE call_sid = ? ORDER BY received_at", (call_sid,))
+
+    def results_for_config(self, config_key, hours=24, answered_by=None, limit=None):
+        """Callbacks for an AMD configuration received in the last `hours` hours, newest first"""
+        sql = "SELECT * FROM callbacks WHERE config_key = ? AND received_at >= ?"
+        args = [config_key, time.time() - hours * 3600]
+        if answered_by:
+            sql += " AND answered_by = ?"
+            args.append(answered_by)
+        sql += " ORDER BY received_at DESC"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(limit)
+        return self.query(sql, args)
+
+    def outcome_counts(self, config_key=None, hours=24):
+        """{config_key: {answered_by: count}} for AMD results in the last `hours` hours"""
+        since = time.time() - hours * 3600
+        if config_key is None:
+            rows = self._reader().execute(
+                "SELECT config_key, answered_by, COUNT(*) FROM callbacks "
+                "WHERE received_at >= ? AND answered_by IS NOT NULL "
+                "GROUP BY config_key, answered_by", (since,))
+        else:
+            rows = self._reader().execute(
+                "SELECT config_key, answered_by, COUNT(*) FROM callbacks "
+                "WHERE config_key = ? AND received_at >= ? AND answered_by IS NOT NULL "
+                "GROUP BY answered_by", (config_key, since))
+        counts = {}
+        for key, answered_by, count in rows:
+            counts.setdefault(key, {})[answered_by] = count
+        return counts
+
+
+def store_from_env():
+    """ResultStore at AMD_STORE_PATH, or None when the variable is unset"""
+    path = os.getenv('AMD_STORE_PATH')
+    if not path:
+        return None
+    return ResultStore(path)
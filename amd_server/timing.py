@@ -0,0 +1,206 @@
+# Per-request stage timing and an on-demand sampling profiler
+#
+# Views mark the end of each stage with timing.lap('decode'), lap('dedup'),
+# ...; each lap costs one perf_counter() call and a thread-local lookup. A
+# WSGI wrapper starts the laps and a Flask after_request hook turns the laps into a Server-Timing header
+# (visible in browser dev tools and curl -v) and feeds them into the
+# Metrics stage histograms behind /metrics and /status. Laps outside a
+# request (spool workers, the log writer thread) are ignored; whole
+# background calls can be timed with timed().
+#
+# The profiler samples every thread's stack with sys._current_frames() from
+# its own thread, so it costs nothing until started and nothing on the
+# request path while running beyond the GIL hand-offs of the sampler. Its
+# output is the collapsed-stack format of flamegraph.pl and speedscope.
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+perf_counter = time.perf_counter
+
+MAX_PROFILE_SECONDS = 60
+
+
+class _Laps(threading.local):
+    laps = None   # [(stage, perf_counter())] while a request is running on this thread
+
+
+class RequestTiming:
+    """Collects per-stage laps of each request and reports them when it ends"""
+
+    def __init__(self, metrics=None, header=True):
+        self.metrics = metrics
+        self.header = header
+        self._local = _Laps()
+        self._request = None
+
+    def install(self, app):
+        """Start the laps in a WSGI wrapper and report them from an after_request hook"""
+        from flask import request
+
+        self._request = request
+        # Not before/teardown_request hooks: Flask resolves every hook through ensure_sync()
+        # on each request, which costs more than the laps themselves
+        app.wsgi_app = self.wrap(app.wsgi_app)
+        app.after_request(self._finish)
+
+    def wrap(self, wsgi_app):
+        """WSGI middleware that times each request from before routing to the after_request hook"""
+        local = self._local
+
+        def timed_app(environ, start_response):
+            local.laps = [(None, perf_counter())]
+            try:
+                return wsgi_app(environ, start_response)
+            finally:
+                # A view that raised still resets the thread's state for the next request
+                local.laps = None
+
+        return timed_app
+
+    def lap(self, stage):
+        """Attribute the time since the previous lap (or the request start) to `stage`"""
+        laps = self._local.laps
+        if laps is not None:
+            laps.append((stage, perf_counter()))
+
+    def _finish(self, response):
+        laps = self._local.laps
+        self._local.laps = None
+        if laps is None:
+            return response
+        end = perf_counter()
+        start = previous = laps[0][1]
+        stages = []
+        for stage, at in laps[1:]:
+            stages.append((stage, at - previous))
+            previous = at
+        stages.append(('total', end - start))
+        if self.header:
+            # add() rather than item assignment, which first scans for an existing value
+            response.headers.add('Server-Timing', ', '.join(
+                ['%s;dur=%.3f' % (stage, seconds * 1000) for stage, seconds in stages]))
+        if self.metrics is not None:
+            self.metrics.observe_stages(self._request.endpoint or 'unmatched', stages)
+        return response
+
+    def timed(self, endpoint, stage, func):
+        """Wrap func so each call is recorded as `stage` of `endpoint` (for background work)"""
+        metrics = self.metrics
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if metrics is not None:
+                    metrics.observe_stages(endpoint, [(stage, perf_counter() - start)])
+
+        return wrapper
+
+
+class _NoTiming:
+    """Stand-in when timing is disabled: laps are no-ops"""
+
+    def install(self, app):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def timed(self, endpoint, stage, func):
+        return func
+
+
+NO_TIMING = _NoTiming()
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the stacks of all other threads every `interval` seconds"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._running = threading.Lock()
+
+    def profile(self, seconds, interval=None, stop=None):
+        """Sample for `seconds` (or until the `stop` Event is set)
+
+        Returns Counter({collapsed stack: samples}), or None if a profile is already running.
+        """
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            return self._sample(seconds, interval or self.interval, stop)
+        finally:
+            self._running.release()
+
+    def _sample(self, seconds, interval, stop):
+        counts = Counter()
+        own = threading.get_ident()
+        deadline = perf_counter() + seconds
+        while perf_counter() < deadline and not (stop is not None and stop.is_set()):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f'thread-{ident}'))
+                counts[';'.join(reversed(stack))] += 1
+            time.sleep(interval)
+        return counts
+
+
+def collapsed(counts):
+    """Collapsed-stack text ('frame;frame;frame count' per line) for flamegraph tools"""
+    return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+
+
+def flask_profile_response(profiler, request, token):
+    """Guarded GET /admin/profile?seconds=N&interval_ms=M handler body
+
+    The token must be sent as 'Authorization: Bearer <token>' or an
+    X-Admin-Token header. Sampling runs in the request thread for N
+    seconds (at most MAX_PROFILE_SECONDS); one profile runs at a time.
+    """
+    from flask import Response
+
+    supplied = request.headers.get('X-Admin-Token') or ''
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        supplied = authorization[len('Bearer '):]
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        return Response('forbidden\n', status=403, mimetype='text/plain')
+    try:
+        seconds = float(request.args.get('seconds', '10'))
+        interval = float(request.args.get('interval_ms', profiler.interval * 1000)) / 1000
+    except ValueError:
+        return Response('seconds and interval_ms must be numbers\n', status=400, mimetype='text/plain')
+    if not 0 < seconds <= MAX_PROFILE_SECONDS or not 0.0005 <= interval <= 1:
+        return Response(f'seconds must be in (0, {MAX_PROFILE_SECONDS}] and interval_ms in [0.5, 1000]\n',
+                        status=400, mimetype='text/plain')
+    counts = profiler.profile(seconds, interval)
+    if counts is None:
+        return Response('a profile is already running\n', status=409, mimetype='text/plain')
+    return Response(collapsed(counts), mimetype='text/plain',
+                    headers={'Content-Disposition': 'attachment; filename="amd_server.collapsed"'})
+
+
+def timing_from_env(metrics):
+    """RequestTiming unless AMD_TIMING=0 (then a no-op stand-in)
+
+    AMD_TIMING          1 (default) to time request stages, 0 to disable
+    AMD_SERVER_TIMING   1 (default) to send the Server-Timing header, 0 to only aggregate
+    """
+    if os.getenv('AMD_TIMING', '1') == '0':
+        return NO_TIMING
+    return RequestTiming(metrics, header=os.getenv('AMD_SERVER_TIMING', '1') != '0')
@@ -0,0 +1,201 @@
+# Precomputed TwiML responses
+#
+# /handle_amd, /silent and /webhook only ever return a handful of distinct
+# documents, so they are rendered once, encoded to bytes and served from a
+# dict together with their ETag. Changing the voice or a message re-renders
+# the whole set: through configure(), or by editing the JSON file named by
+# AMD_TWIML_FILE, whose modification time is checked at most once per
+# `check_interval` seconds by the request that needs an AMD response.
+#
+# The documents are built by the few lines below instead of the twilio
+# package's VoiceResponse: importing twilio costs every worker process at
+# start-up, and the servers only emit <Say>, <Pause> and <Hangup>. The
+# output is byte-for-byte what VoiceResponse renders, so ETags are unchanged.
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+from .webhook import normalize_outcome
+
+CONTENT_TYPE = 'text/xml; charset=utf-8'
+
+# Normalized AMD outcome -> (log action, default message, hang up afterwards)
+AMD_OUTCOMES = {
+    'machine': ("Playing message for answering machine",
+                "This is a message for your answering machine. Have a great day!", True),
+    'human': ("Speaking to human",
+              "Hello! A human answered. This is a test call from Twilio's AMD demo.", False),
+    'fax': ("Fax detected - hanging up",
+            "Fax machine detected. Hanging up.", True),
+    'unknown': ("Unknown AMD result - playing generic message",
+                "Could not determine if human or machine answered. This is a test call.", False),
+}
+
+DEFAULT_VOICE = 'alice'
+DEFAULT_PAUSE = 60
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+# Same escaping as xml.etree.ElementTree, which VoiceResponse serializes with
+_TEXT_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+_ATTRIBUTE_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;',
+                                    '\r': '&#13;', '\n': '&#10;', '\t': '&#09;'})
+
+
+def verb(name, text=None, **attributes):
+    """One TwiML verb element, e.g. verb('Say', 'Hello', voice='alice')"""
+    attrs = ''.join(f' {key}="{str(value).translate(_ATTRIBUTE_ESCAPES)}"'
+                    for key, value in attributes.items() if value is not None)
+    if text is None or text == '':
+        return f'<{name}{attrs} />'
+    return f'<{name}{attrs}>{str(text).translate(_TEXT_ESCAPES)}</{name}>'
+
+
+def response(*verbs):
+    """Complete <Response> document around rendered verbs"""
+    if not verbs:
+        return XML_DECLARATION + '<Response />'
+    return XML_DECLARATION + '<Response>' + ''.join(verbs) + '</Response>'
+
+
+class CachedTwiml:
+    """A rendered TwiML document with its encoded body and response headers"""
+
+    __slots__ = ('body', 'etag', 'headers', 'action', 'message')
+
+    def __init__(self, xml, action=None, message=None):
+        self.body = xml.encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.headers = [('Content-Type', CONTENT_TYPE), ('ETag', f'"{self.etag}"')]
+        self.action = action
+        self.message = message
+
+
+class TwimlCache:
+    """Rendered responses keyed by normalized AnsweredBy value and pause length"""
+
+    def __init__(self, voice=DEFAULT_VOICE, messages=None, pauses=(DEFAULT_PAUSE,), path=None,
+                 check_interval=1.0):
+        self._lock = threading.Lock()
+        self.voice = voice
+        self.messages = dict(messages or {})
+        self._pauses = {}
+        self._amd = {}
+        self.empty = CachedTwiml(response())
+        # Optional JSON file {"voice": ..., "messages": {outcome: message}} layered over the above
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._defaults = (voice, dict(self.messages))
+        self._next_check = 0.0
+        self._mtime = None
+        if path is not None:
+            self._load()
+        self._render(pauses)
+
+    def configure(self, voice=None, messages=None):
+        """Change the voice and/or per-outcome messages; cached responses are rebuilt"""
+        with self._lock:
+            if voice is not None:
+                self.voice = voice
+            if messages:
+                self.messages.update(messages)
+            # Kept under a later AMD_TWIML_FILE reload
+            self._defaults = (voice or self._defaults[0], {**self._defaults[1], **(messages or {})})
+            self._render(())
+
+    def _check(self):
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.check_interval
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+            self._load()
+            self._render(())
+            self.reloads += 1
+        finally:
+            self._lock.release()
+
+    def _load(self):
+        # The file overrides the constructor's voice and messages; a missing or broken file leaves just those
+        voice, messages = self._defaults
+        messages = dict(messages)
+        self._mtime = None
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self._mtime = os.fstat(f.fileno()).st_mtime_ns
+                config = json.load(f)
+            voice = config.get('voice') or voice
+            messages.update({outcome.lower(): message for outcome, message in (config.get('messages') or {}).items()
+                             if message and outcome.lower() in AMD_OUTCOMES})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            sys.stderr.write(f"amd_server twiml: ignoring {self.path}: {e}\n")
+        self.voice = voice
+        self.messages = messages
+
+    def _render(self, pauses):
+        # Called under _lock (or from __init__), so a slower render of an
+        # older configuration cannot replace a newer one
+        amd = {}
+        for outcome, (action, default_message, hangup) in AMD_OUTCOMES.items():
+            message = self.messages.get(outcome, default_message)
+            verbs = [verb('Say', message, voice=self.voice)]
+            if hangup:
+                verbs.append(verb('Hangup'))
+            amd[outcome] = CachedTwiml(response(*verbs), action, message)
+        # Swap in the complete set at once so readers never see a mix
+        self._amd = amd
+        for length in pauses:
+            self.pause(length)
+
+    def amd(self, answered_by):
+        """Response for an AMD result (any AnsweredBy value, already lower-cased)"""
+        if self.path is not None:
+            self._check()
+        return self._amd[normalize_outcome(answered_by)]
+
+    def pause(self, length=DEFAULT_PAUSE):
+        """Response that keeps the caller silent for `length` seconds"""
+        cached = self._pauses.get(length)
+        if cached is None:
+            cached = CachedTwiml(response(verb('Pause', length=length)))
+            self._pauses[length] = cached
+        return cached
+
+
+def flask_response(cached, request=None):
+    """Flask response for a cached document, answering 304 to a matching If-None-Match"""
+    from flask import Response
+
+    if request is not None and cached.etag in request.if_none_match:
+        return Response(status=304, headers=cached.headers[1:])
+    return Response(cached.body, headers=cached.headers)
+
+
+def twiml_from_env():
+    """TwimlCache configured from AMD_TWIML_* and AMD_MESSAGE_<OUTCOME> variables
+
+    AMD_TWIML_VOICE          <Say> voice (default alice)
+    AMD_MESSAGE_<OUTCOME>    message for MACHINE, HUMAN, FAX or UNKNOWN results
+    AMD_TWIML_FILE           JSON file {"voice": ..., "messages": {...}} over the above, re-read when it changes
+    AMD_TWIML_FILE_CHECK     seconds between modification checks of that file (default 1)
+    """
+    messages = {}
+    for outcome in AMD_OUTCOMES:
+        message = os.getenv(f'AMD_MESSAGE_{outcome.upper()}')
+        if message:
+            messages[outcome] = message
+    return TwimlCache(voice=os.getenv('AMD_TWIML_VOICE', DEFAULT_VOICE), messages=messages,
+                      path=os.getenv('AMD_TWIML_FILE') or None,
+                      check_interval=float(os.getenv('AMD_TWIML_FILE_CHECK', '1')))
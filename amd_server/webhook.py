@@ -0,0 +1,233 @@
+# Single-pass decoding of Twilio webhook requests
+#
+# The field -> label -> category tables are built once at import time, so a
+# request is decoded with one read of the form and plain dict lookups.
+from urllib.parse import urlencode
+
+# (Twilio parameter, display label, display category)
+# A category of None means the field is shown under 'Other'.
+COMMON_FIELDS = (
+    ('AccountSid', 'Account SID', None),
+    ('CallSid', 'Call SID', 'Call Information'),
+    ('CallStatus', 'Call Status', 'Call Information'),
+    ('From', 'From Number', 'Call Information'),
+    ('To', 'To Number', 'Call Information'),
+    ('Caller', 'Caller Number', 'Call Information'),
+    ('Called', 'Called Number', 'Call Information'),
+    ('Direction', 'Call Direction', 'Call Information'),
+    ('ApiVersion', 'API Version', 'Callback Information'),
+    ('CallDuration', 'Call Duration', 'Call Information'),
+    ('Duration', 'Duration (seconds)', 'Call Information'),
+    ('RecordingUrl', 'Recording URL', None),
+    ('SipResponseCode', 'SIP Response Code', 'Call Information'),
+)
+
+AMD_FIELDS = (
+    ('AnsweredBy', 'AMD Result'),
+    ('AnsweringMachineDetection', 'AMD Detection'),
+    ('MachineDetectionDuration', 'AMD Duration'),
+    ('MachineDetectionSilenceTimeout', 'AMD Silence Timeout'),
+    ('MachineDetectionSpeechThreshold', 'AMD Speech Threshold'),
+    ('MachineDetectionSpeechEndThreshold', 'AMD Speech End Threshold'),
+    ('MachineDetectionTimeout', 'AMD Timeout'),
+)
+
+# Unit suffixes used by the Advanced Version labels
+AMD_UNITS = {
+    'MachineDetectionDuration': ' (ms)',
+    'MachineDetectionSilenceTimeout': ' (ms)',
+    'MachineDetectionSpeechThreshold': ' (ms)',
+    'MachineDetectionSpeechEndThreshold': ' (ms)',
+    'MachineDetectionTimeout': ' (s)',
+}
+
+STATUS_FIELDS = (
+    ('CallbackSource', 'Callback Source', 'Callback Information'),
+    ('SequenceNumber', 'Sequence Number', 'Callback Information'),
+    ('Timestamp', 'Timestamp', 'Callback Information'),
+)
+
+GEO_FIELDS = tuple(
+    (f'{prefix}{part}', f'{prefix} {label}', 'Geographic Information')
+    for prefix in ('From', 'To', 'Caller', 'Called')
+    for part, label in (('Country', 'Country'), ('State', 'State'),
+                        ('City', 'City'), ('Zip', 'ZIP'))
+)
+
+OTHER_CATEGORY = 'Other'
+
+MACHINE_RESULTS = frozenset([
+    'machine_start', 'machine_end_beep', 'machine_end_silence',
+    'machine_end_other', 'machine',
+])
+
+
+def normalize_outcome(answered_by):
+    """Map an AnsweredBy value onto 'machine', 'human', 'fax' or 'unknown'"""
+    if answered_by in MACHINE_RESULTS:
+        return 'machine'
+    if answered_by in ('human', 'fax'):
+        return answered_by
+    return 'unknown'
+
+
+# Query-string tag added to callback URLs so results map back to the
+# AMD_CONFIGURATIONS entry that placed the call
+CONFIG_PARAM = 'AmdConfig'
+# Companion tag numbering repeated trials of the same configuration
+TRIAL_PARAM = 'AmdTrial'
+# Companion tag carrying the MachineDetection mode (Enable / DetectMessageEnd),
+# which Twilio does not echo back in the AMD callback
+MODE_PARAM = 'AmdMode'
+# Companion tags carrying the destination's region, which the async AMD
+# callback has no geo fields for (see amd_server.geo)
+COUNTRY_PARAM = 'AmdCountry'
+STATE_PARAM = 'AmdState'
+
+AMD_RESULT = "AMD_RESULT"
+STATUS_CALLBACK = "STATUS_CALLBACK"
+RECORDING_CALLBACK = "RECORDING_CALLBACK"
+UNKNOWN = "UNKNOWN"
+
+
+class FieldTable:
+    """Precomputed field -> (label, category index) lookup for one server variant"""
+
+    __slots__ = ('categories', 'fields')
+
+    def __init__(self, amd_category, amd_units):
+        self.categories = ('Call Information', amd_category, 'Callback Information',
+                           'Geographic Information', OTHER_CATEGORY)
+        index = {name: i for i, name in enumerate(self.categories)}
+        other = index[OTHER_CATEGORY]
+
+        amd_fields = tuple(
+            (param, label + (AMD_UNITS.get(param, '') if amd_units else ''), amd_category)
+            for param, label in AMD_FIELDS
+        )
+
+        self.fields = {}
+        for param, label, category in COMMON_FIELDS + amd_fields + STATUS_FIELDS + GEO_FIELDS:
+            self.fields[param] = (label, index[category] if category else other)
+
+    def label(self, param):
+        """Display label for a Twilio parameter (unknown parameters keep their name)"""
+        entry = self.fields.get(param)
+        return entry[0] if entry else param
+
+
+ADVANCED_FIELDS = FieldTable('AMD Results', amd_units=True)
+MANUAL_FIELDS = FieldTable('AMD Information', amd_units=False)
+
+
+class WebhookEvent:
+    """A decoded Twilio callback: request method, webhook type and raw parameters"""
+
+    __slots__ = ('method', 'webhook_type', 'params', 'table')
+
+    def __init__(self, method, webhook_type, params, table):
+        self.method = method
+        self.webhook_type = webhook_type
+        self.params = params
+        self.table = table
+
+    def get(self, param, default=None):
+        return self.params.get(param, default)
+
+    @property
+    def call_sid(self):
+        return self.params.get('CallSid')
+
+    @property
+    def call_status(self):
+        return self.params.get('CallStatus')
+
+    @property
+    def config_key(self):
+        return self.params.get(CONFIG_PARAM)
+
+    @property
+    def trial(self):
+        return self.params.get(TRIAL_PARAM)
+
+    @property
+    def detection_mode(self):
+        """MachineDetection mode from the AmdMode tag, else inferred from the result"""
+        mode = self.params.get(MODE_PARAM)
+        if mode:
+            return mode
+        answered_by = self.answered_by
+        if answered_by == 'machine_start':
+            return 'Enable'
+        if answered_by and answered_by.startswith('machine_end'):
+            return 'DetectMessageEnd'
+        return None
+
+    @property
+    def answered_by(self):
+        """Normalized AMD result, or None when the callback carries no AMD data"""
+        value = self.params.get('AnsweredBy') or self.params.get('AnsweringMachineDetection')
+        return value.lower() if value else None
+
+    def labelled(self):
+        """Parameters keyed by display label, in request order"""
+        fields = self.table.fields
+        return {
+            (fields[key][0] if key in fields else key): value
+            for key, value in self.params.items()
+        }
+
+    def categorized(self):
+        """List of (category, [(label, value), ...]) for non-empty categories"""
+        fields = self.table.fields
+        categories = self.table.categories
+        groups = [[] for _ in categories]
+        other = groups[-1]
+        for key, value in self.params.items():
+            entry = fields.get(key)
+            if entry is None:
+                other.append((key, value))
+            else:
+                groups[entry[1]].append((entry[0], value))
+        return [(categories[i], group) for i, group in enumerate(groups) if group]
+
+
+def classify(params):
+    """Determine the type of webhook based on its parameters"""
+    if params.get('AnsweredBy') or params.get('AnsweringMachineDetection'):
+        return AMD_RESULT
+    elif params.get('CallStatus'):
+        return STATUS_CALLBACK
+    elif params.get('RecordingUrl'):
+        return RECORDING_CALLBACK
+    return UNKNOWN
+
+
+def decode_form(method, form, table=ADVANCED_FIELDS, tags=None):
+    """Build a WebhookEvent from an already-parsed form or query mapping
+
+    tags holds query-string parameters of a POST callback URL (such as
+    AmdConfig); they never override a form field of the same name.
+    """
+    # Werkzeug has already percent-decoded the values; MultiDict.items()
+    # yields the first value for each key, same as the old per-key loop.
+    params = dict(form.items())
+    if tags:
+        for key, value in tags.items():
+            params.setdefault(key, value)
+    return WebhookEvent(method, classify(params), params, table)
+
+
+def decode_request(request_obj, table=ADVANCED_FIELDS):
+    """Decode a Flask request (form for POST, query string for GET) in one pass"""
+    method = request_obj.method
+    if method == 'POST':
+        return decode_form(method, request_obj.form, table, request_obj.args)
+    return decode_form(method, request_obj.args, table)
+
+
+def tag_url(url, **tags):
+    """Append tag query parameters (e.g. AmdConfig=residential_fast) to a callback URL"""
+    if not tags:
+        return url
+    return url + ('&' if '?' in url else '?') + urlencode(tags)
@@ -0,0 +1,147 @@
+# Micro-benchmark: per-request webhook decode cost, before and after amd_server.webhook
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_decode.py [--number 20000]
+#
+# "before" is the parse_webhook_data / get_webhook_type / categorize code the
+# servers used to run on every request; "after" is decode_request() plus
+# WebhookEvent.categorized(). Both produce the same categorized console view.
+import argparse
+import os
+import sys
+import timeit
+from urllib.parse import unquote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from amd_server.webhook import ADVANCED_FIELDS, decode_request
+from payloads import amd_callback, status_callback
+
+
+class FakeRequest:
+    """Just enough of flask.Request for the decoders"""
+
+    def __init__(self, method, data):
+        self.method = method
+        self.form = data if method == 'POST' else {}
+        self.args = data if method == 'GET' else {}
+
+
+# --- Previous implementation (kept verbatim for comparison) -------------------
+
+def legacy_parse_webhook_data(request_obj):
+    data = {}
+    if request_obj.method == 'POST':
+        form_data = request_obj.form
+    else:
+        form_data = request_obj.args
+    common_params = {
+        'AccountSid': 'Account SID', 'CallSid': 'Call SID', 'CallStatus': 'Call Status',
+        'From': 'From Number', 'To': 'To Number', 'Caller': 'Caller Number',
+        'Called': 'Called Number', 'Direction': 'Call Direction', 'ApiVersion': 'API Version',
+        'CallDuration': 'Call Duration', 'Duration': 'Duration (seconds)',
+        'RecordingUrl': 'Recording URL', 'SipResponseCode': 'SIP Response Code',
+    }
+    amd_params = {
+        'AnsweredBy': 'AMD Result', 'AnsweringMachineDetection': 'AMD Detection',
+        'MachineDetectionDuration': 'AMD Duration (ms)',
+        'MachineDetectionSilenceTimeout': 'AMD Silence Timeout (ms)',
+        'MachineDetectionSpeechThreshold': 'AMD Speech Threshold (ms)',
+        'MachineDetectionSpeechEndThreshold': 'AMD Speech End Threshold (ms)',
+        'MachineDetectionTimeout': 'AMD Timeout (s)',
+    }
+    status_params = {
+        'CallbackSource': 'Callback Source', 'SequenceNumber': 'Sequence Number',
+        'Timestamp': 'Timestamp',
+    }
+    geo_params = {
+        'FromCountry': 'From Country', 'FromState': 'From State', 'FromCity': 'From City',
+        'FromZip': 'From ZIP', 'ToCountry': 'To Country', 'ToState': 'To State',
+        'ToCity': 'To City', 'ToZip': 'To ZIP', 'CallerCountry': 'Caller Country',
+        'CallerState': 'Caller State', 'CallerCity': 'Caller City', 'CallerZip': 'Caller ZIP',
+        'CalledCountry': 'Called Country', 'CalledState': 'Called State',
+        'CalledCity': 'Called City', 'CalledZip': 'Called ZIP',
+    }
+    all_params = {**common_params, **amd_params, **status_params, **geo_params}
+    for key, value in form_data.items():
+        decoded_value = unquote(str(value))
+        if key in all_params:
+            data[all_params[key]] = decoded_value
+        else:
+            data[key] = decoded_value
+    return data
+
+
+def legacy_get_webhook_type(request_obj):
+    if request_obj.method == 'POST':
+        form_data = request_obj.form
+    else:
+        form_data = request_obj.args
+    if form_data.get('AnsweredBy') or form_data.get('AnsweringMachineDetection'):
+        return "AMD_RESULT"
+    elif form_data.get('CallStatus'):
+        return "STATUS_CALLBACK"
+    elif form_data.get('RecordingUrl'):
+        return "RECORDING_CALLBACK"
+    else:
+        return "UNKNOWN"
+
+
+def legacy_decode(request_obj):
+    webhook_type = legacy_get_webhook_type(request_obj)
+    parsed_data = legacy_parse_webhook_data(request_obj)
+    categories = {
+        'Call Information': ['Call SID', 'Call Status', 'From Number', 'To Number', 'Caller Number', 'Called Number', 'Call Direction', 'Duration (seconds)', 'Call Duration', 'SIP Response Code'],
+        'AMD Results': ['AMD Result', 'AMD Detection', 'AMD Duration (ms)', 'AMD Timeout (s)', 'AMD Silence Timeout (ms)', 'AMD Speech Threshold (ms)', 'AMD Speech End Threshold (ms)'],
+        'Callback Information': ['Callback Source', 'Sequence Number', 'Timestamp', 'API Version'],
+        'Geographic Information': ['From Country', 'From State', 'From City', 'From ZIP', 'To Country', 'To State', 'To City', 'To ZIP', 'Caller Country', 'Caller State', 'Caller City', 'Caller ZIP', 'Called Country', 'Called State', 'Called City', 'Called ZIP'],
+        'Other': []
+    }
+    categorized_data = {cat: {} for cat in categories}
+    for key, value in parsed_data.items():
+        categorized = False
+        for category, fields in categories.items():
+            if key in fields:
+                categorized_data[category][key] = value
+                categorized = True
+                break
+        if not categorized:
+            categorized_data['Other'][key] = value
+    return webhook_type, [(c, list(d.items())) for c, d in categorized_data.items() if d]
+
+
+# --- Current implementation ---------------------------------------------------
+
+def current_decode(request_obj):
+    event = decode_request(request_obj, ADVANCED_FIELDS)
+    return event.webhook_type, event.categorized()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhook decode micro-benchmark')
+    parser.add_argument('--number', type=int, default=20000, help='decodes per measurement')
+    parser.add_argument('--repeat', type=int, default=5, help='measurements (best is reported)')
+    args = parser.parse_args()
+
+    cases = {
+        'status callback (POST, geo)': FakeRequest('POST', status_callback(1, sequence=2)),
+        'status callback (GET, geo)': FakeRequest('GET', status_callback(1, sequence=2)),
+        'async AMD result (POST)': FakeRequest('POST', amd_callback(1, 'machine_end_beep')),
+    }
+
+    print(f"{'Payload':<30} {'before (us)':>12} {'after (us)':>12} {'speedup':>8}")
+    print("-" * 66)
+    for name, req in cases.items():
+        # Both decoders must agree on the output before we compare their speed
+        assert legacy_decode(req) == current_decode(req), name
+        before = min(timeit.repeat(lambda: legacy_decode(req), number=args.number, repeat=args.repeat))
+        after = min(timeit.repeat(lambda: current_decode(req), number=args.number, repeat=args.repeat))
+        before_us = before / args.number * 1e6
+        after_us = after / args.number * 1e6
+        print(f"{name:<30} {before_us:>12.2f} {after_us:>12.2f} {before_us / after_us:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# Benchmark: production serving mode vs the Flask development server
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_serve.py [--requests 5000] [--concurrency 16] [--workers 4]
+#
+# Starts each server as a subprocess on a free local port and replays a sweep
+# of recorded-shape callbacks (status events with geo fields and AMD results)
+# against /webhook with keep-alive clients, then reports requests/sec and
+# latency percentiles side by side.
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from httpload import closed_loop, encode, wait_until_up
+from payloads import mixed_callbacks
+
+# Payloads are replayed many times over; measure full processing, not dedup hits
+os.environ.setdefault('AMD_DEDUP_SIZE', '0')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(extra_args, port):
+    cmd = [sys.executable, '-m', 'amd_server', 'serve', '--host', '127.0.0.1',
+           '--port', str(port)] + extra_args
+    return subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def stop_server(proc):
+    # Signal the whole group: the dev server's reloader runs the app in a child
+    os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serving mode benchmark')
+    parser.add_argument('--app', default='advanced', choices=('advanced', 'manual'))
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    requests = [encode('POST', '/webhook', payload) for payload in mixed_callbacks(200)]
+    modes = {
+        'dev (Flask debug server)': ['--app', args.app, '--dev'],
+        f'production ({args.workers}x{args.threads} gthread)':
+            ['--app', args.app, '--workers', str(args.workers), '--threads', str(args.threads)],
+    }
+
+    results = {}
+    for name, extra in modes.items():
+        port = free_port()
+        proc = start_server(extra, port)
+        try:
+            if not wait_until_up('127.0.0.1', port):
+                print(f"{name}: server did not start")
+                continue
+            closed_loop('127.0.0.1', port, requests, args.concurrency, total=200)  # warm-up
+            results[name] = closed_loop('127.0.0.1', port, requests, args.concurrency,
+                                        total=args.requests)
+        finally:
+            stop_server(proc)
+
+    print(f"\n{args.requests} POST /webhook requests, {args.concurrency} keep-alive clients")
+    print(f"{'Mode':<34} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    print("-" * 70)
+    for name, r in results.items():
+        print(f"{name:<34} {r['rps']:>9.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+# Benchmark: cold start of the webhook servers
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_startup.py [--app advanced|manual|both] [--runs 5] [--served]
+#                                      [--max-import-ms 500] [--max-first-request-ms 1000]
+#                                      [--output results.json]
+#
+# Every gunicorn worker and every new container imports the app before it
+# can answer Twilio, so start-up time is request latency for the first
+# callbacks after a deploy or scale-out. Each run starts a fresh interpreter:
+#
+#   imports        `python -X importtime` of create_app(); total import time,
+#                  the amd_server package's own share, and the slowest
+#                  top-level imports
+#   first request  process spawn to the first /webhook response through the
+#                  in-process app (interpreter start, imports, create_app,
+#                  first request)
+#   served         (--served) `python -m amd_server serve --workers 1` spawn
+#                  to the first answered /webhook over HTTP
+#
+# Medians over --runs are checked against the --max-* targets, and the run
+# fails when a module listed in --forbid (twilio, numpy, requests, pyarrow,
+# sqlite3 by default) is imported at start-up. The script exits 1 on any
+# breach, for CI, and writes everything as JSON.
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Children start with the caller's environment, before bench_serve turns dedup off
+ENVIRON = dict(os.environ)
+
+from bench_serve import free_port, start_server, stop_server
+from httpload import Client, encode
+from payloads import status_callback
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Heavy or optional modules the request path must not import at start-up
+# (sqlite3 is only needed when AMD_STORE_PATH enables the result store)
+FORBIDDEN = ('twilio', 'numpy', 'requests', 'pyarrow', 'sqlite3')
+
+# Run in a fresh interpreter: time to import, build the app and answer one callback
+FIRST_REQUEST = """
+import json, time
+t0 = time.perf_counter()
+from amd_server.app import create_app
+t1 = time.perf_counter()
+app = create_app({variant!r})
+t2 = time.perf_counter()
+client = app.test_client()
+t3 = time.perf_counter()
+status = client.post('/webhook', data={payload!r}).status_code
+t4 = time.perf_counter()
+print(json.dumps({{'import_ms': (t1 - t0) * 1000, 'create_ms': (t2 - t1) * 1000,
+                  'request_ms': (t4 - t3) * 1000, 'status': status}}), flush=True)
+"""
+
+
+def child_env():
+    env = dict(ENVIRON)
+    # Start-up as deployed by default: no console view, no store (unless set by the caller)
+    env.setdefault('AMD_LOG_CONSOLE', '0')
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from `python -X importtime` output (depth 0 = top level)"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return modules
+
+
+def measure_imports(variant, forbid):
+    code = f"from amd_server.app import create_app; create_app({variant!r})"
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT, env=child_env(),
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"{variant}: create_app failed\n{proc.stderr[-2000:]}")
+    modules = parse_importtime(proc.stderr)
+    names = {name for name, _, _, _ in modules}
+    # The top level is site/encodings and amd_server.app itself; its direct imports say where the time goes
+    top = sorted((m for m in modules if m[3] == 1), key=lambda m: -m[2])
+    return {
+        'total_ms': sum(m[1] for m in modules) / 1000,
+        'amd_server_ms': sum(m[1] for m in modules if m[0].split('.')[0] == 'amd_server') / 1000,
+        'modules': len(modules),
+        'slowest': [(name, cumulative / 1000) for name, _, cumulative, _ in top[:8]],
+        'forbidden': sorted(m for m in forbid if m in names),
+    }
+
+
+def measure_first_request(variant):
+    payload = status_callback(0, 'ringing', 1)
+    code = FIRST_REQUEST.format(variant=variant, payload=payload)
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=child_env(),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    total_ms = (time.perf_counter() - start) * 1000
+    _, stderr = proc.communicate()
+    if not line:
+        raise SystemExit(f"{variant}: first request failed\n{stderr[-2000:]}")
+    result = json.loads(line)
+    if result['status'] != 200:
+        raise SystemExit(f"{variant}: first /webhook request answered {result['status']}")
+    result['total_ms'] = total_ms
+    return result
+
+
+def measure_served(variant, timeout=60):
+    method, url, body, headers = encode('POST', '/webhook', status_callback(0, 'ringing', 1))
+    port = free_port()
+    start = time.perf_counter()
+    proc = start_server(['--app', variant, '--workers', '1', '--threads', '2'], port)
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline:
+            try:
+                status, _ = Client('127.0.0.1', port, timeout=1).request(method, url, body, headers)
+                if status == 200:
+                    return {'total_ms': (time.perf_counter() - start) * 1000}
+            except OSError:
+                pass
+            time.sleep(0.005)
+        raise SystemExit(f"{variant}: server did not answer within {timeout}s")
+    finally:
+        stop_server(proc)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def median(results, key):
+    return round(statistics.median(r[key] for r in results), 1)
+
+
+def run_variant(variant, args):
+    imports = [measure_imports(variant, args.forbid) for _ in range(args.runs)]
+    first = [measure_first_request(variant) for _ in range(args.runs)]
+    result = {
+        'import_ms': median(imports, 'total_ms'),
+        'amd_server_import_ms': median(imports, 'amd_server_ms'),
+        'modules': imports[-1]['modules'],
+        'slowest_imports': imports[-1]['slowest'],
+        'forbidden_imported': sorted({name for r in imports for name in r['forbidden']}),
+        'first_request': {key: median(first, key) for key in ('total_ms', 'import_ms', 'create_ms', 'request_ms')},
+    }
+    if args.served:
+        served = [measure_served(variant) for _ in range(args.runs)]
+        result['served_first_request_ms'] = median(served, 'total_ms')
+    return result
+
+
+def check(report, args):
+    """Target breaches as printable lines"""
+    breaches = []
+    for variant, result in report['runs'].items():
+        if result['forbidden_imported']:
+            breaches.append(f"{variant} imports {', '.join(result['forbidden_imported'])} at start-up")
+        if args.max_import_ms and result['import_ms'] > args.max_import_ms:
+            breaches.append(f"{variant} import time {result['import_ms']} ms > {args.max_import_ms:g} ms")
+        first_ms = result['first_request']['total_ms']
+        if args.max_first_request_ms and first_ms > args.max_first_request_ms:
+            breaches.append(f"{variant} time to first request {first_ms} ms > {args.max_first_request_ms:g} ms")
+        served_ms = result.get('served_first_request_ms')
+        if args.max_served_ms and served_ms and served_ms > args.max_served_ms:
+            breaches.append(f"{variant} served time to first request {served_ms} ms > {args.max_served_ms:g} ms")
+    return breaches
+
+
+def print_run(variant, result):
+    first = result['first_request']
+    print(f"\n{variant}")
+    print(f"  imports:        {result['import_ms']:>8.1f} ms total, {result['amd_server_import_ms']:.1f} ms "
+          f"amd_server, {result['modules']} modules")
+    for name, ms in result['slowest_imports']:
+        print(f"    {name:<28} {ms:>8.1f} ms")
+    print(f"  first request:  {first['total_ms']:>8.1f} ms from spawn (import {first['import_ms']:.1f}, "
+          f"create_app {first['create_ms']:.1f}, request {first['request_ms']:.1f})")
+    if 'served_first_request_ms' in result:
+        print(f"  served:         {result['served_first_request_ms']:>8.1f} ms from spawn to first HTTP response")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhook server cold-start benchmark')
+    parser.add_argument('--app', default='both', choices=('advanced', 'manual', 'both'))
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per measurement (median)')
+    parser.add_argument('--served', action='store_true', help='also time a gunicorn worker to its first response')
+    parser.add_argument('--max-import-ms', type=float, default=500, help='import time target (0 disables)')
+    parser.add_argument('--max-first-request-ms', type=float, default=1000,
+                        help='spawn to first in-process response target (0 disables)')
+    parser.add_argument('--max-served-ms', type=float, default=3000,
+                        help='spawn to first served response target, with --served (0 disables)')
+    parser.add_argument('--forbid', default=','.join(FORBIDDEN),
+                        help='comma-separated modules that must not be imported at start-up')
+    parser.add_argument('--output', default=None, help='result JSON (default: benchmarks/results/)')
+    args = parser.parse_args()
+    args.forbid = [name for name in args.forbid.split(',') if name]
+
+    report = {
+        'benchmark': 'startup',
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs_per_measurement': args.runs,
+        'targets': {'max_import_ms': args.max_import_ms, 'max_first_request_ms': args.max_first_request_ms,
+                    'max_served_ms': args.max_served_ms if args.served else None, 'forbid': args.forbid},
+        'runs': {},
+    }
+    variants = ('advanced', 'manual') if args.app == 'both' else (args.app,)
+    for variant in variants:
+        report['runs'][variant] = result = run_variant(variant, args)
+        print_run(variant, result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_startup-{report['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    breaches = check(report, args)
+    print(f"\nStart-up targets: {len(breaches)} breach(es)")
+    for line in breaches:
+        print(f"  OVER TARGET {line}")
+    if breaches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
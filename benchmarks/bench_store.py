@@ -0,0 +1,81 @@
+# Benchmark: ResultStore ingest throughput and indexed query latency
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_store.py [--rows 1000000] [--path /tmp/amd_bench.db]
+#
+# Fills a fresh store with synthetic callbacks spread over 30 days and six
+# configurations, then times the per-config query helpers.
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from amd_server.store import ResultStore, event_row
+from amd_server.webhook import decode_form
+from payloads import ANSWERED_BY, amd_callback, status_callback
+
+CONFIGS = ('residential_fast', 'business_standard', 'voicemail_drop',
+           'conservative', 'aggressive', 'custom_tuning')
+
+
+def timed(label, fn, repeat=20):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    size = len(result) if hasattr(result, '__len__') else result
+    print(f"  {label:<48} {best * 1000:>8.2f} ms  ({size} rows/groups)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ResultStore benchmark')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--path', default=None, help='database file (default: temporary)')
+    args = parser.parse_args()
+
+    path = args.path or os.path.join(tempfile.mkdtemp(), 'amd_bench.db')
+    store = ResultStore(path, maxsize=args.rows + 1, batch_size=5000)
+    rng = random.Random(42)
+    now = time.time()
+
+    print(f"Ingesting {args.rows} callbacks into {path}")
+    start = time.perf_counter()
+    for n in range(args.rows):
+        config = CONFIGS[n % len(CONFIGS)]
+        if n % 5 == 4:
+            payload = amd_callback(n // 5, rng.choice(ANSWERED_BY), rng.randint(800, 6000))
+        else:
+            payload = status_callback(n // 5, sequence=n % 5)
+        payload['AmdConfig'] = config
+        store.add_rows([event_row(decode_form('POST', payload), now - rng.random() * 30 * 86400)])
+    queued = time.perf_counter() - start
+    store.flush(timeout=600)
+    total = time.perf_counter() - start
+    print(f"  queued in {queued:.1f}s, committed in {total:.1f}s "
+          f"({args.rows / total:,.0f} rows/s, dropped {store.stats()['dropped']})")
+
+    print("Queries (best of 20):")
+    timed("results_for_config('aggressive', 1h)",
+          lambda: store.results_for_config('aggressive', hours=1))
+    timed("results_for_config('aggressive', 24h)",
+          lambda: store.results_for_config('aggressive', hours=24))
+    timed("results_for_config('aggressive', 24h, human)",
+          lambda: store.results_for_config('aggressive', hours=24, answered_by='human'))
+    timed("outcome_counts('voicemail_drop', 24h)",
+          lambda: store.outcome_counts('voicemail_drop', hours=24))
+    timed("outcome_counts(all configs, 24h)",
+          lambda: store.outcome_counts(hours=24))
+    timed("results_for_call(<sid>)",
+          lambda: store.results_for_call(payload['CallSid']))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# Benchmark: cost of request stage timing and of a running profiler
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_timing.py [--app advanced|manual|both] [--rounds 25] [--requests 600]
+#                                     [--max-overhead-pct 10] [--output results.json]
+#
+# Builds the in-process app once per configuration:
+#
+#   off        AMD_TIMING=0 (laps are no-op method calls)
+#   on         stage timing, Server-Timing header and stage histograms
+#   profiling  stage timing while the sampling profiler runs at its default
+#              interval in a background thread
+#
+# and sends the full webhook workload (bench_webhook.workload) to each, one
+# request at a time through the test client. This is the worst case for
+# the overhead: no HTTP parsing or network time dilutes the fixed cost of
+# the laps, the stage histograms and the header.
+#
+# Each request is measured in CPU time of the sending thread (the test
+# client runs the view in it), which other processes and the app's
+# background threads do not disturb, and in wall time. Rounds are
+# interleaved, with the order rotating every round. The best round's mean
+# per request (the least disturbed one, as timeit recommends) is reported,
+# and each configuration is compared with "off" round by round: the median
+# of those paired figures, in microseconds added per request and in
+# percent, is what drifting machine load disturbs least. Timing measured
+# 10-45 us (2-8%) over in-process requests of about 0.4 ms; the script
+# exits 1 when "on" costs more CPU than --max-overhead-pct, for CI, and
+# writes everything as JSON. The profiling figure is reported, not gated:
+# its cost is GIL hand-offs to the sampler, which shows in wall time only,
+# and it only runs while an operator asks for a profile.
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_webhook import RESULTS_DIR, git_commit, workload
+
+from amd_server.serve import load_app
+from amd_server.timing import RequestTiming, SamplingProfiler
+
+CONFIGS = ('off', 'on', 'profiling')
+
+
+def build_app(variant, timing):
+    previous = os.environ.get('AMD_TIMING')
+    os.environ['AMD_TIMING'] = '1' if timing else '0'
+    try:
+        return load_app(variant)
+    finally:
+        if previous is None:
+            del os.environ['AMD_TIMING']
+        else:
+            os.environ['AMD_TIMING'] = previous
+
+
+def send_all(client, requests):
+    """(CPU seconds, wall seconds) per request for one pass over the workload"""
+    cpu, wall = time.thread_time(), time.perf_counter()
+    for method, url, body, headers in requests:
+        client.open(url, method=method, data=body, headers=headers)
+    return (time.thread_time() - cpu) / len(requests), (time.perf_counter() - wall) / len(requests)
+
+
+def lap_cost(laps=200000):
+    """Nanoseconds per lap() inside and outside a request"""
+    timing = RequestTiming()
+    # What wrap() sets up around each request
+    timing._local.laps = [(None, time.perf_counter())]
+    start = time.perf_counter()
+    for _ in range(laps):
+        timing.lap('stage')
+    inside = (time.perf_counter() - start) / laps
+    timing._local.laps = None
+    start = time.perf_counter()
+    for _ in range(laps):
+        timing.lap('stage')
+    outside = (time.perf_counter() - start) / laps
+    return {'in_request_ns': round(inside * 1e9, 1), 'outside_request_ns': round(outside * 1e9, 1)}
+
+
+def measure(client, requests, profiler=None):
+    """One round; with a profiler, sample in the background for the duration of the round"""
+    if profiler is None:
+        return send_all(client, requests)
+    done = threading.Event()
+    sampler = threading.Thread(target=profiler.profile, args=(3600,), kwargs={'stop': done}, daemon=True)
+    sampler.start()
+    try:
+        return send_all(client, requests)
+    finally:
+        done.set()
+        sampler.join()
+
+
+def run_variant(variant, args):
+    requests = [request for _, request in workload(variant)][:args.requests]
+    clients = {config: build_app(variant, config != 'off').test_client() for config in CONFIGS}
+    profiler = SamplingProfiler()
+    for client in clients.values():
+        send_all(client, requests)  # warm-up
+
+    rounds = {config: [] for config in CONFIGS}
+    for n in range(args.rounds):
+        shift = n % len(CONFIGS)
+        for config in CONFIGS[shift:] + CONFIGS[:shift]:
+            rounds[config].append(measure(clients[config], requests, profiler if config == 'profiling' else None))
+
+    result = {}
+    for config, figures in rounds.items():
+        cpu = [c for c, _ in figures]
+        wall = [w for _, w in figures]
+        result[config] = {'cpu_us': round(min(cpu) * 1e6, 2), 'wall_us': round(min(wall) * 1e6, 2),
+                          'median_wall_us': round(statistics.median(wall) * 1e6, 2)}
+    # Each round against "off" in the same round, so drift in machine load cancels out
+    for config, figures in rounds.items():
+        for i, kind in enumerate(('cpu', 'wall')):
+            paired = [(f[i], o[i]) for f, o in zip(figures, rounds['off'])]
+            result[config][f'{kind}_added_us'] = round(statistics.median(f - o for f, o in paired) * 1e6, 2)
+            result[config][f'{kind}_overhead_pct'] = round(
+                statistics.median(f / o - 1 for f, o in paired) * 100, 2)
+    return result
+
+
+def print_run(variant, result):
+    print(f"\n{variant:<12} {'CPU us':>8} {'added':>7} {'':>7} {'wall us':>8} {'added':>7} {'':>7} {'median':>8}")
+    for config, r in result.items():
+        print(f"  {config:<10} {r['cpu_us']:>8.1f} {r['cpu_added_us']:>+7.1f} {r['cpu_overhead_pct']:>+6.1f}% "
+              f"{r['wall_us']:>8.1f} {r['wall_added_us']:>+7.1f} {r['wall_overhead_pct']:>+6.1f}% "
+              f"{r['median_wall_us']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Request timing and profiler overhead benchmark')
+    parser.add_argument('--app', default='both', choices=('advanced', 'manual', 'both'))
+    parser.add_argument('--rounds', type=int, default=25, help='interleaved rounds per configuration (best is compared)')
+    parser.add_argument('--requests', type=int, default=600, help='requests per round')
+    parser.add_argument('--max-overhead-pct', type=float, default=10,
+                        help='allowed CPU cost of timing with the profiler off (0 disables)')
+    parser.add_argument('--output', default=None, help='result JSON (default: benchmarks/results/)')
+    args = parser.parse_args()
+
+    report = {
+        'benchmark': 'timing',
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'rounds': args.rounds,
+        'requests_per_round': args.requests,
+        'max_overhead_pct': args.max_overhead_pct,
+        'lap': lap_cost(),
+        'runs': {},
+    }
+    print(f"lap(): {report['lap']['in_request_ns']} ns in a request, "
+          f"{report['lap']['outside_request_ns']} ns outside one")
+    variants = ('advanced', 'manual') if args.app == 'both' else (args.app,)
+    for variant in variants:
+        report['runs'][variant] = result = run_variant(variant, args)
+        print_run(variant, result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_timing-{report['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    breaches = [f"{variant} timing CPU overhead {result['on']['cpu_overhead_pct']}% "
+                f"(+{result['on']['cpu_added_us']} us per request) > {args.max_overhead_pct:g}%"
+                for variant, result in report['runs'].items()
+                if args.max_overhead_pct and result['on']['cpu_overhead_pct'] > args.max_overhead_pct]
+    print(f"\nTiming overhead targets: {len(breaches)} breach(es)")
+    for line in breaches:
+        print(f"  OVER TARGET {line}")
+    if breaches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
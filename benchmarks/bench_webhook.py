@@ -0,0 +1,260 @@
+# Benchmark: webhook endpoint latency at fixed arrival rates
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_webhook.py [--app advanced|manual|both] [--mode inprocess|served|both]
+#                                      [--rate 200] [--duration 10] [--output results.json]
+#                                      [--compare baseline.json --tolerance 0.15]
+#
+# Replays status callbacks (full geo fields), AMD results of every AnsweredBy
+# kind and the TwiML requests (/silent or /handle_amd), each as GET and POST,
+# at an open-loop fixed arrival rate. "inprocess" drives the Flask app
+# through its test client; "served" starts `python -m amd_server serve` (or
+# targets --url). Reports throughput and p50/p95/p99/p99.9 per request kind,
+# plus per-request allocation figures for the in-process app, and writes
+# everything as JSON. With --compare the run is checked against an earlier
+# result file and the script exits 1 on a regression, for CI.
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# The console view is terminal output, not request-path work
+os.environ.setdefault('AMD_LOG_CONSOLE', '0')
+# Payloads are replayed many times over; measure full processing, not dedup hits
+os.environ.setdefault('AMD_DEDUP_SIZE', '0')
+
+from bench_serve import free_port, start_server, stop_server
+from httpload import encode, http_sender, open_loop, wait_until_up
+from payloads import ANSWERED_BY, STATUS_SEQUENCE, amd_callback, amd_twiml_request, status_callback
+
+from amd_server.serve import load_app
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Fields checked by --compare (name -> higher is better). Tail latency of a
+# single request kind rests on too few samples to gate on, so per-kind runs
+# only compare the median.
+COMPARED_ALL = {'rps': True, 'p50_ms': False, 'p99_ms': False}
+COMPARED_PER_KIND = {'p50_ms': False}
+
+
+def workload(variant, calls=100):
+    """[(label, request)] covering every request kind the variant's Twilio setup sends"""
+    twiml_path = '/silent' if variant == 'advanced' else '/handle_amd'
+    twiml_label = twiml_path.strip('/')
+    requests = []
+    for n in range(calls):
+        answered_by = ANSWERED_BY[n % len(ANSWERED_BY)]
+        for method in ('POST', 'GET'):
+            kind = method.lower()
+            for sequence, status in enumerate(STATUS_SEQUENCE):
+                duration = 30 + n % 40 if status == 'completed' else None
+                requests.append((f'webhook_status_{kind}',
+                                 encode(method, '/webhook', status_callback(n, status, sequence, duration))))
+            requests.append((f'webhook_amd_{kind}',
+                             encode(method, '/webhook', amd_callback(n, answered_by, 1500 + (n * 137) % 4000))))
+            requests.append((f'{twiml_label}_{kind}',
+                             encode(method, twiml_path, amd_twiml_request(n, answered_by))))
+    return requests
+
+
+def flask_sender(app):
+    """open_loop() sender factory that calls the app through a per-thread test client"""
+
+    def make_sender():
+        client = app.test_client()
+
+        def send(method, url, body, headers):
+            return client.open(url, method=method, data=body, headers=headers).status_code
+
+        return send
+
+    return make_sender
+
+
+def allocations(app, requests, per_label=200):
+    """Per-request allocation figures for each request kind, sent one at a time
+
+    peak_kb: tracemalloc peak above the pre-request level
+    retained_blocks: net allocated blocks left behind per request
+    gc_gen0_per_1k: generation-0 collections per 1000 requests (allocation churn)
+    """
+    client = app.test_client()
+    by_label = {}
+    for label, request in requests:
+        by_label.setdefault(label, []).append(request)
+    figures = {}
+    for label, items in sorted(by_label.items()):
+        batch = [items[n % len(items)] for n in range(per_label)]
+        for method, url, body, headers in batch[:20]:
+            client.open(url, method=method, data=body, headers=headers)
+
+        gc.collect()
+        collections = gc.get_stats()[0]['collections']
+        blocks = sys.getallocatedblocks()
+        for method, url, body, headers in batch:
+            client.open(url, method=method, data=body, headers=headers)
+        retained = (sys.getallocatedblocks() - blocks) / per_label
+        gen0 = (gc.get_stats()[0]['collections'] - collections) * 1000 / per_label
+
+        tracemalloc.start()
+        peaks = []
+        for method, url, body, headers in batch:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            client.open(url, method=method, data=body, headers=headers)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+
+        figures[label] = {
+            'peak_kb': round(sum(peaks) / len(peaks) / 1024, 2),
+            'retained_blocks': round(retained, 2),
+            'gc_gen0_per_1k': round(gen0, 1),
+        }
+    return figures
+
+
+def run_inprocess(variant, args):
+    app = load_app(variant)
+    requests = workload(variant)
+    make_sender = flask_sender(app)
+    open_loop(make_sender, requests, args.rate, min(2, args.duration), args.concurrency)  # warm-up
+    return {
+        'latency': open_loop(make_sender, requests, args.rate, args.duration, args.concurrency),
+        'allocations': allocations(app, requests),
+    }
+
+
+def run_served(variant, args):
+    requests = workload(variant)
+    if args.url:
+        host, _, port = args.url.split('://')[-1].rstrip('/').partition(':')
+        port = int(port or 80)
+        proc = None
+    else:
+        host, port = '127.0.0.1', free_port()
+        proc = start_server(['--app', variant, '--workers', str(args.workers),
+                             '--threads', str(args.threads)], port)
+    try:
+        if not wait_until_up(host, port):
+            raise SystemExit(f"{variant}: server did not start")
+        make_sender = http_sender(host, port)
+        open_loop(make_sender, requests, args.rate, min(2, args.duration), args.concurrency)  # warm-up
+        return {'latency': open_loop(make_sender, requests, args.rate, args.duration, args.concurrency)}
+    finally:
+        if proc is not None:
+            stop_server(proc)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, tolerance):
+    """Regressions beyond tolerance as printable lines, for runs present in both files"""
+    regressions = []
+    for run, result in current['runs'].items():
+        old_run = baseline.get('runs', {}).get(run)
+        if not old_run:
+            continue
+        for label, summary in result['latency'].items():
+            old = old_run['latency'].get(label)
+            if not old:
+                continue
+            fields = COMPARED_ALL if label == 'all' else COMPARED_PER_KIND
+            for field, higher_is_better in fields.items():
+                new_value, old_value = summary[field], old[field]
+                if not old_value:
+                    continue
+                change = (new_value - old_value) / old_value
+                if (-change if higher_is_better else change) > tolerance:
+                    regressions.append(f"{run} {label} {field}: {old_value} -> {new_value} ({change:+.0%})")
+    return regressions
+
+
+def print_run(name, result):
+    print(f"\n{name}")
+    print(f"{'Request kind':<22} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'p99.9 ms':>9} {'errors':>7} {'peak KB':>8} {'blocks':>7}")
+    print("-" * 96)
+    allocs = result.get('allocations', {})
+    for label, r in result['latency'].items():
+        a = allocs.get(label)
+        alloc_text = f"{a['peak_kb']:>8.1f} {a['retained_blocks']:>7.1f}" if a else f"{'-':>8} {'-':>7}"
+        print(f"{label:<22} {r['rps']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+              f"{r['p999_ms']:>9.2f} {r['errors']:>7} {alloc_text}")
+    behind = result['latency']['all']['dispatch_behind_ms']
+    if behind > 50:
+        print(f"note: the load generator fell {behind:.0f} ms behind schedule; lower --rate")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhook endpoint latency benchmark')
+    parser.add_argument('--app', default='both', choices=('advanced', 'manual', 'both'))
+    parser.add_argument('--mode', default='both', choices=('inprocess', 'served', 'both'))
+    parser.add_argument('--rate', type=float, default=200, help='requests per second (open loop)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    parser.add_argument('--concurrency', type=int, default=32, help='client threads / connections')
+    parser.add_argument('--workers', type=int, default=2, help='server workers (served mode)')
+    parser.add_argument('--threads', type=int, default=8, help='threads per server worker')
+    parser.add_argument('--url', default=None, help='benchmark an already running server instead')
+    parser.add_argument('--output', default=None, help='result JSON (default: benchmarks/results/)')
+    parser.add_argument('--compare', default=None, help='baseline result JSON to check against')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='allowed relative regression (default 0.15)')
+    args = parser.parse_args()
+
+    variants = ('advanced', 'manual') if args.app == 'both' else (args.app,)
+    modes = ('inprocess', 'served') if args.mode == 'both' else (args.mode,)
+    runners = {'inprocess': run_inprocess, 'served': run_served}
+
+    report = {
+        'benchmark': 'webhook',
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'rate': args.rate,
+        'duration_s': args.duration,
+        'concurrency': args.concurrency,
+        'runs': {},
+    }
+    for variant in variants:
+        for mode in modes:
+            name = f'{variant}/{mode}'
+            report['runs'][name] = result = runners[mode](variant, args)
+            print_run(f"{name} at {args.rate:g} req/s for {args.duration:g}s", result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_webhook-{report['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        print(f"\nCompared with {args.compare} (commit {baseline.get('commit')}, "
+              f"tolerance {args.tolerance:.0%}): {len(regressions)} regression(s)")
+        for line in regressions:
+            print(f"  REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+# Minimal HTTP load generator used by the serving benchmarks
+#
+# Each client thread keeps one persistent (keep-alive) connection and replays
+# the request list round-robin, recording per-request latency. closed_loop()
+# sends as fast as the server answers; open_loop() sends at a fixed arrival
+# rate and measures latency from each request's scheduled send time, so
+# queueing behind a slow server is counted rather than hidden.
+import http.client
+import queue
+import threading
+import time
+from urllib.parse import urlencode
+
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def encode(method, path, payload):
+    """Prepared request tuple (method, url, body, headers) for a callback payload"""
+    if method == 'GET':
+        return (method, f'{path}?{urlencode(payload)}', None, {})
+    return (method, path, urlencode(payload).encode(), FORM_HEADERS)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Throughput and latency percentiles (milliseconds) for one run"""
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(len(values) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'p999_ms': round(percentile(values, 99.9) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+class Client:
+    """One keep-alive connection that reconnects after errors"""
+
+    def __init__(self, host, port, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, url, body=None, headers=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self.conn.request(method, url, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            data = response.read()
+            if response.will_close:
+                self.close()
+            return response.status, data
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def closed_loop(host, port, requests, concurrency=8, total=None, duration=None):
+    """Replay `requests` with `concurrency` clients, each sending as fast as it can
+
+    Stops after `total` requests or `duration` seconds (whichever is given).
+    """
+    if total is None and duration is None:
+        total = len(requests)
+    latencies = []
+    errors = [0]
+    counter = iter(range(total if total is not None else 1 << 62))
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration if duration else None
+
+    def worker():
+        client = Client(host, port)
+        local = []
+        local_errors = 0
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None or (deadline and time.perf_counter() >= deadline):
+                break
+            method, url, body, headers = requests[n % len(requests)]
+            start = time.perf_counter()
+            try:
+                status, _ = client.request(method, url, body, headers)
+                if status >= 400:
+                    local_errors += 1
+            except Exception:
+                local_errors += 1
+                continue
+            local.append(time.perf_counter() - start)
+        client.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+
+def http_sender(host, port, timeout=10):
+    """open_loop() sender factory: one keep-alive Client per worker thread"""
+
+    def make_sender():
+        client = Client(host, port, timeout)
+
+        def send(method, url, body, headers):
+            status, _ = client.request(method, url, body, headers)
+            return status
+
+        return send
+
+    return make_sender
+
+
+def open_loop(make_sender, requests, rate, duration, concurrency=32):
+    """Send labelled requests [(label, (method, url, body, headers))] at `rate` per second
+
+    make_sender() is called once per worker thread and returns
+    send(method, url, body, headers) -> status. Returns a summary per label
+    plus 'all', each with the achieved rate and how far dispatch fell behind.
+    """
+    total = int(rate * duration)
+    backlog = queue.Queue()
+    results = {}
+    lock = threading.Lock()
+
+    def worker():
+        send = make_sender()
+        local = {}
+        while True:
+            item = backlog.get()
+            if item is None:
+                break
+            intended, label, (method, url, body, headers) = item
+            latencies, errors = local.setdefault(label, ([], [0]))
+            try:
+                status = send(method, url, body, headers)
+                if status >= 400:
+                    errors[0] += 1
+            except Exception:
+                errors[0] += 1
+                continue
+            latencies.append(time.perf_counter() - intended)
+        with lock:
+            for label, (latencies, errors) in local.items():
+                entry = results.setdefault(label, ([], [0]))
+                entry[0].extend(latencies)
+                entry[1][0] += errors[0]
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    max_behind = 0.0
+    for n in range(total):
+        intended = start + n / rate
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            max_behind = max(max_behind, -delay)
+        label, request = requests[n % len(requests)]
+        backlog.put((intended, label, request))
+    for _ in threads:
+        backlog.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    summaries = {}
+    every, every_errors = [], 0
+    for label, (latencies, errors) in sorted(results.items()):
+        summaries[label] = summarize(latencies, elapsed, errors[0])
+        every.extend(latencies)
+        every_errors += errors[0]
+    summaries['all'] = summarize(every, elapsed, every_errors)
+    summaries['all'].update(target_rps=rate, dispatch_behind_ms=round(max_behind * 1000, 3))
+    return summaries
+
+
+def wait_until_up(host, port, path='/status', timeout=30):
+    """Poll until the server answers `path`; returns False on timeout"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, _ = Client(host, port, timeout=1).request('GET', path)
+            if status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
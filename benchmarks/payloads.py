@@ -0,0 +1,96 @@
+# Realistic Twilio callback payloads shared by the benchmarks
+#
+# Field names and value shapes follow what Twilio sends to the status
+# callback and async AMD callback URLs configured in the notebooks.
+
+ACCOUNT_SID = 'AC' + '0' * 32
+FROM_NUMBER = '+15017122661'
+TO_NUMBER = '+5511987654321'
+
+GEO = {
+    'FromCountry': 'US', 'FromState': 'CA', 'FromCity': 'SAN FRANCISCO', 'FromZip': '94105',
+    'ToCountry': 'BR', 'ToState': 'SP', 'ToCity': 'SAO PAULO', 'ToZip': '',
+    'CallerCountry': 'US', 'CallerState': 'CA', 'CallerCity': 'SAN FRANCISCO', 'CallerZip': '94105',
+    'CalledCountry': 'BR', 'CalledState': 'SP', 'CalledCity': 'SAO PAULO', 'CalledZip': '',
+}
+
+ANSWERED_BY = (
+    'human', 'machine_start', 'machine_end_beep', 'machine_end_silence',
+    'machine_end_other', 'fax', 'unknown',
+)
+
+STATUS_SEQUENCE = ('initiated', 'ringing', 'in-progress', 'completed')
+
+
+def call_sid(n):
+    """Deterministic 34-character Call SID for call number n"""
+    return f'CA{n:032x}'
+
+
+def status_callback(n, status='in-progress', sequence=0, duration=None):
+    """Status callback with the full set of geo fields"""
+    payload = {
+        'Called': TO_NUMBER,
+        'ToState': GEO['ToState'],
+        'CallerCountry': GEO['CallerCountry'],
+        'Direction': 'outbound-api',
+        'Timestamp': 'Fri, 17 Oct 2026 14:32:15 +0000',
+        'CallbackSource': 'call-progress-events',
+        'SipResponseCode': '200',
+        'CallerState': GEO['CallerState'],
+        'ToZip': GEO['ToZip'],
+        'SequenceNumber': str(sequence),
+        'CallSid': call_sid(n),
+        'To': TO_NUMBER,
+        'CallerZip': GEO['CallerZip'],
+        'ToCountry': GEO['ToCountry'],
+        'CalledZip': GEO['CalledZip'],
+        'ApiVersion': '2010-04-01',
+        'CalledCity': GEO['CalledCity'],
+        'CallStatus': status,
+        'From': FROM_NUMBER,
+        'AccountSid': ACCOUNT_SID,
+        'CalledCountry': GEO['CalledCountry'],
+        'CallerCity': GEO['CallerCity'],
+        'ToCity': GEO['ToCity'],
+        'FromCountry': GEO['FromCountry'],
+        'Caller': FROM_NUMBER,
+        'FromCity': GEO['FromCity'],
+        'CalledState': GEO['CalledState'],
+        'FromZip': GEO['FromZip'],
+        'FromState': GEO['FromState'],
+    }
+    if duration is not None:
+        payload['CallDuration'] = str(duration)
+        payload['Duration'] = str(max(1, duration // 60))
+    return payload
+
+
+def amd_callback(n, answered_by='human', detection_ms=2350):
+    """Async AMD callback as posted to async_amd_status_callback"""
+    return {
+        'AccountSid': ACCOUNT_SID,
+        'CallSid': call_sid(n),
+        'AnsweredBy': answered_by,
+        'MachineDetectionDuration': str(detection_ms),
+    }
+
+
+def amd_twiml_request(n, answered_by='human'):
+    """Synchronous AMD request Twilio makes to the TwiML url (/handle_amd)"""
+    payload = status_callback(n, status='in-progress')
+    del payload['CallbackSource'], payload['SequenceNumber'], payload['Timestamp']
+    payload['AnsweredBy'] = answered_by
+    return payload
+
+
+def mixed_callbacks(calls=100):
+    """Callbacks of one sweep: four status events plus one AMD result per call"""
+    payloads = []
+    for n in range(calls):
+        answered_by = ANSWERED_BY[n % len(ANSWERED_BY)]
+        for sequence, status in enumerate(STATUS_SEQUENCE[:3]):
+            payloads.append(status_callback(n, status, sequence))
+        payloads.append(amd_callback(n, answered_by, 1500 + (n * 137) % 4000))
+        payloads.append(status_callback(n, 'completed', 3, duration=30 + n % 40))
+    return payloads
@@ -0,0 +1,59 @@
+import os
+import threading
+
+import pytest
+
+from amd_server.app import create_app
+from amd_server.fake_twilio import STATUS_EVENTS
+
+
+@pytest.fixture(autouse=True)
+def amd_env(monkeypatch):
+    """Every test starts from the defaults, without the console view"""
+    for name in list(os.environ):
+        if name.startswith('AMD_'):
+            monkeypatch.delenv(name)
+    monkeypatch.setenv('AMD_LOG_CONSOLE', '0')
+    return monkeypatch
+
+
+@pytest.fixture
+def make_app(amd_env):
+    """create_app(variant) with AMD_* overrides; the servers are closed after the test"""
+    servers = []
+
+    def make(variant='advanced', **env):
+        for name, value in env.items():
+            amd_env.setenv(name, str(value))
+        app = create_app(variant)
+        servers.append(app.extensions['amd_server'])
+        return app
+
+    yield make
+    for server in reversed(servers):
+        server.close()
+
+
+def call_params(variant, base='http://amd.test', to='+5511987654321', **extra):
+    """calls.create keywords for a call against the `variant` server at `base`"""
+    params = {'to': to, 'from_': '+15017122661', 'machine_detection': 'Enable',
+              'status_callback': f'{base}/webhook', 'status_callback_event': list(STATUS_EVENTS)}
+    if variant == 'manual':
+        params['url'] = f'{base}/handle_amd'
+    else:
+        params.update(url=f'{base}/silent', async_amd=True, async_amd_status_callback=f'{base}/webhook')
+    params.update(extra)
+    return params
+
+
+class Recorder:
+    """FakeTwilio transport that answers every request with empty TwiML and keeps what was sent"""
+
+    def __init__(self):
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, params):
+        with self._lock:
+            self.requests.append((method, url, dict(params)))
+        return 200, b'<?xml version="1.0" encoding="UTF-8"?><Response />'
@@ -0,0 +1,95 @@
+import json
+import re
+
+import pytest
+
+from amd_server.__main__ import main
+from amd_server.history import CALL_RESOURCE
+from amd_server.store import ResultStore
+from amd_server.webhook import ADVANCED_FIELDS, decode_form
+
+np = pytest.importorskip('numpy')
+from amd_server.analytics import OUTCOMES, UNLABELLED, ResultColumns  # noqa: E402
+
+CALLS = [
+    # (sid, To, AnsweredBy)
+    ('CA1', '+14155550001', 'machine_end_beep'),
+    ('CA2', '+14155550002', 'human'),
+    ('CA3', '+14155550003', 'human'),
+    ('CA4', '+14155550004', 'unknown'),
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'))
+    for n, (sid, to, answered_by) in enumerate(CALLS):
+        status = {'CallSid': sid, 'CallStatus': 'ringing', 'To': to, 'ToCountry': 'US', 'ToState': 'CA'}
+        store.add(decode_form('POST', status, ADVANCED_FIELDS), 1000.0 + n)
+        result = {'CallSid': sid, 'AnsweredBy': answered_by, 'MachineDetectionDuration': str(1000 + 100 * n)}
+        store.add(decode_form('POST', result, ADVANCED_FIELDS, {'AmdConfig': 'fast'}), 1010.0 + n)
+    store.flush()
+    yield store
+    store.close()
+
+
+def expected_of(results):
+    return [OUTCOMES[code] if code != UNLABELLED else None for code in results['expected']]
+
+
+def test_iter_rows_streams_in_chunks(store):
+    rows = store.iter_rows("SELECT call_sid FROM callbacks ORDER BY id", chunk=3)
+    assert [row['call_sid'] for row in rows] == [sid for sid, _, _ in CALLS for _ in range(2)]
+
+
+def test_default_and_overrides_combine(store):
+    results = ResultColumns.from_store(store, {'+14155550002': 'human'}, default='machine')
+    assert len(results) == 4
+    assert expected_of(results) == ['machine', 'human', 'machine', 'machine']
+    assert expected_of(ResultColumns.from_store(store, 'human')) == ['human'] * 4
+    assert expected_of(ResultColumns.from_store(store)) == [None] * 4
+    assert list(results['detection_ms']) == [1000, 1100, 1200, 1300]
+
+
+def test_cli_expected_default_then_override(store, capsys):
+    main(['analytics', '--store', store.path, '--expected', 'machine',
+          '--expected', '+14155550002=human', '--expected', '+14155550003=human'])
+    out = capsys.readouterr().out
+    assert '4 calls' in out
+    # CA1..CA3 match their expected outcome, CA4 (unknown) does not
+    assert re.search(r'^fast\s+4\s+75\.0%', out, re.M)
+
+
+def test_cli_rejects_unknown_outcomes(store):
+    with pytest.raises(SystemExit, match='outcome must be one of'):
+        main(['analytics', '--store', store.path, '--expected', '+14155550002=robot'])
+
+
+def test_default_keeps_scenario_labels():
+    rows = [('CA1', 1.0, 'fast', 'human', 900, None, 'US', 'CA', '+14155550001', 'SimulHuman'),
+            ('CA2', 2.0, 'fast', 'machine_start', 2400, None, 'US', 'CA', '+14155550002', 'ContestadoraSimples'),
+            ('CA3', 3.0, 'fast', 'human', 1000, None, 'US', 'CA', '+14155550003', None)]
+    # The default only fills in the call without a scenario
+    assert expected_of(ResultColumns.from_rows(rows, default='fax')) == ['human', 'machine', 'fax']
+    assert expected_of(ResultColumns.from_rows(rows, 'fax')) == ['human', 'machine', 'fax']
+    results = ResultColumns.from_rows(rows, {'ContestadoraSimples': 'unknown', '+14155550001': 'machine'}, default='fax')
+    assert expected_of(results) == ['machine', 'unknown', 'fax']
+    assert expected_of(ResultColumns.from_rows(rows)) == ['human', 'machine', None]
+
+
+def test_callbacks_are_preferred_over_fetched_rows(store):
+    # History fetched for CA5 before its callback was stored, and for CA6 which had no callback
+    fetched = [('CA5', 'machine_start', '+14155550005'), ('CA6', 'human', '+14155550006')]
+    store.add_rows([(1020.0, sid, 'fast', CALL_RESOURCE, 'completed', answered_by, 2000, None,
+                     json.dumps({'sid': sid, 'to': to})) for sid, answered_by, to in fetched])
+    store.flush()
+    store.add(decode_form('POST', {'CallSid': 'CA5', 'AnsweredBy': 'machine_end_beep'}, ADVANCED_FIELDS), 1030.0)
+    store.flush()
+    results = ResultColumns.from_store(store)
+    answered_by = results.categories['answered_by']
+    destination = results.categories['destination']
+    calls = {sid.decode(): (answered_by[a], destination[d])
+             for sid, a, d in zip(results['call_sid'], results['answered_by'], results['destination'])}
+    assert calls['CA5'] == ('machine_end_beep', '+14155550005')
+    assert calls['CA6'] == ('human', '+14155550006')
+    assert len(calls) == 6
@@ -0,0 +1,117 @@
+import json
+import re
+import threading
+import time
+
+import pytest
+
+from amd_server.app import SERVERS, AdvancedServer, WebhookServer, create_app
+from amd_server.webhook import ADVANCED_FIELDS, decode_form
+
+
+def test_incomplete_variant_fails_at_construction():
+    class Partial(WebhookServer):
+        twiml_endpoint = '/partial'
+
+        def home(self):
+            return 'home'
+
+    with pytest.raises(TypeError, match='process_twiml'):
+        Partial()
+    with pytest.raises(TypeError):
+        WebhookServer()
+
+
+def test_unknown_variant():
+    with pytest.raises(ValueError, match='unknown server variant'):
+        create_app('basic')
+
+
+@pytest.mark.parametrize('variant', sorted(SERVERS))
+def test_pages(make_app, variant):
+    client = make_app(variant).test_client()
+    home = client.get('/')
+    assert home.status_code == 200 and '/webhook' in home.get_data(as_text=True)
+    status = client.get('/status').get_json()
+    assert status['status'] == 'running' and status['server'] == SERVERS[variant].name
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/calls/CA404').status_code == 404
+
+
+def test_twiml_etag(make_app):
+    client = make_app('advanced').test_client()
+    first = client.post('/silent', data={'CallSid': 'CA1'})
+    assert first.headers['Content-Type'].startswith('text/xml')
+    assert b'<Pause length="60" />' in first.get_data()
+    again = client.get('/silent', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_advanced_process_twiml_logs(make_app, tmp_path):
+    log = tmp_path / 'amd.jsonl'
+    server = make_app('advanced', AMD_LOG_FILE=log).extensions['amd_server']
+    assert isinstance(server, AdvancedServer)
+    server.process_twiml(decode_form('POST', {'CallSid': 'CA1'}, ADVANCED_FIELDS), 1000.0)
+    server.log.close()
+    record = json.loads(log.read_text().splitlines()[-1])
+    assert record['kind'] == 'silent' and record['ts'] == 1000.0 and record['method'] == 'POST'
+
+
+def test_server_timing_header(make_app):
+    client = make_app('advanced').test_client()
+    response = client.post('/webhook', data={'CallSid': 'CA1', 'AnsweredBy': 'human'})
+    entries = [entry.split(';dur=') for entry in response.headers['Server-Timing'].split(', ')]
+    stages = [stage for stage, _ in entries]
+    assert stages[0] == 'parse' and stages[-1] == 'total' and 'decode' in stages
+    durations = [float(ms) for _, ms in entries]
+    assert all(ms >= 0 for ms in durations)
+    assert durations[-1] >= sum(durations[:-1]) - 0.01
+    assert client.get('/status').get_json()['timing']['handle_webhook']['total']['count'] == 1
+
+    quiet = make_app('advanced', AMD_SERVER_TIMING='0').test_client()
+    assert 'Server-Timing' not in quiet.post('/webhook', data={'CallSid': 'CA1'}).headers
+    assert 'Server-Timing' not in make_app('advanced', AMD_TIMING='0').test_client().get('/status').headers
+
+
+def test_admin_profile_guard(make_app):
+    assert make_app('advanced').test_client().get('/admin/profile').status_code == 404
+    client = make_app('advanced', AMD_ADMIN_TOKEN='s3cret').test_client()
+    assert client.get('/admin/profile?seconds=0.01').status_code == 403
+    assert client.get('/admin/profile?seconds=0.01', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    assert client.get('/admin/profile?seconds=0.01', headers={'Authorization': 'Bearer s3cre'}).status_code == 403
+    assert client.get('/admin/profile?seconds=61', headers={'X-Admin-Token': 's3cret'}).status_code == 400
+    assert client.get('/admin/profile?seconds=x', headers={'X-Admin-Token': 's3cret'}).status_code == 400
+
+
+def test_admin_profile_collapsed_stacks(make_app):
+    app = make_app('advanced', AMD_ADMIN_TOKEN='s3cret')
+    profiler = app.extensions['amd_server'].profiler
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer s3cret'}
+    first = {}
+
+    def profile():
+        first['response'] = client.get('/admin/profile?seconds=0.3&interval_ms=5', headers=headers)
+
+    thread = threading.Thread(target=profile, name='profile-request')
+    thread.start()
+    while not profiler._running.locked():
+        time.sleep(0.001)
+    # One profile at a time
+    assert client.get('/admin/profile?seconds=0.01', headers=headers).status_code == 409
+    thread.join()
+
+    response = first['response']
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    assert 'attachment' in response.headers['Content-Disposition']
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines
+    counts = []
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        counts.append(int(count))
+        thread_name, *frames = stack.split(';')
+        assert frames and all(re.fullmatch(r'\S+ \(.+:\d+\)', frame) for frame in frames), line
+    # Most frequent stack first; this test's own thread was sampled while it waited
+    assert counts == sorted(counts, reverse=True)
+    assert any(line.startswith('MainThread;') for line in lines)
@@ -0,0 +1,111 @@
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+from amd_server.batch import BatchRunner
+from amd_server.fake_twilio import FakeTwilio, FlaskTransport
+
+from conftest import Recorder
+
+CONFIGURATIONS = {key: {'name': key, 'params': {
+    'url': 'http://amd.test/silent', 'machine_detection': 'Enable', 'async_amd': True,
+    'async_amd_status_callback': 'http://amd.test/webhook', **extra}}
+    for key, extra in (('default', {}), ('fast', {'machine_detection_timeout': 10}))}
+
+
+class TimedClient:
+    """Twilio client stand-in around a FakeTwilio that stamps every calls.create"""
+
+    def __init__(self, platform):
+        self.platform = platform
+        self.created = []
+        self._lock = threading.Lock()
+
+    @property
+    def calls(self):
+        return self
+
+    def create(self, **params):
+        with self._lock:
+            self.created.append((time.monotonic(), params))
+        return self.platform.calls.create(**params)
+
+    def __call__(self, sid):
+        return self.platform.calls(sid)
+
+
+class CountingRunner(BatchRunner):
+    """Keeps the largest number of trials that ran at once"""
+
+    active = peak = 0
+    _count_lock = threading.Lock()
+
+    def run_trial(self, config_key, trial):
+        with self._count_lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            return super().run_trial(config_key, trial)
+        finally:
+            with self._count_lock:
+                self.active -= 1
+
+
+def test_cps_cap_and_concurrency():
+    platform = FakeTwilio(Recorder(), time_scale=0, scenario='human')
+    client = TimedClient(platform)
+    runner = CountingRunner(client, CONFIGURATIONS, '+15017122661', '+15125550000',
+                            concurrency=3, calls_per_second=20, poll_interval=0.01, wait_timeout=10)
+    try:
+        summary = runner.run(trials=5)
+    finally:
+        platform.close()
+    assert len(summary.results) == len(client.created) == 10
+    times = [at for at, _ in client.created]
+    # 20 calls per second with no burst: at least 50ms between creates
+    assert all(b - a >= 0.045 for a, b in zip(times, times[1:]))
+    assert runner.peak == 3
+
+
+def test_results_per_configuration(make_app):
+    app = make_app('advanced')
+    platform = FakeTwilio(FlaskTransport(app), time_scale=0, seed=2, scenario='greeting')
+    client = TimedClient(platform)
+    runner = BatchRunner(client, CONFIGURATIONS, '+15017122661', '+15125550000',
+                         bus=app.extensions['amd_server'].bus, concurrency=4, calls_per_second=1000,
+                         wait_timeout=10)
+    seen = []
+    try:
+        summary = runner.run(trials=3, on_result=lambda result, summary: seen.append(len(summary.results)),
+                             first_trial=4)
+    finally:
+        platform.close()
+    assert seen == list(range(1, 7))
+    assert not any(result.error for result in summary.results)
+    assert {(r.config_key, r.trial) for r in summary.results} == {
+        (key, n) for key in CONFIGURATIONS for n in (4, 5, 6)}
+    for result in summary.results:
+        call = platform.fetch_call(result.call_sid)
+        # Answered from the callback, which matches what the platform decided for that call
+        assert result.source == 'webhook'
+        assert (result.answered_by, result.detection_ms) == (call.answered_by, int(call.machine_detection_duration))
+        assert result.answered_by.startswith('machine_')
+    for _, params in client.created:
+        tags = dict(parse_qsl(urlsplit(params['async_amd_status_callback']).query))
+        assert tags['AmdConfig'] in CONFIGURATIONS and tags['AmdTrial'] in {'4', '5', '6'}
+    rows = {key: (trials, outcomes, errors) for key, trials, outcomes, _, errors in summary.rows()}
+    assert set(rows) == set(CONFIGURATIONS)
+    for trials, outcomes, errors in rows.values():
+        assert trials == 3 and sum(outcomes.values()) == 3 and errors == 0
+
+
+def test_rest_polling_without_a_bus():
+    platform = FakeTwilio(Recorder(), time_scale=0, scenario='human')
+    runner = BatchRunner(platform, CONFIGURATIONS, '+15017122661', '+15125550000',
+                         calls_per_second=1000, poll_interval=0.01, wait_timeout=10)
+    try:
+        summary = runner.run(['fast'], trials=2)
+    finally:
+        platform.close()
+    assert [(r.config_key, r.source, r.answered_by) for r in summary.results] == [('fast', 'rest', 'human')] * 2
+    assert summary.rows()[0][:3] == ('fast', 2, {'human': 2})
@@ -0,0 +1,94 @@
+import time
+
+from amd_server.calls import COMPLETED, EVICTED, INCOMPLETE, CallTracker
+from amd_server.webhook import ADVANCED_FIELDS, decode_form
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class ListWriter:
+    def __init__(self):
+        self.records = []
+
+    def write(self, records):
+        self.records.extend(records)
+
+    def close(self):
+        pass
+
+
+def status(sid, call_status, **fields):
+    form = {'CallSid': sid, 'CallStatus': call_status, 'ToCountry': 'US', 'ToState': 'TX', **fields}
+    return decode_form('POST', form, ADVANCED_FIELDS)
+
+
+def amd(sid, answered_by='human', duration='1800'):
+    return decode_form('POST', {'CallSid': sid, 'AnsweredBy': answered_by,
+                                'MachineDetectionDuration': duration}, ADVANCED_FIELDS, {'AmdConfig': 'fast'})
+
+
+def test_record_merges_status_and_amd():
+    clock = Clock()
+    writer = ListWriter()
+    tracker = CallTracker([writer], grace=30, clock=clock, sweeper=False)
+    for offset, event in ((0, status('CA1', 'initiated')), (2, status('CA1', 'ringing')),
+                          (5, status('CA1', 'in-progress')), (7, amd('CA1')),
+                          (20, status('CA1', 'completed', CallDuration='15'))):
+        tracker.observe(event, clock.now + offset)
+    record = tracker.get('CA1')
+    assert record['time_to_answer_s'] == 5 and record['time_to_amd_s'] == 2
+    assert record['outcome'] == 'human' and record['config_key'] == 'fast' and record['duration_s'] == 15
+    tracker.sweep(clock.now + 49)
+    assert tracker.get('CA1') is not None
+    tracker.sweep(clock.now + 50)
+    assert tracker.get('CA1') is None
+    tracker.close()
+    assert [r['state'] for r in writer.records] == [COMPLETED]
+
+
+def test_idle_calls_are_finalized_and_checks_released():
+    clock = Clock()
+    tracker = CallTracker(idle_ttl=100, clock=clock, sweeper=False)
+    tracker.observe(status('CA1', 'ringing'), clock.now)
+    tracker.observe(status('CA2', 'ringing'), clock.now)
+    tracker.observe(status('CA2', 'in-progress'), clock.now + 60)
+    tracker.sweep(clock.now + 100)
+    assert tracker.get('CA1') is None and tracker.get('CA2') is not None
+    tracker.sweep(clock.now + 160)
+    assert tracker.get('CA2') is None
+    assert tracker.stats()['finalized'][INCOMPLETE] == 2
+    # Calls that end leave nothing behind in the idle checks
+    for n in range(1000):
+        tracker.observe(status(f'CB{n}', 'completed'), clock.now + 200)
+    assert len(tracker._idle) == 0
+    tracker.sweep(clock.now + 300)
+    assert tracker.stats()['active'] == 0 and tracker.stats()['ending'] == 0
+    tracker.close()
+
+
+def test_eviction_releases_idle_check():
+    tracker = CallTracker(max_calls=2, sweeper=False)
+    for sid in ('CA1', 'CA2', 'CA3'):
+        tracker.observe(status(sid, 'ringing'))
+    assert tracker.get('CA1') is None
+    assert list(tracker._idle) == ['CA2', 'CA3']
+    assert tracker.stats()['finalized'][EVICTED] == 1
+    tracker.close()
+
+
+def test_timer_sweeps_without_callbacks():
+    writer = ListWriter()
+    tracker = CallTracker([writer], grace=0.05, sweep_interval=0.02)
+    tracker.observe(status('CA1', 'completed'))
+    deadline = time.monotonic() + 5
+    while tracker.get('CA1') is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert tracker.get('CA1') is None
+    tracker.close()
+    assert [r['call_sid'] for r in writer.records] == ['CA1']
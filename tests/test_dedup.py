@@ -0,0 +1,78 @@
+from amd_server.dedup import DedupCache, SharedKeys, callback_key
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_repeats_get_the_first_response():
+    cache = DedupCache(max_entries=10, ttl=60)
+    key = callback_key('/webhook', {'CallSid': 'CA1', 'SequenceNumber': '2', 'CallbackSource': 'call-progress-events'})
+    assert cache.check(key, 'first') is None
+    assert cache.check(key, 'second') == 'first'
+    assert cache.check(None, 'x') is None
+    assert callback_key('/webhook', {}) is None
+    assert cache.stats()['hits'] == 1
+
+
+def test_entries_expire_and_are_capped():
+    clock = Clock()
+    cache = DedupCache(max_entries=2, ttl=10, clock=clock)
+    for key in ('a', 'b', 'c'):
+        assert cache.check(key, key) is None
+    assert cache.stats()['entries'] == 2
+    assert cache.check('a', 'again') is None
+    clock.now += 11
+    assert cache.check('c', 'later') is None
+    assert cache.stats()['entries'] == 1
+
+
+def test_shared_keys_catch_retries_seen_by_another_worker(tmp_path):
+    path = str(tmp_path / 'dedup.db')
+    clock = Clock()
+    first = DedupCache(ttl=60, shared=SharedKeys(path, clock=clock))
+    second = DedupCache(ttl=60, shared=SharedKeys(path, clock=clock))
+    try:
+        assert first.check('/handle_amd|CA1||human', 'twiml') is None
+        # The retry lands on the other worker, which never saw the first delivery
+        assert second.check('/handle_amd|CA1||human', 'twiml') == 'twiml'
+        assert second.stats()['shared']['hits'] == 1
+        assert second.stats()['hits'] == 1 and second.stats()['misses'] == 0
+        assert second.check('/handle_amd|CA2||human', 'twiml') is None
+        # A key the shared table has let expire can be claimed again
+        clock.now += 61
+        assert DedupCache(ttl=60, shared=SharedKeys(path, clock=clock)).check('/handle_amd|CA1||human', 'x') is None
+    finally:
+        first.close()
+        second.close()
+
+
+def test_unreachable_table_fails_open(tmp_path):
+    shared = SharedKeys(str(tmp_path / 'dedup.db'))
+    shared.close()
+    cache = DedupCache(shared=shared)
+    assert cache.check('k', 'r') is None
+    assert cache.stats()['shared']['errors'] == 1
+
+
+def test_shared_dedup_across_apps(make_app, tmp_path):
+    db = tmp_path / 'dedup.db'
+    apps = [make_app('manual', AMD_DEDUP_SHARED=db) for _ in range(2)]
+    form = {'CallSid': 'CA' + '3' * 32, 'AnsweredBy': 'human', 'CallStatus': 'in-progress'}
+    bodies = [app.test_client().post('/handle_amd', data=form).get_data() for app in apps]
+    assert bodies[0] == bodies[1]
+    results = [app.extensions['amd_server'].metrics.summary()['configs'] for app in apps]
+    assert sum(entry['results'] for configs in results for entry in configs) == 1
+    status = apps[1].test_client().get('/status').get_json()
+    assert status['dedup']['shared']['hits'] == 1
+    metrics = apps[1].test_client().get('/metrics').get_data(as_text=True)
+    assert 'amd_dedup_shared_hits_total 1' in metrics
+
+
+def test_disabled(make_app):
+    app = make_app('advanced', AMD_DEDUP_SIZE=0)
+    assert app.extensions['amd_server'].dedup is None
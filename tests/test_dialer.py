@@ -0,0 +1,241 @@
+import collections
+import json
+import threading
+import time
+
+import pytest
+
+from amd_server.dialer import Checkpoint, Dialer, RetryPolicy, assigner, read_destinations
+from amd_server.fake_twilio import FakeTwilio
+
+from conftest import Recorder
+
+CONFIGURATIONS = {key: {'name': key, 'params': {
+    'url': 'http://amd.test/silent', 'machine_detection': 'Enable', 'async_amd': True,
+    'async_amd_status_callback': 'http://amd.test/webhook'}} for key in ('control', 'candidate')}
+CALLER_IDS = ['+15017122661', '+15017122662']
+BUSY = '+15125550001'
+
+
+class Stop(Exception):
+    pass
+
+
+class CountingClient:
+    """Twilio client stand-in around a FakeTwilio that keeps (to, from, time) of every calls.create"""
+
+    def __init__(self, platform):
+        self.platform = platform
+        self.created = []
+        self._lock = threading.Lock()
+
+    @property
+    def calls(self):
+        return self
+
+    def create(self, **params):
+        with self._lock:
+            self.created.append((params['to'], params['from_'], time.monotonic()))
+        return self.platform.calls.create(**params)
+
+    def __call__(self, sid):
+        return self.platform.calls(sid)
+
+
+@pytest.fixture
+def platform():
+    platform = FakeTwilio(Recorder(), time_scale=0, scenario='human', numbers={BUSY: 'busy'})
+    yield platform
+    platform.close()
+
+
+def rows(count):
+    return [{'to': f'+1512555{n:04d}'} for n in range(count)]
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_restart_resumes_without_redialing(platform, tmp_path):
+    path = str(tmp_path / 'run.jsonl')
+    client = CountingClient(platform)
+    finished = threading.Event()
+
+    def on_result(result, summary):
+        if summary.attempts == 4:
+            finished.set()
+
+    def stop_after_six(checkpoint):
+        # Rows 0-3 end (row 1 busy, to be redialed); rows 4-5 are still up when the run stops
+        yield from rows(10)[:4]
+        assert finished.wait(10)
+        yield from rows(10)[4:6]
+        while checkpoint.dials < 6:
+            time.sleep(0.001)
+        raise Stop
+
+    checkpoint = Checkpoint(path)
+    dialer = Dialer(client, CONFIGURATIONS, CALLER_IDS, calls_per_second=None, poll_interval=1,
+                    retry=RetryPolicy(max_attempts=2, delay=2), checkpoint=checkpoint)
+    with pytest.raises(Stop):
+        dialer.run(stop_after_six(checkpoint), on_result=on_result)
+    dialer.close()
+    assert len(client.created) == 6
+
+    checkpoint = Checkpoint(path)
+    assert checkpoint.done == {0, 2, 3}
+    assert set(checkpoint.retries) == {1} and set(checkpoint.in_flight) == {4, 5}
+    retry_at = checkpoint.retries[1]['retry_at']
+    assert retry_at > time.time()
+    dialer = Dialer(client, CONFIGURATIONS, CALLER_IDS, calls_per_second=None, poll_interval=0.01,
+                    retry=RetryPolicy(max_attempts=2, delay=2), checkpoint=checkpoint)
+    summary = dialer.run(rows(10))
+    dialer.close()
+    assert (summary.skipped, summary.resumed, summary.finished) == (3, 2, 7)
+
+    dialed = collections.Counter(to for to, _, _ in client.created)
+    assert dialed[BUSY] == 2 and all(count == 1 for to, count in dialed.items() if to != BUSY)
+    assert len(dialed) == 10
+    records = read_records(path)
+    dials = [(record['index'], record['attempt']) for record in records if record['event'] == 'dial']
+    assert len(dials) == len(set(dials)) == 11
+    # The redial went out on the schedule set before the restart, not at once
+    redial = [record for record in records if record['event'] == 'dial' and record['attempt'] == 2]
+    assert redial[0]['at'] >= retry_at
+    assert [record['status'] for record in records if record['event'] == 'result' and record['index'] == 1] == [
+        'busy', 'busy']
+
+    # A third run finds every row done
+    checkpoint = Checkpoint(path)
+    dialer = Dialer(client, CONFIGURATIONS, CALLER_IDS, checkpoint=checkpoint)
+    summary = dialer.run(rows(10))
+    dialer.close()
+    assert (summary.skipped, summary.attempts, len(client.created)) == (10, 0, 11)
+
+
+def test_checkpoint_drops_a_torn_line(tmp_path):
+    path = tmp_path / 'run.jsonl'
+    path.write_text('{"event":"result","index":0,"attempt":1,"retry_at":null}\n'
+                    '{"event":"dial","index":1,"attempt":1,"to":"+15125550001","from":null,"con')
+    checkpoint = Checkpoint(str(path))
+    checkpoint.close()
+    assert checkpoint.done == {0} and not checkpoint.in_flight
+    assert path.read_text().endswith('"retry_at":null}\n')
+
+
+def test_busy_and_no_answer_are_redialed_with_backoff(tmp_path):
+    platform = FakeTwilio(Recorder(), time_scale=0, scenario='human',
+                          numbers={BUSY: 'busy', '+15125550002': 'no-answer'})
+    client = CountingClient(platform)
+    dialer = Dialer(client, CONFIGURATIONS, CALLER_IDS, calls_per_second=None, poll_interval=0.01,
+                    retry=RetryPolicy(max_attempts=3, delay=0.1, backoff=2))
+    try:
+        summary = dialer.run(rows(3))
+    finally:
+        dialer.close()
+        platform.close()
+    dialed = collections.defaultdict(list)
+    for to, _, at in client.created:
+        dialed[to].append(at)
+    assert len(dialed['+15125550000']) == 1
+    for to in (BUSY, '+15125550002'):
+        first, second, third = dialed[to]
+        assert second - first >= 0.1 and third - second >= 0.2
+    assert summary.attempts == 7 and summary.finished == 3
+    assert RetryPolicy(delay=300).retry_after('busy', 1) == 300
+    assert RetryPolicy(delay=300).retry_after('busy', 2) == 600
+    assert RetryPolicy().retry_after('busy', 3) is None
+    assert RetryPolicy().retry_after('failed', 1) is None
+
+
+def test_account_and_caller_id_pacing(platform):
+    client = CountingClient(platform)
+    dialer = Dialer(client, CONFIGURATIONS, CALLER_IDS, calls_per_second=40, caller_id_cps=10,
+                    poll_interval=0.01, max_concurrent=20, retry=RetryPolicy(max_attempts=1))
+    try:
+        dialer.run(rows(12))
+    finally:
+        dialer.close()
+    times = sorted(at for _, _, at in client.created)
+    # 12 calls at 10/s per caller ID from two IDs: the per-ID limit binds, not the 40/s account limit
+    assert times[-1] - times[0] >= 0.45
+    by_caller = collections.defaultdict(list)
+    for _, caller_id, at in client.created:
+        by_caller[caller_id].append(at)
+    assert set(by_caller) == set(CALLER_IDS)
+    for stamps in by_caller.values():
+        assert all(b - a >= 0.09 for a, b in zip(stamps, stamps[1:]))
+
+    client = CountingClient(platform)
+    dialer = Dialer(client, CONFIGURATIONS, CALLER_IDS, calls_per_second=20, poll_interval=0.01, max_concurrent=20,
+                    retry=RetryPolicy(max_attempts=1))
+    try:
+        dialer.run(rows(8))
+    finally:
+        dialer.close()
+    times = sorted(at for _, _, at in client.created)
+    assert all(b - a >= 0.045 for a, b in zip(times, times[1:]))
+
+
+def test_concurrency_cap(platform):
+    client = CountingClient(platform)
+    ended = []
+    up = []
+
+    def on_result(result, summary):
+        ended.append(result)
+
+    def create(**params):
+        # Calls up at this moment: placed but not reported back yet
+        up.append(len(client.created) - len(ended) + 1)
+        return CountingClient.create(client, **params)
+
+    client.create = create
+    dialer = Dialer(client, CONFIGURATIONS, CALLER_IDS, calls_per_second=None, poll_interval=0.05,
+                    max_concurrent=3, retry=RetryPolicy(max_attempts=1))
+    try:
+        dialer.run(rows(12), on_result=on_result)
+    finally:
+        dialer.close()
+    assert len(ended) == 12
+    assert max(up) == 3
+
+
+def test_assignment_strategies():
+    destinations = [{'to': f'+1512555{n:04d}'} for n in range(4000)]
+    round_robin = assigner('round-robin', ['control', 'candidate'])
+    assert [round_robin(n, d) for n, d in enumerate(destinations[:4])] == ['control', 'candidate'] * 2
+
+    weighted = assigner('weighted', ['control', 'candidate'], {'control': 3, 'candidate': 1}, seed=1)
+    shares = collections.Counter(weighted(n, d) for n, d in enumerate(destinations))
+    assert 0.72 < shares['control'] / len(destinations) < 0.78
+    # By number, not by position
+    assert weighted(0, destinations[7]) == weighted(7, destinations[7])
+
+    ab = assigner('ab', ['control', 'candidate'], split=0.1, seed=1)
+    shares = collections.Counter(ab(n, d) for n, d in enumerate(destinations))
+    assert 0.08 < shares['candidate'] / len(destinations) < 0.12
+    assert [ab(n, d) for n, d in enumerate(destinations)] == [
+        assigner('ab', ['control', 'candidate'], split=0.1, seed=1)(n, d) for n, d in enumerate(destinations)]
+
+    with pytest.raises(ValueError):
+        assigner('ab', ['control'])
+    with pytest.raises(ValueError):
+        assigner('weighted', ['control'], {'control': 0})
+    with pytest.raises(ValueError):
+        assigner('random', ['control'])
+
+
+def test_read_destinations(tmp_path):
+    bare = tmp_path / 'bare.csv'
+    bare.write_text('+15125550000\n\n+15125550001,x\n')
+    assert list(read_destinations(str(bare))) == [{'to': '+15125550000'}, {'to': '+15125550001'}]
+    headed = tmp_path / 'headed.csv'
+    headed.write_text('Number, Config ,country\n+15125550000,candidate,US\n')
+    assert list(read_destinations(str(headed))) == [{'to': '+15125550000', 'config': 'candidate', 'country': 'US'}]
+    lines = tmp_path / 'rows.jsonl'
+    lines.write_text('"+15125550000"\n{"to": "+15125550001", "from": "+15017122662"}\n')
+    assert list(read_destinations(str(lines))) == [{'to': '+15125550000'},
+                                                    {'to': '+15125550001', 'from': '+15017122662'}]
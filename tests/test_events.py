@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+
+from amd_server.events import EventBus, event_message
+from amd_server.webhook import ADVANCED_FIELDS, decode_form
+
+SID = 'CA' + '3' * 32
+OTHER = 'CA' + '4' * 32
+
+
+def message(call_sid=SID, **fields):
+    return dict({'type': 'STATUS_CALLBACK', 'call_sid': call_sid, 'call_status': None, 'answered_by': None},
+                **fields)
+
+
+def amd_message(call_sid=SID, answered_by='machine_start'):
+    event = decode_form('POST', {'CallSid': call_sid, 'AnsweredBy': answered_by,
+                                 'MachineDetectionDuration': '2400'}, ADVANCED_FIELDS, {'AmdConfig': 'fast'})
+    return event_message(event, received_at=1.5)
+
+
+def test_call_subscribers_only_see_their_call():
+    bus = EventBus()
+    one, wildcard = bus.subscribe(SID), bus.subscribe()
+    bus.publish(message(call_status='ringing'))
+    bus.publish(message(OTHER, call_status='ringing'))
+    assert one.get(0)['call_sid'] == SID and one.get(0) is None
+    assert [wildcard.get(0)['call_sid'], wildcard.get(0)['call_sid']] == [SID, OTHER]
+    assert bus.stats()['subscribers'] == 2
+    one.close()
+    wildcard.close()
+    assert bus.stats() == {'published': 2, 'subscribers': 0, 'amd_results': 0, 'streams': 0,
+                           'streams_refused': 0}
+
+
+def test_amd_message_fields():
+    assert amd_message() == {
+        'type': 'AMD_RESULT', 'call_sid': SID, 'call_status': None, 'answered_by': 'machine_start',
+        'detection_ms': '2400', 'config_key': 'fast', 'received_at': 1.5,
+        'params': {'CallSid': SID, 'AnsweredBy': 'machine_start', 'MachineDetectionDuration': '2400',
+                   'AmdConfig': 'fast'}}
+
+
+def test_wait_for_amd():
+    bus = EventBus()
+    # Arrived before anyone waited: answered from the result table at once
+    bus.publish(amd_message())
+    assert bus.wait_for_amd(SID, timeout=0)['answered_by'] == 'machine_start'
+
+    # Arrives while waiting; status callbacks of the call do not end the wait
+    def publish():
+        while bus.stats()['subscribers'] == 0:
+            time.sleep(0.001)
+        bus.publish(message(OTHER, call_status='in-progress'))
+        bus.publish(amd_message(OTHER, 'human'))
+
+    thread = threading.Thread(target=publish)
+    thread.start()
+    assert bus.wait_for_amd(OTHER, timeout=5)['answered_by'] == 'human'
+    thread.join()
+
+    started = time.monotonic()
+    assert bus.wait_for_amd('CA' + '5' * 32, timeout=0.05) is None
+    assert time.monotonic() - started >= 0.05
+    assert bus.stats()['subscribers'] == 0
+
+
+def test_result_table_is_bounded():
+    bus = EventBus(max_results=2)
+    for n in range(3):
+        bus.publish(amd_message(f'CA{n}'))
+    assert bus.amd_result('CA0') is None and bus.amd_result('CA2') is not None
+    assert bus.stats()['amd_results'] == 2
+
+
+def test_slow_subscriber_drops_overflow():
+    bus = EventBus(subscriber_queue=3)
+    slow, fast = bus.subscribe(), bus.subscribe(maxsize=10)
+    for n in range(5):
+        bus.publish(message(call_status=str(n)))
+    assert [slow.get(0)['call_status'] for _ in range(3)] == ['0', '1', '2'] and slow.get(0) is None
+    assert slow.dropped == 2
+    assert fast.dropped == 0 and len([fast.get(0) for _ in range(5)]) == 5
+
+
+def test_events_stream_framing(make_app):
+    app = make_app('advanced')
+    bus = app.extensions['amd_server'].bus
+    client = app.test_client()
+    assert client.post('/webhook', data={'CallSid': SID, 'AnsweredBy': 'human',
+                                         'MachineDetectionDuration': '1700'}).status_code == 200
+
+    def finish_call():
+        while bus.stats()['subscribers'] == 0:
+            time.sleep(0.001)
+        client.post('/webhook', data={'CallSid': OTHER, 'CallStatus': 'completed'})
+        client.post('/webhook', data={'CallSid': SID, 'CallStatus': 'completed', 'CallDuration': '9'})
+
+    thread = threading.Thread(target=finish_call)
+    thread.start()
+    response = client.get(f'/events?call_sid={SID}', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    body = b''.join(response.response).decode()
+    response.close()
+    thread.join()
+
+    frames = body.split('\n\n')
+    assert frames[0] == 'retry: 3000' and frames[-1] == ''
+    events = []
+    for frame in frames[1:-1]:
+        kind, data = frame.split('\n')
+        assert kind.startswith('event: ') and data.startswith('data: ')
+        events.append((kind[len('event: '):], json.loads(data[len('data: '):])))
+    # The cached AMD result first, then the call's own messages until it ends
+    assert [(kind, data['call_sid'], data['answered_by'], data['call_status']) for kind, data in events] == [
+        ('AMD_RESULT', SID, 'human', None), ('STATUS_CALLBACK', SID, None, 'completed')]
+    assert bus.stats()['subscribers'] == 0
+
+
+def test_open_streams_are_capped(make_app):
+    assert make_app('advanced').extensions['amd_server'].bus.max_streams == 4
+    app = make_app('advanced', AMD_EVENTS_MAX_STREAMS='2')
+    bus = app.extensions['amd_server'].bus
+    client = app.test_client()
+    first = client.get('/events', buffered=False)
+    second = client.get(f'/events?call_sid={SID}', buffered=False)
+    assert first.status_code == second.status_code == 200
+    refused = client.get('/events')
+    assert refused.status_code == 503 and refused.headers['Retry-After'] == '5'
+    assert bus.stats()['streams'] == 2 and bus.stats()['streams_refused'] == 1
+    # Closing a stream frees its slot, even one the client never read
+    second.close()
+    assert bus.stats()['streams'] == 1
+    third = client.get('/events', buffered=False)
+    assert third.status_code == 200
+    third.close()
+    first.close()
+    assert bus.stats()['streams'] == 0 and bus.stats()['subscribers'] == 0
+    assert client.get('/status').get_json()['events']['streams_refused'] == 1
+
+    assert make_app('advanced', AMD_EVENTS_MAX_STREAMS='0').extensions['amd_server'].bus.max_streams is None
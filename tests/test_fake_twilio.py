@@ -0,0 +1,136 @@
+import threading
+
+import pytest
+
+from amd_server.fake_twilio import (FakeTwilio, FlaskTransport, rest_client, rest_server, smoke_run,
+                                    twiml_duration_ms)
+from amd_server.simulator import SCENARIOS, load_scenarios
+from amd_server.webhook import normalize_outcome
+
+from conftest import Recorder, call_params
+
+
+def run(seed, calls=20, **kwargs):
+    """(sid, scenario, answered_by, detection ms) of each call of a run"""
+    platform = FakeTwilio(Recorder(), time_scale=0, seed=seed, **kwargs)
+    try:
+        sids = [platform.calls.create(**call_params('advanced', to=f'+1512555{n:04d}')).sid
+                for n in range(calls)]
+        assert platform.wait(30)
+        return [(sid, platform.fetch_call(sid).scenario, platform.fetch_call(sid).answered_by,
+                 platform.fetch_call(sid).machine_detection_duration) for sid in sids]
+    finally:
+        platform.close()
+
+
+def test_runs_are_reproducible_per_seed():
+    first = run(seed=7)
+    assert run(seed=7) == first
+    other = run(seed=8)
+    assert [call[0] for call in other] != [call[0] for call in first]
+    assert [call[1:] for call in other] != [call[1:] for call in first]
+    assert {call[1] for call in first} == set(load_scenarios())
+
+
+def test_unanswered_share_leaves_scenarios_unchanged():
+    answered = run(seed=3, calls=40)
+    mixed = FakeTwilio(Recorder(), time_scale=0, seed=3, unanswered={'busy': 0.25, 'no-answer': 0.25})
+    try:
+        sids = [mixed.calls.create(**call_params('advanced', to=f'+1512555{n:04d}')).sid for n in range(40)]
+        assert mixed.wait(30)
+        statuses = [mixed.fetch_call(sid).status for sid in sids]
+        assert {'busy', 'no-answer', 'completed'} <= set(statuses)
+        for (sid, scenario, answered_by, _), status in zip(answered, statuses):
+            call = mixed.fetch_call(sid)
+            assert call.scenario == scenario
+            if status == 'completed':
+                assert call.answered_by == answered_by
+            else:
+                assert call.answered_by is None
+    finally:
+        mixed.close()
+
+    with pytest.raises(ValueError):
+        FakeTwilio(Recorder(), unanswered={'failed': 0.1})
+
+
+def test_callbacks_follow_twilio_order():
+    recorder = Recorder()
+    platform = FakeTwilio(recorder, time_scale=0, scenario='human')
+    try:
+        sid = platform.calls.create(**call_params('advanced')).sid
+        assert platform.wait(30)
+    finally:
+        platform.close()
+    sent = [(url.rsplit('/', 1)[1], params.get('CallStatus'), params.get('AnsweredBy'))
+            for _, url, params in recorder.requests]
+    statuses = [status for path, status, answered_by in sent if path == 'webhook' and answered_by is None]
+    assert statuses == ['initiated', 'ringing', 'in-progress', 'completed']
+    assert ('silent', 'in-progress', None) in sent
+    assert ('webhook', None, 'human') in sent
+    assert all(params['CallSid'] == sid for _, _, params in recorder.requests)
+    assert platform.stats()['callback_errors'] == 0
+
+
+def test_twiml_duration():
+    assert twiml_duration_ms(b'<Response><Pause length="60" /></Response>') == 60000
+    assert twiml_duration_ms(b'<Response><Say>Hi</Say><Hangup /><Pause length="9" /></Response>') > 0
+    assert twiml_duration_ms(b'<Response><Hangup /><Pause length="9" /></Response>') == 0
+    assert twiml_duration_ms(b'not xml') == 0
+
+
+@pytest.mark.parametrize('variant', ['advanced', 'manual'])
+def test_smoke_run_against_flask_app(make_app, variant):
+    app = make_app(variant)
+    server = app.extensions['amd_server']
+    platform = FakeTwilio(FlaskTransport(app), time_scale=0, seed=1)
+    try:
+        result = smoke_run(platform, 'http://amd.test', calls=12, variant=variant)
+    finally:
+        platform.close()
+    assert result['callback_errors'] == 0
+    assert result['twiml_fetches'] == 12
+    assert result['correct'] >= 10
+    # Every AMD result the platform sent was counted by the server
+    outcomes = {}
+    for entry in server.metrics.summary()['configs']:
+        for answered_by, count in entry['answered_by'].items():
+            outcomes[answered_by] = outcomes.get(answered_by, 0) + count
+    assert outcomes == result['outcomes']
+
+
+def test_rest_server_with_twilio_client(make_app):
+    pytest.importorskip('twilio')
+    app = make_app('manual')
+    platform = FakeTwilio(FlaskTransport(app), time_scale=0, scenario='greeting')
+    server = rest_server(platform)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = rest_client(f'http://127.0.0.1:{server.server_port}')
+        call = client.calls.create(**call_params('manual'))
+        assert call.sid.startswith('CA')
+        assert platform.wait(30)
+        fetched = client.calls(call.sid).fetch()
+        assert fetched.status == 'completed'
+        assert normalize_outcome(fetched.answered_by) == 'machine'
+        assert [c.sid for c in client.calls.list(limit=5)] == [call.sid]
+    finally:
+        server.shutdown()
+        server.server_close()
+        platform.close()
+
+
+def test_scenario_names_resolve():
+    platform = FakeTwilio(Recorder(), time_scale=0, scenario={'greeting': 1},
+                          numbers={'+15125550000': 'human', '+15125550001': 'busy'})
+    try:
+        human = platform.calls.create(**call_params('advanced', to='+15125550000'))
+        busy = platform.calls.create(**call_params('advanced', to='+15125550001'))
+        other = platform.calls.create(**call_params('advanced', to='+15125550002'))
+        assert platform.wait(30)
+        assert human.scenario == SCENARIOS['human']
+        assert platform.fetch_call(busy.sid).status == 'busy'
+        assert other.scenario == SCENARIOS['greeting']
+    finally:
+        platform.close()
@@ -0,0 +1,83 @@
+import json
+from urllib.parse import parse_qsl, urlsplit
+
+from amd_server.batch import build_call_params
+from amd_server.dialer import Checkpoint, Dialer, RetryPolicy
+from amd_server.fake_twilio import FakeTwilio
+from amd_server.geo import GeoRollups
+from amd_server.webhook import ADVANCED_FIELDS, decode_form
+
+from conftest import Recorder
+
+SID = 'CA' + '2' * 32
+CONFIGURATIONS = {'fast': {'name': 'Fast', 'params': {
+    'url': 'http://amd.test/silent', 'machine_detection': 'Enable', 'async_amd': True,
+    'async_amd_status_callback': 'http://amd.test/webhook'}}}
+
+
+def callback(form, url='http://amd.test/webhook'):
+    """WebhookEvent of a POST to a (possibly tagged) callback URL"""
+    return decode_form('POST', dict(form, CallSid=SID), ADVANCED_FIELDS, dict(parse_qsl(urlsplit(url).query)))
+
+
+def regions(geo):
+    return {(r['country'], r['state']): r['answered_by'] for r in geo.rollups(merged=False) if r['results']}
+
+
+def test_tagged_amd_result_keeps_its_region_in_any_worker():
+    url = build_call_params('fast', CONFIGURATIONS['fast'], '+15017122661', '+15125550000',
+                            region=('US', 'TX'))['async_amd_status_callback']
+    status = {'CallStatus': 'ringing', 'ToCountry': 'US', 'ToState': 'TX'}
+    result = {'AnsweredBy': 'human', 'MachineDetectionDuration': '1800'}
+    # Two gunicorn workers: one receives the status callbacks, the other the AMD result
+    first, second = GeoRollups(), GeoRollups()
+    first.observe(callback(status, url))
+    second.observe(callback(result, url))
+    assert regions(second) == {('US', 'TX'): {'human': 1}}
+
+    # Untagged, the second worker has no region for the call
+    untagged = GeoRollups()
+    untagged.observe(callback(result))
+    assert regions(untagged) == {('unknown', 'unknown'): {'human': 1}}
+    # ... which the worker that saw the status callbacks does
+    first.observe(callback(result))
+    assert regions(first) == {('US', 'TX'): {'human': 1}}
+
+
+def test_call_params_tags():
+    config = CONFIGURATIONS['fast']
+    params = build_call_params('fast', config, '+15017122661', '+5511987654321', region=('BR', None))
+    tags = dict(parse_qsl(urlsplit(params['async_amd_status_callback']).query))
+    assert tags == {'AmdConfig': 'fast', 'AmdMode': 'Enable', 'AmdCountry': 'BR'}
+    params = build_call_params('fast', config, '+15017122661', '+5511987654321')
+    assert 'AmdCountry' not in params['async_amd_status_callback']
+
+
+def test_dialer_tags_rows_with_a_region(tmp_path):
+    recorder = Recorder()
+    platform = FakeTwilio(recorder, time_scale=0, scenario='human', numbers={'+15125550001': 'busy'})
+    checkpoint = Checkpoint(str(tmp_path / 'run.jsonl'))
+    dialer = Dialer(platform, CONFIGURATIONS, '+15017122661', calls_per_second=1000, poll_interval=0.01,
+                    retry=RetryPolicy(max_attempts=2, delay=0), checkpoint=checkpoint)
+    rows = [{'to': '+15125550000', 'country': 'US', 'state': 'TX'}, {'to': '+15125550001', 'country': 'US'},
+            {'to': '+15125550002'}]
+    try:
+        summary = dialer.run(rows)
+        # The AMD callback has no To field: the number comes from the platform's record of the call
+        tags = {}
+        for _, url, params in recorder.requests:
+            query = dict(parse_qsl(urlsplit(url).query))
+            if 'AmdConfig' in query:
+                to = platform.fetch_call(params['CallSid']).to
+                tags.setdefault(to, set()).add((query.get('AmdCountry'), query.get('AmdState')))
+    finally:
+        dialer.close()
+        platform.close()
+    assert summary.attempts == 4
+    # The redial of the busy number is tagged like its first attempt
+    assert tags == {'+15125550000': {('US', 'TX')}, '+15125550001': {('US', None)},
+                    '+15125550002': {(None, None)}}
+    with open(tmp_path / 'run.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    assert {record['to']: record['region'] for record in records} == {
+        '+15125550000': ['US', 'TX'], '+15125550001': ['US', None], '+15125550002': None}
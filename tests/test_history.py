@@ -0,0 +1,116 @@
+import sqlite3
+import threading
+
+import pytest
+
+from amd_server.fake_twilio import FakeTwilio, rest_server
+from amd_server.history import CALL_RESOURCE, HistoryFetcher, RestError, RestSession
+from amd_server.store import ResultStore
+
+from conftest import Recorder, call_params
+
+pytest.importorskip('requests')
+
+
+@pytest.fixture
+def platform():
+    """A fake platform with 25 finished calls, served over HTTP"""
+    platform = FakeTwilio(Recorder(), time_scale=0, seed=5)
+    for n in range(25):
+        platform.calls.create(**call_params('advanced', to=f'+1415555{n:04d}'))
+    assert platform.wait(30)
+    yield platform
+    platform.close()
+
+
+def serve(platform, **options):
+    server = rest_server(platform, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def rest(platform):
+    server = serve(platform)
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def session(base_url, **options):
+    return RestSession('AC' + '0' * 32, 'fake', base_url=base_url, **options)
+
+
+def test_fetch_range_pages_and_stores(platform, rest, tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'))
+    fetcher = HistoryFetcher(session(rest), store, workers=4, page_size=10)
+    try:
+        results = list(fetcher.fetch_range('2000-01-01'))
+        assert len(results) == 25
+        for result in results:
+            assert result['answered_by'] == platform.fetch_call(result['call_sid']).answered_by
+            assert result['machine_detection_duration'] is not None
+        # Three pages of at most 10
+        assert fetcher.stats()['requests'] == 3
+        # A second run skips what is already stored
+        assert list(fetcher.fetch_range('2000-01-01')) == []
+        assert fetcher.stats()['skipped'] == 25
+        assert fetcher.stats()['store_dropped'] == 0
+    finally:
+        fetcher.close()
+    rows = store.query("SELECT call_sid, answered_by FROM callbacks WHERE webhook_type = ?", (CALL_RESOURCE,))
+    assert len(rows) == 25
+    store.close()
+
+
+def test_rows_the_store_drops_are_counted(platform, rest, tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'), maxsize=1)
+    # Hold the write lock: the store's writer blocks and its queue fills up
+    blocker = sqlite3.connect(store.path, isolation_level=None)
+    blocker.execute('BEGIN EXCLUSIVE')
+    fetcher = HistoryFetcher(session(rest), store, workers=4)
+    try:
+        sids = [call.sid for call in platform.list_calls()]
+        assert len(list(fetcher.fetch(sids, skip_stored=False))) == 25
+        dropped = fetcher.stats()['store_dropped']
+        assert dropped > 0 and store.stats()['dropped'] == dropped
+    finally:
+        blocker.rollback()
+        blocker.close()
+        fetcher.close()
+    assert store.stats()['inserted'] == 25 - dropped
+    store.close()
+
+
+def test_fetch_by_sid_retries_throttled_requests(platform, tmp_path):
+    sids = [call.sid for call in platform.list_calls()]
+    server = serve(platform, requests_per_second=100, burst=1)
+    delays = []
+
+    def sleep(seconds):
+        delays.append(seconds)
+        threading.Event().wait(0.02)
+
+    fetcher = HistoryFetcher(session(f'http://127.0.0.1:{server.server_port}', sleep=sleep, max_retries=50,
+                                     pool_size=4), workers=4)
+    try:
+        results = list(fetcher.fetch(sids + ['CA' + 'f' * 32]))
+    finally:
+        fetcher.close()
+        server.shutdown()
+        server.server_close()
+    errors = [result for result in results if result.get('error')]
+    assert len(results) == 26 and len(errors) == 1
+    assert '404' in errors[0]['error']
+    assert {result['call_sid'] for result in results if not result.get('error')} == set(sids)
+    stats = fetcher.stats()
+    assert stats['fetched'] == 25 and stats['errors'] == 1
+    # Throttled requests were retried, honouring Retry-After
+    assert stats['retries'] == len(delays) > 0
+    assert min(delays) >= 1.0
+
+
+def test_non_retryable_errors_raise(rest):
+    with pytest.raises(RestError) as raised:
+        session(rest).get_json('/2010-04-01/Accounts/AC0/Nothing.json')
+    assert raised.value.status == 404
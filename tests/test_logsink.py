@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from amd_server.batching import BLOCK, DROP
+from amd_server.logsink import JsonlFileWriter, LogSink
+
+
+class GatedWriter:
+    """Writer that holds the writer thread in write() until the gate opens"""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.entered = threading.Event()
+        self.records = []
+        self.closed = False
+
+    def write(self, records):
+        self.entered.set()
+        self.gate.wait(10)
+        self.records.extend(records)
+
+    def close(self):
+        self.closed = True
+
+
+def stalled_sink(policy, **kwargs):
+    """LogSink whose writer thread is busy with a first record, with room for two more"""
+    writer = GatedWriter()
+    sink = LogSink([writer], maxsize=2, policy=policy, batch_size=1, **kwargs)
+    assert sink.emit('event', n=0)
+    assert writer.entered.wait(5)
+    assert sink.emit('event', n=1) and sink.emit('event', n=2)
+    return sink, writer
+
+
+def test_drop_policy_counts_what_it_discards():
+    sink, writer = stalled_sink(DROP)
+    started = time.monotonic()
+    assert not sink.emit('event', n=3) and not sink.emit('event', n=4)
+    assert time.monotonic() - started < 0.5
+    assert sink.stats()['dropped'] == 2 and sink.stats()['policy'] == DROP
+    writer.gate.set()
+    sink.close()
+    assert [record['n'] for record in writer.records] == [0, 1, 2]
+    assert writer.closed
+
+
+def test_block_policy_waits_for_room():
+    sink, writer = stalled_sink(BLOCK, block_timeout=0.1)
+    # Still full when the timeout expires: dropped and counted
+    started = time.monotonic()
+    assert not sink.emit('event', n=3)
+    assert time.monotonic() - started >= 0.1 and sink.stats()['dropped'] == 1
+
+    # Room frees up while waiting: accepted
+    threading.Timer(0.05, writer.gate.set).start()
+    assert sink.emit('event', n=4)
+    sink.close()
+    assert [record['n'] for record in writer.records] == [0, 1, 2, 4]
+    assert sink.stats()['dropped'] == 1
+
+    with pytest.raises(ValueError):
+        LogSink([], policy='wait')
+
+
+def test_close_flushes_pending_records(tmp_path):
+    path = tmp_path / 'amd.jsonl'
+    sink = LogSink([JsonlFileWriter(str(path))], flush_interval=60)
+    for n in range(500):
+        sink.emit('event', n=n, ts=1000.0)
+    sink.close()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record['n'] for record in records] == list(range(500))
+    assert records[0] == {'n': 0, 'ts': 1000.0, 'kind': 'event'}
+    assert sink.stats()['queued'] == 0 and sink.stats()['write_errors'] == 0
+
+
+def test_file_rotation_by_bytes(tmp_path):
+    path = str(tmp_path / 'amd.jsonl')
+    line = len(json.dumps({'kind': 'event', 'note': 'x' * 40}, separators=(',', ':')).encode()) + 1
+    writer = JsonlFileWriter(path, max_bytes=line * 3, backup_count=2)
+    for n in range(10):
+        writer.write([{'kind': 'event', 'note': 'x' * 40}])
+    writer.close()
+    assert sorted(os.listdir(tmp_path)) == ['amd.jsonl', 'amd.jsonl.1', 'amd.jsonl.2']
+    sizes = [os.path.getsize(path + suffix) for suffix in ('', '.1', '.2')]
+    # Ten lines, three to a file: the oldest rotated file was discarded
+    assert sizes == [line, line * 3, line * 3]
+
+    # Reopening appends and keeps counting from the size on disk
+    writer = JsonlFileWriter(path, max_bytes=line * 3, backup_count=2)
+    writer.write([{'kind': 'event', 'note': 'x' * 40}] * 2)
+    writer.write([{'kind': 'event', 'note': 'x' * 40}])
+    writer.close()
+    assert os.path.getsize(path) == line and os.path.getsize(path + '.1') == line * 3
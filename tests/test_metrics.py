@@ -0,0 +1,56 @@
+import threading
+
+from amd_server.metrics import Metrics
+from amd_server.webhook import ADVANCED_FIELDS, decode_form
+
+
+def amd_event(answered_by='human', duration='1800', config='residential_fast'):
+    form = {'CallSid': 'CA' + '1' * 32, 'AnsweredBy': answered_by, 'MachineDetectionDuration': duration}
+    return decode_form('POST', form, ADVANCED_FIELDS, {'AmdConfig': config})
+
+
+def test_exited_threads_are_folded():
+    metrics = Metrics()
+
+    def request():
+        metrics.observe(amd_event())
+        metrics.observe_stages('/webhook', [('decode', 0.00002), ('record', 0.00001)])
+
+    for _ in range(200):
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join()
+    assert metrics.shard_count() <= 2
+    counters, histograms = metrics.snapshot()
+    assert metrics.shard_count() == 1
+    answered = [value for (name, _), value in counters.items() if name == 'amd_answered_by_total']
+    assert answered == [200]
+    stages = {dict(labels)['stage']: sum(values[:-1]) for (name, labels), values in histograms.items()
+              if name == 'amd_request_stage_seconds'}
+    assert stages == {'decode': 200, 'record': 200}
+
+
+def test_live_threads_keep_their_shards():
+    metrics = Metrics()
+    started, release = threading.Barrier(5), threading.Event()
+
+    def worker():
+        metrics.observe(amd_event('machine_start', '2500'))
+        started.wait()
+        release.wait()
+        metrics.observe(amd_event('machine_start', '2500'))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    assert metrics.shard_count() == 5
+    summary = metrics.summary()['configs'][0]
+    assert summary['answered_by'] == {'machine_start': 4}
+    release.set()
+    for thread in threads:
+        thread.join()
+    summary = metrics.summary()['configs'][0]
+    assert summary['answered_by'] == {'machine_start': 8}
+    assert summary['detection_count'] == 8
+    assert metrics.shard_count() == 1
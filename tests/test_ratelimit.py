@@ -0,0 +1,61 @@
+import pytest
+
+from amd_server.ratelimit import TokenBucket
+
+
+class Clock:
+    """Injected clock whose sleep() only advances time"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_rate_and_burst():
+    clock = Clock()
+    bucket = TokenBucket(4, burst=3, clock=clock, sleep=clock.sleep)
+    # Starts full: a burst of 3, then nothing until a quarter second has passed
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay() == pytest.approx(0.25)
+    clock.now += 0.1
+    assert not bucket.try_acquire() and bucket.delay() == pytest.approx(0.15)
+    clock.now += 0.15
+    assert bucket.delay() == 0 and bucket.try_acquire()
+
+    # An idle bucket refills to the burst size, never beyond
+    clock.now += 60
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_acquire_sleeps_to_the_next_token():
+    clock = Clock()
+    bucket = TokenBucket(2, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire() and clock.slept == []
+    started = clock.now
+    for _ in range(4):
+        assert bucket.acquire()
+    # Rate 2/s with no burst: one token every half second
+    assert clock.now - started == pytest.approx(2.0)
+    assert all(seconds == pytest.approx(0.5) for seconds in clock.slept)
+
+
+def test_acquire_timeout():
+    clock = Clock()
+    bucket = TokenBucket(1, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire(timeout=0)
+    # The next token is a second away: a shorter timeout gives up without sleeping
+    assert not bucket.acquire(timeout=0.5) and clock.slept == []
+    assert bucket.acquire(timeout=1) and clock.slept == [pytest.approx(1.0)]
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+    assert TokenBucket(5, burst=0).burst == 1
@@ -0,0 +1,71 @@
+import glob
+import os
+
+import pytest
+
+from amd_server.capture import CAPTURE_SUFFIX, read_capture
+from amd_server.fake_twilio import FakeTwilio, FlaskTransport, smoke_run
+from amd_server.replay import FlaskTarget, Replayer
+
+
+@pytest.fixture
+def captured(make_app, amd_env, tmp_path):
+    """Capture directory of a manual-variant run of 12 simulated calls plus a /status request"""
+    directory = str(tmp_path / 'capture')
+    app = make_app('manual', AMD_CAPTURE_DIR=directory)
+    platform = FakeTwilio(FlaskTransport(app), time_scale=0, seed=4)
+    try:
+        smoke_run(platform, 'http://amd.test', calls=12, variant='manual')
+    finally:
+        platform.close()
+    # Recorded once the body has been sent
+    assert b'"uptime' in app.test_client().get('/status').get_data()
+    app.extensions['amd_server'].capture.close()
+    # Targets are built without capture
+    amd_env.delenv('AMD_CAPTURE_DIR')
+    return directory
+
+
+def test_capture_records_every_request(captured):
+    requests = list(read_capture(captured))
+    paths = {request.path for request in requests}
+    assert paths == {'/webhook', '/handle_amd', '/status'}
+    assert sum(request.path == '/handle_amd' for request in requests) == 12
+    assert all(request.status == 200 and request.response is not None for request in requests)
+    assert [request.received_at for request in requests] == sorted(request.received_at for request in requests)
+
+    # A record torn by a crash ends the file without losing the ones before it
+    path, = glob.glob(os.path.join(captured, '*' + CAPTURE_SUFFIX))
+    with open(path, 'ab') as f:
+        f.write(b'\x40\x00\x00\x00\x00\x00\x00\x00{"t":')
+    assert len(list(read_capture(captured))) == len(requests)
+
+
+def test_identical_server_replays_without_diffs(captured, make_app):
+    report = Replayer(FlaskTarget(make_app('manual')), speed=0, concurrency=1).run(read_capture(captured))
+    assert report['requests'] == len(list(read_capture(captured)))
+    assert (report['errors'], report['status_diffs'], report['body_diffs']) == (0, 0, 0)
+    assert report['examples'] == []
+    assert report['paths']['/handle_amd']['latency']['count'] == 12
+
+
+def test_changed_twiml_is_reported(captured, make_app):
+    app = make_app('manual', AMD_MESSAGE_HUMAN='Changed greeting.', AMD_MESSAGE_MACHINE='Changed voicemail.')
+    report = Replayer(FlaskTarget(app), speed=0, max_examples=3).run(read_capture(captured))
+    assert report['status_diffs'] == 0
+    assert report['paths']['/handle_amd']['body_diffs'] > 0
+    assert report['paths']['/webhook']['body_diffs'] == 0
+    assert len(report['examples']) == 3
+    for example in report['examples']:
+        assert example['url'].startswith('/handle_amd')
+        assert example['diff'].startswith('--- captured\n+++ replayed')
+        assert '+' in example['diff'] and 'Changed' in example['diff']
+
+
+def test_volatile_paths_are_not_compared(captured, make_app):
+    app = make_app('manual')
+    status = [request for request in read_capture(captured) if request.path == '/status']
+    assert Replayer(FlaskTarget(app), speed=0).run(status)['body_diffs'] == 0
+    # The same response compared as a plain path differs: uptime and counters moved on
+    report = Replayer(FlaskTarget(app), speed=0, volatile=()).run(status)
+    assert report['body_diffs'] == 1 and report['paths']['/status']['body_diffs'] == 1
@@ -0,0 +1,85 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from amd_server.screening import (ANSWERED_BY, MODES, evaluate, jitter_timelines,  # noqa: E402
+                                  pack_timelines, parameter_grid, screen)
+from amd_server.search import PARAM_BOUNDS  # noqa: E402
+from amd_server.simulator import (BEEP, EXPECTED_OUTCOMES, SILENCE, SPEECH, amd_decision,  # noqa: E402
+                                  load_scenarios)
+
+
+def random_timelines(rng, count):
+    """Speech/silence/beep timelines of 1-12 segments, including beeps at pickup and long silences"""
+    kinds = (SPEECH, SILENCE, BEEP)
+    timelines = []
+    for _ in range(count):
+        timeline = []
+        for _ in range(rng.integers(1, 13)):
+            kind = kinds[rng.choice(3, p=(0.45, 0.45, 0.1))]
+            timeline.append((kind, int(rng.integers(1, 12000 if kind != BEEP else 800))))
+        timelines.append(timeline)
+    return timelines
+
+
+def random_params(rng, count):
+    params = {name: rng.integers(low, high + 1, count) // step * step
+              for name, (low, high, step) in PARAM_BOUNDS.items()}
+    params['machine_detection'] = np.asarray(MODES)[rng.integers(0, len(MODES), count)]
+    return params
+
+
+def scalar(timeline, params, j):
+    return amd_decision(timeline, machine_detection=str(params['machine_detection'][j]),
+                        timeout=int(params['machine_detection_timeout'][j]),
+                        speech_threshold=int(params['machine_detection_speech_threshold'][j]),
+                        speech_end_threshold=int(params['machine_detection_speech_end_threshold'][j]),
+                        silence_timeout=int(params['machine_detection_silence_timeout'][j]))
+
+
+def test_matches_scalar_model_on_120k_random_pairs():
+    rng = np.random.default_rng(16)
+    timelines = random_timelines(rng, 300)
+    params = random_params(rng, 400)
+    # A chunk smaller than the parameter count exercises the chunked path
+    codes, ms = evaluate(pack_timelines(timelines), params, chunk=150)
+    assert codes.shape == (300, 400)
+    mismatches = []
+    for i, timeline in enumerate(timelines):
+        for j in range(400):
+            expected = scalar(timeline, params, j)
+            got = (ANSWERED_BY[codes[i, j]], int(ms[i, j]))
+            if got != expected:
+                mismatches.append((timeline, j, expected, got))
+    assert not mismatches[:5]
+
+
+def test_matches_scalar_model_on_jittered_scenarios():
+    scenarios = load_scenarios()
+    names = list(scenarios)
+    kinds, durations = jitter_timelines(pack_timelines([scenarios[name] for name in names]), copies=5, seed=3)
+    codes_of = {0: SPEECH, 1: SILENCE, 2: BEEP}
+    timelines = [[(codes_of[k], int(d)) for k, d in zip(row_kinds, row_durations) if d > 0]
+                 for row_kinds, row_durations in zip(kinds, durations)]
+    params = random_params(np.random.default_rng(1), 500)
+    codes, ms = evaluate((kinds, durations), params)
+    for i, timeline in enumerate(timelines):
+        for j in range(0, 500, 7):
+            assert (ANSWERED_BY[codes[i, j]], int(ms[i, j])) == scalar(timeline, params, j)
+
+
+def test_screen_ranks_the_grid():
+    params = parameter_grid(steps={'machine_detection_timeout': 28, 'machine_detection_speech_threshold': 1000,
+                                   'machine_detection_speech_end_threshold': 900,
+                                   'machine_detection_silence_timeout': 4000})
+    result, labels = screen(params=params, copies=4)
+    assert len(result) == len(params['machine_detection'])
+    assert sorted(set(labels)) == sorted(EXPECTED_OUTCOMES)
+    best = result.ranked(3)
+    assert len(best) == 3
+    assert result.score[best[0]] == result.score[result.distinct()].max()
+    front = result.pareto_front()
+    assert best[0] in front or result.accuracy[front].max() >= result.accuracy[best[0]]
+    assert set(result.shortlist(2)[0]) == set(PARAM_BOUNDS)
+    with pytest.raises(ValueError):
+        screen({'nameless': [(SPEECH, 1000)]}, {'other': 'human'})
@@ -0,0 +1,155 @@
+import collections
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from amd_server.fake_twilio import FakeTwilio
+from amd_server.search import ParameterSearch, batch_evaluator
+
+from conftest import Recorder
+
+RUNNER = {'concurrency': 8, 'calls_per_second': 1000, 'poll_interval': 0.01, 'wait_timeout': 10}
+BASE_PARAMS = {'machine_detection': 'Enable', 'url': 'http://amd.test/silent', 'async_amd': True,
+               'async_amd_status_callback': 'http://amd.test/webhook'}
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def platform():
+    recorder = Recorder()
+    platform = FakeTwilio(recorder, time_scale=0, seed=5, scenario='greeting')
+    platform.recorder = recorder
+    yield platform
+    platform.close()
+
+
+def search(path, **kwargs):
+    options = dict(expected='machine', candidates=8, eta=2, min_trials=2, seed=3, base_params=BASE_PARAMS)
+    options.update(kwargs)
+    return ParameterSearch(str(path), **options)
+
+
+def trial_tags(recorder):
+    """{config key: AmdTrial numbers} of the AMD callbacks the platform sent"""
+    tags = collections.defaultdict(list)
+    for _, url, params in recorder.requests:
+        query = dict(parse_qsl(urlsplit(url).query))
+        if params.get('AnsweredBy') and 'AmdTrial' in query:
+            tags[query['AmdConfig']].append(int(query['AmdTrial']))
+    return tags
+
+
+def test_each_rung_promotes_the_top_fraction(platform, tmp_path):
+    state = search(tmp_path / 'search.json')
+    rungs = []
+
+    def on_rung(state, survivors):
+        rung = state.rung - 1
+        eliminated = [c for c in state.candidates if c.eliminated_at == rung]
+        promoted = state.survivors
+        assert {c.key for c in promoted} == {c.key for c in survivors}
+        # Survivors all had this rung's trials, and none scored below an eliminated candidate
+        assert all(c.trials == state.rung_trials(rung) for c in promoted + eliminated)
+        scores = {c.key: c.score(state.expected, state.latency_weight) for c in promoted + eliminated}
+        if eliminated:
+            assert min(scores[c.key] for c in promoted) >= max(scores[c.key] for c in eliminated)
+        rungs.append((len(promoted) + len(eliminated), len(promoted)))
+
+    ranked = state.run(batch_evaluator(platform, '+15017122661', '+15125550000', **RUNNER), on_rung)
+    assert rungs == [(8, 4), (4, 2), (2, 1)]
+    assert [c.key for c in ranked] == [c.key for c in state.survivors] and len(ranked) == 1
+    assert state.done and state.rung == 3
+    # 8x2 + 4x2 more + 2x4 more trials, each tagged with a distinct AmdTrial per candidate
+    tags = trial_tags(platform.recorder)
+    assert sum(len(numbers) for numbers in tags.values()) == 16 + 8 + 8
+    for key, numbers in tags.items():
+        assert sorted(numbers) == list(range(1, len(numbers) + 1)), key
+    assert max(len(numbers) for numbers in tags.values()) == 8
+
+
+def test_resumed_search_skips_finished_trials(platform, tmp_path):
+    path = tmp_path / 'search.json'
+    evaluate = batch_evaluator(platform, '+15017122661', '+15125550000', **RUNNER)
+    failed = []
+    recorded = []
+
+    def interrupted(configurations, trials, first_trial, on_result):
+        def record(result):
+            if result.config_key == 'search_1' and not failed:
+                # One failed call: counted as an error, not a trial
+                failed.append(result.trial)
+                result.error = 'call failed'
+            on_result(result)
+            recorded.append(result)
+            if len(recorded) == 11:
+                raise Interrupted
+        evaluate(configurations, trials, first_trial, record)
+
+    state = search(path)
+    with pytest.raises(Interrupted):
+        state.run(interrupted)
+    assert state.rung == 0
+
+    resumed = search(path, candidates=3, seed=99)
+    assert [c.key for c in resumed.candidates] == [c.key for c in state.candidates]
+    before = {c.key: (c.trials, c.errors) for c in resumed.candidates}
+    assert sum(trials for trials, _ in before.values()) == 10
+    assert before['search_1'][1] == 1
+    calls = []
+
+    def tracking(configurations, trials, first_trial, on_result):
+        calls.append((sorted(configurations), trials, first_trial))
+        evaluate(configurations, trials, first_trial, on_result)
+
+    resumed.step(tracking)
+    for keys, trials, first_trial in calls:
+        for key in keys:
+            done, errors = before[key]
+            # Only the missing trials are placed, numbered after every earlier attempt
+            assert trials == 2 - done and first_trial == done + errors + 1
+    assert sum(trials * len(keys) for keys, trials, _ in calls) == 16 - 10
+    assert all(c.trials == 2 for c in resumed.candidates)
+    assert len(resumed.survivors) == 4 and resumed.rung == 1
+
+    # Nothing ran twice under the same AmdTrial tag except the trials that were cut off
+    counts = collections.Counter((key, n) for key, numbers in trial_tags(platform.recorder).items()
+                                 for n in numbers)
+    recorded_tags = {(r.config_key, r.trial) for r in recorded}
+    assert all(count == 1 for tag, count in counts.items() if tag in recorded_tags)
+
+
+def test_pareto_front_has_no_dominated_candidates(tmp_path):
+    # Half voicemail, half human: accuracy for 'machine' varies between parameter sets
+    platform = FakeTwilio(Recorder(), time_scale=0, seed=5, scenario={'greeting': 1, 'human': 1})
+    state = search(tmp_path / 'search.json', candidates=12, min_trials=4, max_rungs=1)
+    try:
+        state.run(batch_evaluator(platform, '+15017122661', '+15125550000', **RUNNER))
+    finally:
+        platform.close()
+    points = {c.key: (c.accuracy('machine'), c.latency_ms()) for c in state.candidates}
+
+    def dominates(a, b):
+        return a[0] >= b[0] and a[1] <= b[1] and a != b
+
+    front = state.pareto_front()
+    assert front
+    keys = {c.key for c in front}
+    for key in keys:
+        assert not any(dominates(points[other], points[key]) for other in points)
+    for key in set(points) - keys:
+        assert any(dominates(points[other], points[key]) for other in keys)
+    # Fastest first, so accuracy rises along the front
+    latencies = [c.latency_ms() for c in front]
+    assert latencies == sorted(latencies)
+    accuracies = [c.accuracy('machine') for c in front]
+    assert accuracies == sorted(accuracies)
+
+
+def test_rung_trials(tmp_path):
+    state = search(tmp_path / 'search.json', candidates=9, eta=3, min_trials=2)
+    assert [state.rung_trials(rung) for rung in range(3)] == [2, 6, 18]
+    with pytest.raises(ValueError):
+        search(tmp_path / 'other.json', expected='robot')
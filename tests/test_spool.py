@@ -0,0 +1,133 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+
+from amd_server.spool import Spool, find_call_sid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Handled:
+    def __init__(self):
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def __call__(self, entry):
+        with self._lock:
+            self.entries.append(entry)
+
+
+def test_find_call_sid():
+    assert find_call_sid(b'AccountSid=AC1&CallSid=CA12&CallStatus=ringing') == b'CA12'
+    assert find_call_sid(b'CallSid=CA9') == b'CA9'
+    assert find_call_sid(b'ParentCallSid=CA1') is None
+
+
+def test_entries_are_processed_in_order_per_call(tmp_path):
+    handled = Handled()
+    spool = Spool(str(tmp_path), handled, workers=3)
+    for n in range(300):
+        sid = f'CA{n % 7}'.encode()
+        assert spool.append(sid, 'POST', '/webhook', b'', b'CallSid=' + sid + b'&SequenceNumber=%d' % n)
+    assert spool.drain()
+    spool.close()
+    assert len(handled.entries) == 300
+    for sid in {entry.call_sid for entry in handled.entries}:
+        numbers = [int(entry.form()['SequenceNumber']) for entry in handled.entries if entry.call_sid == sid]
+        assert numbers == sorted(numbers)
+    stats = spool.stats()
+    assert stats['processed'] == 300 and stats['depth'] == 0
+
+
+def test_backpressure_refuses_then_resumes(tmp_path):
+    release = threading.Event()
+    spool = Spool(str(tmp_path), lambda entry: release.wait(5), workers=1, max_depth=5, resume_depth=2)
+    accepted = [spool.append(b'CA1', 'POST', '/webhook', b'', b'CallSid=CA1') for _ in range(8)]
+    assert accepted.count(True) == 5 and spool.stats()['state'] == 'refusing'
+    release.set()
+    assert spool.drain()
+    assert spool.append(b'CA1', 'POST', '/webhook', b'', b'CallSid=CA1')
+    spool.close()
+    assert spool.stats()['refused'] == 3
+
+
+CRASH = textwrap.dedent('''
+    import os, sys, threading
+    sys.path.insert(0, {root!r})
+    from amd_server.spool import Spool
+
+    # The handler never finishes, so nothing is checkpointed before the crash
+    spool = Spool({directory!r}, lambda entry: threading.Event().wait(), workers=2)
+    for n in range(50):
+        spool.append(b'CA%d' % (n % 5), 'POST', '/webhook', b'AmdConfig=fast', b'CallSid=CA%d&n=%d' % (n % 5, n))
+    os._exit(0)
+''')
+
+
+def test_crash_replays_unprocessed_entries(tmp_path):
+    directory = str(tmp_path / 'spool')
+    subprocess.run([sys.executable, '-c', CRASH.format(root=ROOT, directory=directory)], check=True, timeout=60)
+    # A write torn by the crash: a header promising more bytes than follow
+    segment = os.path.join(directory, 'lane-0', '000000000001.seg')
+    with open(segment, 'ab') as f:
+        f.write(b'\xff\x00\x00\x00\x12\x34\x56\x78partial')
+
+    handled = Handled()
+    spool = Spool(directory, handled, workers=2)
+    assert spool.drain()
+    spool.close()
+    assert spool.replayed == 50 and spool.truncated == 1
+    assert sorted(int(entry.form()['n']) for entry in handled.entries) == list(range(50))
+    assert all(entry.tags() == {'AmdConfig': 'fast'} for entry in handled.entries)
+
+    # Everything was checkpointed on close: a restart replays nothing
+    again = Handled()
+    spool = Spool(directory, again)
+    spool.close()
+    assert spool.replayed == 0 and again.entries == []
+
+
+def test_handle_amd_is_spooled(make_app, tmp_path):
+    app = make_app('manual', AMD_SPOOL_DIR=tmp_path)
+    server = app.extensions['amd_server']
+    client = app.test_client()
+    form = {'CallSid': 'CA' + '5' * 32, 'AnsweredBy': 'machine_end_beep', 'MachineDetectionDuration': '2100'}
+    response = client.post('/handle_amd?AmdConfig=fast', data=form)
+    assert response.status_code == 200 and b'<Hangup />' in response.get_data()
+    assert client.get('/handle_amd', query_string=dict(form, CallSid='CA' + '6' * 32)).status_code == 200
+    assert server.spool.stats()['appended'] == 2
+    assert server.spool.drain()
+    configs = {entry['config']: entry for entry in server.metrics.summary()['configs']}
+    assert configs['fast']['answered_by'] == {'machine_end_beep': 1}
+    assert sum(entry['results'] for entry in configs.values()) == 2
+
+    # Like /webhook: no CallSid is refused rather than processed unspooled
+    assert client.post('/handle_amd', data={'AnsweredBy': 'human'}).status_code == 400
+    assert server.spool.stats()['appended'] == 2
+
+
+def test_handle_amd_falls_back_when_refused(make_app, tmp_path):
+    app = make_app('manual', AMD_SPOOL_DIR=tmp_path, AMD_SPOOL_MAX_DEPTH=0)
+    server = app.extensions['amd_server']
+    response = app.test_client().post('/handle_amd', data={'CallSid': 'CA1', 'AnsweredBy': 'human'})
+    assert response.status_code == 200
+    assert server.spool.stats()['refused'] == 1
+    assert server.metrics.summary()['configs'][0]['answered_by'] == {'human': 1}
+
+
+def test_webhook_is_spooled(make_app, tmp_path):
+    app = make_app('advanced', AMD_SPOOL_DIR=tmp_path)
+    server = app.extensions['amd_server']
+    client = app.test_client()
+    form = {'CallSid': 'CA7', 'CallStatus': 'ringing', 'SequenceNumber': '1',
+            'CallbackSource': 'call-progress-events'}
+    assert client.post('/webhook', data=form).status_code == 200
+    assert client.post('/webhook', data=form).status_code == 200
+    assert client.post('/webhook', data={'CallStatus': 'ringing'}).status_code == 400
+    assert server.spool.drain()
+    assert server.spool.stats()['appended'] == 2
+    # The retry is deduplicated by the spool worker
+    assert server.dedup.stats()['hits'] == 1
+    assert server.calls.get('CA7')['callbacks'] == 1
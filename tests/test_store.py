@@ -0,0 +1,93 @@
+import sqlite3
+import time
+
+import pytest
+
+from amd_server.store import ResultStore, event_row
+from amd_server.webhook import ADVANCED_FIELDS, decode_form
+
+SID = 'CA' + '1' * 32
+OTHER = 'CA' + '2' * 32
+
+
+def event(call_sid=SID, config='fast', **params):
+    return decode_form('POST', dict({'CallSid': call_sid}, **params), ADVANCED_FIELDS,
+                       {'AmdConfig': config} if config else None)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'))
+    now = time.time()
+    store.add(event(CallStatus='ringing', SequenceNumber='1'), now - 30)
+    store.add(event(AnsweredBy='machine_start', MachineDetectionDuration='2400'), now - 20)
+    store.add(event(CallStatus='completed', SequenceNumber='3'), now - 10)
+    store.add(event(OTHER, AnsweredBy='human', MachineDetectionDuration='1800'), now - 5)
+    store.add(event(OTHER, 'slow', AnsweredBy='human'), now - 2 * 86400)
+    store.add(event('CA3', None, AnsweredBy='fax'), now - 60)
+    assert store.flush()
+    yield store
+    store.close()
+
+
+def stalled(store):
+    """Hold the database's write lock, so the store's writer blocks on its next batch"""
+    blocker = sqlite3.connect(store.path, isolation_level=None)
+    blocker.execute('BEGIN EXCLUSIVE')
+    return blocker
+
+
+def test_event_row():
+    row = event(AnsweredBy='Machine_End_Beep', MachineDetectionDuration='x', SequenceNumber='4')
+    received_at, call_sid, config, kind, status, answered_by, detection_ms, sequence, params = event_row(row, 5.0)
+    assert (received_at, call_sid, config, kind, status) == (5.0, SID, 'fast', 'AMD_RESULT', None)
+    assert (answered_by, detection_ms, sequence) == ('machine_end_beep', None, 4)
+    assert params.startswith('{"CallSid":')
+
+
+def test_results_for_call(store):
+    rows = store.results_for_call(SID)
+    assert [(row['call_status'], row['answered_by']) for row in rows] == [
+        ('ringing', None), (None, 'machine_start'), ('completed', None)]
+    assert rows[1]['detection_ms'] == 2400 and rows[0]['sequence'] == 1
+    assert store.results_for_call('CA404') == []
+
+
+def test_results_for_config(store):
+    # Newest first, within the window
+    rows = store.results_for_config('fast')
+    assert [row['call_sid'] for row in rows] == [OTHER, SID, SID, SID]
+    assert [row['call_sid'] for row in store.results_for_config('fast', answered_by='human')] == [OTHER]
+    assert len(store.results_for_config('fast', limit=2)) == 2
+    assert store.results_for_config('slow') == []
+    assert len(store.results_for_config('slow', hours=72)) == 1
+    assert [row['answered_by'] for row in store.results_for_config('fast', hours=15 / 3600)] == ['human', None]
+
+
+def test_outcome_counts(store):
+    assert store.outcome_counts() == {'fast': {'machine_start': 1, 'human': 1}, None: {'fax': 1}}
+    assert store.outcome_counts('fast') == {'fast': {'machine_start': 1, 'human': 1}}
+    assert store.outcome_counts(hours=72)['slow'] == {'human': 1}
+    assert store.outcome_counts('missing') == {}
+
+
+def test_full_queue_drops_and_counts(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'), maxsize=2)
+    blocker = stalled(store)
+    try:
+        rows = [event_row(event(f'CA{n}', AnsweredBy='human'), 1000.0 + n) for n in range(5)]
+        assert store.add_rows(rows[:1]) == 1
+        # Wait until the writer has taken the first row and is blocked on the lock
+        while store.stats()['queued']:
+            time.sleep(0.001)
+        assert store.add_rows(rows[1:]) == 2
+        assert not store.add(event('CA9'))
+        assert store.stats()['dropped'] == 3
+    finally:
+        blocker.rollback()
+        blocker.close()
+    assert store.flush()
+    assert store.stats()['inserted'] == 3
+    assert [row['call_sid'] for row in store.query('SELECT call_sid FROM callbacks ORDER BY id')] == [
+        'CA0', 'CA1', 'CA2']
+    store.close()
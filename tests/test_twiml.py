@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from amd_server import twiml
+from amd_server.twiml import AMD_OUTCOMES, TwimlCache, response, verb
+
+MESSAGES = [
+    "Hello! A human answered.",
+    'Escapes & <tags> "quoted" \'single\'',
+    "Multi\nline\ttext",
+    "Ünïcödé — ✓",
+    "",
+]
+
+
+@pytest.mark.parametrize('message', MESSAGES)
+def test_say_matches_voice_response(message):
+    twiml = pytest.importorskip('twilio.twiml.voice_response')
+    expected = twiml.VoiceResponse()
+    expected.say(message, voice='alice')
+    expected.hangup()
+    assert response(verb('Say', message, voice='alice'), verb('Hangup')) == str(expected)
+
+
+@pytest.mark.parametrize('voice', ['alice', 'Polly.Joanna', 'a "b" & <c>\n'])
+def test_cached_documents_match_voice_response(voice):
+    twiml = pytest.importorskip('twilio.twiml.voice_response')
+    cache = TwimlCache(voice=voice, pauses=(1, 60))
+    for outcome, (_, message, hangup) in AMD_OUTCOMES.items():
+        expected = twiml.VoiceResponse()
+        expected.say(message, voice=voice)
+        if hangup:
+            expected.hangup()
+        assert cache.amd(outcome).body == str(expected).encode('utf-8')
+    for length in (1, 60):
+        expected = twiml.VoiceResponse()
+        expected.pause(length=length)
+        assert cache.pause(length).body == str(expected).encode('utf-8')
+    assert cache.empty.body == str(twiml.VoiceResponse()).encode('utf-8')
+
+
+def test_configure_rerenders():
+    cache = TwimlCache()
+    etag = cache.amd('human').etag
+    cache.configure(messages={'human': 'Hi there'})
+    assert cache.amd('human').message == 'Hi there'
+    assert cache.amd('human').etag != etag
+    assert b'Hi there' in cache.amd('human').body
+
+
+def test_a_slow_render_does_not_replace_a_newer_one(monkeypatch):
+    cache = TwimlCache()
+    rendering = threading.Event()
+    render = twiml.response
+
+    def slow_response(*verbs):
+        if any('Older' in v for v in verbs):
+            rendering.set()
+            time.sleep(0.2)
+        return render(*verbs)
+
+    monkeypatch.setattr(twiml, 'response', slow_response)
+    older = threading.Thread(target=cache.configure, kwargs={'messages': {'human': 'Older'}})
+    older.start()
+    assert rendering.wait(5)
+    cache.configure(messages={'human': 'Newer'})
+    older.join()
+    assert cache.amd('human').message == cache.messages['human'] == 'Newer'
+
+
+def test_config_file_changes_are_picked_up(tmp_path, capsys):
+    path = tmp_path / 'twiml.json'
+    cache = TwimlCache(voice='alice', messages={'fax': 'Fax.'}, path=str(path), check_interval=0)
+    assert cache.amd('machine_end_beep').message == AMD_OUTCOMES['machine'][1]
+
+    path.write_text(json.dumps({'voice': 'man', 'messages': {'Machine': 'Leave it here.', 'other': 'x'}}))
+    assert cache.amd('machine_end_beep').message == 'Leave it here.'
+    assert b'voice="man"' in cache.amd('fax').body
+    assert cache.amd('fax').message == 'Fax.'
+    assert cache.reloads == 1
+    cache.amd('human')
+    assert cache.reloads == 1
+
+    path.write_text('{not json')
+    os.utime(path, ns=(1, 1))
+    assert cache.amd('machine_end_beep').message == AMD_OUTCOMES['machine'][1]
+    assert 'ignoring' in capsys.readouterr().err
+
+    path.unlink()
+    assert cache.amd('fax').message == 'Fax.'
+    assert b'voice="alice"' in cache.amd('fax').body
+
+
+def test_config_file_checks_are_throttled(tmp_path):
+    path = tmp_path / 'twiml.json'
+    cache = TwimlCache(path=str(path), check_interval=3600)
+    cache.amd('human')
+    path.write_text(json.dumps({'messages': {'human': 'Later.'}}))
+    assert cache.amd('human').message == AMD_OUTCOMES['human'][1]
@@ -0,0 +1,116 @@
+import os
+import sys
+from urllib.parse import unquote
+
+import pytest
+from flask import Flask, request
+
+from amd_server.webhook import (ADVANCED_FIELDS, AMD_RESULT, MANUAL_FIELDS, STATUS_CALLBACK, decode_form,
+                                decode_request)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from payloads import ANSWERED_BY, amd_callback, amd_twiml_request, mixed_callbacks, status_callback  # noqa: E402
+
+# Labels of the servers' original parse_webhook_data; the two variants differ only in the AMD units
+BASELINE_LABELS = {
+    'AccountSid': 'Account SID', 'CallSid': 'Call SID', 'CallStatus': 'Call Status',
+    'From': 'From Number', 'To': 'To Number', 'Caller': 'Caller Number',
+    'Called': 'Called Number', 'Direction': 'Call Direction', 'ApiVersion': 'API Version',
+    'CallDuration': 'Call Duration', 'Duration': 'Duration (seconds)',
+    'RecordingUrl': 'Recording URL', 'SipResponseCode': 'SIP Response Code',
+    'CallbackSource': 'Callback Source', 'SequenceNumber': 'Sequence Number', 'Timestamp': 'Timestamp',
+    'FromCountry': 'From Country', 'FromState': 'From State', 'FromCity': 'From City',
+    'FromZip': 'From ZIP', 'ToCountry': 'To Country', 'ToState': 'To State',
+    'ToCity': 'To City', 'ToZip': 'To ZIP', 'CallerCountry': 'Caller Country',
+    'CallerState': 'Caller State', 'CallerCity': 'Caller City', 'CallerZip': 'Caller ZIP',
+    'CalledCountry': 'Called Country', 'CalledState': 'Called State',
+    'CalledCity': 'Called City', 'CalledZip': 'Called ZIP',
+}
+BASELINE_AMD_LABELS = {
+    'advanced': {
+        'AnsweredBy': 'AMD Result', 'AnsweringMachineDetection': 'AMD Detection',
+        'MachineDetectionDuration': 'AMD Duration (ms)',
+        'MachineDetectionSilenceTimeout': 'AMD Silence Timeout (ms)',
+        'MachineDetectionSpeechThreshold': 'AMD Speech Threshold (ms)',
+        'MachineDetectionSpeechEndThreshold': 'AMD Speech End Threshold (ms)',
+        'MachineDetectionTimeout': 'AMD Timeout (s)',
+    },
+    'manual': {
+        'AnsweredBy': 'AMD Result', 'AnsweringMachineDetection': 'AMD Detection',
+        'MachineDetectionDuration': 'AMD Duration',
+        'MachineDetectionSilenceTimeout': 'AMD Silence Timeout',
+        'MachineDetectionSpeechThreshold': 'AMD Speech Threshold',
+        'MachineDetectionSpeechEndThreshold': 'AMD Speech End Threshold',
+        'MachineDetectionTimeout': 'AMD Timeout',
+    },
+}
+TABLES = {'advanced': ADVANCED_FIELDS, 'manual': MANUAL_FIELDS}
+
+
+def baseline_parse(form_data, variant):
+    """The servers' original parse_webhook_data loop over an already-decoded form"""
+    all_params = {**BASELINE_LABELS, **BASELINE_AMD_LABELS[variant]}
+    data = {}
+    for key, value in form_data.items():
+        decoded_value = unquote(str(value))
+        if key in all_params:
+            data[all_params[key]] = decoded_value
+        else:
+            data[key] = decoded_value
+    return data
+
+
+def payloads():
+    cases = mixed_callbacks(calls=len(ANSWERED_BY))
+    cases += [amd_twiml_request(n, answered_by) for n, answered_by in enumerate(ANSWERED_BY)]
+    cases += [status_callback(1, 'completed', 4, duration=125), amd_callback(2, 'HUMAN', 0),
+              {'CallSid': 'CA1', 'RecordingUrl': 'https://api.twilio.com/recording', 'Custom': 'x'},
+              {'AnsweringMachineDetection': 'machine_start', 'MachineDetectionTimeout': '30',
+               'MachineDetectionSilenceTimeout': '5000', 'MachineDetectionSpeechThreshold': '2400',
+               'MachineDetectionSpeechEndThreshold': '1200'}]
+    return cases
+
+
+@pytest.mark.parametrize('variant', sorted(TABLES))
+@pytest.mark.parametrize('method', ['POST', 'GET'])
+def test_labels_match_the_baseline_parser(variant, method):
+    for payload in payloads():
+        event = decode_form(method, payload, TABLES[variant])
+        labelled = event.labelled()
+        assert labelled == baseline_parse(payload, variant)
+        # Same keys in the same (request) order, as the console view lists them
+        assert list(labelled) == list(baseline_parse(payload, variant))
+        assert event.method == method
+
+
+def test_classification():
+    assert decode_form('POST', amd_callback(1)).webhook_type == AMD_RESULT
+    assert decode_form('POST', amd_twiml_request(1)).webhook_type == AMD_RESULT
+    assert decode_form('GET', status_callback(1)).webhook_type == STATUS_CALLBACK
+    assert decode_form('POST', {'RecordingUrl': 'https://api.twilio.com/r'}).webhook_type == 'RECORDING_CALLBACK'
+    assert decode_form('POST', {'CallSid': 'CA1'}).webhook_type == 'UNKNOWN'
+
+
+def test_values_are_decoded_once():
+    # A caller ID or city holding a literal '%' sequence: Werkzeug decodes the wire
+    # form once; the baseline parser unquoted the decoded value a second time
+    form = {'CallSid': 'CA1', 'CallerCity': 'SAO%20PAULO', 'Custom': '100%25', 'From': '+15017122661'}
+    app = Flask(__name__)
+    with app.test_request_context('/webhook', method='POST', data=form):
+        event = decode_request(request)
+    assert event.params == form
+    assert event.labelled()['Caller City'] == 'SAO%20PAULO'
+    assert baseline_parse(form, 'advanced')['Caller City'] == 'SAO PAULO'
+    assert baseline_parse(form, 'advanced')['Custom'] == '100%'
+    # Values without a '%' are unchanged
+    for label in ('Call SID', 'From Number'):
+        assert event.labelled()[label] == baseline_parse(form, 'advanced')[label]
+
+
+def test_tags_never_override_form_fields():
+    app = Flask(__name__)
+    with app.test_request_context('/webhook?AmdConfig=fast&CallSid=CAtag', method='POST',
+                                  data={'CallSid': 'CA1', 'AnsweredBy': 'human'}):
+        event = decode_request(request)
+    assert event.call_sid == 'CA1' and event.config_key == 'fast'